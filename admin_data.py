@@ -0,0 +1,284 @@
+# admin_data.py
+# Import/export masivo de colecciones (users, events, notifications, ...) a archivos NDJSON o BSON,
+# en streaming: la memoria queda acotada por --batch-size sin importar el tamaño de la colección.
+#
+# - export: cursor con batch_size; en BSON los documentos se escriben crudos (RawBSONDocument,
+#   sin decodificar); en NDJSON se usa Extended JSON relajado ($oid, $date, ...) con orjson.
+# - import: lee el archivo por lotes y los escribe con insert_many/bulk_write unordered, con una
+#   escritura en vuelo mientras se lee/parsea el lote siguiente. --workers N parsea el NDJSON en
+#   un pool de procesos (útil en archivos grandes, el parseo es CPU puro).
+# - ls: lista usuarios en streaming (reemplaza a check_users.py).
+# Los archivos terminados en .gz se leen/escriben comprimidos. Usa MONGO_URI y MONGO_DB de main.
+# Run (desde la raíz del repo):
+#   python admin_data.py export users dumps/users.ndjson.gz
+#   python admin_data.py export events dumps/events.bson --query '{"status": "upcoming"}'
+#   python admin_data.py import events dumps/events.bson --drop --create-indexes
+#   python admin_data.py import notifications dumps/notifications.ndjson --workers 4 --mode upsert
+#   python admin_data.py ls users
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import gzip
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import IO, Any, Iterator
+
+import bson
+import orjson
+from bson import json_util
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from pymongo import ReplaceOne
+from pymongo.errors import BulkWriteError
+
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+import main  # noqa: E402
+
+COLLECTIONS = ("users", "events", "notifications", "event_participants", "notifications_archive")
+FORMATS = ("ndjson", "bson")
+JSON_OPTIONS = json_util.RELAXED_JSON_OPTIONS
+RAW_OPTIONS = CodecOptions(document_class=RawBSONDocument)
+DUPLICATE_KEY = 11000
+
+# --- Formatos ---
+
+def guess_format(path: str) -> str:
+    name = path[:-3] if path.endswith(".gz") else path
+    return "bson" if name.endswith(".bson") else "ndjson"
+
+def open_file(path: str, mode: str) -> IO[bytes]:
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "b", compresslevel=6)
+    return open(path, mode + "b", buffering=1 << 20)
+
+def ndjson_default(value: Any) -> Any:
+    """Tipos BSON que orjson no conoce -> Extended JSON ({"$oid": ...}, {"$date": ...})"""
+    return json_util.default(value, JSON_OPTIONS)
+
+def encode_ndjson(doc: dict) -> bytes:
+    return orjson.dumps(
+        doc, default=ndjson_default,
+        option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_APPEND_NEWLINE,
+    )
+
+def from_extended(value: Any) -> Any:
+    """Inverso de encode_ndjson: {"$oid": ...} -> ObjectId, {"$date": ...} -> datetime, etc."""
+    if isinstance(value, dict):
+        return json_util.object_hook({k: from_extended(v) for k, v in value.items()}, JSON_OPTIONS)
+    if isinstance(value, list):
+        return [from_extended(v) for v in value]
+    return value
+
+def parse_ndjson(lines: list[bytes]) -> list[dict]:
+    """Parsea un lote de líneas (top-level para poder mandarlo al pool de procesos)"""
+    return [from_extended(orjson.loads(line)) for line in lines if line.strip()]
+
+def read_batches(path: str, fmt: str, batch_size: int) -> Iterator[list]:
+    """Lotes de líneas crudas (NDJSON) o de RawBSONDocument (BSON); nunca el archivo entero"""
+    with open_file(path, "r") as f:
+        items = bson.decode_file_iter(f, RAW_OPTIONS) if fmt == "bson" else f
+        batch: list = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+# --- Progreso ---
+
+class Progress:
+    """Contadores del import/export y una línea de progreso cada `every` segundos (a stderr)"""
+
+    def __init__(self, label: str, total: int | None = None, every: float = 2.0):
+        self.label = label
+        self.total = total
+        self.every = every
+        self.docs = 0
+        self.bytes = 0
+        self.written = 0
+        self.skipped = 0
+        self.errors = 0
+        self.started = time.perf_counter()
+        self.last_report = self.started
+
+    def add(self, docs: int, nbytes: int = 0):
+        self.docs += docs
+        self.bytes += nbytes
+        now = time.perf_counter()
+        if now - self.last_report >= self.every:
+            self.last_report = now
+            print(self.line(now), file=sys.stderr, flush=True)
+
+    def line(self, now: float | None = None) -> str:
+        elapsed = max((now or time.perf_counter()) - self.started, 1e-9)
+        done = f"{self.docs}/{self.total}" if self.total is not None else str(self.docs)
+        text = f"{self.label}: {done} docs  {self.docs / elapsed:,.0f} docs/s  {self.bytes / elapsed / 1e6:.1f} MB/s"
+        if self.written or self.skipped or self.errors:
+            text += f"  (escritos {self.written}, duplicados {self.skipped}, errores {self.errors})"
+        return text
+
+    def summary(self) -> str:
+        return f"{self.line()}  [{time.perf_counter() - self.started:.1f}s]"
+
+# --- Export ---
+
+async def export_collection(collection, path: str, fmt: str, batch_size: int, query: dict) -> Progress:
+    progress = Progress(f"export {collection.name}", await collection.count_documents(query))
+    if fmt == "bson":
+        collection = collection.with_options(codec_options=RAW_OPTIONS)
+    cursor = collection.find(query, batch_size=batch_size)
+    with open_file(path, "w") as f:
+        chunk: list[bytes] = []
+        async for doc in cursor:
+            chunk.append(doc.raw if fmt == "bson" else encode_ndjson(doc))
+            if len(chunk) >= batch_size:
+                data = b"".join(chunk)
+                f.write(data)
+                progress.add(len(chunk), len(data))
+                chunk = []
+        if chunk:
+            data = b"".join(chunk)
+            f.write(data)
+            progress.add(len(chunk), len(data))
+    return progress
+
+# --- Import ---
+
+async def write_batch(collection, docs: list, mode: str, progress: Progress):
+    """Un lote unordered: un duplicado o un documento inválido no frena al resto del lote"""
+    try:
+        if mode == "upsert":
+            result = await collection.bulk_write(
+                [ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in docs], ordered=False,
+            )
+            progress.written += result.upserted_count + result.modified_count
+        else:
+            result = await collection.insert_many(docs, ordered=False)
+            progress.written += len(result.inserted_ids)
+    except BulkWriteError as e:
+        details = e.details
+        progress.written += details.get("nInserted", 0) + details.get("nUpserted", 0) + details.get("nModified", 0)
+        for error in details.get("writeErrors", []):
+            if error.get("code") == DUPLICATE_KEY:
+                progress.skipped += 1
+            else:
+                progress.errors += 1
+                if progress.errors <= 10:
+                    print(f"error en documento {error.get('index')}: {error.get('errmsg')}", file=sys.stderr)
+
+async def import_collection(
+    collection, path: str, fmt: str, batch_size: int, mode: str, workers: int,
+) -> Progress:
+    progress = Progress(f"import {collection.name}")
+    loop = asyncio.get_running_loop()
+    pool = ProcessPoolExecutor(workers) if workers > 1 and fmt == "ndjson" else None
+    parsing: deque[tuple[asyncio.Future, int]] = deque()  # lotes en el pool, acotados a 2 por worker
+    writing: asyncio.Task | None = None
+
+    async def submit(docs: list, nbytes: int):
+        nonlocal writing
+        if writing:
+            await writing  # a lo sumo una escritura en vuelo: memoria acotada
+        writing = asyncio.create_task(write_batch(collection, docs, mode, progress))
+        progress.add(len(docs), nbytes)
+
+    try:
+        for batch in read_batches(path, fmt, batch_size):
+            if fmt == "bson":
+                # RawBSONDocument va directo al driver, sin decodificar
+                await submit(batch, sum(len(doc.raw) for doc in batch))
+            elif pool:
+                parsing.append((loop.run_in_executor(pool, parse_ndjson, batch), sum(map(len, batch))))
+                if len(parsing) >= workers * 2:
+                    future, nbytes = parsing.popleft()
+                    await submit(await future, nbytes)
+            else:
+                await submit(parse_ndjson(batch), sum(map(len, batch)))
+        while parsing:
+            future, nbytes = parsing.popleft()
+            await submit(await future, nbytes)
+        if writing:
+            await writing
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
+    return progress
+
+# --- ls ---
+
+async def list_users(database, batch_size: int) -> int:
+    """Como el viejo check_users.py pero en streaming: no arma la lista de usuarios en memoria"""
+    total = 0
+    async for user in database.users.find({}, {"name": 1}, batch_size=batch_size):
+        print(f"  - {user.get('name')} (id: {user.get('_id')})")
+        total += 1
+    print(f"Total usuarios: {total}")
+    return total
+
+# --- CLI ---
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Import/export en streaming de colecciones de La Segunda")
+    parser.add_argument("--uri", default=main.MONGO_URI)
+    parser.add_argument("--db", default=main.MONGO_DB)
+    parser.add_argument("--batch-size", type=int, default=1000, help="documentos por lote de cursor/escritura")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    export = sub.add_parser("export", help="colección -> archivo")
+    export.add_argument("collection", choices=COLLECTIONS)
+    export.add_argument("path")
+    export.add_argument("--format", choices=FORMATS, help="default: según la extensión (.bson o NDJSON)")
+    export.add_argument("--query", default="{}", help="filtro en Extended JSON")
+
+    imp = sub.add_parser("import", help="archivo -> colección")
+    imp.add_argument("collection", choices=COLLECTIONS)
+    imp.add_argument("path")
+    imp.add_argument("--format", choices=FORMATS, help="default: según la extensión (.bson o NDJSON)")
+    imp.add_argument("--mode", choices=("insert", "upsert"), default="insert",
+                     help="insert saltea los _id existentes; upsert los reemplaza")
+    imp.add_argument("--workers", type=int, default=1, help="procesos para parsear NDJSON (1 = sin pool)")
+    imp.add_argument("--drop", action="store_true", help="vaciar la colección antes de importar")
+    imp.add_argument("--create-indexes", action="store_true", help="crear los índices de main después de importar")
+
+    ls = sub.add_parser("ls", help="listar documentos")
+    ls.add_argument("collection", choices=("users",))
+    return parser.parse_args(argv)
+
+async def run(args: argparse.Namespace) -> int:
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(args.uri)
+    database = client[args.db]
+    try:
+        if args.command == "ls":
+            await list_users(database, args.batch_size)
+            return 0
+        fmt = args.format or guess_format(args.path)
+        collection = database[args.collection]
+        if args.command == "export":
+            query = json_util.loads(args.query, json_options=JSON_OPTIONS)
+            progress = await export_collection(collection, args.path, fmt, args.batch_size, query)
+        else:
+            if args.drop:
+                await collection.drop()
+            progress = await import_collection(
+                collection, args.path, fmt, args.batch_size, args.mode, args.workers,
+            )
+            if args.create_indexes:
+                # Con la colección cargada: construir el índice una vez es más barato que
+                # mantenerlo documento a documento durante el import
+                await main.ensure_indexes(database)
+        print(progress.summary())
+        return 1 if progress.errors else 0
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(run(parse_args())))
@@ -0,0 +1,129 @@
+# benchmarks/bench_event_mutations.py
+# p50/p99 de los endpoints que mutan eventos: flujo anterior (find_one + update_one +
+# find_one + users.find_one) vs mutate_event (un find_one_and_update con la autorización
+# en el filtro + perfil del organizador desde user_cache).
+#
+# No necesita MongoDB: storage engine en memoria con un round trip simulado por operación
+# (benchmarks/memory_backend.py; latencia base + jitter exponencial, con semilla fija).
+# Run (desde la raíz del repo):
+#   python benchmarks/bench_event_mutations.py
+#   python benchmarks/bench_event_mutations.py --requests 5000 --rtt-ms 0.8
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("LOG_LEVEL", "ERROR")  # sin logs de main entre las filas de la tabla
+
+from bson import ObjectId
+
+import main
+from benchmarks.memory_backend import SimulatedDatabase
+
+
+async def legacy_accept_user(event_id: str, body: main.AcceptRejectBody, user_id: ObjectId, compact: bool = False):
+    """accept_user tal como estaba antes de mutate_event"""
+    db = main.db
+    _id = main.ensure_oid(event_id)
+    target = main.ensure_oid(body.user_id)
+    ev = await db.events.find_one({"_id": _id})
+    if not ev:
+        raise main.HTTPException(status_code=404, detail="Evento no encontrado")
+    if ev["organizer_id"] != user_id:
+        raise main.HTTPException(status_code=403, detail="Sólo el organizador puede aceptar")
+    await db.events.update_one(
+        {"_id": _id},
+        {
+            "$pull": {"pending_approval_participants": target},
+            "$addToSet": {"confirmed_participants": target},
+            "$set": {"updated_at": main.now()},
+        },
+    )
+    ev = await db.events.find_one({"_id": _id})
+    organizer = await db.users.find_one({"_id": ev["organizer_id"]})
+    await main.publish_notification(
+        user_id=str(target),
+        notification_type="application_accepted",
+        title="Postulación aceptada",
+        message=f"Tu solicitud para unirte a '{ev['title']}' fue aceptada",
+        event_id=str(_id),
+        event_title=ev["title"],
+    )
+    return main.serialize_event(ev, organizer)
+
+
+async def seed(latency, requests: int, pending_per_event: int):
+    """requests postulantes repartidos en eventos de pending_per_event pendientes cada uno"""
+    sim = SimulatedDatabase(rtt=latency)
+    main.db = sim
+    main.user_cache = main.UserProfileCache(main.USER_CACHE_SIZE, main.USER_CACHE_TTL)
+    await main.ensure_indexes(sim.raw)
+    now_dt = main.now()
+    organizer_id = (await sim.raw.users.insert_one({
+        "name": "organizer", "rating": 4.5, "cant_events_visited": 0,
+        "cant_events_organized": 0, "cant_no_shows": 0, "created_at": now_dt, "updated_at": now_dt,
+    })).inserted_id
+    targets = []
+    for start in range(0, requests, pending_per_event):
+        pending = [ObjectId() for _ in range(min(pending_per_event, requests - start))]
+        event_id = (await sim.raw.events.insert_one({
+            "title": "bench", "description": None, "fecha_inicio": now_dt, "fecha_fin": now_dt,
+            "activo": 1, "finalizado": False, "organizer_id": organizer_id,
+            "confirmed_participants": [], "pending_approval_participants": list(pending),
+            "blacklisted_participants": [], "location": {"type": "Point", "coordinates": [-58.4, -34.6]},
+            "location_alias": None, "category": "deportes", "created_at": now_dt, "updated_at": now_dt,
+        })).inserted_id
+        targets += [(str(event_id), target) for target in pending]
+    return organizer_id, targets
+
+
+async def run(handler, args) -> dict:
+    rng = random.Random(args.seed)
+    base = args.rtt_ms / 1000.0
+    latency = lambda: base + rng.expovariate(1.0 / (base * 0.25))  # noqa: E731
+    organizer_id, targets = await seed(latency, args.requests, args.pending)
+    samples = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for event_id, target in targets:
+            body = main.AcceptRejectBody(user_id=str(target))
+            t0 = time.perf_counter()
+            await handler(event_id, body, user_id=organizer_id, compact=False)
+            samples.append(time.perf_counter() - t0)
+    samples.sort()
+    return {
+        "p50_ms": statistics.median(samples) * 1000,
+        "p99_ms": samples[int(len(samples) * 0.99) - 1] * 1000,
+        "round_trips": (main.db.round_trips["events"] + main.db.round_trips["users"]) / len(samples),
+    }
+
+
+async def bench(args):
+    print(f"POST /events/{{id}}/accept x {args.requests}, RTT base {args.rtt_ms:.2f} ms (+ jitter)")
+    print(f"{'flujo':>28} | {'p50 (ms)':>9} | {'p99 (ms)':>9} | {'round trips/req':>15}")
+    print("-" * 72)
+    for label, handler in (("find + update + find + user", legacy_accept_user), ("mutate_event", main.accept_user)):
+        r = await run(handler, args)
+        print(f"{label:>28} | {r['p50_ms']:>9.2f} | {r['p99_ms']:>9.2f} | {r['round_trips']:>15.2f}")
+    print("(round trips sin contar el insert de la notificación, igual en ambos flujos)")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark de mutaciones de eventos")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--pending", type=int, default=50, help="postulantes pendientes por evento")
+    parser.add_argument("--rtt-ms", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(bench(parse_args()))
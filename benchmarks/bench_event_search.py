@@ -0,0 +1,141 @@
+# benchmarks/bench_event_search.py
+# Latencia de búsqueda en /events sobre un dataset grande (1M eventos por defecto):
+# regex sobre title (search=regex, modo anterior) vs índice de texto (search=text),
+# con y sin lat/lng.
+#
+# Necesita un mongod local. Usa una base separada (por defecto "la_segunda_bench"),
+# que se puebla la primera vez (o con --reseed) con los mismos índices que crea la API.
+# Run (desde la raíz del repo):
+#   python benchmarks/bench_event_search.py
+#   python benchmarks/bench_event_search.py --events 200000 --queries 100 --reseed
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("LOG_LEVEL", "ERROR")  # sin logs de main entre las filas de la tabla
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+
+import main
+
+WORDS = [
+    "fútbol", "partido", "torneo", "running", "maratón", "yoga", "ciclismo", "vóley", "tenis", "pádel",
+    "museo", "teatro", "concierto", "exposición", "cine", "lectura", "poesía", "música", "danza", "tango",
+    "asado", "degustación", "vinos", "cervecería", "cocina", "empanadas", "café", "pizza", "feria", "mercado",
+    "caminata", "excursión", "recorrido", "histórico", "delta", "barrio", "parque", "plaza", "río", "costanera",
+    "startup", "emprendedores", "charla", "meetup", "programación", "diseño", "marketing", "inversión", "taller", "networking",
+]
+ALIASES = ["Palermo", "San Telmo", "Recoleta", "Belgrano", "Caballito", "Almagro", "La Boca", "Núñez", "Colegiales", "Retiro"]
+QUERIES = ["futbol", "fútbol palermo", "asado", "concierto tango", "taller de diseño", "museo", "maratón", "cerveceria", "yoga parque", "startup"]
+CENTER = (-34.6037, -58.3816)  # Buenos Aires
+
+
+async def seed(database, events: int, users: int, rng: random.Random):
+    print(f"🌱 Poblando {events} eventos y {users} usuarios...")
+    await database.events.drop()
+    await database.users.drop()
+    now_dt = main.now()
+    user_ids = [ObjectId() for _ in range(users)]
+    await database.users.insert_many([
+        {"_id": uid, "name": f"user-{i}", "rating": round(rng.uniform(0, 5), 1), "cant_events_visited": 0,
+         "cant_events_organized": 0, "cant_no_shows": 0, "created_at": now_dt, "updated_at": now_dt}
+        for i, uid in enumerate(user_ids)
+    ])
+    batch = []
+    t0 = time.perf_counter()
+    for i in range(events):
+        title = " ".join(rng.sample(WORDS, 3)).capitalize()
+        start = now_dt + timedelta(hours=rng.randint(1, 24 * 90))
+        batch.append({
+            "title": title,
+            "description": " ".join(rng.choices(WORDS, k=12)),
+            "fecha_inicio": start,
+            "fecha_fin": start + timedelta(hours=2),
+            "activo": 1,
+            "finalizado": False,
+            "organizer_id": rng.choice(user_ids),
+            "confirmed_participants": [],
+            "pending_approval_participants": [],
+            "blacklisted_participants": [],
+            "location": {"type": "Point", "coordinates": [CENTER[1] + rng.gauss(0, 0.3), CENTER[0] + rng.gauss(0, 0.3)]},
+            "location_alias": rng.choice(ALIASES),
+            "category": rng.choice(main.CATEGORIES),
+            "created_at": now_dt,
+            "updated_at": now_dt,
+        })
+        if len(batch) == 10_000:
+            await database.events.insert_many(batch, ordered=False)
+            batch = []
+            print(f"   {i + 1} eventos ({(i + 1) / (time.perf_counter() - t0):.0f}/s)", end="\r")
+    if batch:
+        await database.events.insert_many(batch, ordered=False)
+    print()
+    print("🔧 Creando índices...")
+    await main.ensure_indexes(database)
+
+
+async def timed(q: str, search: str, geo: bool, max_km) -> float:
+    lat, lng = (CENTER[0], CENTER[1]) if geo else (None, None)
+    t0 = time.perf_counter()
+    # query_events: lo que hace GET /events sin pasar por el cache de respuestas de Discover
+    await main.query_events(
+        status=1, category=None, from_date=None, to_date=None, lat=lat, lng=lng,
+        max_km=max_km if geo else None, q=q, search=search, limit=20, skip=0, after=None,
+    )
+    return time.perf_counter() - t0
+
+
+async def bench(args):
+    client = AsyncIOMotorClient(args.uri)
+    database = client[args.db]
+    main.db = database
+    count = await database.events.estimated_document_count()
+    if args.reseed or count < args.events:
+        await seed(database, args.events, args.users, random.Random(args.seed))
+        count = await database.events.estimated_document_count()
+    print(f"{count} eventos en '{args.db}', {args.queries} búsquedas por modo")
+    print(f"{'modo':>22} | {'p50 (ms)':>9} | {'p95 (ms)':>9} | {'p99 (ms)':>9}")
+    print("-" * 60)
+    rng = random.Random(args.seed)
+    modes = [("regex", False), ("text", False), ("regex", True), ("text", True)]
+    for search, geo in modes:
+        samples = []
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(args.queries):
+                # Cache de perfiles vacío: cada búsqueda paga también el $in de organizadores
+                main.user_cache = main.UserProfileCache(main.USER_CACHE_SIZE, main.USER_CACHE_TTL)
+                samples.append(await timed(rng.choice(QUERIES), search, geo, args.max_km))
+        samples.sort()
+        label = f"{search}{' + geo' if geo else ''}"
+        p = lambda q: samples[min(len(samples) - 1, int(len(samples) * q))] * 1000  # noqa: E731
+        print(f"{label:>22} | {statistics.median(samples) * 1000:>9.1f} | {p(0.95):>9.1f} | {p(0.99):>9.1f}")
+    client.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark de búsqueda de eventos")
+    parser.add_argument("--uri", default=os.getenv("MONGO_URI", "mongodb://localhost:27017"))
+    parser.add_argument("--db", default="la_segunda_bench")
+    parser.add_argument("--events", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--max-km", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--reseed", action="store_true")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(bench(parse_args()))
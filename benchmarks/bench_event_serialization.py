@@ -0,0 +1,101 @@
+# benchmarks/bench_event_serialization.py
+# Costo por evento de serializar una lista de EventOut (una página de Discover):
+# - pydantic: serialize_event -> EventOut, más lo que hace FastAPI con response_model
+#   (validar la lista otra vez, jsonable_encoder y json.dumps en JSONResponse)
+# - orjson: event_json -> orjson.dumps (lo que usan ahora las listas)
+# No necesita MongoDB: los documentos se generan en memoria.
+# Run (desde la raíz del repo):
+#   python benchmarks/bench_event_serialization.py
+#   python benchmarks/bench_event_serialization.py --page 100 --participants 50
+
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import timedelta
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("LOG_LEVEL", "ERROR")  # sin logs de main entre las filas de la tabla
+
+import orjson
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+
+import main
+
+
+def make_docs(n: int, participants: int, rng: random.Random) -> list[dict]:
+    now_dt = main.now()
+    docs = []
+    for i in range(n):
+        start = now_dt + timedelta(hours=rng.randint(1, 24 * 90))
+        docs.append({
+            "_id": ObjectId(),
+            "title": f"Evento {i}",
+            "description": "Partido amistoso en la plaza, traer agua",
+            "fecha_inicio": start,
+            "fecha_fin": start + timedelta(hours=2),
+            "activo": 1,
+            "finalizado": False,
+            "organizer_id": ObjectId(),
+            "confirmed_participants": [ObjectId() for _ in range(participants)],
+            "pending_approval_participants": [ObjectId() for _ in range(participants // 2)],
+            "blacklisted_participants": [],
+            "location": {"type": "Point", "coordinates": [-58.38 + rng.gauss(0, 0.1), -34.6 + rng.gauss(0, 0.1)]},
+            "location_alias": "Palermo",
+            "category": rng.choice(main.CATEGORIES),
+            "created_at": now_dt,
+            "updated_at": now_dt,
+            "distance_meters": rng.uniform(0, 10_000),
+        })
+    return docs
+
+
+def pydantic_path(docs: list[dict], organizer: dict, adapter: TypeAdapter) -> bytes:
+    out = [main.serialize_event(d, organizer) for d in docs]
+    validated = adapter.validate_python(out, from_attributes=True)  # response_model
+    return JSONResponse(jsonable_encoder(validated)).body
+
+
+def orjson_path(docs: list[dict], organizer: dict) -> bytes:
+    return orjson.dumps([main.event_json(d, organizer) for d in docs])
+
+
+def bench(args):
+    rng = random.Random(args.seed)
+    docs = make_docs(args.page, args.participants, rng)
+    organizer = {"name": "Organizador", "rating": 4.5}
+    adapter = TypeAdapter(List[main.EventOut])
+    assert orjson.loads(pydantic_path(docs, organizer, adapter)) == orjson.loads(orjson_path(docs, organizer))
+    print(f"páginas de {args.page} eventos, {args.participants} participantes confirmados por evento, {args.rounds} rondas")
+    print(f"{'modo':>10} | {'µs/evento p50':>14} | {'µs/evento p95':>14} | {'KB/página':>10}")
+    print("-" * 58)
+    for label, fn in [("pydantic", lambda: pydantic_path(docs, organizer, adapter)), ("orjson", lambda: orjson_path(docs, organizer))]:
+        samples = []
+        for _ in range(args.rounds):
+            t0 = time.perf_counter()
+            body = fn()
+            samples.append((time.perf_counter() - t0) / args.page)
+        samples.sort()
+        p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+        print(f"{label:>10} | {statistics.median(samples) * 1e6:>14.1f} | {p95 * 1e6:>14.1f} | {len(body) / 1024:>10.1f}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark de serialización de listas de eventos")
+    parser.add_argument("--page", type=int, default=20)
+    parser.add_argument("--participants", type=int, default=10)
+    parser.add_argument("--rounds", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=7)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    bench(parse_args())
@@ -0,0 +1,160 @@
+# benchmarks/bench_geo_discovery.py
+# Latencia de Discover (/events con lat/lng): índice geo en memoria (GEO_INDEX_ENABLED=1)
+# vs $geoNear en MongoDB, sobre N eventos activos alrededor de Buenos Aires.
+#
+# Sin mongod compara sólo el índice en memoria (NumPy vs Python puro, si NumPy está instalado).
+# Con un mongod local además puebla la base "la_segunda_geo_bench" y mide list_events entero
+# (query_events, sin el cache de respuestas; incluye el $in de organizadores) con y sin el índice.
+# Run (desde la raíz del repo):
+#   python benchmarks/bench_geo_discovery.py
+#   python benchmarks/bench_geo_discovery.py --events 100000 --queries 500 --reseed
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("LOG_LEVEL", "ERROR")  # sin logs de main entre las filas de la tabla
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import PyMongoError
+
+import main
+
+CENTER = (-34.6037, -58.3816)  # Buenos Aires
+
+
+def make_events(n: int, users: list[ObjectId], rng: random.Random) -> list[dict]:
+    now_dt = main.now()
+    events = []
+    for i in range(n):
+        start = now_dt + timedelta(hours=rng.randint(1, 24 * 90))
+        events.append({
+            "_id": ObjectId(),
+            "title": f"Evento {i}",
+            "description": "",
+            "fecha_inicio": start,
+            "fecha_fin": start + timedelta(hours=2),
+            "activo": 1,
+            "finalizado": False,
+            "organizer_id": rng.choice(users),
+            "confirmed_participants": [],
+            "pending_approval_participants": [],
+            "blacklisted_participants": [],
+            "location": {"type": "Point", "coordinates": [CENTER[1] + rng.gauss(0, 0.3), CENTER[0] + rng.gauss(0, 0.3)]},
+            "location_alias": None,
+            "category": rng.choice(main.CATEGORIES),
+            "created_at": now_dt,
+            "updated_at": now_dt,
+        })
+    return events
+
+
+def random_query(rng: random.Random, max_km: float) -> dict:
+    """Mezcla de búsquedas de Discover: con/sin radio, con/sin categoría"""
+    return {
+        "lat": CENTER[0] + rng.gauss(0, 0.1),
+        "lng": CENTER[1] + rng.gauss(0, 0.1),
+        "max_km": max_km if rng.random() < 0.5 else None,
+        "category": rng.choice(main.CATEGORIES) if rng.random() < 0.5 else None,
+    }
+
+
+def report(label: str, samples: list[float]):
+    samples.sort()
+    p = lambda q: samples[min(len(samples) - 1, int(len(samples) * q))] * 1000  # noqa: E731
+    print(f"{label:>26} | {statistics.median(samples) * 1000:>9.3f} | {p(0.95):>9.3f} | {p(0.99):>9.3f}")
+
+
+def bench_index(events: list[dict], queries: list[dict]):
+    index = main.ActiveEventGeoIndex()
+    index.ready = True
+    for ev in events:
+        index.sync(ev)
+    backends = [("python", None)] + ([("numpy", main.np)] if main.np is not None else [])
+    numpy_module = main.np
+    for name, module in backends:
+        main.np = module
+        index._build()  # las columnas dependen del backend; no se mide la reconstrucción
+        samples = []
+        for q in queries:
+            t0 = time.perf_counter()
+            index.nearest(q["lat"], q["lng"], q["category"], None, None, q["max_km"], None, [], 0, 20)
+            samples.append(time.perf_counter() - t0)
+        report(f"índice en memoria ({name})", samples)
+    main.np = numpy_module
+
+
+async def bench_mongo(args, events: list[dict], users: list[ObjectId], queries: list[dict]):
+    client = AsyncIOMotorClient(args.uri, serverSelectionTimeoutMS=2000)
+    database = client[args.db]
+    try:
+        count = await database.events.estimated_document_count()
+    except PyMongoError:
+        print(f"{'MongoDB':>26} | (sin mongod en {args.uri}, se omite)")
+        return
+    main.db = database
+    if args.reseed or count != len(events):
+        print(f"🌱 Poblando {len(events)} eventos...")
+        await database.events.drop()
+        await database.users.drop()
+        await database.users.insert_many([{"_id": uid, "name": f"user-{i}", "rating": 0.0} for i, uid in enumerate(users)])
+        for i in range(0, len(events), 10_000):
+            await database.events.insert_many(events[i:i + 10_000], ordered=False)
+        await main.ensure_indexes(database)
+    main.GEO_INDEX_ENABLED = True
+    main.geo_index = main.ActiveEventGeoIndex()
+    await main.geo_index.load()
+    for label, enabled in [("query_events + $geoNear", False), ("query_events + índice", True)]:
+        main.GEO_INDEX_ENABLED = enabled
+        samples = []
+        with contextlib.redirect_stdout(io.StringIO()):
+            for q in queries:
+                t0 = time.perf_counter()
+                await main.query_events(
+                    status=1, category=q["category"], from_date=None, to_date=None,
+                    lat=q["lat"], lng=q["lng"], max_km=q["max_km"], q=None, search="text",
+                    limit=20, skip=0, after=None,
+                )
+                samples.append(time.perf_counter() - t0)
+        report(label, samples)
+    client.close()
+
+
+async def bench(args):
+    rng = random.Random(args.seed)
+    users = [ObjectId() for _ in range(args.users)]
+    events = make_events(args.events, users, rng)
+    queries = [random_query(rng, args.max_km) for _ in range(args.queries)]
+    print(f"{args.events} eventos activos, {args.queries} búsquedas por modo")
+    print(f"{'modo':>26} | {'p50 (ms)':>9} | {'p95 (ms)':>9} | {'p99 (ms)':>9}")
+    print("-" * 64)
+    bench_index(events, queries)
+    await bench_mongo(args, events, users, queries)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark de Discover: índice geo en memoria vs $geoNear")
+    parser.add_argument("--uri", default=os.getenv("MONGO_URI", "mongodb://localhost:27017"))
+    parser.add_argument("--db", default="la_segunda_geo_bench")
+    parser.add_argument("--events", type=int, default=20_000)
+    parser.add_argument("--users", type=int, default=2_000)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--max-km", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--reseed", action="store_true")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(bench(parse_args()))
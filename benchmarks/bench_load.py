@@ -0,0 +1,357 @@
+# benchmarks/bench_load.py
+# Prueba de carga reproducible contra la app FastAPI completa (middlewares, validación,
+# serialización), sin levantar uvicorn: los requests van por httpx.ASGITransport.
+#
+# 1. Genera un dataset sintético con semilla fija: N usuarios, M eventos repartidos alrededor
+#    de Buenos Aires en todas las CATEGORIES, algunos eventos "enormes" con miles de
+#    participantes y un backlog de notificaciones por usuario.
+# 2. Corre fases: discover sin geo, discover con geo, tormenta de apply/accept, cancel de
+#    eventos enormes, tormenta de reconexiones SSE (Last-Event-ID) y una mezcla de todo.
+# 3. Imprime throughput y p50/p95/p99 por endpoint y guarda todo en JSON para comparar corridas.
+#
+# Backends:
+#   --backend mongo   mongod local (MONGO_URI), base "la_segunda_load" (se borra y repuebla)
+#   --backend memory  el storage engine en memoria de main (STORAGE_ENGINE=memory): mide el
+#                     overhead propio de la app, sin red ni mongod
+# RabbitMQ se reemplaza siempre por el broker en memoria (NOTIFICATION_BROKER=memory).
+# Ojo: con ASGITransport la respuesta vuelve cuando terminan las BackgroundTasks, así que el
+# cancel de un evento enorme incluye la publicación del fan-out.
+# Run (desde la raíz del repo):
+#   python benchmarks/bench_load.py --backend memory
+#   python benchmarks/bench_load.py --users 5000 --events 50000 --concurrency 64
+#   python benchmarks/bench_load.py --compare benchmarks/results/<corrida anterior>.json
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Awaitable
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("LOG_LEVEL", "ERROR")  # sin logs de main entre las filas de la tabla
+os.environ["NOTIFICATION_BROKER"] = "memory"
+
+import httpx
+from bson import ObjectId
+
+import main
+from storage_memory import MemoryClient
+
+CENTER = (-34.6037, -58.3816)  # Buenos Aires
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+# ---------------------------------
+# Dataset sintético
+# ---------------------------------
+def make_users(n: int) -> list[dict]:
+    now_dt = main.now()
+    return [
+        {
+            "_id": ObjectId(), "name": f"user{i}", "rating": 0.0, "cant_events_visited": 0,
+            "cant_events_organized": 0, "cant_no_shows": 0, "created_at": now_dt, "updated_at": now_dt,
+        }
+        for i in range(n)
+    ]
+
+
+def make_events(n: int, huge: int, huge_participants: int, users: list[dict], rng: random.Random) -> list[dict]:
+    """Eventos activos a futuro; los primeros `huge` tienen listas de participantes largas"""
+    now_dt = main.now()
+    user_ids = [u["_id"] for u in users]
+    events = []
+    for i in range(n):
+        start = now_dt + timedelta(hours=rng.randint(1, 24 * 90))
+        organizer = rng.choice(user_ids)
+        others = [u for u in rng.sample(user_ids, min(len(user_ids), huge_participants if i < huge else rng.randint(0, 12))) if u != organizer]
+        split = len(others) * 3 // 4
+        events.append({
+            "_id": ObjectId(),
+            "title": f"Evento {i}",
+            "description": "",
+            "fecha_inicio": start,
+            "fecha_fin": start + timedelta(hours=rng.choice((1, 2, 3, 6))),
+            "activo": 1,
+            "finalizado": False,
+            "organizer_id": organizer,
+            "confirmed_participants": others[:split],
+            "pending_approval_participants": others[split:],
+            "blacklisted_participants": [],
+            "location": {"type": "Point", "coordinates": [CENTER[1] + rng.gauss(0, 0.3), CENTER[0] + rng.gauss(0, 0.3)]},
+            "location_alias": None,
+            "category": rng.choice(main.CATEGORIES),
+            "created_at": now_dt,
+            "updated_at": now_dt,
+        })
+    return events
+
+
+def make_notifications(users: list[dict], per_user: int, rng: random.Random) -> list[dict]:
+    docs = []
+    start = main.now() - timedelta(days=7)
+    for u in users:
+        for i in range(per_user):
+            doc = main.notification_doc(str(u["_id"]), "event_reminder", "Recordatorio", f"Notificación {i}")
+            doc.pop("outbox", None)  # backlog ya entregado: el relay no tiene que publicarlo
+            doc["created_at"] = start + timedelta(seconds=rng.randint(0, 7 * 86400))
+            doc["read"] = rng.random() < 0.7
+            docs.append(doc)
+    return docs
+
+
+async def connect(backend: str):
+    if backend == "memory":
+        client = MemoryClient()
+    else:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(main.MONGO_URI, serverSelectionTimeoutMS=2000, event_listeners=[main.mongo_metrics])
+        await client.admin.command("ping")
+        await client.drop_database("la_segunda_load")
+    database = client["la_segunda_load"]
+    await main.ensure_indexes(database)
+    return database
+
+
+async def seed(args, rng: random.Random) -> dict:
+    """Puebla la base y deja main listo como después de on_startup"""
+    main.db = await connect(args.backend)
+    main.notification_exchange = main.InProcessExchange()
+    users = make_users(args.users)
+    events = make_events(args.events, args.huge_events, args.huge_participants, users, rng)
+    notifications = make_notifications(users, args.notifications_per_user, rng)
+    t0 = time.perf_counter()
+    for collection, docs in (("users", users), ("events", events), ("notifications", notifications)):
+        for i in range(0, len(docs), 5000):
+            await main.db[collection].insert_many(docs[i:i + 5000], ordered=False)
+    await main.roster.migrate()
+    if main.GEO_INDEX_ENABLED:
+        await main.geo_index.load()
+    print(f"dataset: {len(users)} usuarios, {len(events)} eventos ({args.huge_events} con {args.huge_participants} participantes), "
+          f"{len(notifications)} notificaciones  [{time.perf_counter() - t0:.1f}s, backend {args.backend}]")
+    return {"users": users, "events": events}
+
+
+# ---------------------------------
+# Workloads
+# ---------------------------------
+# Un job es (endpoint, factory): endpoint es el template de la ruta con el que se agrupan las
+# latencias; factory arma la corrutina que hace el request y devuelve el status
+Job = "tuple[str, Callable[[], Awaitable[int]]]"
+
+
+def discover_job(http: httpx.AsyncClient, rng: random.Random, geo: bool) -> Job:
+    params: dict = {"limit": 20}
+    if rng.random() < 0.5:
+        params["category"] = rng.choice(main.CATEGORIES)
+    if geo:
+        params.update(lat=CENTER[0] + rng.gauss(0, 0.1), lng=CENTER[1] + rng.gauss(0, 0.1))
+        if rng.random() < 0.5:
+            params["max_km"] = rng.choice((2, 5, 10, 25))
+    label = "GET /events (geo)" if geo else "GET /events"
+    return label, lambda: status_of(http.get("/events", params=params))
+
+
+def apply_accept_jobs(http: httpx.AsyncClient, data: dict, rng: random.Random, count: int) -> tuple[list[Job], list[Job]]:
+    """Muchos usuarios postulándose al mismo evento chico y después el organizador aceptando a todos"""
+    event = data["events"][-1]
+    organizer = {"X-User-Id": str(event["organizer_id"])}
+    applicants = [u["_id"] for u in rng.sample(data["users"], min(count, len(data["users"]))) if u["_id"] != event["organizer_id"]]
+    path = f"/events/{event['_id']}"
+    applies = [
+        ("POST /events/{event_id}/apply", lambda u=u: status_of(http.post(f"{path}/apply", params={"view": "compact"}, headers={"X-User-Id": str(u)})))
+        for u in applicants
+    ]
+    accepts = [
+        ("POST /events/{event_id}/accept", lambda u=u: status_of(http.post(f"{path}/accept", params={"view": "compact"}, json={"user_id": str(u)}, headers=organizer)))
+        for u in applicants
+    ]
+    return applies, accepts
+
+
+def cancel_jobs(http: httpx.AsyncClient, data: dict, huge: int) -> list[Job]:
+    return [
+        ("PATCH /events/{event_id}/cancel", lambda ev=ev: status_of(http.patch(
+            f"/events/{ev['_id']}/cancel", params={"view": "compact"}, headers={"X-User-Id": str(ev["organizer_id"])})))
+        for ev in data["events"][:huge]
+    ]
+
+
+def sse_reconnect_jobs(data: dict, rng: random.Random, count: int) -> list[Job]:
+    """Reconexiones con Last-Event-ID (ej. después de un deploy): tiempo hasta el primer frame.
+    Va directo al endpoint porque ASGITransport no devuelve la respuesta hasta que termina el stream."""
+
+    async def reconnect(user_id: str) -> int:
+        latest = await main.db.notifications.find({"user_id": ObjectId(user_id)}).sort("_id", -1).limit(5).to_list(5)
+        last_id = str(latest[-1]["_id"]) if latest else None
+        response = await main.stream_notifications(x_user_id=user_id, last_event_id=last_id, last_event_id_param=None)
+        frames = response.body_iterator
+        try:
+            await asyncio.wait_for(frames.__anext__(), timeout=5)
+        finally:
+            await frames.aclose()
+        return 200
+
+    users = rng.sample(data["users"], min(count, len(data["users"])))
+    return [("GET /notifications/stream (reconnect)", lambda u=u: reconnect(str(u["_id"]))) for u in users]
+
+
+def mixed_jobs(http: httpx.AsyncClient, data: dict, rng: random.Random, count: int) -> list[Job]:
+    """Tráfico típico: mayormente lecturas, con algunas postulaciones"""
+    jobs: list[Job] = []
+    events = data["events"]
+    for _ in range(count):
+        r = rng.random()
+        user = rng.choice(data["users"])
+        headers = {"X-User-Id": str(user["_id"])}
+        if r < 0.35:
+            jobs.append(discover_job(http, rng, geo=True))
+        elif r < 0.55:
+            jobs.append(discover_job(http, rng, geo=False))
+        elif r < 0.70:
+            ev = rng.choice(events)
+            jobs.append(("GET /events/{event_id}", lambda ev=ev: status_of(http.get(f"/events/{ev['_id']}", params={"view": "compact"}))))
+        elif r < 0.82:
+            jobs.append(("GET /notifications", lambda h=headers: status_of(http.get("/notifications", headers=h))))
+        elif r < 0.92:
+            jobs.append(("GET /notifications/unread_count", lambda h=headers: status_of(http.get("/notifications/unread_count", headers=h))))
+        else:
+            ev = rng.choice(events)
+            jobs.append(("POST /events/{event_id}/apply", lambda ev=ev, h=headers: status_of(http.post(f"/events/{ev['_id']}/apply", params={"view": "compact"}, headers=h))))
+    return jobs
+
+
+async def status_of(request: Awaitable[httpx.Response]) -> int:
+    return (await request).status_code
+
+
+# ---------------------------------
+# Runner
+# ---------------------------------
+def percentile(samples: list[float], q: float) -> float:
+    return samples[min(len(samples) - 1, int(len(samples) * q))] * 1000
+
+
+async def run_phase(name: str, jobs: list[Job], concurrency: int) -> dict:
+    """Corre los jobs con `concurrency` requests en vuelo; devuelve las métricas por endpoint"""
+    samples: dict[str, list[float]] = {}
+    errors: dict[str, int] = {}
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one(endpoint: str, factory):
+        async with slots:
+            t0 = time.perf_counter()
+            try:
+                status = await factory()
+            except Exception:
+                status = 599
+            samples.setdefault(endpoint, []).append(time.perf_counter() - t0)
+            if status >= 400:
+                errors[endpoint] = errors.get(endpoint, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[one(endpoint, factory) for endpoint, factory in jobs])
+    wall = time.perf_counter() - started
+
+    endpoints = {}
+    for endpoint, values in samples.items():
+        values.sort()
+        endpoints[endpoint] = {
+            "requests": len(values),
+            "errors": errors.get(endpoint, 0),
+            "rps": len(values) / wall,
+            "p50_ms": percentile(values, 0.50),
+            "p95_ms": percentile(values, 0.95),
+            "p99_ms": percentile(values, 0.99),
+        }
+    print(f"\n[{name}] {len(jobs)} requests en {wall:.2f}s ({len(jobs) / wall:.0f} req/s), concurrencia {concurrency}")
+    print(f"{'endpoint':>40} | {'req':>6} | {'req/s':>8} | {'p50 ms':>8} | {'p95 ms':>8} | {'p99 ms':>8} | {'err':>4}")
+    print("-" * 98)
+    for endpoint, r in endpoints.items():
+        print(f"{endpoint:>40} | {r['requests']:>6} | {r['rps']:>8.0f} | {r['p50_ms']:>8.2f} | {r['p95_ms']:>8.2f} | {r['p99_ms']:>8.2f} | {r['errors']:>4}")
+    return {"wall_s": wall, "requests": len(jobs), "endpoints": endpoints}
+
+
+def compare(current: dict, baseline_path: str):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nvs {baseline_path} ({baseline['meta']['timestamp']}, {baseline['meta']['git']})")
+    print(f"{'fase / endpoint':>52} | {'req/s':>14} | {'p50 ms':>16} | {'p99 ms':>16}")
+    print("-" * 108)
+    for phase, result in current["phases"].items():
+        for endpoint, r in result["endpoints"].items():
+            base = baseline["phases"].get(phase, {}).get("endpoints", {}).get(endpoint)
+            if base is None:
+                continue
+            delta = lambda key: f"{base[key]:>6.1f}→{r[key]:<6.1f}({(r[key] / base[key] - 1) * 100 if base[key] else 0:+.0f}%)"  # noqa: E731
+            print(f"{phase + ' / ' + endpoint:>52} | {base['rps']:>5.0f}→{r['rps']:<5.0f} | {delta('p50_ms'):>16} | {delta('p99_ms'):>16}")
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def bench(args):
+    rng = random.Random(args.seed)
+    data = await seed(args, rng)
+    transport = httpx.ASGITransport(app=main.app)
+    phases = {}
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        phases["discover"] = await run_phase("discover", [discover_job(http, rng, geo=False) for _ in range(args.requests)], args.concurrency)
+        phases["discover_geo"] = await run_phase("discover geo", [discover_job(http, rng, geo=True) for _ in range(args.requests)], args.concurrency)
+        applies, accepts = apply_accept_jobs(http, data, rng, args.storm)
+        phases["apply_storm"] = await run_phase("apply storm", applies, args.concurrency)
+        phases["accept_storm"] = await run_phase("accept storm", accepts, args.concurrency)
+        phases["sse_reconnect_storm"] = await run_phase("SSE reconnect storm", sse_reconnect_jobs(data, rng, args.storm), args.concurrency)
+        phases["mixed"] = await run_phase("mixed", mixed_jobs(http, data, rng, args.requests), args.concurrency)
+        # Al final: deja los eventos enormes cancelados
+        phases["cancel_huge"] = await run_phase("cancel huge events", cancel_jobs(http, data, args.huge_events), 1)
+
+    result = {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(),
+            "git": git_revision(),
+            "python": platform.python_version(),
+            "args": vars(args),
+            "env": {k: v for k, v in os.environ.items() if k.startswith(("ROSTER_", "DISCOVER_", "GEO_", "NOTIFICATION_", "SSE_", "USER_CACHE"))},
+        },
+        "phases": phases,
+    }
+    out = args.out or os.path.join(RESULTS_DIR, f"{datetime.utcnow():%Y%m%dT%H%M%S}-{args.backend}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"\nresultados en {out}")
+    if args.compare:
+        compare(result, args.compare)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Prueba de carga con dataset sintético")
+    parser.add_argument("--backend", choices=("mongo", "memory"), default="memory")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--events", type=int, default=5000)
+    parser.add_argument("--huge-events", type=int, default=3)
+    parser.add_argument("--huge-participants", type=int, default=1500)
+    parser.add_argument("--notifications-per-user", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=1000, help="requests por fase de discover y en la mezcla")
+    parser.add_argument("--storm", type=int, default=300, help="usuarios en las tormentas de apply/accept y SSE")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", help="archivo JSON de resultados (default: benchmarks/results/<ts>-<backend>.json)")
+    parser.add_argument("--compare", help="JSON de una corrida anterior para comparar")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(bench(parse_args()))
@@ -0,0 +1,123 @@
+# benchmarks/bench_logging_stall.py
+# Cuánto traba el event loop escribir logs cuando stdout es lento (terminal, pipe de docker
+# logs lleno): print() en el loop, como estaban los hot paths, vs el logging con QueueHandler
+# (el loop sólo encola; escribe un thread aparte), con y sin muestreo.
+#
+# No necesita MongoDB ni RabbitMQ. stdout se simula con un stream que tarda --write-us por
+# escritura. Un monitor duerme 1 ms en loop y mide cuánto tarde se despierta (lag del loop)
+# mientras --requests requests simulados loguean lo que logueaban un login y un frame SSE.
+# Run (desde la raíz del repo):
+#   python benchmarks/bench_logging_stall.py
+#   python benchmarks/bench_logging_stall.py --requests 5000 --write-us 200
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+
+class SlowStream:
+    """stdout que tarda write_s por escritura (bloquea a quien escribe)"""
+
+    def __init__(self, write_s: float):
+        self.write_s = write_s
+        self.writes = 0
+
+    def write(self, text: str):
+        time.sleep(self.write_s)
+        self.writes += 1
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+def print_request(out: SlowStream, i: int):
+    """Lo que imprimía un request antes: log_requests + login_user + un frame SSE"""
+    headers = {"host": "localhost:8000", "content-type": "application/json", "x-user-id": f"{i:024x}"}
+    print("🔍 POST /users/login recibido", file=out)
+    print(f"🔍 Headers: {headers}", file=out)
+    print(f"🔍 login_user llamado con name: 'user{i}'", file=out)
+    print(f"🔍 Usuario encontrado: user{i}", file=out)
+    print(f"📤 Enviando notificación por SSE a usuario {i:024x}", file=out)
+
+
+def log_request(out: SlowStream, i: int):
+    """Lo mismo con los loggers de main (una línea por request y un frame SSE en DEBUG)"""
+    main.log_http.info("request", extra={"method": "POST", "path": "/users/login", "status": 200, "duration_ms": 1.2})
+    main.log_sse.debug("frame enviado", extra={"user_id": f"{i:024x}", "id": str(i)})
+
+
+async def monitor(lags: list[float], stop: asyncio.Event):
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        await asyncio.sleep(0.001)
+        lags.append(time.perf_counter() - t0 - 0.001)
+
+
+async def run(args, emit, out: SlowStream) -> dict:
+    lags: list[float] = []
+    stop = asyncio.Event()
+    watcher = asyncio.create_task(monitor(lags, stop))
+    await asyncio.sleep(0.01)
+
+    async def request(i: int):
+        await asyncio.sleep(0)  # un await de por medio, como un request real
+        emit(out, i)
+
+    t0 = time.perf_counter()
+    for start in range(0, args.requests, args.concurrency):
+        await asyncio.gather(*[request(i) for i in range(start, min(args.requests, start + args.concurrency))])
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    await watcher
+    lags.sort()
+    return {
+        "elapsed": elapsed,
+        "p50": statistics.median(lags) * 1000,
+        "p99": lags[min(len(lags) - 1, int(len(lags) * 0.99))] * 1000,
+        "max": lags[-1] * 1000,
+    }
+
+
+async def bench(args):
+    main.log_listener.stop()
+    write_s = args.write_us / 1e6
+    print(f"{args.requests} requests ({args.concurrency} concurrentes), stdout a {args.write_us:.0f} µs por escritura")
+    print(f"{'modo':>22} | {'tiempo (s)':>10} | {'lag p50 (ms)':>12} | {'lag p99 (ms)':>12} | {'lag máx (ms)':>12} | {'escrituras':>10}")
+    print("-" * 94)
+    modes = [("print", print_request, None), ("logging sin muestreo", log_request, 0.0), ("logging (muestreo)", log_request, args.sample_rate)]
+    for label, emit, sample_rate in modes:
+        out = SlowStream(write_s)
+        listener = None
+        if sample_rate is not None:
+            main.LOG_SAMPLE_RATE = sample_rate
+            main.LOG_QUEUE_SIZE = args.requests * 2  # que no descarte: se mide el costo de escribir todo
+            listener = main.setup_logging(stream=out)
+            logging.getLogger("la_segunda").setLevel(logging.DEBUG)
+        r = await run(args, emit, out)
+        if listener is not None:
+            listener.stop()  # espera a que el thread termine de escribir
+        print(f"{label:>22} | {r['elapsed']:>10.2f} | {r['p50']:>12.2f} | {r['p99']:>12.2f} | {r['max']:>12.2f} | {out.writes:>10}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark de lag del event loop por logging")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--write-us", type=float, default=100.0)
+    parser.add_argument("--sample-rate", type=float, default=10.0)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(bench(parse_args()))
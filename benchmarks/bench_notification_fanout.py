@@ -0,0 +1,96 @@
+# benchmarks/bench_notification_fanout.py
+# Latencia del fan-out de notificaciones (cancel/complete) vs cantidad de participantes.
+# Compara el loop original (insert_one + publish por participante, secuencial)
+# contra publish_notifications_bulk (un insert_many + publish en lotes en background).
+#
+# No necesita MongoDB ni RabbitMQ: storage engine en memoria con un round trip simulado por
+# operación (benchmarks/memory_backend.py) y main.InProcessExchange con el mismo delay por
+# publisher confirm.
+# Run (desde la raíz del repo):
+#   python benchmarks/bench_notification_fanout.py
+#   python benchmarks/bench_notification_fanout.py --rtt-ms 0.5 --sizes 10 100 1000
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("LOG_LEVEL", "ERROR")  # sin logs de main entre las filas de la tabla
+
+from bson import ObjectId
+from fastapi import BackgroundTasks
+
+import main
+from benchmarks.memory_backend import SimulatedDatabase
+
+
+async def run_legacy(user_ids: list[str]) -> float:
+    t0 = time.perf_counter()
+    for uid in user_ids:
+        await main.publish_notification(
+            user_id=uid,
+            notification_type="event_cancelled",
+            title="Evento cancelado",
+            message="El evento 'bench' ha sido cancelado",
+            event_id=str(ObjectId()),
+            event_title="bench",
+        )
+    return time.perf_counter() - t0
+
+
+async def run_bulk(user_ids: list[str]) -> tuple[float, float]:
+    background = BackgroundTasks()
+    t0 = time.perf_counter()
+    await main.publish_notifications_bulk(
+        background,
+        user_ids=user_ids,
+        notification_type="event_cancelled",
+        title="Evento cancelado",
+        message="El evento 'bench' ha sido cancelado",
+        event_id=str(ObjectId()),
+        event_title="bench",
+    )
+    response_ready = time.perf_counter() - t0
+    # Lo que Starlette corre después de enviar la respuesta
+    await background()
+    return response_ready, time.perf_counter() - t0
+
+
+async def bench(sizes: list[int], rtt: float):
+    print(f"RTT simulado por round trip: {rtt * 1000:.2f} ms")
+    print(f"{'participantes':>13} | {'loop (ms)':>10} | {'bulk resp (ms)':>14} | {'bulk total (ms)':>15} | {'speedup':>7}")
+    print("-" * 72)
+    for n in sizes:
+        user_ids = [str(ObjectId()) for _ in range(n)]
+
+        main.db = SimulatedDatabase(rtt)
+        main.notification_exchange = main.InProcessExchange(delay=rtt)
+        with contextlib.redirect_stdout(io.StringIO()):
+            legacy = await run_legacy(user_ids)
+
+        main.db = SimulatedDatabase(rtt)
+        main.notification_exchange = main.InProcessExchange(delay=rtt)
+        with contextlib.redirect_stdout(io.StringIO()):
+            resp, total = await run_bulk(user_ids)
+        assert main.notification_exchange.published == n
+        assert await main.db.raw.notifications.count_documents({}) == n
+
+        print(f"{n:>13} | {legacy * 1000:>10.1f} | {resp * 1000:>14.1f} | {total * 1000:>15.1f} | {legacy / resp:>6.0f}x")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark del fan-out de notificaciones")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100, 1000, 5000])
+    parser.add_argument("--rtt-ms", type=float, default=1.0, help="latencia simulada por round trip (Mongo o confirm de RabbitMQ)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    asyncio.run(bench(args.sizes, args.rtt_ms / 1000.0))
@@ -0,0 +1,96 @@
+# benchmarks/bench_notification_outbox.py
+# Latencia de publish_notification (lo que paga el request) con publicación inline vs outbox,
+# con el broker sano, lento y caído; y cuánto tarda el relay en vaciar el outbox al volver.
+#
+# No necesita MongoDB ni RabbitMQ: storage engine en memoria con un round trip simulado por
+# operación (benchmarks/memory_backend.py) y el broker es main.InProcessExchange (delay =
+# espera del publisher confirm).
+# Run (desde la raíz del repo):
+#   python benchmarks/bench_notification_outbox.py
+#   python benchmarks/bench_notification_outbox.py --requests 2000 --slow-ms 80
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("LOG_LEVEL", "ERROR")  # sin logs de main entre las filas de la tabla
+
+from bson import ObjectId
+
+import main
+from benchmarks.memory_backend import SimulatedDatabase
+
+
+def pctl(samples: list[float], q: float) -> float:
+    return samples[min(len(samples) - 1, int(len(samples) * q))] * 1000
+
+
+async def run(args, delivery: str, broker: str) -> dict:
+    sim = SimulatedDatabase(args.rtt_ms / 1000)
+    await main.ensure_indexes(sim.raw)
+    main.db = sim
+    main.NOTIFICATION_DELIVERY = delivery
+    main.NOTIFICATION_OUTBOX_POLL = 0.01
+    exchange = main.InProcessExchange(delay=(args.slow_ms if broker == "lento" else args.confirm_ms) / 1000)
+    exchange.fail = broker == "caído"
+    main.notification_exchange = exchange
+    main.outbox_relay = main.OutboxRelay()
+    relay = asyncio.create_task(main.outbox_relay.run()) if delivery == "outbox" else None
+    user_ids = [str(ObjectId()) for _ in range(50)]
+    samples = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(args.requests):
+            t0 = time.perf_counter()
+            await main.publish_notification(user_ids[i % len(user_ids)], "application_accepted", "Postulación aceptada", "ok")
+            samples.append(time.perf_counter() - t0)
+        drain_s = None
+        if relay is not None:
+            # El broker vuelve (o sigue sano): cuánto tarda el relay en publicar todo lo pendiente
+            exchange.fail = False
+            main.outbox_relay.failures = 0
+            t0 = time.perf_counter()
+            main.outbox_relay.wake()
+            while await sim.raw.notifications.count_documents({"outbox": {"$exists": True}}):
+                await asyncio.sleep(0.005)
+            drain_s = time.perf_counter() - t0
+            relay.cancel()
+    samples.sort()
+    return {
+        "p50": statistics.median(samples) * 1000,
+        "p99": pctl(samples, 0.99),
+        "delivered": exchange.published,
+        "drain_s": drain_s,
+    }
+
+
+async def bench(args):
+    print(f"{args.requests} notificaciones, RTT MongoDB {args.rtt_ms:.2f} ms, confirm {args.confirm_ms:.1f} ms (lento: {args.slow_ms:.0f} ms)")
+    print(f"{'modo':>8} | {'broker':>7} | {'p50 (ms)':>9} | {'p99 (ms)':>9} | {'entregadas':>10} | {'vaciado outbox (s)':>18}")
+    print("-" * 78)
+    for delivery in ("inline", "outbox"):
+        for broker in ("sano", "lento", "caído"):
+            r = await run(args, delivery, broker)
+            drain = f"{r['drain_s']:.2f}" if r["drain_s"] is not None else "-"
+            print(f"{delivery:>8} | {broker:>7} | {r['p50']:>9.2f} | {r['p99']:>9.2f} | {r['delivered']:>10} | {drain:>18}")
+    print("(inline con el broker caído pierde el push: la notificación sólo queda en MongoDB)")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark de publish_notification: inline vs outbox")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--rtt-ms", type=float, default=0.3)
+    parser.add_argument("--confirm-ms", type=float, default=1.0)
+    parser.add_argument("--slow-ms", type=float, default=50.0)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(bench(parse_args()))
@@ -0,0 +1,103 @@
+# benchmarks/bench_sse_reconnect_storm.py
+# Tormenta de reconexiones SSE con Last-Event-ID: carga sobre MongoDB con y sin el
+# replay buffer en memoria (sse_replay).
+#
+# No necesita MongoDB: corre sobre el storage engine en memoria con un round trip simulado
+# por query y un pool de conexiones acotado (benchmarks/memory_backend.py).
+# Run (desde la raíz del repo):
+#   python benchmarks/bench_sse_reconnect_storm.py
+#   python benchmarks/bench_sse_reconnect_storm.py --users 5000 --missed 5 --rtt-ms 2
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("LOG_LEVEL", "ERROR")  # sin logs de main entre las filas de la tabla
+
+from bson import ObjectId
+
+import main
+from benchmarks.memory_backend import SimulatedDatabase
+
+
+async def build_dataset(users: int, per_user: int, rtt: float, pool_size: int, ring_size: int):
+    """Llena la colección y (si ring_size > 0) el replay buffer, como lo haría el consumer"""
+    sim = SimulatedDatabase(rtt, pool_size)
+    await main.ensure_indexes(sim.raw)
+    main.db = sim
+    main.sse_replay = main.NotificationReplayBuffer(ring_size, max(users, 1))
+    resume_points, docs = [], []
+    for _ in range(users):
+        uid = ObjectId()
+        ids = []
+        for i in range(per_user):
+            doc = main.notification_doc(str(uid), "new_application", "Nueva postulación", f"mensaje {i}", str(ObjectId()), "bench")
+            doc["_id"] = ObjectId()
+            docs.append(doc)
+            main.sse_replay.record(str(uid), main.notification_payload(doc))
+            ids.append(doc["_id"])
+        resume_points.append((str(uid), ids))
+    await sim.raw.notifications.insert_many(docs)
+    return resume_points
+
+
+async def reconnect(user_id: str, last_id: ObjectId, expected: int) -> float:
+    t0 = time.perf_counter()
+    resp = await main.stream_notifications(user_id, str(last_id), None)
+    it = resp.body_iterator
+    try:
+        for _ in range(expected):
+            await it.__anext__()
+    finally:
+        await it.aclose()
+    return time.perf_counter() - t0
+
+
+async def storm(args, ring_size: int) -> dict:
+    points = await build_dataset(args.users, args.per_user, args.rtt_ms / 1000.0, args.pool, ring_size)
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        latencies = await asyncio.gather(
+            *[reconnect(uid, ids[-args.missed - 1], args.missed) for uid, ids in points]
+        )
+    wall = time.perf_counter() - t0
+    latencies = sorted(latencies)
+    return {
+        "queries": main.db.round_trips["notifications"],
+        "wall_ms": wall * 1000,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+
+async def bench(args):
+    print(f"{args.users} reconexiones simultáneas, {args.missed} notificaciones perdidas c/u, "
+          f"RTT {args.rtt_ms:.1f} ms, pool {args.pool}")
+    print(f"{'replay buffer':>14} | {'queries Mongo':>13} | {'total (ms)':>10} | {'p50 (ms)':>9} | {'p99 (ms)':>9}")
+    print("-" * 68)
+    for label, ring_size in (("deshabilitado", 0), (f"{args.ring}/usuario", args.ring)):
+        r = await storm(args, ring_size)
+        print(f"{label:>14} | {r['queries']:>13} | {r['wall_ms']:>10.1f} | {r['p50_ms']:>9.2f} | {r['p99_ms']:>9.2f}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark de tormenta de reconexiones SSE")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--per-user", type=int, default=20, help="notificaciones existentes por usuario")
+    parser.add_argument("--missed", type=int, default=3, help="notificaciones perdidas durante la desconexión")
+    parser.add_argument("--ring", type=int, default=main.SSE_REPLAY_BUFFER, help="tamaño del replay buffer por usuario")
+    parser.add_argument("--rtt-ms", type=float, default=1.0)
+    parser.add_argument("--pool", type=int, default=100, help="maxPoolSize simulado de Motor")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(bench(parse_args()))
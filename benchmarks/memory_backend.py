@@ -0,0 +1,104 @@
+# benchmarks/memory_backend.py
+# MongoDB simulado para los benchmarks: el storage engine en memoria (storage_memory.py) con
+# la latencia de un mongod de verdad. Cada operación espera un slot del pool de conexiones
+# (como maxPoolSize de Motor) y después un round trip; un cursor (find/aggregate) cuesta un
+# round trip al traer sus documentos. Los round trips se cuentan por colección.
+#
+#   sim = SimulatedDatabase(rtt=0.001, pool_size=100)
+#   await main.ensure_indexes(sim.raw)   # sembrar/preparar por .raw no cuesta round trips
+#   main.db = sim
+#   ...
+#   sim.round_trips["notifications"]
+
+from __future__ import annotations
+
+import asyncio
+import inspect
+import os
+import sys
+from collections import Counter
+from typing import Any, Callable, Optional, Union
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage_memory import MemoryClient, MemoryCollection, MemoryDatabase  # noqa: E402
+
+# segundos por round trip, fijo o una función (p. ej. base + jitter)
+Latency = Union[float, Callable[[], float]]
+
+
+class SimulatedCursor:
+    """Cursor de find()/aggregate(): sort/skip/limit encadenables; un round trip al leerlo"""
+
+    def __init__(self, database: "SimulatedDatabase", name: str, cursor: Any):
+        self._database = database
+        self._name = name
+        self._cursor = cursor
+
+    def __getattr__(self, attr: str):
+        method = getattr(self._cursor, attr)
+
+        def chained(*args, **kwargs):
+            method(*args, **kwargs)
+            return self
+        return chained
+
+    async def to_list(self, length: Optional[int] = None) -> list[dict[str, Any]]:
+        await self._database.round_trip(self._name)
+        return await self._cursor.to_list(length)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in await self.to_list():
+            yield doc
+
+
+class SimulatedCollection:
+    def __init__(self, database: "SimulatedDatabase", collection: MemoryCollection):
+        self._database = database
+        self._collection = collection
+
+    def find(self, *args, **kwargs) -> SimulatedCursor:
+        return SimulatedCursor(self._database, self._collection.name, self._collection.find(*args, **kwargs))
+
+    def aggregate(self, *args, **kwargs) -> SimulatedCursor:
+        return SimulatedCursor(self._database, self._collection.name, self._collection.aggregate(*args, **kwargs))
+
+    def __getattr__(self, attr: str):
+        method = getattr(self._collection, attr)
+        if not inspect.iscoroutinefunction(method):
+            return method
+
+        async def with_round_trip(*args, **kwargs):
+            await self._database.round_trip(self._collection.name)
+            return await method(*args, **kwargs)
+        return with_round_trip
+
+
+class SimulatedDatabase:
+    def __init__(self, rtt: Latency, pool_size: int = 100, name: str = "bench"):
+        self.raw: MemoryDatabase = MemoryClient()[name]
+        self.rtt = rtt
+        self.pool_size = pool_size
+        self.round_trips: Counter[str] = Counter()
+        self._pool: Optional[asyncio.Semaphore] = None  # se crea en el loop del benchmark
+        self._collections: dict[str, SimulatedCollection] = {}
+
+    async def round_trip(self, name: str):
+        if self._pool is None:
+            self._pool = asyncio.Semaphore(self.pool_size)
+        self.round_trips[name] += 1
+        async with self._pool:
+            await asyncio.sleep(self.rtt() if callable(self.rtt) else self.rtt)
+
+    def __getitem__(self, name: str) -> SimulatedCollection:
+        if name not in self._collections:
+            self._collections[name] = SimulatedCollection(self, self.raw[name])
+        return self._collections[name]
+
+    def __getattr__(self, name: str) -> SimulatedCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
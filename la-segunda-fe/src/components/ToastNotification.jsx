@@ -11,6 +11,8 @@ function getNotificationIcon(type) {
       return '❌'
     case 'event_started':
       return '🚀'
+    case 'event_ended':
+      return '⏰'
     case 'event_finished':
       return '🏁'
     case 'event_cancelled':
@@ -30,6 +32,8 @@ function getNotificationColor(type) {
       return 'bg-red-500'
     case 'event_started':
       return 'bg-purple-500'
+    case 'event_ended':
+      return 'bg-orange-500'
     case 'event_finished':
       return 'bg-yellow-500'
     case 'event_cancelled':
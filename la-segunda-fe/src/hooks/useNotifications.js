@@ -1,10 +1,39 @@
-import { useEffect, useState, useRef } from 'react'
+import { useEffect, useReducer, useState, useRef } from 'react'
 import { getUserId } from '../lib/auth.js'
 import { api } from '../lib/api.js'
 
+// Lista y contador de no leídas en un solo reducer: el contador depende de la lista
+// (un digest que ya estaba sin leer no suma) y el reducer tiene que ser puro (StrictMode lo
+// ejecuta dos veces)
+function notificationsReducer(state, action) {
+  switch (action.type) {
+    case 'loaded':
+      return { notifications: action.notifications, unreadCount: action.unread }
+    case 'received': {
+      const incoming = action.notification
+      // Los digests (ej. "12 personas quieren unirse") llegan otra vez con el mismo id
+      // cada vez que se actualizan: se reemplazan arriba de la lista
+      const existing = state.notifications.find(n => n.id === incoming.id)
+      const isNew = !existing || existing.read
+      return {
+        notifications: [incoming, ...state.notifications.filter(n => n.id !== incoming.id)],
+        unreadCount: isNew ? state.unreadCount + 1 : state.unreadCount,
+      }
+    }
+    case 'read':
+      return {
+        notifications: state.notifications.map(n => n.id === action.id ? { ...n, read: true } : n),
+        unreadCount: Math.max(0, state.unreadCount - 1),
+      }
+    case 'readAll':
+      return { notifications: state.notifications.map(n => ({ ...n, read: true })), unreadCount: 0 }
+    default:
+      return state
+  }
+}
+
 export function useNotifications() {
-  const [notifications, setNotifications] = useState([])
-  const [unreadCount, setUnreadCount] = useState(0)
+  const [{ notifications, unreadCount }, dispatch] = useReducer(notificationsReducer, { notifications: [], unreadCount: 0 })
   const [loading, setLoading] = useState(true)
   const eventSourceRef = useRef(null)
 
@@ -18,10 +47,11 @@ export function useNotifications() {
     // Cargar notificaciones históricas
     async function loadNotifications() {
       try {
-        const data = await api.get('/notifications?limit=50')
-        setNotifications(data)
-        const unread = data.filter(n => !n.read).length
-        setUnreadCount(unread)
+        const [data, { unread }] = await Promise.all([
+          api.get('/notifications?limit=50&include_archived=true'),
+          api.get('/notifications/unread_count'),
+        ])
+        dispatch({ type: 'loaded', notifications: data, unread })
       } catch (err) {
         console.error('Error cargando notificaciones:', err)
       } finally {
@@ -116,11 +146,16 @@ export function useNotifications() {
       // Si tenemos una notificación válida, procesarla
       if (notificationData && notificationData.type) {
         console.log('✅ Notificación parseada:', notificationData)
-        setNotifications(prev => [notificationData, ...prev])
-        setUnreadCount(prev => prev + 1)
+        dispatch({ type: 'received', notification: notificationData })
       }
     }
 
+    // El backend pide recargar el historial cuando no puede reenviar todo lo perdido al reconectar
+    eventSource.addEventListener('resync', () => {
+      console.log('🔄 SSE resync: recargando historial de notificaciones')
+      loadNotifications()
+    })
+
     eventSource.onerror = (error) => {
       console.error('❌ Error en SSE:', error)
       console.log('Estado del EventSource:', eventSource.readyState)
@@ -139,10 +174,7 @@ export function useNotifications() {
   const markAsRead = async (notificationId) => {
     try {
       await api.patch(`/notifications/${notificationId}/read`)
-      setNotifications(prev =>
-        prev.map(n => n.id === notificationId ? { ...n, read: true } : n)
-      )
-      setUnreadCount(prev => Math.max(0, prev - 1))
+      dispatch({ type: 'read', id: notificationId })
     } catch (err) {
       console.error('Error marcando notificación como leída:', err)
     }
@@ -151,8 +183,7 @@ export function useNotifications() {
   const markAllAsRead = async () => {
     try {
       await api.patch('/notifications/read-all')
-      setNotifications(prev => prev.map(n => ({ ...n, read: true })))
-      setUnreadCount(0)
+      dispatch({ type: 'readAll' })
     } catch (err) {
       console.error('Error marcando todas como leídas:', err)
     }
@@ -160,10 +191,11 @@ export function useNotifications() {
 
   const refresh = async () => {
     try {
-      const data = await api.get('/notifications?limit=50')
-      setNotifications(data)
-      const unread = data.filter(n => !n.read).length
-      setUnreadCount(unread)
+      const [data, { unread }] = await Promise.all([
+        api.get('/notifications?limit=50&include_archived=true'),
+        api.get('/notifications/unread_count'),
+      ])
+      dispatch({ type: 'loaded', notifications: data, unread })
     } catch (err) {
       console.error('Error refrescando notificaciones:', err)
     }
@@ -77,6 +77,18 @@ export const api = {
     return res.json()
   },
 
+  // GET de una lista paginada: { data, nextCursor } (el cursor viene en el header X-Next-Cursor)
+  async getPage(url) {
+    const res = await fetch(`${API_URL}${url}`, {
+      headers: getHeaders()
+    })
+    if (!res.ok) {
+      const err = await res.json().catch(() => ({ detail: res.statusText }))
+      throw new Error(err.detail || `Error ${res.status}`)
+    }
+    return { data: await res.json(), nextCursor: res.headers.get('X-Next-Cursor') }
+  },
+
   async post(url, body) {
     const res = await fetch(`${API_URL}${url}`, {
       method: 'POST',
@@ -4,6 +4,16 @@ import { useParams, useNavigate, Link } from 'react-router-dom'
 import { api } from '../lib/api.js'
 import { getUserId } from '../lib/auth.js'
 
+const PARTICIPANTS_PAGE = 50
+
+function LoadMore({shown, total, onClick}) {
+  return (
+    <button className="mt-3 text-xs sm:text-sm px-3 py-1 rounded border hover:bg-gray-50" onClick={onClick}>
+      Cargar más{total !== undefined ? ` (${shown} de ${total})` : ''}
+    </button>
+  )
+}
+
 function Chip({children}) {
   return <span className="text-xs rounded-full border px-2 py-0.5">{children}</span>
 }
@@ -23,49 +33,60 @@ export default function Event() {
   const [confirmed, setConfirmed] = useState([])
   const [pendingUsers, setPendingUsers] = useState({})
   const [confirmedUsers, setConfirmedUsers] = useState({})
+  const [pendingCursor, setPendingCursor] = useState(null)
+  const [confirmedCursor, setConfirmedCursor] = useState(null)
   const [userStatus, setUserStatus] = useState(null) // 'pending', 'confirmed', null
 
-  async function load() {
-    const data = await api.get(`/events/${id}`)
-    setEv(data)
-    setPending(data.pending_approval_participants || [])
-    setConfirmed(data.confirmed_participants || [])
-    
-    // Determinar estado del usuario actual
-    const currentUserId = getUserId()
-    if (currentUserId) {
-      if (data.confirmed_participants.includes(currentUserId)) {
-        setUserStatus('confirmed')
-      } else if (data.pending_approval_participants.includes(currentUserId)) {
-        setUserStatus('pending')
-      } else {
-        setUserStatus(null)
-      }
+  // Una página de participantes por estado, con nombre y rating (sirve con cualquier ROSTER_STORAGE).
+  // after es el cursor de la página anterior; nextCursor es null cuando no hay más
+  async function loadParticipants(status, after = null) {
+    try {
+      let url = `/events/${id}/participants?status=${status}&limit=${PARTICIPANTS_PAGE}`
+      if (after) url += `&after=${encodeURIComponent(after)}`
+      const { data: members, nextCursor } = await api.getPage(url)
+      const usersMap = {}
+      members.forEach(m => { usersMap[m.user_id] = { id: m.user_id, name: m.name, rating: m.rating ?? undefined } })
+      return { ids: members.map(m => m.user_id), usersMap, nextCursor }
+    } catch (e) {
+      console.error(`Error cargando participantes (${status}):`, e)
+      return { ids: [], usersMap: {}, nextCursor: after }
     }
+  }
 
-    // Cargar información de usuarios pendientes
-    if (data.pending_approval_participants.length > 0) {
-      try {
-        const users = await api.post('/users/batch', data.pending_approval_participants)
-        const usersMap = {}
-        users.forEach(u => { usersMap[u.id] = u })
-        setPendingUsers(usersMap)
-      } catch (e) {
-        console.error('Error cargando usuarios pendientes:', e)
-      }
+  async function loadMore(status) {
+    if (status === 'pending') {
+      const page = await loadParticipants('pending', pendingCursor)
+      setPending(ids => [...ids, ...page.ids.filter(uid => !ids.includes(uid))])
+      setPendingUsers(users => ({ ...users, ...page.usersMap }))
+      setPendingCursor(page.nextCursor)
+    } else {
+      const page = await loadParticipants('confirmed', confirmedCursor)
+      setConfirmed(ids => [...ids, ...page.ids.filter(uid => !ids.includes(uid))])
+      setConfirmedUsers(users => ({ ...users, ...page.usersMap }))
+      setConfirmedCursor(page.nextCursor)
     }
+  }
+
+  async function load() {
+    // view=compact trae los conteos y my_status en vez de las listas completas
+    const data = await api.get(`/events/${id}?view=compact`)
+    setEv(data)
 
-    // Cargar información de usuarios confirmados
-    if (data.confirmed_participants.length > 0) {
-      try {
-        const users = await api.post('/users/batch', data.confirmed_participants)
-        const usersMap = {}
-        users.forEach(u => { usersMap[u.id] = u })
-        setConfirmedUsers(usersMap)
-      } catch (e) {
-        console.error('Error cargando usuarios confirmados:', e)
-      }
+    // Determinar estado del usuario actual
+    if (getUserId()) {
+      setUserStatus(data.my_status === 'confirmed' || data.my_status === 'pending' ? data.my_status : null)
     }
+
+    const [pendingPage, confirmedPage] = await Promise.all([
+      loadParticipants('pending'),
+      loadParticipants('confirmed'),
+    ])
+    setPending(pendingPage.ids)
+    setPendingUsers(pendingPage.usersMap)
+    setPendingCursor(pendingPage.nextCursor)
+    setConfirmed(confirmedPage.ids)
+    setConfirmedUsers(confirmedPage.usersMap)
+    setConfirmedCursor(confirmedPage.nextCursor)
   }
   useEffect(()=>{ load() }, [id])
 
@@ -191,7 +212,7 @@ export default function Event() {
       {/* Participantes confirmados */}
       {confirmed.length > 0 && (
         <div className="rounded-xl border bg-white p-3 sm:p-4">
-          <h3 className="font-semibold text-sm sm:text-base mb-2">Participantes confirmados ({confirmed.length})</h3>
+          <h3 className="font-semibold text-sm sm:text-base mb-2">Participantes confirmados ({ev.confirmed_count})</h3>
           <ul className="space-y-2">
             {confirmed.map(uid => {
               const user = confirmedUsers[uid]
@@ -208,6 +229,7 @@ export default function Event() {
               )
             })}
           </ul>
+          {confirmedCursor && <LoadMore shown={confirmed.length} total={ev.confirmed_count} onClick={()=>loadMore('confirmed')} />}
         </div>
       )}
 
@@ -264,7 +286,7 @@ export default function Event() {
 
       {isOrganizer && (
         <div className="rounded-xl border bg-white p-3 sm:p-4">
-          <h3 className="font-semibold text-sm sm:text-base mb-2">Pendientes de aprobación</h3>
+          <h3 className="font-semibold text-sm sm:text-base mb-2">Pendientes de aprobación{ev.pending_count ? ` (${ev.pending_count})` : ''}</h3>
           {pending.length===0 ? <div className="text-xs sm:text-sm text-gray-600">No hay pendientes.</div> : (
             <ul className="space-y-3">
               {pending.map(uid => {
@@ -290,6 +312,7 @@ export default function Event() {
               })}
             </ul>
           )}
+          {pendingCursor && <LoadMore shown={pending.length} total={ev.pending_count} onClick={()=>loadMore('pending')} />}
         </div>
       )}
     </div>
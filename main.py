@@ -10,18 +10,45 @@
 from __future__ import annotations
 
 import os
+import sys
 import json
+import gzip
+import base64
+import math
+import time
+import heapq
+import bisect
+import random
+import queue
+import threading
 import asyncio
-from datetime import datetime
-from typing import Any, Optional, List, Literal
+import contextlib
+import contextvars
+import logging
+import logging.handlers
+from collections import Counter, OrderedDict, deque
+from itertools import islice
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Optional, List, Literal
 
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi import FastAPI, HTTPException, Depends, Header, Query, Body
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, Body, BackgroundTasks
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel, Field
-from bson import ObjectId
+from bson import ObjectId, json_util
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne, monitoring
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
 import aio_pika
+import orjson
+
+from storage_memory import EARTH_RADIUS_M, MemoryClient, haversine_m
+
+try:
+    import numpy as np
+except ImportError:  # opcional: sin NumPy el índice geo en memoria calcula distancias en Python puro
+    np = None
 
 # ----------------------------
 # Simplificaciones (decisiones)
@@ -34,15 +61,501 @@ import aio_pika
 # - Descubrimiento: si llega lat/lon, usamos $geoNear para ordenar por cercanía y (opcional) filtrar por distancia.
 # - Contadores de usuario (visitados/organizados/no-shows) se actualizan con endpoints explícitos de "complete" y "no_show".
 
+# -----------------
+# Logging
+# -----------------
+# Logs estructurados (una línea JSON por registro) que no bloquean el event loop:
+# - los loggers sólo encolan (QueueHandler); un thread aparte (QueueListener) arma el JSON
+#   y escribe en stdout. Si stdout se traba y la cola se llena, se descarta y se cuenta
+# - categorías: loggers "la_segunda.<categoría>" (http, sse, rabbitmq, notifications, ...);
+#   LOG_LEVEL es el nivel por defecto y LOG_LEVELS lo cambia por categoría ("sse=DEBUG,http=WARNING")
+# - muestreo: de cada (categoría, mensaje) pasan a lo sumo LOG_SAMPLE_RATE registros DEBUG/INFO
+#   por segundo; el siguiente que pasa lleva "suppressed" con los descartados. WARNING o más
+#   pasan siempre. Los datos variables van en extra=, no en el mensaje
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "10"))  # 0 = sin muestreo
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+_LOG_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+class JsonLogFormatter(logging.Formatter):
+    """Un objeto JSON por línea: ts, level, category, msg y los campos de extra="""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "category": record.name.rsplit(".", 1)[-1],
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _LOG_RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return orjson.dumps(entry, default=str).decode()
+
+class LogSampler(logging.Filter):
+    """Token bucket por (logger, mensaje) para los registros DEBUG/INFO"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+        self._buckets: dict[tuple[str, Any], list[float]] = {}  # key -> [tokens, último, descartados]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.rate <= 0 or record.levelno >= logging.WARNING:
+            return True
+        now_t = time.monotonic()
+        bucket = self._buckets.get((record.name, record.msg))
+        if bucket is None:
+            bucket = self._buckets[(record.name, record.msg)] = [self.rate, now_t, 0]
+        tokens = min(self.rate, bucket[0] + (now_t - bucket[1]) * self.rate)
+        bucket[1] = now_t
+        if tokens < 1:
+            bucket[0] = tokens
+            bucket[2] += 1
+            return False
+        bucket[0] = tokens - 1
+        if bucket[2]:
+            record.suppressed = int(bucket[2])
+            bucket[2] = 0
+        return True
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    """Encola sin bloquear; el mensaje y la excepción se resuelven acá, el JSON en el listener"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+def setup_logging(stream=None) -> logging.handlers.QueueListener:
+    """Configura los loggers "la_segunda.*" y arranca el thread que escribe (por defecto en stdout)"""
+    root = logging.getLogger("la_segunda")
+    root.setLevel(LOG_LEVEL)
+    root.propagate = False
+    for item in filter(None, LOG_LEVELS.split(",")):
+        category, _, level = item.partition("=")
+        logging.getLogger(f"la_segunda.{category.strip()}").setLevel(level.strip().upper())
+    log_queue: queue.Queue = queue.Queue(LOG_QUEUE_SIZE)
+    handler = LogQueueHandler(log_queue)
+    handler.addFilter(LogSampler(LOG_SAMPLE_RATE))
+    root.handlers[:] = [handler]
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonLogFormatter())
+    listener = logging.handlers.QueueListener(log_queue, output)
+    listener.start()
+    return listener
+
+log_listener = setup_logging()
+log = logging.getLogger("la_segunda.app")
+log_http = logging.getLogger("la_segunda.http")
+log_sse = logging.getLogger("la_segunda.sse")
+log_rabbitmq = logging.getLogger("la_segunda.rabbitmq")
+log_notifications = logging.getLogger("la_segunda.notifications")
+log_events = logging.getLogger("la_segunda.events")
+log_users = logging.getLogger("la_segunda.users")
+
+# -----------------
+# Metrics
+# -----------------
+# GET /metrics en formato de texto de Prometheus. Pensado para dejarlo prendido:
+# - el hot path sólo incrementa ints y listas ya creadas (sin locks, sin armar labels): los
+#   histogramas se crean la primera vez que aparece una ruta / comando y se reutilizan
+# - todo lo que es "estado actual" (streams abiertos, frames encolados, profundidad de la
+#   queue) se lee recién al hacer el scrape
+# - los tiempos de MongoDB vienen del command monitoring del driver, que corre en los threads
+#   de Motor: cada thread escribe en su propio shard y el scrape los suma
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MONGO_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+class Histogram:
+    """Histograma de buckets fijos; counts[i] cuenta valores <= bounds[i] (el último, +Inf)"""
+
+    __slots__ = ("bounds", "counts", "total")
+
+    def __init__(self, bounds: tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += value
+
+    def merge(self, other: Histogram):
+        for i, n in enumerate(other.counts):
+            self.counts[i] += n
+        self.total += other.total
+
+    def expose(self, name: str, labels: str, out: list[str]):
+        """Agrega las líneas _bucket/_sum/_count (labels ya formateados, sin llaves)"""
+        sep = "," if labels else ""
+        cumulative = 0
+        for bound, n in zip(self.bounds, self.counts):
+            cumulative += n
+            out.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}')
+        cumulative += self.counts[-1]
+        out.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {cumulative}')
+        labels = f"{{{labels}}}" if labels else ""
+        out.append(f"{name}_sum{labels} {self.total}")
+        out.append(f"{name}_count{labels} {cumulative}")
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Tiempos por (comando, colección) desde el command monitoring de pymongo"""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards: list[dict[str, Any]] = []
+        self._lock = threading.Lock()  # sólo para registrar el shard de un thread nuevo
+
+    def _shard(self) -> dict[str, Any]:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {"pending": {}, "ok": {}, "failed": {}}
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = event.command.get("collection", "")  # getMore
+        self._shard()["pending"][event.request_id] = collection
+
+    def _finish(self, event, outcome: str):
+        shard = self._shard()
+        collection = shard["pending"].pop(event.request_id, "")
+        by_command = shard[outcome].get(event.command_name)
+        if by_command is None:
+            by_command = shard[outcome][event.command_name] = {}
+        hist = by_command.get(collection)
+        if hist is None:
+            hist = by_command[collection] = Histogram(MONGO_BUCKETS)
+        hist.observe(event.duration_micros / 1e6)
+
+    def succeeded(self, event):
+        self._finish(event, "ok")
+
+    def failed(self, event):
+        self._finish(event, "failed")
+
+    def merged(self) -> dict[tuple[str, str, str], Histogram]:
+        """(outcome, comando, colección) -> histograma sumado de todos los threads"""
+        with self._lock:
+            shards = list(self._shards)
+        total: dict[tuple[str, str, str], Histogram] = {}
+        for shard in shards:
+            for outcome in ("ok", "failed"):
+                for command, by_collection in shard[outcome].copy().items():
+                    for collection, hist in by_collection.copy().items():
+                        key = (outcome, command, collection)
+                        if key not in total:
+                            total[key] = Histogram(MONGO_BUCKETS)
+                        total[key].merge(hist)
+        return total
+
+class Metrics:
+    """Métricas del proceso que se actualizan desde el event loop"""
+
+    def __init__(self):
+        self.routes: dict[str, dict[str, Histogram]] = {}       # método -> ruta -> latencia
+        self.statuses: dict[str, dict[str, list[int]]] = {}     # método -> ruta -> [1xx..5xx]
+        self.loops: dict[str, Histogram] = {}                   # tarea en background -> duración de cada vuelta
+        self.serialize = Histogram(LATENCY_BUCKETS)             # orjson en json_response
+        self.rabbitmq_published = 0
+        self.rabbitmq_publish_failed = 0
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float):
+        by_route = self.routes.get(method)
+        if by_route is None:
+            by_route = self.routes[method] = {}
+            self.statuses[method] = {}
+        hist = by_route.get(route)
+        if hist is None:
+            hist = by_route[route] = Histogram(LATENCY_BUCKETS)
+            self.statuses[method][route] = [0, 0, 0, 0, 0]
+        hist.observe(seconds)
+        self.statuses[method][route][min(4, max(0, status // 100 - 1))] += 1
+
+    def observe_loop(self, task: str, seconds: float):
+        hist = self.loops.get(task)
+        if hist is None:
+            hist = self.loops[task] = Histogram(LATENCY_BUCKETS)
+        hist.observe(seconds)
+
+    def render(self) -> str:
+        out: list[str] = []
+
+        def family(name: str, kind: str, doc: str):
+            out.append(f"# HELP {name} {doc}")
+            out.append(f"# TYPE {name} {kind}")
+
+        family("http_request_duration_seconds", "histogram", "Latencia de los requests por ruta")
+        for method, by_route in list(self.routes.items()):
+            for route, hist in list(by_route.items()):
+                hist.expose("http_request_duration_seconds", f'method="{method}",route="{route}"', out)
+        family("http_responses_total", "counter", "Respuestas por ruta y clase de status")
+        for method, by_route in list(self.statuses.items()):
+            for route, counts in list(by_route.items()):
+                for i, n in enumerate(counts):
+                    if n:
+                        out.append(f'http_responses_total{{method="{method}",route="{route}",status="{i + 1}xx"}} {n}')
+        family("json_serialize_seconds", "histogram", "orjson.dumps en json_response")
+        self.serialize.expose("json_serialize_seconds", "", out)
+
+        family("mongodb_command_duration_seconds", "histogram", "Comandos de MongoDB por comando y colección")
+        for (outcome, command, collection), hist in sorted(mongo_metrics.merged().items()):
+            hist.expose("mongodb_command_duration_seconds", f'command="{command}",collection="{collection}",outcome="{outcome}"', out)
+
+        family("sse_streams_open", "gauge", "Streams SSE abiertos en este worker")
+        out.append(f"sse_streams_open {len(sse_registry)}")
+        family("sse_frames_queued", "gauge", "Frames encolados en los buffers de los streams")
+        out.append(f"sse_frames_queued {sse_registry.queued_frames()}")
+
+        family("rabbitmq_published_total", "counter", "Notificaciones publicadas (confirmadas por el broker)")
+        out.append(f"rabbitmq_published_total {self.rabbitmq_published}")
+        family("rabbitmq_publish_failed_total", "counter", "Publicaciones que fallaron o no se confirmaron")
+        out.append(f"rabbitmq_publish_failed_total {self.rabbitmq_publish_failed}")
+        consumer = notification_consumer
+        for name, kind, value, doc in (
+            ("rabbitmq_consumed_total", "counter", consumer.received, "Mensajes recibidos por el consumer"),
+            ("rabbitmq_delivered_total", "counter", consumer.delivered, "Mensajes entregados a al menos un stream"),
+            ("rabbitmq_dead_lettered_total", "counter", consumer.dead_lettered, "Mensajes enviados a la DLQ"),
+            ("rabbitmq_acks_total", "counter", consumer.batcher.acked, "Mensajes confirmados (acks en lote)"),
+            ("rabbitmq_consumer_in_flight", "gauge", consumer.in_flight, "Mensajes en proceso"),
+            ("rabbitmq_consumer_connected", "gauge", int(consumer.connected), "1 si el consumer está conectado"),
+            ("rabbitmq_queue_depth", "gauge", consumer.queue_depth if consumer.queue_depth is not None else "NaN", "Mensajes en la queue (último muestreo)"),
+        ):
+            family(name, kind, doc)
+            out.append(f"{name} {value}")
+
+        family("background_loop_duration_seconds", "histogram", "Duración de cada vuelta de las tareas en background")
+        for task, hist in list(self.loops.items()):
+            hist.expose("background_loop_duration_seconds", f'task="{task}"', out)
+        out.append("")
+        return "\n".join(out)
+
+metrics = Metrics()
+mongo_metrics = MongoCommandMetrics()
+
+# -----------------
+# Profiling
+# -----------------
+# Perfil de requests puntuales, apagado por default. Se activa con cualquiera de:
+# - PROFILE_HEADER=1: el request trae "X-Profile: 1"
+# - PROFILE_SAMPLE_RATE: fracción de requests perfilados al azar (0.01 = 1%)
+# - PROFILE_SLOW_MS: se guardan los requests que tardaron más que eso (obliga a seguir a todos)
+# Por cada request perfilado se escribe en PROFILE_DIR:
+# - <ts>-<método>-<ruta>-<ms>.folded: stacks muestreados del event loop mientras corría el
+#   request, en formato "folded" (flamegraph.pl, speedscope)
+# - una línea en slow_requests.ndjson con la secuencia de awaits a MongoDB / RabbitMQ
+# Con todo apagado no se instala el middleware ni el listener: costo cero.
+PROFILE_HEADER = os.getenv("PROFILE_HEADER", "0") == "1"
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))              # 0 = sin captura por latencia
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))      # período del muestreo de stacks
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_EXCLUDE = tuple(p for p in os.getenv("PROFILE_EXCLUDE", "/notifications/stream,/metrics").split(",") if p)
+PROFILE_MAX_AWAITS = 2000  # por request
+PROFILING = PROFILE_HEADER or PROFILE_SAMPLE_RATE > 0 or PROFILE_SLOW_MS > 0
+
+current_profile: contextvars.ContextVar[Optional[RequestProfile]] = contextvars.ContextVar("current_profile", default=None)
+
+class RequestProfile:
+    """Lo que se juntó de un request: awaits (kind, name, inicio, duración) y stacks muestreados"""
+
+    def __init__(self, method: str, path: str, trigger: Optional[str]):
+        self.method = method
+        self.path = path
+        self.trigger = trigger  # "header" | "sample" | None (sólo se guarda si resulta lento)
+        self.started = time.perf_counter()
+        self.awaits: list[tuple[str, str, float, float]] = []
+        self.pending: dict[int, tuple[str, str, float]] = {}  # request_id de Mongo -> (comando, colección, inicio)
+        self.stacks: Counter[str] = Counter()
+
+    def record_await(self, kind: str, name: str, started: float):
+        if len(self.awaits) < PROFILE_MAX_AWAITS:
+            self.awaits.append((kind, name, started - self.started, time.perf_counter() - started))
+
+    def write(self, route: str, status: int, elapsed: float):
+        """Escribe el .folded y la línea del log (corre en un thread: I/O de disco)"""
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        ms = elapsed * 1000
+        folded = None
+        if self.stacks:
+            slug = route.strip("/").replace("/", "_").replace("{", "").replace("}", "") or "root"
+            folded = os.path.join(PROFILE_DIR, f"{datetime.utcnow():%Y%m%dT%H%M%S%f}-{self.method}-{slug}-{ms:.0f}ms.folded")
+            with open(folded, "w") as f:
+                for stack, count in self.stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+        line = {
+            "ts": datetime.utcnow().isoformat(),
+            "method": self.method,
+            "path": self.path,
+            "route": route,
+            "status": status,
+            "duration_ms": round(ms, 2),
+            "trigger": self.trigger or "slow",
+            "samples": sum(self.stacks.values()),
+            "sample_interval_ms": PROFILE_INTERVAL_MS,
+            "profile": folded,
+            "awaits": [
+                {"kind": kind, "name": name, "at_ms": round(at * 1000, 2), "duration_ms": round(d * 1000, 2)}
+                for kind, name, at, d in self.awaits
+            ],
+        }
+        with open(os.path.join(PROFILE_DIR, "slow_requests.ndjson"), "ab") as f:
+            f.write(orjson.dumps(line) + b"\n")
+
+def profile_await(kind: str, name: str, started: float):
+    """Anota un await terminado en el perfil del request actual (llamar sólo si PROFILING)"""
+    profile = current_profile.get()
+    if profile is not None:
+        profile.record_await(kind, name, started)
+
+class ProfileCommandListener(monitoring.CommandListener):
+    """Comandos de MongoDB del request perfilado (Motor copia el contexto al thread del driver)"""
+
+    def started(self, event):
+        profile = current_profile.get()
+        if profile is not None:
+            collection = event.command.get(event.command_name)
+            if not isinstance(collection, str):
+                collection = event.command.get("collection", "")
+            profile.pending[event.request_id] = (event.command_name, collection, time.perf_counter())
+
+    def _finish(self, event):
+        profile = current_profile.get()
+        if profile is not None:
+            pending = profile.pending.pop(event.request_id, None)
+            if pending is not None:
+                command, collection, started = pending
+                profile.record_await("mongodb", f"{command} {collection}", started)
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event)
+
+class StackSampler:
+    """Thread que cada PROFILE_INTERVAL_MS mira qué está ejecutando el event loop y, si la task
+    actual es un request perfilado, suma el stack a su perfil. Sólo ve tiempo de CPU en el loop:
+    la espera de I/O aparece en los awaits. Tasks hijas (gather) no se atribuyen al request."""
+
+    def __init__(self):
+        self.active: dict[asyncio.Task, RequestProfile] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(loop, threading.get_ident()), name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self, loop: asyncio.AbstractEventLoop, loop_thread: int):
+        interval = PROFILE_INTERVAL_MS / 1000
+        while not self._stop.wait(interval):
+            if not self.active:
+                continue
+            profile = self.active.get(asyncio.current_task(loop))
+            frame = sys._current_frames().get(loop_thread)
+            if profile is None or frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            profile.stacks[";".join(reversed(stack))] += 1
+
+stack_sampler = StackSampler()
+
+class RequestProfilerMiddleware:
+    """ASGI puro y registrado primero (el más interno), así el endpoint corre en la misma task"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(PROFILE_EXCLUDE):
+            return await self.app(scope, receive, send)
+        trigger = None
+        if PROFILE_HEADER and (b"x-profile", b"1") in scope["headers"]:
+            trigger = "header"
+        elif PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+            trigger = "sample"
+        if trigger is None and PROFILE_SLOW_MS <= 0:
+            return await self.app(scope, receive, send)
+
+        profile = RequestProfile(scope["method"], scope["path"], trigger)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        task = asyncio.current_task()
+        token = current_profile.set(profile)
+        stack_sampler.active[task] = profile
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            stack_sampler.active.pop(task, None)
+            current_profile.reset(token)
+            elapsed = time.perf_counter() - profile.started
+            if trigger is not None or elapsed * 1000 >= PROFILE_SLOW_MS:
+                route = scope.get("route")
+                try:
+                    # La respuesta ya salió: el request sólo paga el tiempo de agendar el write
+                    await asyncio.to_thread(profile.write, route.path if route is not None else "unmatched", status, elapsed)
+                except OSError:
+                    log.exception("no se pudo escribir el perfil", extra={"path": profile.path})
+
 # -----------------
 # Mongo connection
 # -----------------
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
 MONGO_DB = os.getenv("MONGO_DB", "la_segunda")
 
-client: AsyncIOMotorClient | None = None
+client: AsyncIOMotorClient | MemoryClient | None = None
 db = None
 
+# -----------------
+# Storage engine
+# -----------------
+# Las rutas usan `db` con la API de colecciones de Motor: esa API es la capa de almacenamiento
+# y STORAGE_ENGINE elige quién la implementa:
+# - "motor" (default): MongoDB
+# - "memory": MemoryClient (storage_memory.py), todo en el proceso. Sirve para medir el overhead
+#   propio de la app y correr la API entera en CI o en los tests sin mongod. Sin persistencia ni
+#   change streams (el índice geo usa la recarga periódica), sin TTL y sin command monitoring.
+STORAGE_ENGINE = os.getenv("STORAGE_ENGINE", "motor")
+if STORAGE_ENGINE not in ("motor", "memory"):
+    raise RuntimeError(f"STORAGE_ENGINE inválido: '{STORAGE_ENGINE}' (usar 'motor' o 'memory')")
+
 # -----------------
 # RabbitMQ connection
 # -----------------
@@ -51,10 +564,275 @@ rabbitmq_connection: aio_pika.Connection | None = None
 rabbitmq_channel: aio_pika.Channel | None = None
 notification_exchange: aio_pika.Exchange | None = None
 
+# Broker de notificaciones:
+# - "rabbitmq": exchange "notifications" en RABBITMQ_URI, consumido por rabbitmq_consumer
+# - "memory": InProcessExchange, entrega directo a los SSE streams del proceso (un solo
+#   worker; para desarrollo y benchmarks sin RabbitMQ)
+NOTIFICATION_BROKER = os.getenv("NOTIFICATION_BROKER", "rabbitmq")
+if NOTIFICATION_BROKER not in ("rabbitmq", "memory"):
+    raise RuntimeError(f"NOTIFICATION_BROKER inválido: '{NOTIFICATION_BROKER}' (usar 'rabbitmq' o 'memory')")
+
+# Publicación de notificaciones:
+# - "inline": el request guarda la notificación y la publica antes de responder
+# - "outbox": el request sólo la guarda; la publica el relay del outbox (ver OutboxRelay)
+NOTIFICATION_DELIVERY = os.getenv("NOTIFICATION_DELIVERY", "inline")
+if NOTIFICATION_DELIVERY not in ("inline", "outbox"):
+    raise RuntimeError(f"NOTIFICATION_DELIVERY inválido: '{NOTIFICATION_DELIVERY}' (usar 'inline' o 'outbox')")
+
+# Modo de entrega de notificaciones en tiempo real:
+# - "shared": todos los workers consumen de la queue durable compartida "notification_queue"
+#   (sólo sirve con un único worker: el mensaje cae en un worker al azar)
+# - "per_worker": cada worker declara su propia queue exclusiva y la vincula al exchange
+#   con la routing key de cada usuario que tiene un SSE stream abierto en ese worker
+SSE_DELIVERY_MODE = os.getenv("SSE_DELIVERY_MODE", "shared")
+if SSE_DELIVERY_MODE not in ("shared", "per_worker"):
+    raise RuntimeError(f"SSE_DELIVERY_MODE inválido: '{SSE_DELIVERY_MODE}' (usar 'shared' o 'per_worker')")
+worker_queue: aio_pika.Queue | None = None
+user_route_refs: dict[str, int] = {}   # user_id -> streams abiertos en este worker
+bound_user_routes: set[str] = set()    # user_ids vinculados hoy a worker_queue
+user_route_lock: asyncio.Lock | None = None
+SSE_ROUTE_LINGER = float(os.getenv("SSE_ROUTE_LINGER", "15"))  # segundos que se mantiene el binding tras cerrar el último stream
+
 # -----------------
-# SSE streams (user_id -> asyncio.Queue)
+# SSE streams (user_id -> {stream_id -> SSEStream})
 # -----------------
-active_sse_streams: dict[str, asyncio.Queue] = {}
+# Cada conexión SSE (una pestaña) tiene su propio buffer acotado de frames ya serializados.
+# Cuando un cliente lento llena su buffer se aplica la política de overflow:
+# - "drop_oldest": se descarta el frame más viejo
+# - "coalesce": el frame nuevo reemplaza al pendiente del mismo (type, event_id); si no hay, drop_oldest
+# - "disconnect": se cierra el stream (el navegador reconecta solo)
+SSE_STREAM_BUFFER = int(os.getenv("SSE_STREAM_BUFFER", "100"))
+SSE_OVERFLOW_POLICY = os.getenv("SSE_OVERFLOW_POLICY", "drop_oldest")
+if SSE_OVERFLOW_POLICY not in ("drop_oldest", "coalesce", "disconnect"):
+    raise RuntimeError(f"SSE_OVERFLOW_POLICY inválida: '{SSE_OVERFLOW_POLICY}' (usar 'drop_oldest', 'coalesce' o 'disconnect')")
+
+class SSEStream:
+    """Una conexión SSE: buffer acotado de (key, encolado_en, frame) + contadores"""
+
+    __slots__ = ("user_id", "stream_id", "maxsize", "policy", "opened_at", "closed",
+                 "delivered", "dropped", "coalesced", "_buffer", "_bytes", "_ready")
+
+    def __init__(self, user_id: str, stream_id: int, maxsize: int, policy: str):
+        self.user_id = user_id
+        self.stream_id = stream_id
+        self.maxsize = maxsize
+        self.policy = policy
+        self.opened_at = time.monotonic()
+        self.closed = False
+        self.delivered = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self._buffer: deque[tuple[tuple[Any, Any], float, Optional[str], str]] = deque()
+        self._bytes = 0
+        self._ready = asyncio.Event()
+
+    def push(self, key: tuple[Any, Any], frame_id: Optional[str], frame: str):
+        """Encola un frame sin bloquear nunca al productor"""
+        if self.closed:
+            return
+        if len(self._buffer) >= self.maxsize:
+            if self.policy == "disconnect":
+                self.dropped += len(self._buffer) + 1
+                self.close()
+                return
+            if self.policy == "coalesce":
+                for i, (k, enqueued_at, _, old) in enumerate(self._buffer):
+                    if k == key:
+                        self._buffer[i] = (key, enqueued_at, frame_id, frame)
+                        self._bytes += len(frame) - len(old)
+                        self.coalesced += 1
+                        return
+            _, _, _, old = self._buffer.popleft()
+            self._bytes -= len(old)
+            self.dropped += 1
+        self._buffer.append((key, time.monotonic(), frame_id, frame))
+        self._bytes += len(frame)
+        self._ready.set()
+
+    async def next_frame(self, timeout: float) -> Optional[tuple[Optional[str], str]]:
+        """Devuelve el próximo (frame_id, frame), None si venció el timeout (keepalive)"""
+        if not self._buffer and not self.closed:
+            self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                return None
+        if not self._buffer:
+            return None
+        _, _, frame_id, frame = self._buffer.popleft()
+        self._bytes -= len(frame)
+        self.delivered += 1
+        return frame_id, frame
+
+    def close(self):
+        self.closed = True
+        self._buffer.clear()
+        self._bytes = 0
+        self._ready.set()
+
+    def stats(self) -> dict[str, Any]:
+        now_mono = time.monotonic()
+        return {
+            "stream_id": self.stream_id,
+            "user_id": self.user_id,
+            "buffered": len(self._buffer),
+            "buffered_bytes": self._bytes,
+            "lag_seconds": round(now_mono - self._buffer[0][1], 3) if self._buffer else 0.0,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "open_seconds": round(now_mono - self.opened_at, 1),
+        }
+
+class SSEStreamRegistry:
+    """Streams SSE abiertos en este worker, varios por usuario"""
+
+    def __init__(self, maxsize: int, policy: str):
+        self.maxsize = maxsize
+        self.policy = policy
+        self._by_user: dict[str, dict[int, SSEStream]] = {}
+        self._next_id = 0
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self._by_user
+
+    def user_ids(self) -> list[str]:
+        return list(self._by_user)
+
+    def open(self, user_id: str) -> SSEStream:
+        self._next_id += 1
+        stream = SSEStream(user_id, self._next_id, self.maxsize, self.policy)
+        self._by_user.setdefault(user_id, {})[stream.stream_id] = stream
+        self._count += 1
+        return stream
+
+    def close(self, stream: SSEStream):
+        """Idempotente: se puede llamar varias veces para el mismo stream"""
+        stream.close()
+        streams = self._by_user.get(stream.user_id)
+        if streams is None or streams.pop(stream.stream_id, None) is None:
+            return
+        self._count -= 1
+        if not streams:
+            del self._by_user[stream.user_id]
+
+    def queued_frames(self) -> int:
+        return sum(len(st._buffer) for per_user in self._by_user.values() for st in per_user.values())
+
+    def close_all(self):
+        for streams in list(self._by_user.values()):
+            for stream in list(streams.values()):
+                self.close(stream)
+
+    def publish(self, user_id: str, payload: dict[str, Any]) -> int:
+        """Entrega payload a todos los streams de user_id; devuelve a cuántos"""
+        streams = self._by_user.get(user_id)
+        if not streams:
+            return 0
+        frame = sse_frame(payload)  # se serializa una vez para todas las pestañas
+        key = (payload.get("type"), payload.get("event_id"))
+        for stream in list(streams.values()):
+            stream.push(key, sse_event_id(payload), frame)
+        return len(streams)
+
+    def stats(self, limit: int = 100, user_id: Optional[str] = None) -> dict[str, Any]:
+        if user_id is not None:
+            streams = list(self._by_user.get(user_id, {}).values())
+        else:
+            streams = [st for per_user in self._by_user.values() for st in per_user.values()]
+        per_stream = [st.stats() for st in streams]
+        per_stream.sort(key=lambda st: st["lag_seconds"], reverse=True)
+        return {
+            "streams": self._count,
+            "users": len(self._by_user),
+            "buffer_size": self.maxsize,
+            "overflow_policy": self.policy,
+            "buffered_frames": sum(st["buffered"] for st in per_stream),
+            "buffered_bytes": sum(st["buffered_bytes"] for st in per_stream),
+            "max_lag_seconds": per_stream[0]["lag_seconds"] if per_stream else 0.0,
+            "per_stream": per_stream[:limit],
+        }
+
+sse_registry = SSEStreamRegistry(SSE_STREAM_BUFFER, SSE_OVERFLOW_POLICY)
+
+def sse_event_id(payload: dict[str, Any]) -> Optional[str]:
+    """id del frame SSE: el de la notificación, o el de su última revisión si es un digest
+    (cada actualización de un digest es un evento nuevo para Last-Event-ID)"""
+    return payload.get("rev") or payload.get("id")
+
+def sse_frame(payload: dict[str, Any]) -> str:
+    """Frame SSE con id (el navegador lo reenvía como Last-Event-ID al reconectar)"""
+    event_id = sse_event_id(payload)
+    if event_id:
+        return f"id: {event_id}\ndata: {json.dumps(payload)}\n\n"
+    return f"data: {json.dumps(payload)}\n\n"
+
+# -----------------
+# SSE replay (Last-Event-ID)
+# -----------------
+# Ring buffer por usuario con las últimas notificaciones que recibió este worker, para
+# reanudar streams sin ir a MongoDB. Sólo es confiable mientras el worker recibe *todas*
+# las notificaciones del usuario: en modo "shared" (un único consumer) siempre; en modo
+# "per_worker" mientras su routing key está vinculada (al desvincularla se descarta).
+SSE_REPLAY_BUFFER = int(os.getenv("SSE_REPLAY_BUFFER", "50"))      # notificaciones por usuario (0 = deshabilitado)
+SSE_REPLAY_USERS = int(os.getenv("SSE_REPLAY_USERS", "10000"))    # usuarios retenidos (LRU)
+SSE_REPLAY_LIMIT = int(os.getenv("SSE_REPLAY_LIMIT", "200"))      # máximo a reenviar desde MongoDB al reanudar
+
+class NotificationReplayBuffer:
+    """user_id -> deque[(id del evento SSE, payload)] en orden de llegada, con LRU sobre usuarios"""
+
+    def __init__(self, per_user: int, max_users: int):
+        self.per_user = per_user
+        self.max_users = max_users
+        self._rings: OrderedDict[str, deque[tuple[ObjectId, dict[str, Any]]]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, user_id: str, payload: dict[str, Any]):
+        event_id = sse_event_id(payload) or ""
+        if self.per_user <= 0 or not ObjectId.is_valid(event_id):
+            return
+        ring = self._rings.get(user_id)
+        if ring is None:
+            ring = self._rings[user_id] = deque(maxlen=self.per_user)
+            if len(self._rings) > self.max_users:
+                self._rings.popitem(last=False)
+        else:
+            self._rings.move_to_end(user_id)
+        ring.append((ObjectId(event_id), payload))
+
+    def forget(self, user_id: str):
+        self._rings.pop(user_id, None)
+
+    def clear(self):
+        self._rings.clear()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "users": len(self._rings),
+            "per_user": self.per_user,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def after(self, user_id: str, last_id: ObjectId) -> Optional[list[dict[str, Any]]]:
+        """Notificaciones posteriores a last_id, o None si el buffer no alcanza a cubrir el hueco"""
+        ring = self._rings.get(user_id)
+        if ring is not None:
+            for i, (oid, _) in enumerate(ring):
+                if oid == last_id:
+                    self.hits += 1
+                    # de un digest revisado varias veces alcanza con la última revisión
+                    latest = {payload["id"]: payload for _, payload in islice(ring, i + 1, None)}
+                    return list(latest.values())
+        self.misses += 1
+        return None
+
+sse_replay = NotificationReplayBuffer(SSE_REPLAY_BUFFER, SSE_REPLAY_USERS)
 
 # -------------
 # Pydantic I/O
@@ -89,6 +867,9 @@ class EventCreate(BaseModel):
     category: str = Field(...)
     # status/activo no se recibe en create: siempre 1 (activo)
 
+ParticipantStatus = Literal["confirmed", "pending", "blacklisted"]
+MyStatus = Literal["organizer", "confirmed", "pending", "blacklisted", "none"]
+
 class EventOut(BaseModel):
     id: str
     title: str
@@ -100,6 +881,7 @@ class EventOut(BaseModel):
     organizer_id: str
     organizer_name: Optional[str] = None
     organizer_rating: Optional[float] = None
+    # listas completas sólo en view=full con ROSTER_STORAGE=embedded; si no, vacías (usar /events/{id}/participants)
     confirmed_participants: List[str]
     pending_approval_participants: List[str]
     blacklisted_participants: List[str]
@@ -109,6 +891,17 @@ class EventOut(BaseModel):
     created_at: datetime
     updated_at: datetime
     distance_meters: Optional[float] = None  # presente sólo si consulta con lat/lng
+    confirmed_count: int = 0
+    pending_count: int = 0
+    blacklisted_count: int = 0
+    my_status: Optional[MyStatus] = None  # sólo en view=compact con X-User-Id
+
+class ParticipantOut(BaseModel):
+    user_id: str
+    status: ParticipantStatus
+    name: Optional[str] = None
+    rating: Optional[float] = None
+    joined_at: Optional[datetime] = None  # sólo con ROSTER_STORAGE=collection
 
 class AcceptRejectBody(BaseModel):
     user_id: str
@@ -118,23 +911,32 @@ class MyEventsOut(BaseModel):
     activos_no_finalizados: List[EventOut]
     activos_finalizados: List[EventOut]
     eliminados: List[EventOut]
+    next_cursor: Optional[str] = None  # siguiente página de cada bucket (after=)
 
 class NotificationOut(BaseModel):
     id: str
     user_id: str
-    type: str  # "new_application", "application_accepted", "application_rejected", "event_started", "event_finished", "event_cancelled"
+    type: str  # "new_application", "application_accepted", "application_rejected", "event_started", "event_ended", "event_finished", "event_cancelled"
     title: str
     message: str
     event_id: Optional[str] = None
     event_title: Optional[str] = None
     read: bool = False
+    count: int = 1  # > 1 en los digests (notificaciones agrupadas)
     created_at: datetime
 
+class UnreadCountOut(BaseModel):
+    unread: int
+
 # -------------
 # FastAPI app
 # -------------
 app = FastAPI(title="La Segunda — MVP API", version="0.1.0")
 
+if PROFILING:
+    # Primero = más interno: corre en la misma task que el endpoint (ver RequestProfilerMiddleware)
+    app.add_middleware(RequestProfilerMiddleware)
+
 # Configuración de CORS flexible para desarrollo
 FRONT_ORIGIN = os.getenv("FRONT_ORIGIN", "")
 if FRONT_ORIGIN:
@@ -153,19 +955,26 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],             # GET, POST, PATCH, DELETE, OPTIONS
     allow_headers=["*"],             # incluye X-User-Id, Content-Type, etc.
+    expose_headers=["X-Next-Cursor"],  # paginación por cursor de las listas
 )
 
-# Middleware para logging de requests (después de CORS)
+# Middleware para logging de requests (después de CORS): una línea por request, muestreada,
+# sin headers ni body
 @app.middleware("http")
 async def log_requests(request, call_next):
-    if request.url.path == "/users/login" and request.method == "POST":
-        print(f"🔍 POST /users/login recibido")
-        print(f"🔍 Headers: {dict(request.headers)}")
-        print(f"🔍 Content-Type: {request.headers.get('content-type', 'N/A')}")
-        print(f"🔍 Content-Length: {request.headers.get('content-length', 'N/A')}")
+    started = time.perf_counter()
     response = await call_next(request)
-    if request.url.path == "/users/login" and request.method == "POST":
-        print(f"🔍 Response status: {response.status_code}")
+    elapsed = time.perf_counter() - started
+    if METRICS_ENABLED:
+        # El template de la ruta ("/events/{event_id}"), no el path: cardinalidad acotada
+        route = request.scope.get("route")
+        metrics.observe_request(request.method, route.path if route is not None else "unmatched", response.status_code, elapsed)
+    log_http.info("request", extra={
+        "method": request.method,
+        "path": request.url.path,
+        "status": response.status_code,
+        "duration_ms": round(elapsed * 1000, 2),
+    })
     return response
 
 
@@ -188,6 +997,15 @@ async def get_current_user_id(x_user_id: Optional[str] = Header(default=None, al
     x_user_id = x_user_id.strip() if isinstance(x_user_id, str) else str(x_user_id).strip()
     return ensure_oid(x_user_id)
 
+async def get_optional_user_id(x_user_id: Optional[str] = Header(default=None, alias="X-User-Id")) -> Optional[ObjectId]:
+    """X-User-Id en endpoints públicos: sólo se usa para personalizar la respuesta (my_status)"""
+    return await get_current_user_id(x_user_id) if x_user_id else None
+
+def compact_view(
+    view: Literal["full", "compact"] = Query("full", description="compact: sin listas de participantes, con conteos y my_status"),
+) -> bool:
+    return view == "compact"
+
 def serialize_user(doc: dict[str, Any]) -> UserOut:
     return UserOut(
         id=str(doc["_id"]),
@@ -202,188 +1020,1063 @@ def serialize_user(doc: dict[str, Any]) -> UserOut:
         updated_at=doc["updated_at"],
     )
 
-def serialize_event(doc: dict[str, Any], organizer_info: Optional[dict[str, Any]] = None) -> EventOut:
+def serialize_event(doc: dict[str, Any], organizer_info: Optional[dict[str, Any]] = None, compact: bool = False, my_status: Optional[str] = None) -> EventOut:
+    return EventOut(**event_json(doc, organizer_info, compact, my_status))
+
+# -----------------
+# Fast JSON responses
+# -----------------
+# Las listas (Discover, mis eventos, historial de notificaciones, /users/batch) van directo de
+# documento de MongoDB a bytes con orjson, sin construir modelos Pydantic ni la segunda
+# validación de response_model. Los dicts replican campo a campo (mismo orden, defaults y
+# conversiones) a UserOut/EventOut/NotificationOut; los endpoints siguen declarando
+# response_model, así que el esquema OpenAPI no cambia.
+def user_json(doc: dict[str, Any]) -> dict[str, Any]:
+    return {
+        "id": str(doc["_id"]),
+        "name": doc["name"],
+        "phone": doc.get("phone"),
+        "description": doc.get("description"),
+        "cant_events_visited": doc.get("cant_events_visited", 0),
+        "cant_events_organized": doc.get("cant_events_organized", 0),
+        "cant_no_shows": doc.get("cant_no_shows", 0),
+        "rating": float(doc.get("rating", 0.0)),
+        "created_at": doc["created_at"],
+        "updated_at": doc["updated_at"],
+    }
+
+def event_json(doc: dict[str, Any], organizer_info: Optional[dict[str, Any]] = None, compact: bool = False, my_status: Optional[str] = None) -> dict[str, Any]:
     loc = doc["location"]["coordinates"]  # [lng, lat]
-    organizer_name = None
-    organizer_rating = None
-    if organizer_info:
-        organizer_name = organizer_info.get("name")
-        organizer_rating = float(organizer_info.get("rating", 0.0))
-    out = EventOut(
-        id=str(doc["_id"]),
-        title=doc["title"],
-        description=doc.get("description"),
-        fecha_inicio=doc["fecha_inicio"],
-        fecha_fin=doc["fecha_fin"],
-        activo=int(doc["activo"]),
-        finalizado=bool(doc.get("finalizado", False)),
-        organizer_id=str(doc["organizer_id"]),
-        organizer_name=organizer_name,
-        organizer_rating=organizer_rating,
-        confirmed_participants=[str(u) for u in doc.get("confirmed_participants", [])],
-        pending_approval_participants=[str(u) for u in doc.get("pending_approval_participants", [])],
-        blacklisted_participants=[str(u) for u in doc.get("blacklisted_participants", [])],
-        location=GeoPoint(lat=loc[1], lng=loc[0]),
-        location_alias=doc.get("location_alias"),
-        category=doc["category"],
-        created_at=doc["created_at"],
-        updated_at=doc["updated_at"],
-        distance_meters=doc.get("distance_meters"),
+    distance = doc.get("distance_meters")
+    counts = participant_counts(doc)
+    # las listas sólo existen con ROSTER_STORAGE=embedded; el resto de los casos las devuelve vacías
+    lists = {
+        field: [] if compact else list(map(str, doc.get(field, [])))
+        for field in ROSTER_FIELDS.values()
+    }
+    return {
+        "id": str(doc["_id"]),
+        "title": doc["title"],
+        "description": doc.get("description"),
+        "fecha_inicio": doc["fecha_inicio"],
+        "fecha_fin": doc["fecha_fin"],
+        "activo": int(doc["activo"]),
+        "finalizado": bool(doc.get("finalizado", False)),
+        "organizer_id": str(doc["organizer_id"]),
+        "organizer_name": organizer_info.get("name") if organizer_info else None,
+        "organizer_rating": float(organizer_info.get("rating", 0.0)) if organizer_info else None,
+        "confirmed_participants": lists["confirmed_participants"],
+        "pending_approval_participants": lists["pending_approval_participants"],
+        "blacklisted_participants": lists["blacklisted_participants"],
+        "location": {"lat": float(loc[1]), "lng": float(loc[0])},
+        "location_alias": doc.get("location_alias"),
+        "category": doc["category"],
+        "created_at": doc["created_at"],
+        "updated_at": doc["updated_at"],
+        "distance_meters": float(distance) if distance is not None else None,
+        "confirmed_count": counts["confirmed"],
+        "pending_count": counts["pending"],
+        "blacklisted_count": counts["blacklisted"],
+        "my_status": my_status,
+    }
+
+def participant_json(user_id: ObjectId, status: str, joined_at: Optional[datetime], profile: Optional[dict[str, Any]]) -> dict[str, Any]:
+    return {
+        "user_id": str(user_id),
+        "status": status,
+        "name": profile.get("name") if profile else None,
+        "rating": float(profile.get("rating", 0.0)) if profile else None,
+        "joined_at": joined_at,
+    }
+
+def notification_json(doc: dict[str, Any]) -> dict[str, Any]:
+    return {
+        "id": str(doc["_id"]),
+        "user_id": str(doc["user_id"]),
+        "type": doc["type"],
+        "title": doc["title"],
+        "message": notification_message(doc),
+        "event_id": str(doc["event_id"]) if doc.get("event_id") else None,
+        "event_title": doc.get("event_title"),
+        "read": bool(doc.get("read", False)),
+        "count": doc.get("count", 1),
+        "created_at": doc["created_at"],
+    }
+
+def json_response(content: Any, next_cursor: Optional[str] = None) -> Response:
+    """Respuesta JSON ya serializada (FastAPI no la vuelve a validar)"""
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    started = time.perf_counter()
+    body = orjson.dumps(content)
+    metrics.serialize.observe(time.perf_counter() - started)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+# -----------------
+# Event mutations
+# -----------------
+# Las mutaciones de eventos van en un solo round trip: la autorización (organizer_id,
+# activo, ...) forma parte del filtro de find_one_and_update, que devuelve el documento
+# ya actualizado. Sólo si no matchea se vuelve a leer el evento para responder 404 vs 403/400.
+EVENT_OUT_PROJECTION = {
+    "title": 1, "description": 1, "fecha_inicio": 1, "fecha_fin": 1, "activo": 1,
+    "finalizado": 1, "organizer_id": 1, "confirmed_participants": 1,
+    "pending_approval_participants": 1, "blacklisted_participants": 1,
+    "location": 1, "location_alias": 1, "category": 1, "created_at": 1, "updated_at": 1,
+    "participant_counts": 1,
+}
+
+# (falla?, status_code, detail): se evalúan en orden contra el evento actual sólo cuando
+# el filtro de la mutación no matcheó
+EventCheck = tuple[Callable[[dict[str, Any]], bool], int, str]
+
+def organizer_check(user_id: ObjectId, detail: str) -> EventCheck:
+    return (lambda cur: cur["organizer_id"] != user_id, 403, detail)
+
+async def mutate_event(_id: ObjectId, predicate: dict[str, Any], update: dict[str, Any], checks: List[EventCheck]) -> dict[str, Any]:
+    """Aplica update si el evento cumple predicate y devuelve el documento actualizado"""
+    ev = await db.events.find_one_and_update(
+        {"_id": _id, **predicate},
+        update,
+        projection=EVENT_OUT_PROJECTION,
+        return_document=ReturnDocument.AFTER,
     )
-    return out
+    if ev is not None:
+        geo_index.sync(ev)
+        await discover_cache.invalidate_event(ev)
+        return ev
+    current = await db.events.find_one(
+        {"_id": _id},
+        {"organizer_id": 1, "activo": 1, "finalizado": 1, "blacklisted_participants": 1},
+    )
+    if not current:
+        raise HTTPException(status_code=404, detail="Evento no encontrado")
+    for failed, status_code, detail in checks:
+        if failed(current):
+            raise HTTPException(status_code=status_code, detail=detail)
+    # El filtro dejó de matchear entre las dos lecturas (otra request cambió el evento)
+    raise HTTPException(status_code=409, detail="El evento cambió durante la operación, reintentá")
+
+# -----------------
+# Rosters (participantes)
+# -----------------
+# ROSTER_STORAGE elige dónde viven confirmados / pendientes / bloqueados:
+# - "embedded" (default): arrays dentro del evento; cada operación es un solo find_one_and_update
+# - "collection": un documento por (evento, usuario) en "event_participants" y contadores en
+#   participant_counts del evento, que queda de tamaño fijo por más popular que sea. Cada
+#   operación valida el evento, mueve el estado en el roster (el índice único evita duplicados)
+#   y actualiza los contadores; sin transacciones, así que una caída en el medio puede dejar un
+#   contador desfasado. Al arrancar se migran los arrays embebidos que haya.
+# En los dos modos EventOut trae los conteos; las listas se leen paginadas de /events/{id}/participants.
+ROSTER_STORAGE = os.getenv("ROSTER_STORAGE", "embedded")  # "embedded" | "collection"
+ROSTER_FIELDS = {
+    "confirmed": "confirmed_participants",
+    "pending": "pending_approval_participants",
+    "blacklisted": "blacklisted_participants",
+}
+# Si un usuario está en más de una lista (no-show con bloqueo), gana la primera
+MEMBERSHIP_PRIORITY = ("blacklisted", "confirmed", "pending")
+
+def participant_counts(doc: dict[str, Any]) -> dict[str, int]:
+    counts = doc.get("participant_counts")
+    if counts is not None:
+        return {status: int(counts.get(status, 0)) for status in ROSTER_FIELDS}
+    return {status: len(doc.get(field, [])) for status, field in ROSTER_FIELDS.items()}
+
+class EmbeddedRoster:
+    """Participantes en arrays del evento (esquema original)"""
+
+    def new_event_fields(self) -> dict[str, Any]:
+        return {field: [] for field in ROSTER_FIELDS.values()}
+
+    async def migrate(self):
+        pass
+
+    async def apply(self, _id: ObjectId, user_id: ObjectId) -> dict[str, Any]:
+        # quitar de confirmados por si acaso y agregar a pending (idempotente)
+        return await mutate_event(
+            _id,
+            {
+                "activo": 1,
+                "organizer_id": {"$ne": user_id},
+                "blacklisted_participants": {"$ne": user_id},
+            },
+            {
+                "$pull": {"confirmed_participants": user_id},
+                "$addToSet": {"pending_approval_participants": user_id},
+                "$set": {"updated_at": now()},
+            },
+            [
+                (lambda cur: cur["activo"] != 1, 400, "Evento no activo"),
+                (lambda cur: cur["organizer_id"] == user_id, 400, "El organizador no necesita postularse"),
+                (lambda cur: user_id in cur.get("blacklisted_participants", []), 403, "Usuario bloqueado para este evento"),
+            ],
+        )
+
+    async def accept(self, _id: ObjectId, organizer_id: ObjectId, target: ObjectId) -> dict[str, Any]:
+        # mover de pending -> confirmed
+        return await mutate_event(
+            _id,
+            {"organizer_id": organizer_id},
+            {
+                "$pull": {"pending_approval_participants": target},
+                "$addToSet": {"confirmed_participants": target},
+                "$set": {"updated_at": now()},
+            },
+            [organizer_check(organizer_id, "Sólo el organizador puede aceptar")],
+        )
+
+    async def reject(self, _id: ObjectId, organizer_id: ObjectId, target: ObjectId, blacklist: bool) -> dict[str, Any]:
+        update: dict[str, Any] = {
+            "$pull": {
+                "pending_approval_participants": target,
+                "confirmed_participants": target,
+            },
+            "$set": {"updated_at": now()},
+        }
+        if blacklist:
+            update["$addToSet"] = {"blacklisted_participants": target}
+        return await mutate_event(
+            _id,
+            {"organizer_id": organizer_id},
+            update,
+            [organizer_check(organizer_id, "Sólo el organizador puede rechazar")],
+        )
+
+    async def no_show(self, _id: ObjectId, organizer_id: ObjectId, target: ObjectId, blacklist: bool) -> dict[str, Any]:
+        # opcionalmente bloquear (en el mismo update que valida al organizador)
+        update: dict[str, Any] = {"$set": {"updated_at": now()}}
+        if blacklist:
+            update["$addToSet"] = {"blacklisted_participants": target}
+        return await mutate_event(
+            _id,
+            {"organizer_id": organizer_id},
+            update,
+            [organizer_check(organizer_id, "Sólo el organizador puede marcar no-show")],
+        )
+
+    async def user_ids(self, ev: dict[str, Any], *statuses: str) -> list[ObjectId]:
+        """Participantes del evento en esos estados (ev viene con las listas proyectadas)"""
+        return [u for status in statuses for u in ev.get(ROSTER_FIELDS[status], [])]
+
+    async def membership(self, events: list[dict[str, Any]], user_id: ObjectId) -> dict[ObjectId, str]:
+        """_id del evento -> estado del usuario, para documentos que ya traen las listas"""
+        out = {}
+        for ev in events:
+            for status in MEMBERSHIP_PRIORITY:
+                if user_id in ev.get(ROSTER_FIELDS[status], []):
+                    out[ev["_id"]] = status
+                    break
+        return out
+
+    async def membership_by_id(self, event_ids: list[ObjectId], user_id: ObjectId) -> dict[ObjectId, str]:
+        """Como membership pero sin los documentos: MongoDB devuelve sólo en qué listas está"""
+        if not event_ids:
+            return {}
+        cursor = db.events.aggregate([
+            {"$match": {"_id": {"$in": event_ids}}},
+            {"$project": {
+                status: {"$in": [user_id, {"$ifNull": [f"${field}", []]}]}
+                for status, field in ROSTER_FIELDS.items()
+            }},
+        ])
+        out = {}
+        async for ev in cursor:
+            status = next((status for status in MEMBERSHIP_PRIORITY if ev[status]), None)
+            if status:
+                out[ev["_id"]] = status
+        return out
+
+    async def page(self, _id: ObjectId, status: str, after: Optional[str], limit: int) -> tuple[list[tuple[ObjectId, Optional[datetime]]], Optional[str]]:
+        """Una página de la lista (user_id, joined_at); el cursor es el offset dentro del array"""
+        offset = 0
+        if after:
+            cursor_status, offset = decode_cursor(after, "participants")
+            if cursor_status != status:
+                raise HTTPException(status_code=400, detail="El cursor no corresponde a esta consulta")
+        docs = [d async for d in db.events.aggregate([
+            {"$match": {"_id": _id}},
+            {"$project": {"ids": {"$slice": [{"$ifNull": [f"${ROSTER_FIELDS[status]}", []]}, offset, limit]}}},
+        ])]
+        if not docs:
+            raise HTTPException(status_code=404, detail="Evento no encontrado")
+        ids = docs[0]["ids"]
+        next_cursor = encode_cursor("participants", status, offset + limit) if len(ids) == limit else None
+        return [(u, None) for u in ids], next_cursor
+
+class CollectionRoster:
+    """Participantes en la colección event_participants, con contadores en el evento"""
+
+    def new_event_fields(self) -> dict[str, Any]:
+        return {"participant_counts": {status: 0 for status in ROSTER_FIELDS}}
+
+    async def migrate(self):
+        """Pasa al roster los arrays embebidos de eventos creados con ROSTER_STORAGE=embedded (idempotente)"""
+        fields = list(ROSTER_FIELDS.values())
+        cursor = db.events.find({"$or": [{field: {"$exists": True}} for field in fields]}, {field: 1 for field in fields})
+        migrated = 0
+        async for ev in cursor:
+            statuses: dict[ObjectId, str] = {}
+            for status in reversed(MEMBERSHIP_PRIORITY):  # el de mayor prioridad pisa
+                for user_id in ev.get(ROSTER_FIELDS[status], []):
+                    statuses[user_id] = status
+            t = now()
+            if statuses:
+                await db.event_participants.bulk_write([
+                    UpdateOne(
+                        {"event_id": ev["_id"], "user_id": user_id},
+                        {"$setOnInsert": {"status": status, "created_at": t, "updated_at": t}},
+                        upsert=True,
+                    )
+                    for user_id, status in statuses.items()
+                ], ordered=False)
+            counts = {
+                status: await db.event_participants.count_documents({"event_id": ev["_id"], "status": status})
+                for status in ROSTER_FIELDS
+            }
+            await db.events.update_one(
+                {"_id": ev["_id"]},
+                {"$set": {"participant_counts": counts}, "$unset": {field: "" for field in fields}},
+            )
+            migrated += 1
+        if migrated:
+            log_events.info("eventos migrados a event_participants", extra={"events": migrated})
+
+    async def _event(self, _id: ObjectId) -> dict[str, Any]:
+        ev = await db.events.find_one({"_id": _id}, {"organizer_id": 1, "activo": 1})
+        if not ev:
+            raise HTTPException(status_code=404, detail="Evento no encontrado")
+        return ev
+
+    async def _check_organizer(self, _id: ObjectId, organizer_id: ObjectId, detail: str):
+        ev = await self._event(_id)
+        if ev["organizer_id"] != organizer_id:
+            raise HTTPException(status_code=403, detail=detail)
+
+    async def _move(self, _id: ObjectId, user_id: ObjectId, status: Optional[str], unless_blacklisted: bool = False) -> dict[str, Any]:
+        """Pone a user_id en status (None = lo saca), ajusta los contadores y devuelve el evento actualizado"""
+        query: dict[str, Any] = {"event_id": _id, "user_id": user_id}
+        if unless_blacklisted:
+            query["status"] = {"$ne": "blacklisted"}
+        if status is None:
+            prev = await db.event_participants.find_one_and_delete(query, projection={"status": 1})
+        else:
+            t = now()
+            try:
+                prev = await db.event_participants.find_one_and_update(
+                    query,
+                    {"$set": {"status": status, "updated_at": t}, "$setOnInsert": {"created_at": t}},
+                    projection={"status": 1},
+                    upsert=True,
+                    return_document=ReturnDocument.BEFORE,
+                )
+            except DuplicateKeyError:
+                # el filtro excluía a los bloqueados y el upsert chocó con el índice único
+                raise HTTPException(status_code=403, detail="Usuario bloqueado para este evento")
+        old = prev["status"] if prev else None
+        update: dict[str, Any] = {"$set": {"updated_at": now()}}
+        if old != status:
+            update["$inc"] = {}
+            if old:
+                update["$inc"][f"participant_counts.{old}"] = -1
+            if status:
+                update["$inc"][f"participant_counts.{status}"] = 1
+        return await mutate_event(_id, {}, update, [])
+
+    async def apply(self, _id: ObjectId, user_id: ObjectId) -> dict[str, Any]:
+        ev = await self._event(_id)
+        if ev["activo"] != 1:
+            raise HTTPException(status_code=400, detail="Evento no activo")
+        if ev["organizer_id"] == user_id:
+            raise HTTPException(status_code=400, detail="El organizador no necesita postularse")
+        return await self._move(_id, user_id, "pending", unless_blacklisted=True)
+
+    async def accept(self, _id: ObjectId, organizer_id: ObjectId, target: ObjectId) -> dict[str, Any]:
+        await self._check_organizer(_id, organizer_id, "Sólo el organizador puede aceptar")
+        return await self._move(_id, target, "confirmed")
+
+    async def reject(self, _id: ObjectId, organizer_id: ObjectId, target: ObjectId, blacklist: bool) -> dict[str, Any]:
+        await self._check_organizer(_id, organizer_id, "Sólo el organizador puede rechazar")
+        if blacklist:
+            return await self._move(_id, target, "blacklisted")
+        # Como en el roster embebido: rechazar a alguien bloqueado no lo desbloquea
+        return await self._move(_id, target, None, unless_blacklisted=True)
+
+    async def no_show(self, _id: ObjectId, organizer_id: ObjectId, target: ObjectId, blacklist: bool) -> dict[str, Any]:
+        if not blacklist:
+            return await mutate_event(
+                _id,
+                {"organizer_id": organizer_id},
+                {"$set": {"updated_at": now()}},
+                [organizer_check(organizer_id, "Sólo el organizador puede marcar no-show")],
+            )
+        await self._check_organizer(_id, organizer_id, "Sólo el organizador puede marcar no-show")
+        return await self._move(_id, target, "blacklisted")
+
+    async def user_ids(self, ev: dict[str, Any], *statuses: str) -> list[ObjectId]:
+        cursor = db.event_participants.find({"event_id": ev["_id"], "status": {"$in": list(statuses)}}, {"user_id": 1})
+        return [d["user_id"] async for d in cursor]
+
+    async def membership(self, events: list[dict[str, Any]], user_id: ObjectId) -> dict[ObjectId, str]:
+        return await self.membership_by_id([ev["_id"] for ev in events], user_id)
+
+    async def membership_by_id(self, event_ids: list[ObjectId], user_id: ObjectId) -> dict[ObjectId, str]:
+        if not event_ids:
+            return {}
+        cursor = db.event_participants.find({"user_id": user_id, "event_id": {"$in": event_ids}}, {"event_id": 1, "status": 1})
+        return {d["event_id"]: d["status"] async for d in cursor}
+
+    async def page(self, _id: ObjectId, status: str, after: Optional[str], limit: int) -> tuple[list[tuple[ObjectId, Optional[datetime]]], Optional[str]]:
+        """Una página de la lista (user_id, joined_at) en orden de llegada, con keyset sobre _id"""
+        query: dict[str, Any] = {"event_id": _id, "status": status}
+        if after:
+            cursor_status, last_id = decode_cursor(after, "participants")
+            if cursor_status != status:
+                raise HTTPException(status_code=400, detail="El cursor no corresponde a esta consulta")
+            query["_id"] = {"$gt": last_id}
+        else:
+            await self._event(_id)  # 404 si no existe
+        cursor = db.event_participants.find(query, {"user_id": 1, "created_at": 1}).sort("_id", 1).limit(limit)
+        docs = [d async for d in cursor]
+        next_cursor = encode_cursor("participants", status, docs[-1]["_id"]) if len(docs) == limit else None
+        return [(d["user_id"], d.get("created_at")) for d in docs], next_cursor
+
+roster = CollectionRoster() if ROSTER_STORAGE == "collection" else EmbeddedRoster()
+
+async def my_status_of(ev: dict[str, Any], user_id: ObjectId) -> str:
+    if ev["organizer_id"] == user_id:
+        return "organizer"
+    return (await roster.membership([ev], user_id)).get(ev["_id"], "none")
+
+async def event_out(ev: dict[str, Any], organizer: Optional[dict[str, Any]], compact: bool, viewer: Optional[ObjectId]) -> EventOut:
+    """serialize_event; en view=compact con usuario conocido agrega my_status"""
+    my_status = await my_status_of(ev, viewer) if compact and viewer else None
+    return serialize_event(ev, organizer, compact, my_status)
+
+async def with_my_status(events: list[dict[str, Any]], user_id: ObjectId) -> list[dict[str, Any]]:
+    """Agrega my_status a eventos ya serializados con event_json (p. ej. desde el cache de Discover)"""
+    uid = str(user_id)
+    membership = await roster.membership_by_id([ObjectId(e["id"]) for e in events if e["organizer_id"] != uid], user_id)
+    return [
+        {**e, "my_status": "organizer" if e["organizer_id"] == uid else membership.get(ObjectId(e["id"]), "none")}
+        for e in events
+    ]
 
 # ------------------------
 # Lifespan / Indexes setup
 # ------------------------
-async def rabbitmq_consumer():
-    """Consumer de RabbitMQ que envía notificaciones a SSE streams"""
-    global rabbitmq_connection, rabbitmq_channel, notification_exchange
-    
-    # Esperar un poco para que MongoDB esté listo
-    await asyncio.sleep(2)
-    
-    print(f"🔄 Intentando conectar a RabbitMQ: {RABBITMQ_URI}")
-    
-    try:
-        # Conectar a RabbitMQ
-        print("📡 Conectando a RabbitMQ...")
-        rabbitmq_connection = await aio_pika.connect_robust(RABBITMQ_URI)
-        print("✅ Conexión a RabbitMQ establecida")
-        
-        rabbitmq_channel = await rabbitmq_connection.channel()
-        print("✅ Canal de RabbitMQ creado")
+def deliver_notification(data: dict[str, Any]) -> int:
+    """Entrega una notificación que llegó del broker a los SSE streams de este worker.
+
+    Devuelve a cuántos streams llegó (0 si el usuario no tiene ninguno abierto: la
+    notificación ya está en MongoDB y aparece cuando recarga)"""
+    user_id = data["user_id"]
+    sse_replay.record(user_id, data)
+    if user_id not in sse_registry:
+        return 0
+    return sse_registry.publish(user_id, data)
+
+class InProcessExchange:
+    """Stand-in del exchange "notifications" (NOTIFICATION_BROKER=memory).
+
+    publish entrega directo con deliver_notification; delay simula la espera del publisher
+    confirm y fail un broker caído (publish levanta ConnectionError)"""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.fail = False
+        self.published = 0
+
+    async def publish(self, message: aio_pika.Message, routing_key: str):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.fail:
+            raise ConnectionError("broker en memoria caído")
+        self.published += 1
+        deliver_notification(json.loads(message.body))
+
+# Consumer de notificaciones:
+# - QoS: hasta RABBITMQ_PREFETCH mensajes sin ackear por worker
+# - hasta RABBITMQ_CONSUMER_CONCURRENCY handlers en paralelo
+# - acks en lote: cada RABBITMQ_ACK_BATCH mensajes (o a los RABBITMQ_ACK_INTERVAL segundos)
+#   un solo ack multiple=True hasta el mayor delivery tag contiguo ya procesado
+# - un mensaje que no se puede procesar (JSON inválido, sin user_id, error del handler) se
+#   manda al exchange "notifications.dead" (queue "notification_dlq") con el error en los
+#   headers, en vez de ackearlo y perderlo
+# - si no se puede conectar o el consumer se cae, se reintenta con backoff exponencial; ya
+#   conectado, connect_robust reconecta y vuelve a suscribir la queue solo
+RABBITMQ_PREFETCH = int(os.getenv("RABBITMQ_PREFETCH", "200"))
+RABBITMQ_CONSUMER_CONCURRENCY = int(os.getenv("RABBITMQ_CONSUMER_CONCURRENCY", "32"))
+RABBITMQ_ACK_BATCH = int(os.getenv("RABBITMQ_ACK_BATCH", "50"))
+RABBITMQ_ACK_INTERVAL = float(os.getenv("RABBITMQ_ACK_INTERVAL", "0.05"))
+RABBITMQ_RECONNECT_MAX = float(os.getenv("RABBITMQ_RECONNECT_MAX", "30"))  # techo del backoff (segundos)
+RABBITMQ_LAG_INTERVAL = float(os.getenv("RABBITMQ_LAG_INTERVAL", "10"))    # cada cuánto se mide la profundidad de la queue
+
+class AckBatcher:
+    """Acks de un canal: un ack multiple=True por lote, hasta el mayor delivery tag contiguo procesado.
+
+    Un mensaje ya resuelto por su cuenta (nack) cuenta como procesado pero no se usa como tope
+    del ack múltiple (ackear un tag ya resuelto cierra el canal)"""
+
+    def __init__(self, max_batch: int, interval: float):
+        self.max_batch = max_batch
+        self.interval = interval
+        self._order: deque[int] = deque()  # delivery tags en orden de llegada
+        self._done: dict[int, tuple[aio_pika.abc.AbstractIncomingMessage, bool]] = {}
+        self._timer: asyncio.Task | None = None
+        self.frames = 0
+        self.acked = 0
+
+    def received(self, message: aio_pika.abc.AbstractIncomingMessage):
+        self._order.append(message.delivery_tag)
+
+    def settle(self, message: aio_pika.abc.AbstractIncomingMessage):
+        """Marca como resuelto un mensaje cuyo handler no llegó a done() (cancelado o fallado)"""
+        self._done[message.delivery_tag] = (message, True)
+
+    async def done(self, message: aio_pika.abc.AbstractIncomingMessage, settled: bool = False):
+        self._done[message.delivery_tag] = (message, settled)
+        if len(self._done) >= self.max_batch:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.interval)
+        self._timer = None
+        await self.flush()
+
+    async def flush(self):
+        last = None
+        count = 0
+        while self._order and self._order[0] in self._done:
+            message, settled = self._done.pop(self._order.popleft())
+            if not settled:
+                last = message
+                count += 1
+        if last is not None:
+            await last.ack(multiple=True)
+            self.frames += 1
+            self.acked += count
+
+class NotificationConsumer:
+    """Consume la queue de notificaciones de este worker y entrega a los SSE streams"""
+
+    def __init__(self):
+        self.batcher = AckBatcher(RABBITMQ_ACK_BATCH, RABBITMQ_ACK_INTERVAL)
+        self.dead_exchange: aio_pika.abc.AbstractExchange | None = None
+        self.connected = False
+        self.reconnects = 0
+        self.received = 0
+        self.delivered = 0      # mensajes que llegaron a al menos un stream
+        self.no_stream = 0      # el usuario no tenía streams abiertos en este worker
+        self.dead_lettered = 0
+        self.in_flight = 0
+        self.queue_depth: Optional[int] = None
+        self._handled_at: deque[float] = deque()        # monotonic de los últimos 60s (throughput)
+        self._latencies: deque[float] = deque(maxlen=1000)  # created_at -> entrega, en segundos
+        # referencias fuertes a las tareas (el loop sólo guarda una débil); stop() las espera
+        self._handlers: set[asyncio.Task] = set()
+        self._depth_task: asyncio.Task | None = None
+
+    def on_reconnect(self, *_):
+        # Los delivery tags son por canal: los pendientes del canal viejo los reentrega el broker
+        self.reconnects += 1
+        self.batcher = AckBatcher(RABBITMQ_ACK_BATCH, RABBITMQ_ACK_INTERVAL)
+
+    async def handle(self, message: aio_pika.abc.AbstractIncomingMessage, batcher: AckBatcher, slots: asyncio.Semaphore):
+        settled = False
+        handled = False
+        data = None
+        try:
+            try:
+                data = json.loads(message.body)
+                if not isinstance(data, dict) or "user_id" not in data:
+                    raise ValueError("mensaje sin user_id")
+                if deliver_notification(data):
+                    self.delivered += 1
+                else:
+                    self.no_stream += 1
+            except Exception as e:
+                settled = await self.dead_letter(message, e)
+            handled = True
+        finally:
+            self.in_flight -= 1
+            slots.release()
+            self._handled_at.append(time.monotonic())
+            if not handled:
+                # Cancelado (stop) o caído a mitad de camino: el tag se marca resuelto antes que
+                # nada (si no, el ack contiguo de todos los siguientes queda trabado) y se devuelve
+                # con nack para que el broker lo reentregue
+                batcher.settle(message)
+                with contextlib.suppress(Exception):
+                    await message.nack(requeue=True)
+        try:
+            await batcher.done(message, settled)
+        except Exception as e:
+            log_rabbitmq.warning("error ackeando mensajes", extra={"error": str(e)})
+        # Sólo para métricas: un created_at raro no puede mandar a la DLQ algo ya entregado
+        if isinstance(data, dict) and data.get("created_at"):
+            with contextlib.suppress(TypeError, ValueError):
+                self._latencies.append((now() - datetime.fromisoformat(data["created_at"])).total_seconds())
+
+    async def dead_letter(self, message: aio_pika.abc.AbstractIncomingMessage, error: Exception) -> bool:
+        """Manda el mensaje a la DLQ; devuelve True si tuvo que resolverlo con nack"""
+        try:
+            await self.dead_exchange.publish(
+                aio_pika.Message(
+                    message.body,
+                    content_type=message.content_type,
+                    headers={"x-error": f"{type(error).__name__}: {error}", "x-routing-key": message.routing_key},
+                ),
+                routing_key="dead",
+            )
+            self.dead_lettered += 1
+            log_rabbitmq.warning("mensaje enviado a la DLQ", extra={"error": f"{type(error).__name__}: {error}"})
+            return False
+        except Exception as e:
+            log_rabbitmq.error("no se pudo mandar el mensaje a la DLQ, se descarta", extra={"error": str(error), "dlq_error": str(e)})
+            await message.nack(requeue=False)
+            return True
+
+    async def sample_depth(self, queue: aio_pika.abc.AbstractQueue):
+        while True:
+            try:
+                self.queue_depth = (await queue.declare()).message_count
+            except Exception:
+                self.queue_depth = None
+            await asyncio.sleep(RABBITMQ_LAG_INTERVAL)
+
+    async def consume(self, connection: aio_pika.abc.AbstractRobustConnection):
+        """Declara la topología y consume hasta que se cierre la conexión"""
+        global rabbitmq_channel, notification_exchange, worker_queue
+        rabbitmq_channel = await connection.channel(publisher_confirms=True)
+        await rabbitmq_channel.set_qos(prefetch_count=RABBITMQ_PREFETCH)
         
         # Crear exchange y queue
         notification_exchange = await rabbitmq_channel.declare_exchange(
             "notifications", aio_pika.ExchangeType.DIRECT, durable=True
         )
-        print("✅ Exchange 'notifications' declarado")
-        
-        queue = await rabbitmq_channel.declare_queue("notification_queue", durable=True)
-        print("✅ Queue 'notification_queue' declarada")
-        
-        await queue.bind(notification_exchange, routing_key="notifications")
-        print("✅ Queue vinculada al exchange")
+        self.dead_exchange = await rabbitmq_channel.declare_exchange(
+            "notifications.dead", aio_pika.ExchangeType.FANOUT, durable=True
+        )
+        dead_queue = await rabbitmq_channel.declare_queue("notification_dlq", durable=True)
+        await dead_queue.bind(self.dead_exchange)
         
-        print("=" * 60)
-        print("✅ RabbitMQ conectado y consumer iniciado correctamente")
-        print("=" * 60)
+        if SSE_DELIVERY_MODE == "per_worker":
+            # Queue con nombre generado por el broker; se borra sola al cerrar la conexión
+            queue = await rabbitmq_channel.declare_queue(exclusive=True, auto_delete=True)
+            worker_queue = queue
+            # Vincular usuarios que abrieron su stream antes de que RabbitMQ estuviera listo
+            for uid in list(user_route_refs):
+                await sync_user_route(uid)
+        else:
+            queue = await rabbitmq_channel.declare_queue("notification_queue", durable=True)
+            await queue.bind(notification_exchange, routing_key="notifications")
         
-        # Consumir mensajes
-        async with queue.iterator() as queue_iter:
-            async for message in queue_iter:
-                try:
-                    async with message.process():
-                        data = json.loads(message.body.decode())
-                        user_id = data["user_id"]
-                        
-                        # Enviar a SSE stream si está activo
-                        if user_id in active_sse_streams:
-                            print(f"📤 Enviando notificación a usuario {user_id} via SSE (tipo: {data.get('type', 'unknown')})")
-                            await active_sse_streams[user_id].put(data)
-                        else:
-                            print(f"⚠️ Usuario {user_id} no tiene SSE stream activo.")
-                            print(f"   Streams activos: {list(active_sse_streams.keys())}")
-                            print(f"   Nota: La notificación se guardó en MongoDB y aparecerá cuando el usuario recargue la página.")
-                except Exception as e:
-                    print(f"❌ Error procesando mensaje de RabbitMQ: {e}")
-                    import traceback
-                    traceback.print_exc()
-    except Exception as e:
-        print("=" * 60)
-        print(f"❌ Error en consumer de RabbitMQ: {e}")
-        print("=" * 60)
-        import traceback
-        traceback.print_exc()
-        # Si RabbitMQ no está disponible, continuar sin él
+        log_rabbitmq.info("consumer conectado", extra={"queue": queue.name, "prefetch": RABBITMQ_PREFETCH, "concurrency": RABBITMQ_CONSUMER_CONCURRENCY})
+        self.connected = True
+        slots = asyncio.Semaphore(RABBITMQ_CONSUMER_CONCURRENCY)
+        self._depth_task = asyncio.create_task(self.sample_depth(queue))
+        try:
+            async with queue.iterator() as queue_iter:
+                async for message in queue_iter:
+                    await slots.acquire()
+                    batcher = self.batcher
+                    batcher.received(message)
+                    self.received += 1
+                    self.in_flight += 1
+                    task = asyncio.create_task(self.handle(message, batcher, slots))
+                    self._handlers.add(task)
+                    task.add_done_callback(self._handlers.discard)
+        finally:
+            self._depth_task.cancel()
+            self._depth_task = None
+            self.connected = False
+
+    async def stop(self, timeout: float = 5.0):
+        """Shutdown: espera los mensajes en curso (o los cancela tras timeout) y manda sus acks"""
+        if self._depth_task is not None:
+            self._depth_task.cancel()
+        if self._handlers:
+            _, pending = await asyncio.wait(set(self._handlers), timeout=timeout)
+            for task in pending:
+                task.cancel()  # nack con requeue: el broker los reentrega a otro consumer
+            if pending:
+                await asyncio.wait(pending, timeout=1.0)  # que alcancen a resolver su tag
+        try:
+            await self.batcher.flush()
+        except Exception as e:
+            log_rabbitmq.warning("error ackeando mensajes al cerrar", extra={"error": str(e)})
+
+    def stats(self) -> dict[str, Any]:
+        cutoff = time.monotonic() - 60
+        while self._handled_at and self._handled_at[0] < cutoff:
+            self._handled_at.popleft()
+        latencies = sorted(self._latencies)
+        pct = lambda q: round(latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1000, 1) if latencies else None  # noqa: E731
+        return {
+            "connected": self.connected,
+            "reconnects": self.reconnects,
+            "prefetch": RABBITMQ_PREFETCH,
+            "concurrency": RABBITMQ_CONSUMER_CONCURRENCY,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "received": self.received,
+            "delivered": self.delivered,
+            "no_stream": self.no_stream,
+            "dead_lettered": self.dead_lettered,
+            "acked": self.batcher.acked,
+            "ack_frames": self.batcher.frames,
+            "throughput_per_s": round(len(self._handled_at) / 60, 2),
+            "latency_ms": {"p50": pct(0.5), "p99": pct(0.99)},
+        }
+
+notification_consumer = NotificationConsumer()
+
+async def rabbitmq_consumer():
+    """Mantiene conectado el consumer de RabbitMQ que envía notificaciones a SSE streams"""
+    global rabbitmq_connection, rabbitmq_channel, notification_exchange, worker_queue
+    
+    # Esperar un poco para que MongoDB esté listo
+    await asyncio.sleep(2)
+    
+    attempt = 0
+    while True:
+        connection = None
+        try:
+            log_rabbitmq.info("conectando", extra={"attempt": attempt + 1})
+            connection = await aio_pika.connect_robust(RABBITMQ_URI)
+            connection.reconnect_callbacks.add(notification_consumer.on_reconnect)
+            rabbitmq_connection = connection
+            attempt = 0
+            await notification_consumer.consume(connection)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log_rabbitmq.error("error en el consumer", extra={"error": str(e)})
+        # Mientras tanto se sigue sin RabbitMQ: las notificaciones quedan en MongoDB (y en el outbox)
         rabbitmq_connection = None
         rabbitmq_channel = None
         notification_exchange = None
+        worker_queue = None
+        bound_user_routes.clear()
+        sse_replay.clear()
+        if connection is not None:
+            with contextlib.suppress(Exception):
+                await connection.close()
+        attempt += 1
+        delay = min(RABBITMQ_RECONNECT_MAX, 2.0 ** attempt) * random.uniform(0.5, 1.0)
+        log_rabbitmq.info("reintentando conexión", extra={"delay_s": round(delay, 1)})
+        await asyncio.sleep(delay)
+
+# -----------------
+# Event lifecycle scheduler
+# -----------------
+# En vez de escanear "events" cada 60s, cada worker mantiene un heap de deadlines
+# (fecha_inicio y fecha_fin de los eventos activos) y duerme exactamente hasta el próximo.
+# - se carga una sola vez al arrancar; create/cancel/delete/complete lo actualizan incrementalmente
+# - sin deadlines pendientes duerme sin timeout: cero queries en reposo
+# - inicio: avisa a los confirmados; fin: le recuerda al organizador que lo marque como finalizado
+#   (finalizar sigue siendo manual porque registra asistencia y no-shows)
+# - cada transición se dispara una sola vez gracias a los marcadores "inicio_notificado" y
+#   "fin_notificado", que se setean con un find_one_and_update atómico (también entre varios workers)
+LIFECYCLE_CATCHUP_SECONDS = int(os.getenv("LIFECYCLE_CATCHUP_SECONDS", "3600"))  # transiciones perdidas (ej. deploy) que todavía se notifican
+
+def naive_utc(dt: datetime) -> datetime:
+    """Normaliza a datetime UTC naive, igual que lo devuelve MongoDB"""
+    if dt.tzinfo is not None:
+        return dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+LifecycleTransition = Literal["start", "end"]
+
+class EventLifecycleScheduler:
+    """Cola de prioridad de transiciones de eventos ((event_id, "start"|"end") -> deadline)"""
+
+    def __init__(self):
+        self._heap: list[tuple[datetime, str, str]] = []
+        self._pending: dict[tuple[str, str], datetime] = {}
+        self._wakeup: asyncio.Event | None = None
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def schedule(self, event_id: str, fecha_inicio: datetime, fecha_fin: datetime):
+        self._push(event_id, "start", fecha_inicio)
+        self._push(event_id, "end", fecha_fin)
+
+    def _push(self, event_id: str, transition: LifecycleTransition, deadline: datetime):
+        deadline = naive_utc(deadline)
+        self._pending[(event_id, transition)] = deadline
+        heapq.heappush(self._heap, (deadline, event_id, transition))
+        # Si es el nuevo deadline más próximo, despertar al loop para recalcular el sleep
+        if self._wakeup is not None and self._heap[0][1:] == (event_id, transition):
+            self._wakeup.set()
+
+    def unschedule(self, event_id: str):
+        # Las entradas del heap quedan obsoletas y se descartan cuando llegan al tope
+        self._pending.pop((event_id, "start"), None)
+        self._pending.pop((event_id, "end"), None)
+
+    def _discard_stale(self):
+        while self._heap:
+            deadline, event_id, transition = self._heap[0]
+            if self._pending.get((event_id, transition)) == deadline:
+                return
+            heapq.heappop(self._heap)
+
+    def _pop_due(self, now_dt: datetime) -> list[tuple[str, str]]:
+        due = []
+        self._discard_stale()
+        while self._heap and self._heap[0][0] <= now_dt:
+            _, event_id, transition = heapq.heappop(self._heap)
+            del self._pending[(event_id, transition)]
+            due.append((event_id, transition))
+            self._discard_stale()
+        return due
+
+    def _next_timeout(self) -> Optional[float]:
+        self._discard_stale()
+        if not self._heap:
+            return None
+        return max(0.0, (self._heap[0][0] - now()).total_seconds())
+
+    async def load(self):
+        """Carga las transiciones pendientes desde MongoDB (una vez, al arrancar)"""
+        now_dt = now()
+        catchup = now_dt - timedelta(seconds=LIFECYCLE_CATCHUP_SECONDS)
+        cursor = db.events.find(
+            {
+                "activo": 1,
+                "finalizado": {"$ne": True},
+                "fecha_fin": {"$gte": catchup},
+                "$or": [{"inicio_notificado": {"$ne": True}}, {"fin_notificado": {"$ne": True}}],
+            },
+            {"fecha_inicio": 1, "fecha_fin": 1, "inicio_notificado": 1, "fin_notificado": 1},
+        )
+        async for ev in cursor:
+            event_id = str(ev["_id"])
+            if not ev.get("inicio_notificado") and ev["fecha_inicio"] >= catchup and ev["fecha_fin"] >= now_dt:
+                self._push(event_id, "start", ev["fecha_inicio"])
+            if not ev.get("fin_notificado"):
+                self._push(event_id, "end", ev["fecha_fin"])
+        log_events.info("scheduler de eventos cargado", extra={"pending": len(self)})
+
+    async def fire_start(self, event_id: str):
+        """Marca el inicio como notificado y avisa a los confirmados (a lo sumo una vez por evento)"""
+        now_dt = now()
+        ev = await db.events.find_one_and_update(
+            {
+                "_id": ObjectId(event_id),
+                "activo": 1,
+                "finalizado": {"$ne": True},
+                "inicio_notificado": {"$ne": True},
+                "fecha_inicio": {"$lte": now_dt},
+                "fecha_fin": {"$gte": now_dt},  # si ya terminó no tiene sentido avisar que comenzó
+            },
+            {"$set": {"inicio_notificado": True}},
+            projection={"title": 1, "confirmed_participants": 1},
+        )
+        if not ev:
+            return  # cancelado, eliminado, ya terminado o ya notificado por otro worker
+        payloads = await save_notifications_bulk(
+            user_ids=await roster.user_ids(ev, "confirmed"),
+            notification_type="event_started",
+            title="Evento comenzó",
+            message=f"El evento '{ev['title']}' ha comenzado",
+            event_id=event_id,
+            event_title=ev["title"],
+        )
+        await publish_notifications_batch(payloads)
+
+    async def fire_end(self, event_id: str):
+        """Marca el fin como notificado y le pide al organizador que finalice el evento (una vez por evento)"""
+        ev = await db.events.find_one_and_update(
+            {
+                "_id": ObjectId(event_id),
+                "activo": 1,
+                "finalizado": {"$ne": True},
+                "fin_notificado": {"$ne": True},
+                "fecha_fin": {"$lte": now()},
+            },
+            {"$set": {"fin_notificado": True}},
+            projection={"title": 1, "organizer_id": 1},
+        )
+        if not ev:
+            return  # cancelado, eliminado, ya finalizado o ya notificado por otro worker
+        await publish_notification(
+            user_id=str(ev["organizer_id"]),
+            notification_type="event_ended",
+            title="Evento terminado",
+            message=f"Tu evento '{ev['title']}' terminó. Marcalo como finalizado para registrar la asistencia",
+            event_id=event_id,
+            event_title=ev["title"],
+        )
+
+    async def run(self):
+        self._wakeup = asyncio.Event()
+        await self.load()
+        while True:
+            self._wakeup.clear()
+            started = time.perf_counter()
+            for event_id, transition in self._pop_due(now()):
+                try:
+                    if transition == "start":
+                        await self.fire_start(event_id)
+                    else:
+                        await self.fire_end(event_id)
+                except Exception:
+                    log_events.exception("error en transición del evento", extra={"event_id": event_id, "transition": transition})
+            metrics.observe_loop("check_event_starts", time.perf_counter() - started)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self._next_timeout())
+            except asyncio.TimeoutError:
+                pass
+
+lifecycle_scheduler = EventLifecycleScheduler()
 
 async def check_event_starts():
-    """Tarea en background que verifica eventos que comenzaron y notifica a participantes"""
+    """Tarea en background que notifica el inicio y el fin de cada evento"""
     while True:
         try:
-            await asyncio.sleep(60)  # Verificar cada minuto
-            now_dt = now()
-            
-            # Buscar eventos que comenzaron en el último minuto
-            cursor = db.events.find({
-                "activo": 1,
-                "finalizado": {"$ne": True},
-                "fecha_inicio": {
-                    "$gte": datetime.fromtimestamp(now_dt.timestamp() - 120),  # Últimos 2 minutos
-                    "$lte": now_dt
-                }
-            })
-            
-            async for ev in cursor:
-                # Notificar a participantes confirmados
-                for participant_id in ev.get("confirmed_participants", []):
-                    # Verificar si ya notificamos este evento
-                    existing = await db.notifications.find_one({
-                        "user_id": ObjectId(participant_id),
-                        "event_id": ev["_id"],
-                        "type": "event_started"
-                    })
-                    if not existing:
-                        await publish_notification(
-                            user_id=str(participant_id),
-                            notification_type="event_started",
-                            title="Evento comenzó",
-                            message=f"El evento '{ev['title']}' ha comenzado",
-                            event_id=str(ev["_id"]),
-                            event_title=ev["title"],
-                        )
-        except Exception as e:
-            print(f"Error en check_event_starts: {e}")
+            await lifecycle_scheduler.run()
+        except Exception:
+            log_events.exception("error en check_event_starts")
+            await asyncio.sleep(5)
+
+# -----------------
+# Index manifest
+# -----------------
+# Cada query de la API declara acá el índice que necesita; ensure_indexes crea exactamente
+# estos (create_index es idempotente). Un índice compuesto también sirve a los prefijos, así
+# que no se declaran índices que sean prefijo de otro.
+# (colección, keys, opciones de create_index, query que lo usa)
+IndexSpec = tuple[str, list[tuple[str, Any]], dict[str, Any], str]
+
+def index_manifest() -> list[IndexSpec]:
+    specs: list[IndexSpec] = [
+        ("users", [("name", 1)], {}, "POST /users/login y /users/register por nombre"),
+        ("events", [("location", "2dsphere")], {}, "GET /events con lat/lng ($geoNear, $geoWithin)"),
+        ("events", [("category", 1)], {}, "GET /events?category= sin lat/lng"),
+        ("events", [("fecha_inicio", 1)], {}, "GET /events con from_date/to_date y cualquier activo"),
+        ("events", [("activo", 1), ("fecha_inicio", 1), ("_id", 1)], {},
+         "GET /events sin lat/lng (sort + keyset), carga del scheduler y del índice geo"),
+        ("events", [("organizer_id", 1), ("activo", 1)], {}, "GET /events/my ($match inicial del $facet)"),
+        # Búsqueda de texto (sólo puede haber un índice text por colección).
+        # Con idioma "spanish" MongoDB aplica stemming y stop words en español, y la versión 3
+        # del índice ignora tildes y diéresis ("fútbol" == "futbol")
+        ("events", [("title", "text"), ("description", "text"), ("location_alias", "text"), ("category", "text")],
+         {"weights": EVENT_TEXT_WEIGHTS, "default_language": "spanish", "name": "events_text"}, "GET /events?q="),
+        ("event_participants", [("event_id", 1), ("user_id", 1)], {"unique": True}, "altas/bajas del roster (un estado por usuario)"),
+        ("event_participants", [("event_id", 1), ("status", 1), ("_id", 1)], {}, "GET /events/{id}/participants (keyset)"),
+        ("event_participants", [("user_id", 1), ("event_id", 1)], {}, "my_status en view=compact"),
+        ("notifications", [("user_id", 1), ("created_at", -1), ("_id", -1)], {}, "GET /notifications (sort + keyset)"),
+        ("notifications", [("user_id", 1), ("read", 1)], {}, "PATCH /notifications/read-all, recuento de no leídas y no leídas del stream"),
+        ("notifications", [("user_id", 1), ("_id", 1)], {}, "replay del stream por Last-Event-ID"),
+        ("notifications", [("read", 1), ("created_at", 1)], {}, "archivador: leídas vencidas"),
+        ("notifications", [("outbox", 1)], {"partialFilterExpression": {"outbox": {"$exists": True}}},
+         "relay del outbox (sólo las pendientes de publicar)"),
+        ("notifications", [("coalesce_key", 1)], {"unique": True, "partialFilterExpression": {"coalesce_key": {"$exists": True}}},
+         "upsert de digests (coalescing)"),
+        ("notifications", [("user_id", 1), ("rev", 1)], {"partialFilterExpression": {"rev": {"$exists": True}}},
+         "replay por Last-Event-ID de digests revisados"),
+    ]
+    if DISCOVER_CACHE_TTL > 0:
+        specs.append(("discover_invalidations", [("at", 1)], {"expireAfterSeconds": 3600},
+                      "invalidaciones del cache de Discover entre workers (lectura por at + TTL)"))
+    if NOTIFICATION_ARCHIVE == "collection":
+        specs.append(("notifications_archive", [("user_id", 1), ("created_at", -1), ("_id", -1)], {},
+                      "GET /notifications?include_archived=true"))
+        if NOTIFICATION_ARCHIVE_TTL_DAYS > 0:
+            # Cambiar el TTL de un índice existente requiere collMod (create_index falla)
+            specs.append(("notifications_archive", [("archived_at", 1)],
+                          {"expireAfterSeconds": int(NOTIFICATION_ARCHIVE_TTL_DAYS * 86400), "name": "archived_at_ttl"},
+                          "TTL del historial archivado"))
+    return specs
+
+async def ensure_indexes(database):
+    """Crea los índices del manifest (idempotente)"""
+    for collection, keys, options, _ in index_manifest():
+        await database[collection].create_index(keys, **options)
+
+# Loops de startup y tareas sueltas: el event loop sólo guarda una referencia débil a cada
+# tarea, así que se retienen acá y el shutdown las cancela
+background_tasks: set[asyncio.Task] = set()
+
+def spawn(coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
 
 @app.on_event("startup")
 async def on_startup():
-    global client, db
-    client = AsyncIOMotorClient(MONGO_URI)  # equivalente a hacer "use lasegunda"
+    global client, db, notification_exchange
+    listeners: list[monitoring.CommandListener] = []
+    if METRICS_ENABLED:
+        listeners.append(mongo_metrics)
+    if PROFILING:
+        listeners.append(ProfileCommandListener())
+        stack_sampler.start(asyncio.get_running_loop())
+    if STORAGE_ENGINE == "memory":
+        client = MemoryClient()
+    else:
+        client = AsyncIOMotorClient(MONGO_URI, event_listeners=listeners)  # equivalente a hacer "use lasegunda"
     db = client[MONGO_DB]
-    # Indexes
-    await db.users.create_index("name")
-    await db.events.create_index([("location", "2dsphere")])
-    await db.events.create_index([("category", 1)])
-    await db.events.create_index([("fecha_inicio", 1)])
-    await db.events.create_index([("activo", 1)])
-    await db.notifications.create_index([("user_id", 1), ("created_at", -1)])
-    await db.notifications.create_index([("user_id", 1), ("read", 1)])
+    await ensure_indexes(db)
+    await roster.migrate()
     # Ready ping
     await db.command("ping")
     
     # Iniciar consumer de RabbitMQ en background
-    asyncio.create_task(rabbitmq_consumer())
+    if NOTIFICATION_BROKER == "memory":
+        notification_exchange = InProcessExchange()
+    else:
+        spawn(rabbitmq_consumer())
+    if NOTIFICATION_DELIVERY == "outbox":
+        spawn(outbox_relay.run())
     # Iniciar tarea para verificar eventos que comienzan
-    asyncio.create_task(check_event_starts())
+    spawn(check_event_starts())
+    if GEO_INDEX_ENABLED:
+        spawn(geo_index.run())
+    if discover_cache.enabled:
+        spawn(discover_cache.run())
+    if NOTIFICATION_READ_TTL_DAYS > 0 or NOTIFICATION_MAX_PER_USER > 0:
+        spawn(notification_archiver.run())
 
 @app.on_event("shutdown")
 async def on_shutdown():
-    print("🛑 Cerrando conexiones...")
+    log.info("cerrando conexiones")
     # Cerrar todos los SSE streams
-    for user_id in list(active_sse_streams.keys()):
-        del active_sse_streams[user_id]
-    print(f"✅ {len(active_sse_streams)} SSE streams cerrados")
+    open_streams = len(sse_registry)
+    sse_registry.close_all()
+    log_sse.info("SSE streams cerrados", extra={"streams": open_streams})
+
+    # Frenar los loops en background y terminar los mensajes que el consumer tiene en curso
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*list(background_tasks), return_exceptions=True)
+    await notification_consumer.stop()
     
     # Cerrar RabbitMQ
     if rabbitmq_connection:
         try:
             await rabbitmq_connection.close()
-            print("✅ Conexión RabbitMQ cerrada")
+            log_rabbitmq.info("conexión cerrada")
         except Exception as e:
-            print(f"⚠️ Error cerrando RabbitMQ: {e}")
+            log_rabbitmq.warning("error cerrando la conexión", extra={"error": str(e)})
     
     # Cerrar MongoDB
     if client:
         try:
             client.close()
-            print("✅ Conexión MongoDB cerrada")
+            log.info("conexión MongoDB cerrada")
         except Exception as e:
-            print(f"⚠️ Error cerrando MongoDB: {e}")
+            log.warning("error cerrando MongoDB", extra={"error": str(e)})
     
-    print("✅ Shutdown completo")
+    stack_sampler.stop()
+    log.info("shutdown completo")
+    log_listener.stop()  # vacía la cola de logs antes de salir
 
 # ---------
 # Utilities
@@ -391,15 +2084,661 @@ async def on_shutdown():
 def now() -> datetime:
     return datetime.utcnow()
 
+# Tareas en background que deben correr en un solo worker a la vez (archivador, relay del
+# outbox): cada una toma un lease con vencimiento en la colección "job_leases"
+WORKER_ID = f"{os.uname().nodename}:{os.getpid()}"
+
+async def acquire_job_lease(job_id: str, seconds: float) -> Optional[dict[str, Any]]:
+    """Toma (o renueva) el lease de job_id para este worker; None si lo tiene otro"""
+    now_dt = now()
+    try:
+        return await db.job_leases.find_one_and_update(
+            {"_id": job_id, "$or": [{"lease_until": {"$lt": now_dt}}, {"owner": WORKER_ID}]},
+            {"$set": {"owner": WORKER_ID, "lease_until": now_dt + timedelta(seconds=seconds)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        return None  # el documento existe y el lease vigente es de otro worker
+
 def geojson_point(p: GeoPoint) -> dict[str, Any]:
     return {"type": "Point", "coordinates": [p.lng, p.lat]}
 
+# ---------
+# Keyset pagination
+# ---------
+# Las listas se paginan con cursores opacos: base64url de [tipo, valores...] serializado con
+# json_util (conserva datetime y ObjectId). El cursor de una página se devuelve en el header
+# X-Next-Cursor (o en next_cursor) y se manda como after= para pedir la siguiente.
+# skip sigue funcionando por compatibilidad, pero cuesta O(skip) y no se combina con after.
+def encode_cursor(kind: str, *values: Any) -> str:
+    raw = json_util.dumps([kind, *values]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(token: str, kind: str) -> list[Any]:
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        decoded = json_util.loads(raw)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    if not isinstance(decoded, list) or not decoded or decoded[0] != kind:
+        raise HTTPException(status_code=400, detail="El cursor no corresponde a esta consulta")
+    return decoded[1:]
+
+def reject_skip_with_cursor(skip: int, after: Optional[str]):
+    """El cursor ya marca dónde sigue la lista: un skip encima saltearía resultados"""
+    if skip and after:
+        raise HTTPException(status_code=400, detail="skip no se puede combinar con after")
+
+def keyset_after(field: str, direction: int, value: Any, last_id: ObjectId) -> dict[str, Any]:
+    """Filtro "posterior a (value, last_id)" para un orden (field, _id) en la dirección dada"""
+    op = "$gt" if direction > 0 else "$lt"
+    return {"$or": [{field: {op: value}}, {field: value, "_id": {op: last_id}}]}
+
+# ---------
+# User profile cache
+# ---------
+# Casi todos los endpoints de eventos necesitan nombre/rating del organizador.
+# LRU + TTL en memoria de perfiles proyectados (los campos de UserOut), con multi-get
+# batcheado para las listas. Las escrituras que cambian un perfil lo invalidan o lo
+# reemplazan en este worker; en otros workers el TTL acota cuánto puede quedar viejo.
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))  # segundos (0 = sin cache)
+USER_PROFILE_PROJECTION = {
+    "name": 1, "phone": 1, "description": 1, "rating": 1,
+    "cant_events_visited": 1, "cant_events_organized": 1, "cant_no_shows": 1,
+    "created_at": 1, "updated_at": 1,
+}
+
+class UserProfileCache:
+    """_id -> (expira_en, perfil) con desalojo LRU"""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[ObjectId, tuple[float, dict[str, Any]]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _lookup(self, user_id: ObjectId) -> Optional[dict[str, Any]]:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self._entries[user_id]
+            return None
+        self._entries.move_to_end(user_id)
+        return entry[1]
+
+    def put(self, doc: dict[str, Any]):
+        """Write-through: guarda el perfil recién leído/escrito de MongoDB"""
+        if self.ttl <= 0:
+            return
+        profile = {k: v for k, v in doc.items() if k == "_id" or k in USER_PROFILE_PROJECTION}
+        self._entries[doc["_id"]] = (time.monotonic() + self.ttl, profile)
+        self._entries.move_to_end(doc["_id"])
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, *user_ids: ObjectId):
+        for user_id in user_ids:
+            self._entries.pop(user_id, None)
+
+    async def get(self, user_id: ObjectId) -> Optional[dict[str, Any]]:
+        profile = self._lookup(user_id)
+        if profile is not None:
+            self.hits += 1
+            return profile
+        self.misses += 1
+        doc = await db.users.find_one({"_id": user_id}, USER_PROFILE_PROJECTION)
+        if doc:
+            self.put(doc)
+        return doc
+
+    async def get_many(self, user_ids: List[ObjectId]) -> dict[str, dict[str, Any]]:
+        """str(_id) -> perfil; los faltantes se traen con un solo $in"""
+        found: dict[str, dict[str, Any]] = {}
+        missing: list[ObjectId] = []
+        for user_id in dict.fromkeys(user_ids):
+            profile = self._lookup(user_id)
+            if profile is not None:
+                found[str(user_id)] = profile
+            else:
+                missing.append(user_id)
+        self.hits += len(found)
+        self.misses += len(missing)
+        if missing:
+            async for doc in db.users.find({"_id": {"$in": missing}}, USER_PROFILE_PROJECTION):
+                self.put(doc)
+                found[str(doc["_id"])] = doc
+        return found
+
+    def stats(self) -> dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+user_cache = UserProfileCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
+# ---------
+# In-memory geo index (Discover)
+# ---------
+# Opcional (GEO_INDEX_ENABLED=1): cada worker mantiene en RAM los eventos activos y no
+# finalizados y resuelve /events con lat/lng sin ir a MongoDB: haversine vectorizado con
+# NumPy sobre todos los eventos (o en Python puro si NumPy no está instalado), filtros por
+# category/fechas/max_km y orden por cercanía, igual que $geoNear.
+# - se carga al arrancar; las mutaciones de este worker lo actualizan en el momento
+# - los cambios de otros workers llegan por change stream (replica set) o, en un mongod
+#   standalone, recargando cada GEO_INDEX_REFRESH segundos
+# - mientras no está cargado, o si la búsqueda usa q / activo != 1, se usa MongoDB
+GEO_INDEX_ENABLED = os.getenv("GEO_INDEX_ENABLED", "0") == "1"
+GEO_INDEX_REFRESH = float(os.getenv("GEO_INDEX_REFRESH", "30"))
+
+class ActiveEventGeoIndex:
+    def __init__(self):
+        self._docs: dict[ObjectId, dict[str, Any]] = {}
+        self._dirty = True
+        self.ready = False
+        self.queries = 0
+        self.loaded_at: Optional[datetime] = None
+        # columnas (se reconstruyen sólo cuando cambió algo)
+        self._rows: list[dict[str, Any]] = []
+        self._lat: Any = []
+        self._lng: Any = []
+        self._start: Any = []
+        self._category: Any = []
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    @staticmethod
+    def indexable(doc: dict[str, Any]) -> bool:
+        return doc.get("activo") == 1 and not doc.get("finalizado", False)
+
+    def sync(self, doc: dict[str, Any]):
+        """Refleja el estado actual de un evento: lo agrega/reemplaza si sigue activo, si no lo saca"""
+        if not self.ready:
+            return  # todavía no se cargó (o está deshabilitado): load() trae el estado completo
+        if self.indexable(doc):
+            self._docs[doc["_id"]] = {k: v for k, v in doc.items() if k == "_id" or k in EVENT_OUT_PROJECTION}
+            self._dirty = True
+        else:
+            self.remove(doc["_id"])
+
+    def remove(self, event_id: ObjectId):
+        if self._docs.pop(event_id, None) is not None:
+            self._dirty = True
+
+    async def load(self):
+        """Reemplaza el contenido con los eventos activos de MongoDB"""
+        cursor = db.events.find({"activo": 1, "finalizado": {"$ne": True}}, EVENT_OUT_PROJECTION)
+        self._docs = {d["_id"]: d async for d in cursor}
+        self._dirty = True
+        self.ready = True
+        self.loaded_at = now()
+
+    def _build(self):
+        self._rows = list(self._docs.values())
+        lngs = [d["location"]["coordinates"][0] for d in self._rows]
+        lats = [d["location"]["coordinates"][1] for d in self._rows]
+        starts = [d["fecha_inicio"] for d in self._rows]
+        categories = [d["category"] for d in self._rows]
+        if np is not None:
+            self._lat = np.radians(np.array(lats, dtype=np.float64))
+            self._lng = np.radians(np.array(lngs, dtype=np.float64))
+            self._start = np.array(starts, dtype="datetime64[us]")
+            self._category = np.array(categories, dtype=object)
+        else:
+            self._lat, self._lng, self._start, self._category = lats, lngs, starts, categories
+        self._dirty = False
+
+    def can_serve(self, status: int, q: Optional[str]) -> bool:
+        return GEO_INDEX_ENABLED and self.ready and status == 1 and not q
+
+    def nearest(
+        self,
+        lat: float,
+        lng: float,
+        category: Optional[str],
+        from_date: Optional[datetime],
+        to_date: Optional[datetime],
+        max_km: Optional[float],
+        min_distance: Optional[float],
+        seen_ids: List[ObjectId],
+        skip: int,
+        limit: int,
+    ) -> list[dict[str, Any]]:
+        """Eventos ordenados por distancia (con distance_meters), con la misma semántica que $geoNear"""
+        if self._dirty:
+            self._build()
+        self.queries += 1
+        from_date = naive_utc(from_date) if from_date else None
+        to_date = naive_utc(to_date) if to_date else None
+        max_m = max_km * 1000.0 if max_km else None
+        seen = set(seen_ids)
+        need = skip + limit + len(seen)
+        if np is not None:
+            candidates = self._nearest_numpy(lat, lng, category, from_date, to_date, max_m, min_distance, need)
+        else:
+            candidates = self._nearest_python(lat, lng, category, from_date, to_date, max_m, min_distance, need)
+        out = []
+        for distance, row in candidates:
+            if row["_id"] in seen:
+                continue
+            out.append({**row, "distance_meters": distance})
+        return out[skip:skip + limit]
+
+    def _nearest_numpy(self, lat, lng, category, from_date, to_date, max_m, min_distance, need):
+        phi = math.radians(lat)
+        a = (np.sin((self._lat - phi) / 2) ** 2
+             + math.cos(phi) * np.cos(self._lat) * np.sin((self._lng - math.radians(lng)) / 2) ** 2)
+        dist = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+        mask = np.ones(len(self._rows), dtype=bool)
+        if category:
+            mask &= self._category == category
+        if from_date:
+            mask &= self._start >= np.datetime64(from_date, "us")
+        if to_date:
+            mask &= self._start <= np.datetime64(to_date, "us")
+        if max_m is not None:
+            mask &= dist <= max_m
+        if min_distance is not None:
+            mask &= dist >= min_distance
+        idx = np.flatnonzero(mask)
+        if len(idx) > need:
+            idx = idx[np.argpartition(dist[idx], need - 1)[:need]]
+        idx = idx[np.argsort(dist[idx], kind="stable")]
+        return [(float(dist[i]), self._rows[i]) for i in idx]
+
+    def _nearest_python(self, lat, lng, category, from_date, to_date, max_m, min_distance, need):
+        candidates = []
+        for i, row in enumerate(self._rows):
+            if category and self._category[i] != category:
+                continue
+            if from_date and self._start[i] < from_date:
+                continue
+            if to_date and self._start[i] > to_date:
+                continue
+            distance = haversine_m(lat, lng, self._lat[i], self._lng[i])
+            if max_m is not None and distance > max_m:
+                continue
+            if min_distance is not None and distance < min_distance:
+                continue
+            candidates.append((distance, i))
+        return [(d, self._rows[i]) for d, i in heapq.nsmallest(need, candidates)]
+
+    def apply_change(self, change: dict[str, Any]):
+        """Aplica un cambio del change stream de la colección events"""
+        if change["operationType"] == "delete":
+            self.remove(change["documentKey"]["_id"])
+        elif change.get("fullDocument") is not None:
+            self.sync(change["fullDocument"])
+
+    async def run(self):
+        """Carga inicial + mantenimiento: change stream si hay replica set, si no recarga periódica"""
+        while True:
+            try:
+                await self.load()
+                log_events.info("índice geo en memoria cargado", extra={"events": len(self)})
+                async with db.events.watch(full_document="updateLookup") as stream:
+                    async for change in stream:
+                        self.apply_change(change)
+            except OperationFailure as e:
+                # mongod standalone: no hay change streams
+                log_events.warning("índice geo sin change streams, recarga periódica", extra={"code": e.code, "refresh_s": GEO_INDEX_REFRESH})
+                while True:
+                    await asyncio.sleep(GEO_INDEX_REFRESH)
+                    try:
+                        await self.load()
+                    except Exception:
+                        log_events.exception("error recargando índice geo")
+            except Exception:
+                # el stream se cortó: se pudieron perder cambios, se recarga entero
+                log_events.exception("error en índice geo")
+                await asyncio.sleep(5)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "enabled": GEO_INDEX_ENABLED,
+            "ready": self.ready,
+            "events": len(self),
+            "queries": self.queries,
+            "numpy": np is not None,
+            "loaded_at": self.loaded_at.isoformat() if self.loaded_at else None,
+        }
+
+geo_index = ActiveEventGeoIndex()
+
+# ---------
+# Discover response cache
+# ---------
+# GET /events con lat/lng se repite desde Discover con los mismos filtros y posiciones casi
+# iguales (cada usuario tiene la suya, pero dentro del mismo barrio). El cache se indexa por
+# tile (celda de DISCOVER_TILE_KM de lado) + filtros y guarda los eventos candidatos del tile:
+# los que están a menos de DISCOVER_CACHE_RADIUS_KM (más media diagonal) del centro del tile.
+# Cada request calcula sus distancias reales desde su lat/lng sobre esos candidatos y aplica
+# max_km, el cursor y skip/limit, así que distance_meters y el corte de max_km son exactos; si
+# la página puede incluir eventos más allá de lo que cubren los candidatos, va a MongoDB.
+# - fresco durante DISCOVER_CACHE_TTL segundos; después, hasta DISCOVER_CACHE_STALE segundos
+#   más, se sirve la versión vieja mientras se recalcula en background (una vez por key)
+# - una mutación de evento borra sólo los tiles que el evento puede cambiar: mismo category
+#   (o sin filtro) y dentro del alcance de los candidatos medido desde el centro del tile
+# - entre workers: cada invalidación se anota en la colección discover_invalidations y los
+#   demás workers la aplican cada DISCOVER_CACHE_SYNC segundos; hasta entonces pueden servir
+#   candidatos anteriores al cambio
+# - un cálculo que estaba en curso cuando llegó una invalidación que lo afecta se devuelve
+#   pero no se guarda
+# - sin lat/lng, con search=text (orden por relevancia) o con el índice geo en memoria
+#   sirviendo la consulta, no se usa el cache
+DISCOVER_CACHE_TTL = float(os.getenv("DISCOVER_CACHE_TTL", "10"))  # 0 = deshabilitado
+DISCOVER_CACHE_STALE = float(os.getenv("DISCOVER_CACHE_STALE", "30"))
+DISCOVER_CACHE_SIZE = int(os.getenv("DISCOVER_CACHE_SIZE", "2000"))
+DISCOVER_CACHE_SYNC = float(os.getenv("DISCOVER_CACHE_SYNC", "1"))  # segundos entre lecturas de invalidaciones de otros workers
+DISCOVER_TILE_KM = float(os.getenv("DISCOVER_TILE_KM", "1"))
+DISCOVER_CACHE_RADIUS_KM = float(os.getenv("DISCOVER_CACHE_RADIUS_KM", "10"))  # distancias que se resuelven desde el cache
+DISCOVER_TILE_CANDIDATES = int(os.getenv("DISCOVER_TILE_CANDIDATES", "2000"))  # tope de eventos por tile
+
+# (tile, activo, category, from_date, to_date, q)
+DiscoverKey = tuple
+Tile = tuple[int, int]
+Origin = tuple[float, float]
+# (lat, lng, category) del evento que cambió
+Invalidation = tuple[float, float, Optional[str]]
+
+class DiscoverCacheEntry:
+    __slots__ = ("docs", "center", "category", "reach_m", "fresh_until", "stale_until")
+
+    def __init__(self, docs: list[dict[str, Any]], center: Origin, category: Optional[str], reach_m: float, ttl: float, stale: float):
+        self.docs = docs  # candidatos del tile (EVENT_OUT_PROJECTION)
+        self.center = center
+        self.category = category
+        self.reach_m = reach_m  # están todos los eventos a menos de esto del centro
+        self.fresh_until = time.monotonic() + ttl
+        self.stale_until = self.fresh_until + stale
+
+    def affected_by(self, change: Invalidation) -> bool:
+        lat, lng, category = change
+        if self.category and self.category != category:
+            return False
+        return haversine_m(self.center[0], self.center[1], lat, lng) <= self.reach_m
+
+    def page(
+        self,
+        lat: float,
+        lng: float,
+        max_km: Optional[float],
+        min_distance: Optional[float],
+        seen_ids: List[ObjectId],
+        skip: int,
+        limit: int,
+    ) -> Optional[list[dict[str, Any]]]:
+        """La página pedida desde (lat, lng), o None si los candidatos no alcanzan a cubrirla"""
+        # los candidatos incluyen todo evento a menos de esto del request
+        covered_m = self.reach_m - haversine_m(self.center[0], self.center[1], lat, lng)
+        max_m = max_km * 1000.0 if max_km else None
+        seen = set(seen_ids)
+        rows = []
+        for doc in self.docs:
+            ev_lng, ev_lat = doc["location"]["coordinates"]
+            distance = haversine_m(lat, lng, ev_lat, ev_lng)
+            if max_m is not None and distance > max_m:
+                continue
+            if min_distance is not None and distance < min_distance:
+                continue
+            if doc["_id"] in seen:
+                continue
+            rows.append((distance, doc))
+        rows.sort(key=lambda row: row[0])
+        rows = rows[skip:skip + limit]
+        complete = max_m is not None and max_m < covered_m
+        if not complete and not (len(rows) == limit and rows[-1][0] < covered_m):
+            return None
+        return [{**doc, "distance_meters": distance} for distance, doc in rows]
+
+# compute() -> (candidatos del tile, reach_m)
+DiscoverCompute = Callable[[], Any]
+
+class DiscoverResponseCache:
+    def __init__(self, max_size: int, ttl: float, stale: float, tile_km: float = DISCOVER_TILE_KM, radius_km: float = DISCOVER_CACHE_RADIUS_KM):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.stale = stale
+        self.tile_km = tile_km
+        self.radius_km = radius_km
+        self._tile_deg = tile_km / 111.32  # grados de latitud por tile (los de longitud quedan más angostos)
+        self._entries: OrderedDict[DiscoverKey, DiscoverCacheEntry] = OrderedDict()
+        self._inflight: dict[DiscoverKey, asyncio.Future] = {}
+        self._refreshing: set[asyncio.Task] = set()
+        # invalidaciones recientes (monotonic, cambio): un cálculo que empezó antes de una que
+        # lo afecta no se guarda
+        self._recent: deque[tuple[float, Invalidation]] = deque(maxlen=1000)
+        self._synced_at: Optional[datetime] = None
+        self._synced_ids: set[ObjectId] = set()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.fallbacks = 0  # páginas que los candidatos no cubrían
+        self.invalidations = 0
+        self.remote_changes = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def tile(self, lat: float, lng: float) -> Tile:
+        return math.floor(lat / self._tile_deg), math.floor(lng / self._tile_deg)
+
+    def tile_area(self, tile: Tile) -> tuple[Origin, float]:
+        """(centro del tile, radio a pedir desde el centro para cubrir radius_km desde cualquier punto del tile)"""
+        half = self._tile_deg / 2
+        center_lat = min(max((tile[0] + 0.5) * self._tile_deg, -90.0), 90.0)
+        center_lng = min(max((tile[1] + 0.5) * self._tile_deg, -180.0), 180.0)
+        half_diagonal = max(
+            haversine_m(center_lat, center_lng, center_lat + dlat, center_lng + dlng)
+            for dlat in (-half, half) for dlng in (-half, half)
+        )
+        return (center_lat, center_lng), self.radius_km * 1000.0 + half_diagonal
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _store(self, key: DiscoverKey, entry: DiscoverCacheEntry):
+        self._entries.pop(key, None)
+        self._entries[key] = entry
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _stale_since(self, started: float, entry: DiscoverCacheEntry) -> bool:
+        """¿Llegó, mientras se calculaba entry, una invalidación que la afecta?"""
+        if len(self._recent) == self._recent.maxlen and self._recent[0][0] > started:
+            return True  # se perdió historia: no se puede saber, mejor no guardar
+        return any(t >= started and entry.affected_by(change) for t, change in reversed(self._recent))
+
+    async def _compute(self, key: DiscoverKey, center: Origin, category: Optional[str], compute: DiscoverCompute) -> DiscoverCacheEntry:
+        """Calcula una sola vez por key aunque lleguen varias requests juntas"""
+        pending = self._inflight.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        started = time.monotonic()
+        try:
+            docs, reach_m = await compute()
+            entry = DiscoverCacheEntry(docs, center, category, reach_m, self.ttl, self.stale)
+            if not self._stale_since(started, entry):
+                self._store(key, entry)
+            future.set_result(entry)
+            return entry
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # marcado como consumido si nadie más esperaba
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def _revalidate(self, key: DiscoverKey, center: Origin, category: Optional[str], compute: DiscoverCompute):
+        try:
+            await self._compute(key, center, category, compute)
+        except Exception as e:
+            log_events.warning("error recalculando cache de Discover", extra={"error": str(e)})
+
+    async def get(self, key: DiscoverKey, center: Origin, category: Optional[str], compute: DiscoverCompute) -> DiscoverCacheEntry:
+        entry = self._entries.get(key)
+        t = time.monotonic()
+        if entry is not None and t <= entry.stale_until:
+            self._entries.move_to_end(key)
+            if t <= entry.fresh_until:
+                self.hits += 1
+            else:
+                self.stale_hits += 1
+                if key not in self._inflight:
+                    task = asyncio.create_task(self._revalidate(key, center, category, compute))
+                    self._refreshing.add(task)
+                    task.add_done_callback(self._refreshing.discard)
+            return entry
+        self.misses += 1
+        return await self._compute(key, center, category, compute)
+
+    def apply(self, change: Invalidation):
+        """Borra las entradas cuyo resultado puede cambiar por este cambio"""
+        self._recent.append((time.monotonic(), change))
+        doomed = [key for key, entry in self._entries.items() if entry.affected_by(change)]
+        for key in doomed:
+            del self._entries[key]
+        self.invalidations += len(doomed)
+
+    async def invalidate_event(self, doc: dict[str, Any]):
+        """Invalida en este worker y lo anota para los demás"""
+        if not self.enabled:
+            return
+        lng, lat = doc["location"]["coordinates"]
+        change = (lat, lng, doc.get("category"))
+        self.apply(change)
+        try:
+            await db.discover_invalidations.insert_one(
+                {"at": now(), "worker": WORKER_ID, "lat": lat, "lng": lng, "category": change[2]}
+            )
+        except Exception as e:
+            # los otros workers se enteran por TTL
+            log_events.warning("no se pudo anotar la invalidación de Discover", extra={"error": str(e)})
+
+    async def sync(self):
+        """Aplica las invalidaciones de otros workers desde la última lectura"""
+        query_at = now()
+        since = self._synced_at or query_at
+        # margen por relojes y escrituras que se confirman fuera de orden; los ya vistos se saltean
+        cursor = db.discover_invalidations.find(
+            {"at": {"$gte": since - timedelta(seconds=2)}, "worker": {"$ne": WORKER_ID}}
+        ).sort("at", 1)
+        seen: set[ObjectId] = set()
+        async for doc in cursor:
+            seen.add(doc["_id"])
+            if doc["_id"] in self._synced_ids:
+                continue
+            self.apply((doc["lat"], doc["lng"], doc.get("category")))
+            self.remote_changes += 1
+        self._synced_ids = seen
+        self._synced_at = query_at
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(DISCOVER_CACHE_SYNC)
+            try:
+                await self.sync()
+            except Exception as e:
+                log_events.warning("error leyendo invalidaciones de Discover", extra={"error": str(e)})
+
+    def stats(self) -> dict[str, Any]:
+        served = self.hits + self.stale_hits
+        total = served + self.misses
+        return {
+            "enabled": self.enabled,
+            "size": len(self),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "stale_seconds": self.stale,
+            "tile_km": self.tile_km,
+            "radius_km": self.radius_km,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_ratio": round(served / total, 4) if total else None,
+            "fallbacks": self.fallbacks,
+            "invalidations": self.invalidations,
+            "remote_changes": self.remote_changes,
+        }
+
+discover_cache = DiscoverResponseCache(DISCOVER_CACHE_SIZE, DISCOVER_CACHE_TTL, DISCOVER_CACHE_STALE)
+
 # ---------
 # Notification utilities
 # ---------
-async def save_notification(user_id: str, notification_type: str, title: str, message: str, event_id: Optional[str] = None, event_title: Optional[str] = None):
-    """Guarda una notificación en MongoDB"""
-    doc = {
+def notification_routing_key(user_id: str) -> str:
+    """Routing key con la que se publica una notificación para user_id"""
+    if SSE_DELIVERY_MODE == "per_worker":
+        return f"user.{user_id}"
+    return "notifications"
+
+async def sync_user_route(user_id: str):
+    """Vincula/desvincula la queue del worker según haya o no streams abiertos para user_id"""
+    global user_route_lock
+    if worker_queue is None or notification_exchange is None:
+        return
+    if user_route_lock is None:
+        user_route_lock = asyncio.Lock()
+    # El estado deseado se lee dentro del lock, así un bind/unbind tardío nunca pisa uno más nuevo
+    async with user_route_lock:
+        wanted = user_id in user_route_refs
+        if wanted and user_id not in bound_user_routes:
+            await worker_queue.bind(notification_exchange, routing_key=notification_routing_key(user_id))
+            bound_user_routes.add(user_id)
+        elif not wanted and user_id in bound_user_routes:
+            await worker_queue.unbind(notification_exchange, routing_key=notification_routing_key(user_id))
+            bound_user_routes.discard(user_id)
+            # Desde acá este worker deja de ver las notificaciones del usuario
+            sse_replay.forget(user_id)
+
+async def acquire_user_route(user_id: str):
+    """Registra un stream abierto de user_id en este worker (modo per_worker)"""
+    if SSE_DELIVERY_MODE != "per_worker":
+        return
+    user_route_refs[user_id] = user_route_refs.get(user_id, 0) + 1
+    try:
+        await sync_user_route(user_id)
+    except Exception as e:
+        log_rabbitmq.warning("error vinculando routing key", extra={"user_id": user_id, "error": str(e)})
+
+def release_user_route(user_id: str):
+    """Libera un stream de user_id; al cerrar el último se desvincula su routing key"""
+    if SSE_DELIVERY_MODE != "per_worker" or user_id not in user_route_refs:
+        return
+    user_route_refs[user_id] -= 1
+    if user_route_refs[user_id] <= 0:
+        del user_route_refs[user_id]
+        # Puede llamarse desde un generador cancelado: el unbind corre en su propia task.
+        # Se demora SSE_ROUTE_LINGER para que una reconexión rápida encuentre el binding
+        # (y el replay buffer) intactos
+        spawn(_unbind_user_route_later(user_id))
+
+async def _unbind_user_route_later(user_id: str):
+    try:
+        await asyncio.sleep(SSE_ROUTE_LINGER)
+        await sync_user_route(user_id)
+    except Exception as e:
+        log_rabbitmq.warning("error desvinculando routing key", extra={"user_id": user_id, "error": str(e)})
+
+def notification_doc(user_id: str, notification_type: str, title: str, message: str, event_id: Optional[str] = None, event_title: Optional[str] = None) -> dict[str, Any]:
+    """Arma el documento de notificación tal como se guarda en MongoDB"""
+    return {
         "user_id": ObjectId(user_id),
         "type": notification_type,
         "title": title,
@@ -408,54 +2747,268 @@ async def save_notification(user_id: str, notification_type: str, title: str, me
         "event_title": event_title,
         "read": False,
         "created_at": now(),
+        **outbox_marker(),
+    }
+
+def notification_payload(doc: dict[str, Any]) -> dict[str, Any]:
+    """Convierte un documento de notificación (ya insertado) al JSON que viaja por RabbitMQ/SSE"""
+    return {
+        "id": str(doc["_id"]),
+        "user_id": str(doc["user_id"]),
+        "type": doc["type"],
+        "title": doc["title"],
+        "message": notification_message(doc),
+        "event_id": str(doc["event_id"]) if doc.get("event_id") else None,
+        "event_title": doc.get("event_title"),
+        "read": bool(doc.get("read", False)),
+        "count": doc.get("count", 1),
+        "created_at": doc["created_at"].isoformat(),
+        **({"rev": str(doc["rev"])} if doc.get("rev") else {}),
+    }
+
+# Contador de no leídas por usuario (colección notification_counters, _id = user_id):
+# - se crea la primera vez que se consulta, contando en notifications
+# - desde ahí cada alta / lectura lo ajusta con $inc (sin upsert: un $inc nunca crea
+#   un contador que arranque en cero con notificaciones viejas sin contar)
+# - cada $inc también sube "seq": el conteo inicial sólo se guarda si seq no cambió mientras
+#   se contaba, así un alta que entra entre el count y el $set no se pierde (se recuenta)
+UNREAD_SEED_ATTEMPTS = 3
+
+async def bump_unread(counts: dict[ObjectId, int]):
+    """Suma (o resta) no leídas a los contadores ya creados, en un solo round trip"""
+    counts = {uid: n for uid, n in counts.items() if n}
+    if len(counts) == 1:
+        [(uid, n)] = counts.items()
+        await db.notification_counters.update_one({"_id": uid}, {"$inc": {"unread": n, "seq": 1}})
+    elif counts:
+        ops = [UpdateOne({"_id": uid}, {"$inc": {"unread": n, "seq": 1}}) for uid, n in counts.items()]
+        await db.notification_counters.bulk_write(ops, ordered=False)
+
+async def unread_count(user_id: ObjectId) -> int:
+    """No leídas de user_id desde su contador (lo recalcula si falta o quedó negativo)"""
+    counter = await db.notification_counters.find_one({"_id": user_id})
+    if counter is not None and counter.get("seeded", True) and counter.get("unread", -1) >= 0:
+        return counter["unread"]
+    for _ in range(UNREAD_SEED_ATTEMPTS):
+        # Crear el contador (sin sembrar) antes de contar: desde acá los $inc de bump_unread
+        # caen en él y suben seq, y el $set condicional se entera
+        counter = await db.notification_counters.find_one_and_update(
+            {"_id": user_id},
+            {"$setOnInsert": {"unread": 0, "seq": 0, "seeded": False}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        if counter.get("seeded", True) and counter.get("unread", -1) >= 0:
+            return counter["unread"]  # lo sembró otro request mientras tanto
+        unread = await db.notifications.count_documents({"user_id": user_id, "read": False})
+        result = await db.notification_counters.update_one(
+            {"_id": user_id, "seq": counter.get("seq")},
+            {"$set": {"unread": unread, "seeded": True}},
+        )
+        if result.matched_count:
+            return unread
+    # Mucha escritura concurrente: un conteo fresco, sin guardarlo en el contador
+    # (se vuelve a intentar sembrar en la próxima consulta)
+    return await db.notifications.count_documents({"user_id": user_id, "read": False})
+
+# Coalescing: los tipos de NOTIFICATION_COALESCE_TYPES se agrupan por (usuario, tipo, evento)
+# en ventanas fijas de NOTIFICATION_COALESCE_WINDOW segundos. La primera de la ventana crea la
+# notificación y las siguientes actualizan esa misma (count + 1, fecha de la última, vuelve a
+# no leída) con un único upsert sobre coalesce_key, que tiene índice único. Cada revisión lleva
+# un rev (ObjectId) nuevo, que es el id del frame SSE: así Last-Event-ID reenvía un digest que
+# cambió mientras el cliente estaba desconectado aunque su _id sea anterior.
+# La publicación a RabbitMQ de esas actualizaciones se demora NOTIFICATION_COALESCE_DEBOUNCE
+# segundos, así una ráfaga de postulaciones llega al cliente como un solo frame con el total
+NOTIFICATION_COALESCE_TYPES = set(filter(None, os.getenv("NOTIFICATION_COALESCE_TYPES", "new_application").split(",")))
+NOTIFICATION_COALESCE_WINDOW = int(os.getenv("NOTIFICATION_COALESCE_WINDOW", "0"))  # 0 = deshabilitado (ej. 600)
+NOTIFICATION_COALESCE_DEBOUNCE = float(os.getenv("NOTIFICATION_COALESCE_DEBOUNCE", "2"))
+
+# Texto de un digest con count > 1 (se arma al leer, el documento guarda el mensaje original)
+NOTIFICATION_DIGEST_MESSAGES = {
+    "new_application": "{count} personas quieren unirse a '{event_title}'",
+}
+
+def notification_message(doc: dict[str, Any]) -> str:
+    count = doc.get("count", 1)
+    template = NOTIFICATION_DIGEST_MESSAGES.get(doc["type"])
+    if count > 1 and template:
+        return template.format(count=count, event_title=doc.get("event_title") or "")
+    return doc["message"]
+
+def coalesces(notification_type: str, event_id: Optional[str]) -> bool:
+    return NOTIFICATION_COALESCE_WINDOW > 0 and event_id is not None and notification_type in NOTIFICATION_COALESCE_TYPES
+
+async def coalesce_notification(doc: dict[str, Any]) -> tuple[dict[str, Any], bool]:
+    """Suma doc al digest de su ventana; devuelve (digest actualizado, si recién se creó)"""
+    window = int(time.time() // NOTIFICATION_COALESCE_WINDOW)
+    key = f"{doc['type']}:{doc['user_id']}:{doc['event_id']}:{window}"
+    fresh = {k: v for k, v in doc.items() if k not in ("read", "created_at", "outbox")}
+    fresh["_id"] = ObjectId()
+    rev = ObjectId()
+    update = {
+        "$setOnInsert": fresh,
+        "$set": {"read": False, "created_at": doc["created_at"], "rev": rev, **outbox_marker()},
+        "$inc": {"count": 1},
     }
-    await db.notifications.insert_one(doc)
+    try:
+        before = await db.notifications.find_one_and_update({"coalesce_key": key}, update, upsert=True)
+    except DuplicateKeyError:
+        # Dos upserts simultáneos de la misma ventana: el segundo ya encuentra el digest
+        before = await db.notifications.find_one_and_update({"coalesce_key": key}, update, upsert=True)
+    if before is None:
+        digest = {**fresh, "read": False, "created_at": doc["created_at"], "rev": rev, "count": 1, "coalesce_key": key}
+    else:
+        digest = {**before, "read": False, "created_at": doc["created_at"], "rev": rev, "count": before.get("count", 1) + 1}
+    # Cuenta como no leída nueva si se creó o si el usuario ya la había leído
+    if before is None or before.get("read"):
+        await bump_unread({digest["user_id"]: 1})
+    return digest, before is None
+
+class DigestPublisher:
+    """Publica los digests actualizados con debounce: por digest sale sólo el último estado"""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self._pending: dict[str, dict[str, Any]] = {}
+        self._timers: set[asyncio.Task] = set()  # referencia fuerte: el loop sólo guarda una débil
+        self.scheduled = 0
+        self.published = 0
+
+    def schedule(self, payload: dict[str, Any]):
+        self.scheduled += 1
+        current = self._pending.get(payload["id"])
+        if current is None:
+            task = asyncio.create_task(self._publish_later(payload["id"]))
+            self._timers.add(task)
+            task.add_done_callback(self._timers.discard)
+        elif current["count"] > payload["count"]:
+            return  # llegó antes un estado más nuevo
+        self._pending[payload["id"]] = payload
+
+    async def _publish_later(self, notification_id: str):
+        await asyncio.sleep(self.delay)
+        payload = self._pending.pop(notification_id, None)
+        if payload is not None:
+            self.published += 1
+            await send_notification_payload(payload)
+
+    def stats(self) -> dict[str, Any]:
+        return {"pending": len(self._pending), "scheduled": self.scheduled, "published": self.published}
+
+digest_publisher = DigestPublisher(NOTIFICATION_COALESCE_DEBOUNCE)
 
 async def publish_notification(user_id: str, notification_type: str, title: str, message: str, event_id: Optional[str] = None, event_title: Optional[str] = None):
     """Publica una notificación a RabbitMQ y la guarda en MongoDB"""
     # Guardar en MongoDB primero para obtener el ID
-    doc = {
-        "user_id": ObjectId(user_id),
-        "type": notification_type,
-        "title": title,
-        "message": message,
-        "event_id": ObjectId(event_id) if event_id else None,
-        "event_title": event_title,
-        "read": False,
-        "created_at": now(),
-    }
-    result = await db.notifications.insert_one(doc)
-    notification_id = str(result.inserted_id)
-    
-    # Publicar a RabbitMQ
+    doc = notification_doc(user_id, notification_type, title, message, event_id, event_title)
+    if coalesces(notification_type, event_id):
+        doc, created = await coalesce_notification(doc)
+    else:
+        await db.notifications.insert_one(doc)
+        await bump_unread({doc["user_id"]: 1})
+        created = True
+    if NOTIFICATION_DELIVERY == "outbox":
+        outbox_relay.wake()
+    elif created:
+        await send_notification_payload(notification_payload(doc))
+    else:
+        digest_publisher.schedule(notification_payload(doc))
+
+async def send_notification_payload(notification_data: dict[str, Any]):
+    """Publica a RabbitMQ una notificación ya guardada"""
+    user_id = notification_data["user_id"]
     if not notification_exchange:
-        print(f"⚠️ RabbitMQ no disponible, notificación guardada en MongoDB: {notification_id}")
+        log_notifications.info("RabbitMQ no disponible, notificación sólo en MongoDB", extra={"notification_id": notification_data["id"]})
+        sse_replay.forget(user_id)  # el replay buffer ya no cubre todas sus notificaciones
         return
     
-    notification_data = {
-        "id": notification_id,
-        "user_id": user_id,
-        "type": notification_type,
-        "title": title,
-        "message": message,
-        "event_id": event_id,
-        "event_title": event_title,
-        "read": False,
-        "created_at": doc["created_at"].isoformat(),
-    }
-    
     try:
+        started = time.perf_counter()
         await notification_exchange.publish(
             aio_pika.Message(
                 json.dumps(notification_data).encode(),
                 content_type="application/json",
             ),
-            routing_key="notifications",
+            routing_key=notification_routing_key(user_id),
         )
-        print(f"✅ Notificación publicada a RabbitMQ para usuario {user_id}: {notification_type}")
+        if PROFILING:
+            profile_await("rabbitmq", "publish", started)
+        metrics.rabbitmq_published += 1
+        log_notifications.debug("notificación publicada", extra={"user_id": user_id, "type": notification_data["type"]})
     except Exception as e:
-        print(f"❌ Error publicando notificación a RabbitMQ: {e}")
-        print(f"   Exchange disponible: {notification_exchange is not None}")
+        sse_replay.forget(user_id)
+        metrics.rabbitmq_publish_failed += 1
+        log_notifications.warning("error publicando notificación", extra={"user_id": user_id, "error": str(e)})
+
+# Fan-out masivo (cancel/complete de eventos grandes):
+# - un solo insert_many para todas las notificaciones
+# - publicación a RabbitMQ en lotes concurrentes; el canal usa publisher confirms,
+#   así que cada publish espera su ack pero los acks de un lote se esperan en paralelo
+# - la publicación corre como BackgroundTask, después de enviar la respuesta HTTP
+NOTIFICATION_PUBLISH_BATCH = int(os.getenv("NOTIFICATION_PUBLISH_BATCH", "500"))
+
+async def save_notifications_bulk(user_ids: List[str], notification_type: str, title: str, message: str, event_id: Optional[str] = None, event_title: Optional[str] = None) -> list[dict[str, Any]]:
+    """Guarda una notificación por destinatario con un único insert_many y devuelve los payloads"""
+    user_ids = list(dict.fromkeys(str(u) for u in user_ids))  # sin duplicados, orden estable
+    if not user_ids:
+        return []
+    docs = [notification_doc(uid, notification_type, title, message, event_id, event_title) for uid in user_ids]
+    # insert_many completa el _id de cada documento
+    await db.notifications.insert_many(docs, ordered=False)
+    await bump_unread({d["user_id"]: 1 for d in docs})
+    return [notification_payload(d) for d in docs]
+
+async def publish_payloads(exchange, payloads: list[dict[str, Any]]) -> list[bool]:
+    """Publica en lotes de NOTIFICATION_PUBLISH_BATCH; devuelve por payload si el broker lo confirmó"""
+    confirmed = []
+    for i in range(0, len(payloads), NOTIFICATION_PUBLISH_BATCH):
+        batch = payloads[i:i + NOTIFICATION_PUBLISH_BATCH]
+        started = time.perf_counter()
+        results = await asyncio.gather(
+            *[
+                exchange.publish(
+                    aio_pika.Message(json.dumps(p).encode(), content_type="application/json"),
+                    routing_key=notification_routing_key(p["user_id"]),
+                )
+                for p in batch
+            ],
+            return_exceptions=True,
+        )
+        if PROFILING:
+            profile_await("rabbitmq", f"publish x{len(batch)}", started)
+        for p, r in zip(batch, results):
+            confirmed.append(not isinstance(r, BaseException))
+            if isinstance(r, BaseException):
+                sse_replay.forget(p["user_id"])
+                metrics.rabbitmq_publish_failed += 1
+            else:
+                metrics.rabbitmq_published += 1
+    return confirmed
+
+async def publish_notifications_batch(payloads: list[dict[str, Any]]):
+    """Publica payloads ya guardados a RabbitMQ en lotes, esperando los confirms de cada lote en paralelo"""
+    if not payloads:
+        return
+    if NOTIFICATION_DELIVERY == "outbox":
+        outbox_relay.wake()  # ya quedaron en el outbox al guardarse
+        return
+    if not notification_exchange:
+        log_notifications.info("RabbitMQ no disponible, notificaciones sólo en MongoDB", extra={"count": len(payloads)})
+        for p in payloads:
+            sse_replay.forget(p["user_id"])
+        return
+    confirmed = await publish_payloads(notification_exchange, payloads)
+    failed = confirmed.count(False)
+    if failed:
+        log_notifications.warning("notificaciones no confirmadas por RabbitMQ", extra={"failed": failed, "count": len(payloads)})
+    else:
+        log_notifications.info("notificaciones publicadas", extra={"count": len(payloads), "type": payloads[0]["type"]})
+
+async def publish_notifications_bulk(background_tasks: BackgroundTasks, user_ids: List[str], notification_type: str, title: str, message: str, event_id: Optional[str] = None, event_title: Optional[str] = None):
+    """Guarda todas las notificaciones ahora y deja la publicación a RabbitMQ para después de la respuesta"""
+    payloads = await save_notifications_bulk(user_ids, notification_type, title, message, event_id, event_title)
+    if payloads:
+        background_tasks.add_task(publish_notifications_batch, payloads)
 
 def serialize_notification(doc: dict[str, Any]) -> NotificationOut:
     return NotificationOut(
@@ -463,13 +3016,252 @@ def serialize_notification(doc: dict[str, Any]) -> NotificationOut:
         user_id=str(doc["user_id"]),
         type=doc["type"],
         title=doc["title"],
-        message=doc["message"],
+        message=notification_message(doc),
         event_id=str(doc["event_id"]) if doc.get("event_id") else None,
         event_title=doc.get("event_title"),
         read=bool(doc.get("read", False)),
+        count=doc.get("count", 1),
         created_at=doc["created_at"],
     )
 
+# ---------
+# Notification retention
+# ---------
+# Opcional (apagado por default: mueve datos fuera de lo que lee la UI). Con algún límite > 0,
+# "notifications" guarda sólo el historial reciente y el resto se mueve a almacenamiento frío:
+# - las leídas con más de NOTIFICATION_READ_TTL_DAYS días
+# - lo que exceda las NOTIFICATION_MAX_PER_USER más nuevas de cada usuario (leídas o no)
+# Así el tamaño de la colección (y de sus índices) depende de los usuarios, no de la historia.
+# El archivador corre en un solo worker a la vez (acquire_job_lease) y mueve en lotes de
+# NOTIFICATION_ARCHIVE_BATCH: primero escribe el lote en el destino y después lo borra, así que
+# una pasada cortada a la mitad se completa en la siguiente.
+# Destinos (NOTIFICATION_ARCHIVE):
+# - "collection": notifications_archive, que GET /notifications?include_archived=true sigue leyendo
+# - "files": un NDJSON gzip por día en NOTIFICATION_ARCHIVE_DIR (lectura offline; un lote
+#   cortado antes del delete puede repetirse, el _id permite deduplicar)
+# - "delete": se descartan
+NOTIFICATION_ARCHIVE = os.getenv("NOTIFICATION_ARCHIVE", "collection")
+NOTIFICATION_READ_TTL_DAYS = float(os.getenv("NOTIFICATION_READ_TTL_DAYS", "0"))  # 0 = las leídas no vencen
+NOTIFICATION_MAX_PER_USER = int(os.getenv("NOTIFICATION_MAX_PER_USER", "0"))      # 0 = sin tope
+NOTIFICATION_ARCHIVE_BATCH = int(os.getenv("NOTIFICATION_ARCHIVE_BATCH", "1000"))
+NOTIFICATION_ARCHIVE_INTERVAL = float(os.getenv("NOTIFICATION_ARCHIVE_INTERVAL", "600"))  # segundos entre pasadas
+NOTIFICATION_ARCHIVE_DIR = os.getenv("NOTIFICATION_ARCHIVE_DIR", "notifications_archive")
+NOTIFICATION_ARCHIVE_TTL_DAYS = float(os.getenv("NOTIFICATION_ARCHIVE_TTL_DAYS", "0"))  # TTL de notifications_archive (0 = para siempre)
+
+def append_archive_file(docs: list[dict[str, Any]]):
+    """Agrega docs al NDJSON gzip del día (cada append es un miembro gzip más; zcat los lee de corrido)"""
+    os.makedirs(NOTIFICATION_ARCHIVE_DIR, exist_ok=True)
+    path = os.path.join(NOTIFICATION_ARCHIVE_DIR, f"notifications-{now():%Y%m%d}.ndjson.gz")
+    lines = "".join(json_util.dumps(d, json_options=json_util.RELAXED_JSON_OPTIONS) + "\n" for d in docs)
+    with gzip.open(path, "ab") as f:
+        f.write(lines.encode())
+
+class NotificationArchiver:
+    """Mueve las notificaciones fuera de la retención al destino configurado"""
+
+    LEASE_ID = "notification_archiver"
+
+    def __init__(self):
+        self.runs = 0
+        self.archived = 0
+        self.last_run: Optional[datetime] = None
+        self.leader = False
+
+    async def _move(self, docs: list[dict[str, Any]]):
+        if NOTIFICATION_ARCHIVE == "collection":
+            archived_at = now()
+            try:
+                await db.notifications_archive.insert_many([{**d, "archived_at": archived_at} for d in docs], ordered=False)
+            except BulkWriteError as e:
+                # Los ya archivados por una pasada anterior cortada chocan por _id: se ignoran
+                if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                    raise
+        elif NOTIFICATION_ARCHIVE == "files":
+            await asyncio.to_thread(append_archive_file, docs)
+        await db.notifications.delete_many({"_id": {"$in": [d["_id"] for d in docs]}})
+        # Si se movieron no leídas, el contador de esos usuarios se descarta y se recuenta al
+        # próximo GET /notifications/unread_count (un $inc no sabe qué leyó el usuario mientras tanto)
+        unread_users = list({d["user_id"] for d in docs if not d.get("read")})
+        if unread_users:
+            await db.notification_counters.delete_many({"_id": {"$in": unread_users}})
+        self.archived += len(docs)
+
+    async def _drain(self, cursor, pending: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        """Acumula lo que devuelve cursor y lo mueve de a lotes completos"""
+        async for doc in cursor:
+            pending.append(doc)
+            if len(pending) >= NOTIFICATION_ARCHIVE_BATCH:
+                await self._move(pending)
+                pending = []
+        return pending
+
+    async def run_once(self) -> int:
+        """Una pasada completa; devuelve cuántas notificaciones movió (0 si no es el líder)"""
+        lease = await acquire_job_lease(self.LEASE_ID, 2 * NOTIFICATION_ARCHIVE_INTERVAL)
+        self.leader = lease is not None
+        if lease is None:
+            return 0
+        before = self.archived
+        pending: list[dict[str, Any]] = []
+        if NOTIFICATION_READ_TTL_DAYS > 0:
+            cutoff = now() - timedelta(days=NOTIFICATION_READ_TTL_DAYS)
+            expired = db.notifications.find({"read": True, "created_at": {"$lt": cutoff}}).batch_size(NOTIFICATION_ARCHIVE_BATCH)
+            pending = await self._drain(expired, pending)
+        if NOTIFICATION_MAX_PER_USER > 0:
+            # Sólo pueden haber pasado el tope los usuarios que recibieron algo desde la última
+            # pasada (watermark = último _id visto, guardado en el lease)
+            newest = await db.notifications.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+            watermark = lease.get("watermark")
+            for user_id in await db.notifications.distinct("user_id", {"_id": {"$gt": watermark}} if watermark else {}):
+                overflow = (
+                    db.notifications.find({"user_id": user_id})
+                    .sort([("created_at", -1), ("_id", -1)])
+                    .skip(NOTIFICATION_MAX_PER_USER)
+                    .batch_size(NOTIFICATION_ARCHIVE_BATCH)
+                )
+                pending = await self._drain(overflow, pending)
+            if newest is not None:
+                await db.job_leases.update_one({"_id": self.LEASE_ID, "owner": WORKER_ID}, {"$set": {"watermark": newest["_id"]}})
+        if pending:
+            await self._move(pending)
+        self.runs += 1
+        self.last_run = now()
+        return self.archived - before
+
+    async def run(self):
+        while True:
+            try:
+                started = time.perf_counter()
+                moved = await self.run_once()
+                metrics.observe_loop("notification_archiver", time.perf_counter() - started)
+                if moved:
+                    log_notifications.info("notificaciones archivadas", extra={"count": moved, "mode": NOTIFICATION_ARCHIVE})
+            except Exception:
+                log_notifications.exception("error archivando notificaciones")
+            await asyncio.sleep(NOTIFICATION_ARCHIVE_INTERVAL)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "mode": NOTIFICATION_ARCHIVE,
+            "read_ttl_days": NOTIFICATION_READ_TTL_DAYS,
+            "max_per_user": NOTIFICATION_MAX_PER_USER,
+            "leader": self.leader,
+            "runs": self.runs,
+            "archived": self.archived,
+            "last_run": self.last_run.isoformat() if self.last_run else None,
+        }
+
+notification_archiver = NotificationArchiver()
+
+# ---------
+# Notification outbox
+# ---------
+# Con NOTIFICATION_DELIVERY=outbox el request sólo escribe la notificación: el documento lleva
+# un marcador "outbox" (un ObjectId nuevo en cada escritura pendiente de publicar) y es su
+# propio registro de outbox. El relay corre en un solo worker a la vez (acquire_job_lease):
+# - lee los pendientes en lotes de NOTIFICATION_OUTBOX_BATCH por el índice parcial de "outbox"
+# - los publica todos juntos y espera los publisher confirms del lote en paralelo
+# - les saca el marcador con un bulk_write condicionado al marcador leído: un digest que se
+#   actualizó mientras tanto sigue pendiente y sale con su último estado en la vuelta siguiente
+# - si el broker no está o no confirma, reintenta con backoff exponencial (con jitter)
+# La entrega es at-least-once: un corte entre el publish y el bulk_write repite el lote
+# (el cliente reemplaza las notificaciones por id)
+NOTIFICATION_OUTBOX_BATCH = int(os.getenv("NOTIFICATION_OUTBOX_BATCH", "500"))
+NOTIFICATION_OUTBOX_POLL = float(os.getenv("NOTIFICATION_OUTBOX_POLL", "1"))  # segundos entre lecturas si nadie lo despierta
+NOTIFICATION_OUTBOX_MAX_BACKOFF = float(os.getenv("NOTIFICATION_OUTBOX_MAX_BACKOFF", "30"))
+NOTIFICATION_OUTBOX_LEASE = float(os.getenv("NOTIFICATION_OUTBOX_LEASE", "15"))
+
+def outbox_marker() -> dict[str, Any]:
+    """Campos que dejan una escritura de notificación pendiente de publicar"""
+    return {"outbox": ObjectId()} if NOTIFICATION_DELIVERY == "outbox" else {}
+
+class OutboxRelay:
+    """Publica las notificaciones pendientes del outbox"""
+
+    LEASE_ID = "notification_outbox"
+
+    def __init__(self):
+        self._wakeup: asyncio.Event | None = None
+        self._lease_until: Optional[datetime] = None
+        self.published = 0
+        self.unconfirmed = 0
+        self.batches = 0
+        self.failures = 0  # fallos consecutivos (definen el backoff)
+        self.last_error: Optional[str] = None
+
+    def wake(self):
+        """Despierta al relay de este worker (si es el líder publica sin esperar el poll)"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def is_leader(self) -> bool:
+        # El lease se renueva cuando pasó la mitad, no en cada vuelta
+        now_dt = now()
+        if self._lease_until is None or self._lease_until - now_dt < timedelta(seconds=NOTIFICATION_OUTBOX_LEASE / 2):
+            lease = await acquire_job_lease(self.LEASE_ID, NOTIFICATION_OUTBOX_LEASE)
+            self._lease_until = lease["lease_until"] if lease else None
+        return self._lease_until is not None
+
+    async def drain_once(self) -> int:
+        """Publica un lote de pendientes; devuelve cuántos quedaron publicados"""
+        cursor = db.notifications.find({"outbox": {"$exists": True}}).sort("outbox", 1).limit(NOTIFICATION_OUTBOX_BATCH)
+        docs = [d async for d in cursor]
+        if not docs:
+            return 0
+        exchange = notification_exchange
+        if exchange is None:
+            raise RuntimeError(f"broker no disponible ({len(docs)}+ pendientes)")
+        confirmed = await publish_payloads(exchange, [notification_payload(d) for d in docs])
+        sent = [d for d, ok in zip(docs, confirmed) if ok]
+        if sent:
+            await db.notifications.bulk_write(
+                [UpdateOne({"_id": d["_id"], "outbox": d["outbox"]}, {"$unset": {"outbox": ""}}) for d in sent],
+                ordered=False,
+            )
+        self.batches += 1
+        self.published += len(sent)
+        if len(sent) < len(docs):
+            self.unconfirmed += len(docs) - len(sent)
+            raise RuntimeError(f"{len(docs) - len(sent)}/{len(docs)} notificaciones sin confirmar")
+        return len(sent)
+
+    async def run(self):
+        self._wakeup = asyncio.Event()
+        while True:
+            self._wakeup.clear()
+            try:
+                if await self.is_leader():
+                    started = time.perf_counter()
+                    sent = await self.drain_once()
+                    metrics.observe_loop("outbox_relay", time.perf_counter() - started)
+                    self.failures = 0
+                    if sent >= NOTIFICATION_OUTBOX_BATCH:
+                        continue  # probablemente quedan más
+            except Exception as e:
+                self.failures += 1
+                self.last_error = str(e)
+                delay = min(NOTIFICATION_OUTBOX_MAX_BACKOFF, 0.5 * 2 ** (self.failures - 1)) * random.uniform(0.5, 1.0)
+                log_notifications.warning("outbox sin publicar, reintento", extra={"error": str(e), "delay_s": round(delay, 1)})
+                await asyncio.sleep(delay)
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=NOTIFICATION_OUTBOX_POLL)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "mode": NOTIFICATION_DELIVERY,
+            "leader": self._lease_until is not None,
+            "published": self.published,
+            "unconfirmed": self.unconfirmed,
+            "batches": self.batches,
+            "consecutive_failures": self.failures,
+            "last_error": self.last_error,
+        }
+
+outbox_relay = OutboxRelay()
+
 # --------------
 # Public routes
 # --------------
@@ -477,77 +3269,109 @@ def serialize_notification(doc: dict[str, Any]) -> NotificationOut:
 async def health():
     return {"ok": True, "time": now().isoformat()}
 
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Métricas deshabilitadas")
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.get("/categories")
 async def categories():
     return {"categories": CATEGORIES}
 
+@app.get("/cache/stats")
+async def cache_stats():
+    """Hit/miss de los caches en memoria de este worker"""
+    return {"user_profiles": user_cache.stats(), "geo_index": geo_index.stats(), "discover": discover_cache.stats()}
+
 # -------------
 # Notifications (SSE + History)
 # -------------
+async def load_sse_replay(user_id: ObjectId, last_id: Optional[ObjectId]) -> tuple[list[dict[str, Any]], bool]:
+    """Notificaciones a reenviar al abrir un stream: (payloads, truncado)"""
+    if last_id is None:
+        # Conexión nueva: no leídas recientes (llegaron antes de que el usuario se conectara)
+        cursor = db.notifications.find(
+            {
+                "user_id": user_id,
+                "read": False,
+                "created_at": {"$gte": datetime.fromtimestamp(now().timestamp() - 300)}  # Últimos 5 minutos
+            }
+        ).sort("created_at", -1).limit(10)
+        recent_notifications = [n async for n in cursor]
+        return [notification_payload(n) for n in reversed(recent_notifications)], False  # Más antiguas primero
+    # Reconexión: exactamente lo posterior a Last-Event-ID, primero desde memoria
+    cached = sse_replay.after(str(user_id), last_id)
+    if cached is not None:
+        return cached, False
+    # Lo creado después de last_id, más los digests anteriores revisados después (rev > last_id),
+    # en una sola query: cada rama del $or usa su índice ((user_id, _id) y (user_id, rev))
+    cursor = db.notifications.find(
+        {"user_id": user_id, "$or": [{"_id": {"$gt": last_id}}, {"rev": {"$gt": last_id}}]}
+    ).sort("_id", 1).limit(SSE_REPLAY_LIMIT + 1)
+    missed = [n async for n in cursor]
+    missed.sort(key=lambda n: n.get("rev") or n["_id"])
+    return [notification_payload(n) for n in missed[:SSE_REPLAY_LIMIT]], len(missed) > SSE_REPLAY_LIMIT
+
 @app.get("/notifications/stream")
 async def stream_notifications(
     x_user_id: Optional[str] = Query(None, alias="X-User-Id"),
+    last_event_id: Optional[str] = Header(None, alias="Last-Event-ID"),
+    last_event_id_param: Optional[str] = Query(None, alias="last_event_id"),
 ):
-    """Endpoint SSE para recibir notificaciones en tiempo real"""
+    """Endpoint SSE para recibir notificaciones en tiempo real.
+    Si llega Last-Event-ID (header que manda el navegador al reconectar, o query param)
+    se reenvían las notificaciones posteriores a ese id.
+    """
     # EventSource no puede enviar headers, así que aceptamos user_id como query param
     if not x_user_id:
         raise HTTPException(status_code=401, detail="X-User-Id requerido")
     user_id = ensure_oid(x_user_id)
     
     user_id_str = str(user_id)
-    queue = asyncio.Queue()
-    
-    # Verificar si hay notificaciones no leídas recientes y enviarlas al conectar
-    # (para notificaciones que llegaron antes de que el usuario se conectara)
-    try:
-        cursor = db.notifications.find(
-            {
-                "user_id": user_id,
-                "read": False,
-                "created_at": {"$gte": datetime.fromtimestamp(now().timestamp() - 300)}  # Últimos 5 minutos
-            }
-        ).sort("created_at", -1).limit(10)
-        recent_notifications = [n async for n in cursor]
-        
-        # Enviar notificaciones recientes al stream
-        for notif in reversed(recent_notifications):  # Más antiguas primero
-            notification_data = {
-                "id": str(notif["_id"]),
-                "user_id": user_id_str,
-                "type": notif["type"],
-                "title": notif["title"],
-                "message": notif["message"],
-                "event_id": str(notif["event_id"]) if notif.get("event_id") else None,
-                "event_title": notif.get("event_title"),
-                "read": False,
-                "created_at": notif["created_at"].isoformat(),
-            }
-            await queue.put(notification_data)
-            print(f"📬 Reenviando notificación reciente al usuario {user_id_str}: {notif['type']}")
-    except Exception as e:
-        print(f"⚠️ Error al cargar notificaciones recientes: {e}")
-    
-    active_sse_streams[user_id_str] = queue
-    print(f"🔔 SSE stream iniciado para usuario {user_id_str}. Total streams activos: {len(active_sse_streams)}")
+    resume_from = (last_event_id or last_event_id_param or "").strip()
+    # Un id inválido se ignora: se trata como conexión nueva
+    last_id = ObjectId(resume_from) if ObjectId.is_valid(resume_from) else None
     
     async def event_generator():
+        # El stream se registra dentro del generador: el finally garantiza que se
+        # libere aunque el cliente corte antes del primer frame.
+        # Se abre antes de cargar el replay para no perder lo que llegue mientras tanto
+        stream = sse_registry.open(user_id_str)
+        log_sse.info("stream abierto", extra={"user_id": user_id_str, "streams": len(sse_registry)})
         try:
-            while True:
-                # Esperar mensaje de la queue (con timeout para mantener conexión viva)
-                try:
-                    notification = await asyncio.wait_for(queue.get(), timeout=30.0)
-                    print(f"📤 Enviando notificación por SSE a usuario {user_id_str}: {notification.get('type', 'unknown')}")
-                    yield f"data: {json.dumps(notification)}\n\n"
-                except asyncio.TimeoutError:
+            await acquire_user_route(user_id_str)
+            replayed: set[str] = set()
+            try:
+                payloads, truncated = await load_sse_replay(user_id, last_id)
+            except Exception as e:
+                log_sse.warning("error cargando notificaciones para reenviar", extra={"user_id": user_id_str, "error": str(e)})
+                payloads, truncated = [], False
+            for payload in payloads:
+                replayed.add(sse_event_id(payload))
+                yield sse_frame(payload)
+            if truncated:
+                # Faltan más de SSE_REPLAY_LIMIT: el cliente debe recargar el historial
+                yield "event: resync\ndata: {}\n\n"
+            while not stream.closed:
+                # Esperar frame del buffer (con timeout para mantener conexión viva)
+                item = await stream.next_frame(timeout=30.0)
+                if item is None:
+                    if stream.closed:
+                        break  # desconectado por overflow
                     # Enviar keepalive
                     yield ": keepalive\n\n"
-        except asyncio.CancelledError:
-            if user_id_str in active_sse_streams:
-                del active_sse_streams[user_id_str]
+                    continue
+                frame_id, frame = item
+                if frame_id in replayed:
+                    continue  # llegó en vivo mientras se cargaba el replay
+                log_sse.debug("frame enviado", extra={"user_id": user_id_str, "id": frame_id})
+                yield frame
         except Exception as e:
-            print(f"Error en SSE stream para usuario {user_id_str}: {e}")
-            if user_id_str in active_sse_streams:
-                del active_sse_streams[user_id_str]
+            log_sse.warning("error en stream", extra={"user_id": user_id_str, "error": str(e)})
+        finally:
+            sse_registry.close(stream)
+            release_user_route(user_id_str)
     
     return StreamingResponse(
         event_generator(),
@@ -559,18 +3383,74 @@ async def stream_notifications(
         }
     )
 
+@app.get("/notifications/stream/stats")
+async def stream_stats(
+    user_id: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+):
+    """Estado de los SSE streams de este worker: memoria y lag por stream (los más atrasados primero)"""
+    stats = sse_registry.stats(limit=limit, user_id=user_id)
+    stats["replay"] = sse_replay.stats()
+    stats["digests"] = digest_publisher.stats()
+    stats["outbox"] = outbox_relay.stats()
+    stats["consumer"] = notification_consumer.stats()
+    return stats
+
+@app.get("/notifications/retention/stats")
+async def retention_stats():
+    """Configuración de retención y lo que archivó este worker"""
+    return notification_archiver.stats()
+
 @app.get("/notifications", response_model=List[NotificationOut])
 async def get_notifications(
     user_id: ObjectId = Depends(get_current_user_id),
     limit: int = Query(50, ge=1, le=100),
     skip: int = Query(0, ge=0),
+    after: Optional[str] = Query(None, description="X-Next-Cursor de la página anterior"),
+    include_archived: bool = Query(False, description="incluir el historial archivado (NOTIFICATION_ARCHIVE=collection)"),
 ):
-    """Obtiene el historial de notificaciones del usuario"""
-    cursor = db.notifications.find(
-        {"user_id": user_id}
-    ).sort("created_at", -1).skip(skip).limit(limit)
-    notifications = [serialize_notification(n) async for n in cursor]
-    return notifications
+    """Obtiene el historial de notificaciones del usuario (más nuevas primero)"""
+    reject_skip_with_cursor(skip, after)
+    query: dict[str, Any] = {"user_id": user_id}
+    if after:
+        created_at, last_id = decode_cursor(after, "notif")
+        query = {"$and": [query, keyset_after("created_at", -1, created_at, last_id)]}
+    sort = [("created_at", -1), ("_id", -1)]
+    if include_archived and NOTIFICATION_ARCHIVE == "collection":
+        # Las dos colecciones se intercalan en el tiempo (el tope por usuario archiva no leídas
+        # viejas, la retención sólo leídas): se trae la misma página de cada una y se mezcla.
+        # Una notificación en pleno movimiento puede estar en ambas, de ahí el dict por _id
+        merged: dict[ObjectId, dict[str, Any]] = {}
+        for collection in (db.notifications, db.notifications_archive):
+            async for n in collection.find(query).sort(sort).limit(skip + limit):
+                merged.setdefault(n["_id"], n)
+        docs = sorted(merged.values(), key=lambda n: (n["created_at"], n["_id"]), reverse=True)[skip:skip + limit]
+    else:
+        cursor = db.notifications.find(query).sort(sort).skip(skip).limit(limit)
+        docs = [n async for n in cursor]
+    next_cursor = encode_cursor("notif", docs[-1]["created_at"], docs[-1]["_id"]) if len(docs) == limit else None
+    return json_response([notification_json(n) for n in docs], next_cursor)
+
+NOTIFICATIONS_MARK_READ_MAX = 500  # ids por PATCH /notifications/read
+
+@app.get("/notifications/unread_count", response_model=UnreadCountOut)
+async def get_unread_count(user_id: ObjectId = Depends(get_current_user_id)):
+    """Cantidad de notificaciones sin leer (una lectura por _id, sin tocar el historial)"""
+    return {"unread": await unread_count(user_id)}
+
+@app.patch("/notifications/read", response_model=UnreadCountOut)
+async def mark_notifications_read(
+    notification_ids: List[str] = Body(..., max_length=NOTIFICATIONS_MARK_READ_MAX),
+    user_id: ObjectId = Depends(get_current_user_id),
+):
+    """Marca como leídas varias notificaciones del usuario con un solo update_many"""
+    oids = list(dict.fromkeys(ensure_oid(nid) for nid in notification_ids))
+    result = await db.notifications.update_many(
+        {"_id": {"$in": oids}, "user_id": user_id, "read": False},
+        {"$set": {"read": True}}
+    )
+    await bump_unread({user_id: -result.modified_count})
+    return {"unread": await unread_count(user_id)}
 
 @app.patch("/notifications/{notification_id}/read")
 async def mark_notification_read(
@@ -579,13 +3459,15 @@ async def mark_notification_read(
 ):
     """Marca una notificación como leída"""
     _id = ensure_oid(notification_id)
-    notification = await db.notifications.find_one({"_id": _id, "user_id": user_id})
-    if not notification:
-        raise HTTPException(status_code=404, detail="Notificación no encontrada")
-    await db.notifications.update_one(
-        {"_id": _id},
+    # El filtro por read=False hace que sólo la primera lectura descuente del contador
+    result = await db.notifications.update_one(
+        {"_id": _id, "user_id": user_id, "read": False},
         {"$set": {"read": True}}
     )
+    if result.modified_count:
+        await bump_unread({user_id: -1})
+    elif not await db.notifications.find_one({"_id": _id, "user_id": user_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Notificación no encontrada")
     return {"ok": True}
 
 @app.patch("/notifications/read-all")
@@ -593,10 +3475,12 @@ async def mark_all_notifications_read(
     user_id: ObjectId = Depends(get_current_user_id),
 ):
     """Marca todas las notificaciones del usuario como leídas"""
-    await db.notifications.update_many(
+    result = await db.notifications.update_many(
         {"user_id": user_id, "read": False},
         {"$set": {"read": True}}
     )
+    # Se descuenta lo que efectivamente cambió: una notificación que llega en el medio sigue contando
+    await bump_unread({user_id: -result.modified_count})
     return {"ok": True}
 
 # -------------
@@ -604,14 +3488,10 @@ async def mark_all_notifications_read(
 # -------------
 @app.post("/users/login", response_model=UserOut)
 async def login_user(body: UserCreate):
-    print(f"🔍 login_user llamado con name: '{body.name}'")
-    print(f"🔍 Buscando usuario en MongoDB...")
     user = await db.users.find_one({"name": body.name})
-    print(f"🔍 Resultado de búsqueda: {user is not None}")
     if not user:
-        print(f"🔍 Usuario '{body.name}' no encontrado en la base de datos")
+        log_users.info("login de usuario inexistente", extra={"name": body.name})
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
-    print(f"🔍 Usuario encontrado: {user.get('name', 'N/A')}")
     return serialize_user(user)
 
 @app.post("/users/register", response_model=UserOut)
@@ -652,13 +3532,15 @@ async def users_me_patch(
     updates["updated_at"] = now()
     await db.users.update_one({"_id": user_id}, {"$set": updates})
     user = await db.users.find_one({"_id": user_id})
+    if user:
+        user_cache.put(user)
     return serialize_user(user)
 
 @app.get("/users/{user_id}", response_model=UserOut)
 async def get_user(user_id: str):
     """Obtiene información de un usuario por su ID"""
     _id = ensure_oid(user_id)
-    user = await db.users.find_one({"_id": _id})
+    user = await user_cache.get(_id)
     if not user:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
     return serialize_user(user)
@@ -667,83 +3549,172 @@ async def get_user(user_id: str):
 async def get_users_batch(user_ids: List[str] = Body(...)):
     """Obtiene información de múltiples usuarios por sus IDs"""
     oids = [ensure_oid(uid) for uid in user_ids]
-    cursor = db.users.find({"_id": {"$in": oids}})
-    users = [serialize_user(u) async for u in cursor]
-    return users
+    profiles = await user_cache.get_many(oids)
+    return json_response([user_json(profiles[str(oid)]) for oid in dict.fromkeys(oids) if str(oid) in profiles])
 
 # -------------
 # Events (CRUD)
 # -------------
 @app.post("/events", response_model=EventOut)
-async def create_event(body: EventCreate, user_id: ObjectId = Depends(get_current_user_id)):
+async def create_event(body: EventCreate, user_id: ObjectId = Depends(get_current_user_id), compact: bool = Depends(compact_view)):
     if body.category not in CATEGORIES:
         raise HTTPException(status_code=400, detail="Categoría inválida")
     doc = {
         "title": body.title,
         "description": body.description,
-        "fecha_inicio": body.fecha_inicio,
-        "fecha_fin": body.fecha_fin,
+        "fecha_inicio": naive_utc(body.fecha_inicio),  # como lo devolvería MongoDB
+        "fecha_fin": naive_utc(body.fecha_fin),
         "activo": 1,  # activo
         "finalizado": False,  # no finalizado al crear
         "organizer_id": user_id,
-        "confirmed_participants": [],
-        "pending_approval_participants": [],
-        "blacklisted_participants": [],
+        **roster.new_event_fields(),
         "location": geojson_point(body.location),
         "location_alias": body.location_alias,
         "category": body.category,
         "created_at": now(),
         "updated_at": now(),
     }
-    res = await db.events.insert_one(doc)
-    ev = await db.events.find_one({"_id": res.inserted_id})
-    organizer = await db.users.find_one({"_id": user_id})
-    return serialize_event(ev, organizer)
+    res = await db.events.insert_one(doc)  # completa doc["_id"]
+    lifecycle_scheduler.schedule(str(res.inserted_id), doc["fecha_inicio"], doc["fecha_fin"])
+    geo_index.sync(doc)
+    await discover_cache.invalidate_event(doc)
+    organizer = await user_cache.get(user_id)
+    return serialize_event(doc, organizer, compact, "organizer" if compact else None)
+
+# /events/my es una sola agregación: un $match por (organizer_id, activo) que usa el índice
+# compuesto y un $facet con un sub-pipeline por bucket (filtro + keyset + sort + limit).
+# El resultado del $facet es un único documento (máx. 16MB), por eso cada bucket está acotado.
+MY_EVENTS_BUCKET_LIMIT = int(os.getenv("MY_EVENTS_BUCKET_LIMIT", "50"))
+
+def my_events_buckets(now_dt: datetime) -> dict[str, tuple[dict[str, Any], str, int]]:
+    """bucket -> (filtro, campo de orden, dirección); el desempate es siempre por _id"""
+    return {
+        # activos (activo=1), no marcados como finalizados, y fecha_fin >= ahora
+        "activos_no_finalizados": ({
+            "activo": 1,
+            "finalizado": {"$ne": True},  # no finalizados
+            "fecha_fin": {"$gte": now_dt}
+        }, "fecha_inicio", 1),
+        # activos (activo=1) y (marcados como finalizados O fecha_fin < ahora), más recientes primero
+        "activos_finalizados": ({
+            "activo": 1,
+            "$or": [
+                {"finalizado": True},  # marcados como finalizados
+                {"fecha_fin": {"$lt": now_dt}}  # o fecha ya pasó
+            ]
+        }, "fecha_fin", -1),
+        # eliminados (activo=0), más recientes primero
+        "eliminados": ({
+            "activo": 0
+        }, "updated_at", -1),
+    }
 
 @app.get("/events/my", response_model=MyEventsOut)
-async def get_my_events(user_id: ObjectId = Depends(get_current_user_id)):
+async def get_my_events(
+    user_id: ObjectId = Depends(get_current_user_id),
+    limit: int = Query(MY_EVENTS_BUCKET_LIMIT, ge=1, le=200, description="máximo por bucket"),
+    after: Optional[str] = Query(None, description="next_cursor de la página anterior"),
+    compact: bool = Depends(compact_view),
+):
     """Obtiene los eventos del usuario organizados por estado:
     - activos_no_finalizados: activos (activo=1) y no comenzados/en transcurso (fecha_fin >= ahora)
     - activos_finalizados: activos (activo=1) y finalizados (fecha_fin < ahora)
     - eliminados: eliminados (activo=0)
+    Cada bucket se pagina por separado; next_cursor guarda la posición de los tres.
     """
     now_dt = now()
+    # bucket -> None (desde el principio), [valor, _id] (posterior a) o "done" (agotado)
+    positions: dict[str, Any] = decode_cursor(after, "my")[0] if after else {}
     
-    # Eventos activos no finalizados (activo=1, no marcados como finalizados, y fecha_fin >= ahora)
-    cursor_activos_no_fin = db.events.find({
-        "organizer_id": user_id,
-        "activo": 1,
-        "finalizado": {"$ne": True},  # no finalizados
-        "fecha_fin": {"$gte": now_dt}
-    }).sort("fecha_inicio", 1)
-    activos_no_finalizados = [d async for d in cursor_activos_no_fin]
-    
-    # Eventos activos finalizados (activo=1 y (marcados como finalizados O fecha_fin < ahora))
-    cursor_activos_fin = db.events.find({
-        "organizer_id": user_id,
-        "activo": 1,
-        "$or": [
-            {"finalizado": True},  # marcados como finalizados
-            {"fecha_fin": {"$lt": now_dt}}  # o fecha ya pasó
+    buckets = my_events_buckets(now_dt)
+    facets: dict[str, list[dict[str, Any]]] = {}
+    for name, (query, field, direction) in buckets.items():
+        position = positions.get(name)
+        if position == "done":
+            continue
+        if position is not None:
+            query = {"$and": [query, keyset_after(field, direction, position[0], position[1])]}
+        facets[name] = [
+            {"$match": query},
+            {"$sort": {field: direction, "_id": direction}},
+            {"$limit": limit},
         ]
-    }).sort("fecha_fin", -1)  # más recientes primero
-    activos_finalizados = [d async for d in cursor_activos_fin]
     
-    # Eventos eliminados (activo=0)
-    cursor_eliminados = db.events.find({
-        "organizer_id": user_id,
-        "activo": 0
-    }).sort("updated_at", -1)  # más recientes primero
-    eliminados = [d async for d in cursor_eliminados]
+    result: dict[str, list[dict[str, Any]]] = {}
+    if facets:
+        cursor = db.events.aggregate([
+            {"$match": {"organizer_id": user_id, "activo": {"$in": [0, 1]}}},
+            {"$project": EVENT_OUT_PROJECTION},
+            {"$facet": facets},
+        ])
+        # sin documento de $facet los tres buckets quedan vacíos (setdefault abajo)
+        found = await cursor.to_list(length=1)
+        result = found[0] if found else {}
+    
+    next_positions: dict[str, Any] = {}
+    for name, (_, field, _) in buckets.items():
+        docs = result.setdefault(name, [])
+        next_positions[name] = [docs[-1][field], docs[-1]["_id"]] if len(docs) == limit else "done"
+    
+    next_cursor = None
+    if any(p != "done" for p in next_positions.values()):
+        next_cursor = encode_cursor("my", next_positions)
     
     # Obtener información del organizador (el usuario mismo)
-    organizer = await db.users.find_one({"_id": user_id})
+    organizer = await user_cache.get(user_id)
     
-    return {
-        "activos_no_finalizados": [serialize_event(d, organizer) for d in activos_no_finalizados],
-        "activos_finalizados": [serialize_event(d, organizer) for d in activos_finalizados],
-        "eliminados": [serialize_event(d, organizer) for d in eliminados]
-    }
+    return json_response({
+        **{name: [event_json(d, organizer, compact, "organizer" if compact else None) for d in result[name]] for name in buckets},
+        "next_cursor": next_cursor,
+    }, next_cursor)
+
+# -------------
+# Búsqueda de texto
+# -------------
+# GET /events/search (o GET /events?search=text) resuelve q con el índice text "events_text"
+# (title, description, location_alias, category). GET /events?q= sigue siendo un substring en
+# title por default: Discover busca mientras se tipea y $text sólo matchea palabras completas.
+# Sin lat/lng se ordena por relevancia (textScore). Con lat/lng, $geoNear no se puede combinar
+# con $text, así que se traen los SEARCH_GEO_CANDIDATES más relevantes (ya filtrados por radio
+# con $geoWithin si llega max_km) y se rankean en memoria mezclando relevancia y distancia:
+#   rank = score / (1 + distancia_km / SEARCH_DISTANCE_SCALE_KM)
+EVENT_TEXT_WEIGHTS = {"title": 10, "location_alias": 4, "category": 3, "description": 1}
+SEARCH_GEO_CANDIDATES = int(os.getenv("SEARCH_GEO_CANDIDATES", "500"))
+SEARCH_DISTANCE_SCALE_KM = float(os.getenv("SEARCH_DISTANCE_SCALE_KM", "5"))
+
+async def search_events(
+    match: dict[str, Any],
+    q: str,
+    lat: Optional[float],
+    lng: Optional[float],
+    max_km: Optional[float],
+    skip: int,
+    limit: int,
+) -> list[dict[str, Any]]:
+    """Documentos de la página pedida, ordenados por relevancia (y cercanía si hay lat/lng)"""
+    text_match = {**match, "$text": {"$search": q}}
+    score = {"score": {"$meta": "textScore"}}
+    if lat is None or lng is None:
+        cursor = db.events.find(text_match, score).sort(
+            [("score", {"$meta": "textScore"}), ("fecha_inicio", 1)]
+        ).skip(skip).limit(limit)
+        return [d async for d in cursor]
+
+    if max_km:
+        text_match["location"] = {
+            "$geoWithin": {"$centerSphere": [[lng, lat], max_km * 1000.0 / EARTH_RADIUS_M]}
+        }
+    cursor = db.events.find(text_match, score).sort(
+        [("score", {"$meta": "textScore"})]
+    ).limit(SEARCH_GEO_CANDIDATES)
+    ranked = []
+    async for d in cursor:
+        ev_lng, ev_lat = d["location"]["coordinates"]
+        d["distance_meters"] = haversine_m(lat, lng, ev_lat, ev_lng)
+        rank = d["score"] / (1.0 + d["distance_meters"] / (SEARCH_DISTANCE_SCALE_KM * 1000.0))
+        ranked.append((rank, d))
+    ranked.sort(key=lambda item: item[0], reverse=True)
+    return [d for _, d in ranked[skip:skip + limit]]
 
 @app.get("/events", response_model=List[EventOut])
 async def list_events(
@@ -755,9 +3726,91 @@ async def list_events(
     lng: Optional[float] = Query(None, ge=-180, le=180),
     max_km: Optional[float] = Query(None, gt=0),
     q: Optional[str] = None,
+    search: Literal["text", "regex"] = Query("regex", description="regex: substring en title (lo que usa Discover mientras se tipea); text: índice de texto con ranking, como /events/search"),
+    limit: int = Query(20, ge=1, le=100),
+    skip: int = Query(0, ge=0),
+    after: Optional[str] = Query(None, description="X-Next-Cursor de la página anterior"),
+    compact: bool = Depends(compact_view),
+    viewer: Optional[ObjectId] = Depends(get_optional_user_id),
+):
+    reject_skip_with_cursor(skip, after)
+    geo = lat is not None and lng is not None
+    if not discover_cache.enabled or not geo or (q and search == "text") or geo_index.can_serve(status, q):
+        out, next_cursor = await query_events(status, category, from_date, to_date, lat, lng, max_km, q, search, limit, skip, after, compact)
+    else:
+        min_distance, seen_ids = decode_cursor(after, "geo") if after else (None, [])
+        tile = discover_cache.tile(lat, lng)
+        center, reach_m = discover_cache.tile_area(tile)
+        match = events_match(status, category, from_date, to_date, q)
+
+        async def compute():
+            return await tile_candidates(match, center, reach_m)
+
+        entry = await discover_cache.get((tile, status, category, from_date, to_date, q), center, category, compute)
+        docs = entry.page(lat, lng, max_km, min_distance, seen_ids, skip, limit)
+        if docs is None:
+            discover_cache.fallbacks += 1
+            out, next_cursor = await query_events(status, category, from_date, to_date, lat, lng, max_km, q, search, limit, skip, after, compact)
+        else:
+            out, next_cursor = await geo_events_out(docs, limit, min_distance, seen_ids, compact)
+    if compact and viewer:
+        out = await with_my_status(out, viewer)
+    return json_response(out, next_cursor)
+
+async def tile_candidates(match: dict[str, Any], center: Origin, reach_m: float) -> tuple[list[dict[str, Any]], float]:
+    """Eventos a menos de reach_m del centro de un tile (hasta DISCOVER_TILE_CANDIDATES): (docs, alcance real)"""
+    cursor = db.events.aggregate([
+        {
+            "$geoNear": {
+                "near": {"type": "Point", "coordinates": [center[1], center[0]]},
+                "distanceField": "distance_meters",
+                "spherical": True,
+                "query": match,
+                "maxDistance": reach_m,
+            }
+        },
+        {"$limit": DISCOVER_TILE_CANDIDATES + 1},
+        {"$project": {**EVENT_OUT_PROJECTION, "distance_meters": 1}},
+    ])
+    docs = [d async for d in cursor]
+    if len(docs) > DISCOVER_TILE_CANDIDATES:
+        # tile muy denso: sólo está completo lo más cercano que el primer evento que quedó afuera
+        reach_m = docs[-1]["distance_meters"]
+        docs = [d for d in docs if d["distance_meters"] < reach_m]
+    return docs, reach_m
+
+@app.get("/events/search", response_model=List[EventOut])
+async def text_search_events(
+    q: str = Query(..., min_length=1),
+    status: int = Query(1, ge=0, le=2, alias="activo"),
+    category: Optional[str] = None,
+    from_date: Optional[datetime] = None,
+    to_date: Optional[datetime] = None,
+    lat: Optional[float] = Query(None, ge=-90, le=90),
+    lng: Optional[float] = Query(None, ge=-180, le=180),
+    max_km: Optional[float] = Query(None, gt=0),
     limit: int = Query(20, ge=1, le=100),
     skip: int = Query(0, ge=0),
+    after: Optional[str] = Query(None, description="X-Next-Cursor de la página anterior"),
+    compact: bool = Depends(compact_view),
+    viewer: Optional[ObjectId] = Depends(get_optional_user_id),
 ):
+    """Búsqueda por palabras completas con el índice de texto (title, description, location_alias,
+    category; stemming en español, sin tildes), por relevancia y, con lat/lng, cercanía"""
+    reject_skip_with_cursor(skip, after)
+    out, next_cursor = await query_events(status, category, from_date, to_date, lat, lng, max_km, q, "text", limit, skip, after, compact)
+    if compact and viewer:
+        out = await with_my_status(out, viewer)
+    return json_response(out, next_cursor)
+
+def events_match(
+    status: int,
+    category: Optional[str],
+    from_date: Optional[datetime],
+    to_date: Optional[datetime],
+    q: Optional[str] = None,
+) -> dict[str, Any]:
+    """Filtro de GET /events (q como substring del título; la búsqueda de texto va aparte)"""
     match: dict[str, Any] = {"activo": status}
     # Excluir eventos finalizados en la búsqueda de descubrir
     match["finalizado"] = {"$ne": True}  # no finalizados
@@ -772,138 +3825,175 @@ async def list_events(
             match["fecha_inicio"]["$lte"] = to_date
         if not match["fecha_inicio"]:
             match.pop("fecha_inicio")
+    if q:
+        match["title"] = {"$regex": q, "$options": "i"}
+    return match
+
+async def geo_events_out(
+    docs: list[dict[str, Any]],
+    limit: int,
+    min_distance: Optional[float],
+    seen_ids: List[ObjectId],
+    compact: bool,
+) -> tuple[list[dict[str, Any]], Optional[str]]:
+    """Página por cercanía (docs con distance_meters, en orden) como EventOut en JSON + cursor siguiente"""
+    next_cursor = None
+    if len(docs) == limit:
+        last_distance = docs[-1]["distance_meters"]
+        tied = [d["_id"] for d in docs if d["distance_meters"] == last_distance]
+        if min_distance is not None and last_distance == min_distance:
+            tied = seen_ids + tied  # página completa de empates: acumular
+        next_cursor = encode_cursor("geo", last_distance, tied)
+    # Obtener organizadores únicos
+    organizers_map = await user_cache.get_many([d["organizer_id"] for d in docs])
+    return [event_json(d, organizers_map.get(str(d["organizer_id"])), compact) for d in docs], next_cursor
+
+async def query_events(
+    status: int,
+    category: Optional[str],
+    from_date: Optional[datetime],
+    to_date: Optional[datetime],
+    lat: Optional[float],
+    lng: Optional[float],
+    max_km: Optional[float],
+    q: Optional[str],
+    search: str,
+    limit: int,
+    skip: int,
+    after: Optional[str],
+    compact: bool = False,
+) -> tuple[list[dict[str, Any]], Optional[str]]:
+    """Resuelve GET /events contra el índice geo o MongoDB; devuelve (eventos como EventOut en JSON, cursor siguiente)"""
+    geo = lat is not None and lng is not None
+
+    if q and search == "text":
+        # El orden por relevancia no admite keyset: el cursor guarda el offset
+        offset = decode_cursor(after, "text")[0] if after else skip
+        docs = await search_events(events_match(status, category, from_date, to_date), q, lat, lng, max_km, offset, limit)
+        next_cursor = encode_cursor("text", offset + limit) if len(docs) == limit else None
+        organizers_map = await user_cache.get_many([d["organizer_id"] for d in docs])
+        return [event_json(d, organizers_map.get(str(d["organizer_id"])), compact) for d in docs], next_cursor
+
+    match = events_match(status, category, from_date, to_date, q)
 
     # Búsqueda por cercanía (y distancia en respuesta) si llega lat/lng
-    pipeline: list[dict[str, Any]] = []
-    if lat is not None and lng is not None:
-        near_stage: dict[str, Any] = {
-            "$geoNear": {
-                "near": {"type": "Point", "coordinates": [lng, lat]},
-                "distanceField": "distance_meters",
-                "spherical": True,
-                "query": match
+    if geo:
+        # Cursor (distancia, _ids ya enviados a esa distancia): los resultados vienen en orden de
+        # distancia, así que alcanza con arrancar en esa distancia y excluir los empates ya vistos
+        min_distance, seen_ids = decode_cursor(after, "geo") if after else (None, [])
+        if geo_index.can_serve(status, q):
+            docs = geo_index.nearest(lat, lng, category, from_date, to_date, max_km, min_distance, seen_ids, skip, limit)
+        else:
+            query = {**match, "_id": {"$nin": seen_ids}} if seen_ids else match
+            near_stage: dict[str, Any] = {
+                "$geoNear": {
+                    "near": {"type": "Point", "coordinates": [lng, lat]},
+                    "distanceField": "distance_meters",
+                    "spherical": True,
+                    # los filtros (incluido el regex) van dentro de $geoNear para que skip/limit paginen sobre lo filtrado
+                    "query": query
+                }
             }
-        }
-        if max_km:
-            near_stage["$geoNear"]["maxDistance"] = max_km * 1000.0
-        pipeline.append(near_stage)
-        if q:
-            pipeline.append({"$match": {"title": {"$regex": q, "$options": "i"}}})
-        pipeline += [
-            {"$skip": skip},
-            {"$limit": limit},
-        ]
-        cursor = db.events.aggregate(pipeline)
-        docs = [d async for d in cursor]
-        # Obtener organizadores únicos
-        organizer_ids = list(set([d["organizer_id"] for d in docs]))
-        organizers_map = {}
-        if organizer_ids:
-            org_cursor = db.users.find({"_id": {"$in": organizer_ids}})
-            async for org in org_cursor:
-                organizers_map[str(org["_id"])] = org
-        # map distance_meters through serialization
-        out = []
-        for d in docs:
-            # pass through computed distance
-            d["distance_meters"] = float(d.get("distance_meters", 0.0))
-            organizer = organizers_map.get(str(d["organizer_id"]))
-            out.append(serialize_event(d, organizer))
-        return out
+            if max_km:
+                near_stage["$geoNear"]["maxDistance"] = max_km * 1000.0
+            if min_distance is not None:
+                near_stage["$geoNear"]["minDistance"] = min_distance
+            pipeline: list[dict[str, Any]] = [
+                near_stage,
+                {"$skip": skip},
+                {"$limit": limit},
+            ]
+            cursor = db.events.aggregate(pipeline)
+            docs = [d async for d in cursor]
+        return await geo_events_out(docs, limit, min_distance, seen_ids, compact)
 
-    # Si no hay lat/lng: .find simple con filtros y sort por fecha
+    # Si no hay lat/lng: .find simple con filtros y sort por fecha (desempate por _id)
     query = match
-    if q:
-        query = {**match, "title": {"$regex": q, "$options": "i"}}
-    cursor = db.events.find(query).sort("fecha_inicio", 1).skip(skip).limit(limit)
+    if after:
+        fecha_inicio, last_id = decode_cursor(after, "fecha")
+        query = {"$and": [match, keyset_after("fecha_inicio", 1, fecha_inicio, last_id)]}
+    cursor = db.events.find(query).sort([("fecha_inicio", 1), ("_id", 1)]).skip(skip).limit(limit)
     docs = [d async for d in cursor]
+    next_cursor = encode_cursor("fecha", docs[-1]["fecha_inicio"], docs[-1]["_id"]) if len(docs) == limit else None
     # Obtener organizadores únicos
-    organizer_ids = list(set([d["organizer_id"] for d in docs]))
-    organizers_map = {}
-    if organizer_ids:
-        org_cursor = db.users.find({"_id": {"$in": organizer_ids}})
-        async for org in org_cursor:
-            organizers_map[str(org["_id"])] = org
-    return [serialize_event(d, organizers_map.get(str(d["organizer_id"]))) for d in docs]
+    organizers_map = await user_cache.get_many([d["organizer_id"] for d in docs])
+    return [event_json(d, organizers_map.get(str(d["organizer_id"])), compact) for d in docs], next_cursor
 
 @app.get("/events/{event_id}", response_model=EventOut)
-async def get_event(event_id: str):
+async def get_event(event_id: str, compact: bool = Depends(compact_view), viewer: Optional[ObjectId] = Depends(get_optional_user_id)):
     _id = ensure_oid(event_id)
     ev = await db.events.find_one({"_id": _id})
     if not ev:
         raise HTTPException(status_code=404, detail="Evento no encontrado")
-    organizer = await db.users.find_one({"_id": ev["organizer_id"]})
-    return serialize_event(ev, organizer)
+    organizer = await user_cache.get(ev["organizer_id"])
+    return await event_out(ev, organizer, compact, viewer)
 
 @app.patch("/events/{event_id}/cancel", response_model=EventOut)
-async def cancel_event(event_id: str, user_id: ObjectId = Depends(get_current_user_id)):
+async def cancel_event(event_id: str, background_tasks: BackgroundTasks, user_id: ObjectId = Depends(get_current_user_id), compact: bool = Depends(compact_view)):
     _id = ensure_oid(event_id)
-    ev = await db.events.find_one({"_id": _id})
-    if not ev:
-        raise HTTPException(status_code=404, detail="Evento no encontrado")
-    if ev["organizer_id"] != user_id:
-        raise HTTPException(status_code=403, detail="Sólo el organizador puede cancelar")
-    await db.events.update_one({"_id": _id}, {"$set": {"activo": 2, "updated_at": now()}})
-    ev = await db.events.find_one({"_id": _id})
-    organizer = await db.users.find_one({"_id": ev["organizer_id"]})
+    ev = await mutate_event(
+        _id,
+        {"organizer_id": user_id},
+        {"$set": {"activo": 2, "updated_at": now()}},
+        [organizer_check(user_id, "Sólo el organizador puede cancelar")],
+    )
+    lifecycle_scheduler.unschedule(str(_id))
+    organizer = await user_cache.get(ev["organizer_id"])
     
     # Notificar a participantes confirmados y pendientes
-    all_participants = list(ev.get("confirmed_participants", [])) + list(ev.get("pending_approval_participants", []))
-    for participant_id in all_participants:
-        await publish_notification(
-            user_id=str(participant_id),
-            notification_type="event_cancelled",
-            title="Evento cancelado",
-            message=f"El evento '{ev['title']}' ha sido cancelado",
-            event_id=str(_id),
-            event_title=ev["title"],
-        )
+    all_participants = await roster.user_ids(ev, "confirmed", "pending")
+    await publish_notifications_bulk(
+        background_tasks,
+        user_ids=all_participants,
+        notification_type="event_cancelled",
+        title="Evento cancelado",
+        message=f"El evento '{ev['title']}' ha sido cancelado",
+        event_id=str(_id),
+        event_title=ev["title"],
+    )
     
-    return serialize_event(ev, organizer)
+    return await event_out(ev, organizer, compact, user_id)
 
 @app.delete("/events/{event_id}", response_model=EventOut)
-async def delete_event(event_id: str, user_id: ObjectId = Depends(get_current_user_id)):
+async def delete_event(event_id: str, user_id: ObjectId = Depends(get_current_user_id), compact: bool = Depends(compact_view)):
     _id = ensure_oid(event_id)
-    ev = await db.events.find_one({"_id": _id})
-    if not ev:
-        raise HTTPException(status_code=404, detail="Evento no encontrado")
-    if ev["organizer_id"] != user_id:
-        raise HTTPException(status_code=403, detail="Sólo el organizador puede eliminar")
-    await db.events.update_one({"_id": _id}, {"$set": {"activo": 0, "updated_at": now()}})
-    ev = await db.events.find_one({"_id": _id})
-    organizer = await db.users.find_one({"_id": ev["organizer_id"]})
-    return serialize_event(ev, organizer)
+    ev = await mutate_event(
+        _id,
+        {"organizer_id": user_id},
+        {"$set": {"activo": 0, "updated_at": now()}},
+        [organizer_check(user_id, "Sólo el organizador puede eliminar")],
+    )
+    lifecycle_scheduler.unschedule(str(_id))
+    organizer = await user_cache.get(ev["organizer_id"])
+    return await event_out(ev, organizer, compact, user_id)
 
 # -------------
 # Postulación y moderación
 # -------------
-@app.post("/events/{event_id}/apply", response_model=EventOut)
-async def apply_to_event(event_id: str, user_id: ObjectId = Depends(get_current_user_id)):
+@app.get("/events/{event_id}/participants", response_model=List[ParticipantOut])
+async def list_participants(
+    event_id: str,
+    status: ParticipantStatus = Query("confirmed"),
+    limit: int = Query(50, ge=1, le=200),
+    after: Optional[str] = Query(None, description="X-Next-Cursor de la página anterior"),
+):
+    """Lista paginada de participantes de un evento por estado, con nombre y rating"""
     _id = ensure_oid(event_id)
-    ev = await db.events.find_one({"_id": _id})
-    if not ev:
-        raise HTTPException(status_code=404, detail="Evento no encontrado")
-    if ev["activo"] != 1:
-        raise HTTPException(status_code=400, detail="Evento no activo")
-    if user_id == ev["organizer_id"]:
-        raise HTTPException(status_code=400, detail="El organizador no necesita postularse")
-    if user_id in ev.get("blacklisted_participants", []):
-        raise HTTPException(status_code=403, detail="Usuario bloqueado para este evento")
-
-    # quitar de confirmados por si acaso y agregar a pending (idempotente)
-    await db.events.update_one(
-        {"_id": _id},
-        {
-            "$pull": {"confirmed_participants": user_id},
-            "$addToSet": {"pending_approval_participants": user_id},
-            "$set": {"updated_at": now()},
-        },
+    members, next_cursor = await roster.page(_id, status, after, limit)
+    profiles = await user_cache.get_many([user_id for user_id, _ in members])
+    return json_response(
+        [participant_json(user_id, status, joined_at, profiles.get(str(user_id))) for user_id, joined_at in members],
+        next_cursor,
     )
-    ev = await db.events.find_one({"_id": _id})
-    organizer = await db.users.find_one({"_id": ev["organizer_id"]})
+
+@app.post("/events/{event_id}/apply", response_model=EventOut)
+async def apply_to_event(event_id: str, user_id: ObjectId = Depends(get_current_user_id), compact: bool = Depends(compact_view)):
+    _id = ensure_oid(event_id)
+    ev = await roster.apply(_id, user_id)
+    organizer = await user_cache.get(ev["organizer_id"])
     
     # Notificar al organizador
-    applicant = await db.users.find_one({"_id": user_id})
+    applicant = await user_cache.get(user_id)
     applicant_name = applicant.get("name", "Un usuario") if applicant else "Un usuario"
     await publish_notification(
         user_id=str(ev["organizer_id"]),
@@ -914,28 +4004,14 @@ async def apply_to_event(event_id: str, user_id: ObjectId = Depends(get_current_
         event_title=ev["title"],
     )
     
-    return serialize_event(ev, organizer)
+    return await event_out(ev, organizer, compact, user_id)
 
 @app.post("/events/{event_id}/accept", response_model=EventOut)
-async def accept_user(event_id: str, body: AcceptRejectBody, user_id: ObjectId = Depends(get_current_user_id)):
+async def accept_user(event_id: str, body: AcceptRejectBody, user_id: ObjectId = Depends(get_current_user_id), compact: bool = Depends(compact_view)):
     _id = ensure_oid(event_id)
     target = ensure_oid(body.user_id)
-    ev = await db.events.find_one({"_id": _id})
-    if not ev:
-        raise HTTPException(status_code=404, detail="Evento no encontrado")
-    if ev["organizer_id"] != user_id:
-        raise HTTPException(status_code=403, detail="Sólo el organizador puede aceptar")
-    # mover de pending -> confirmed
-    await db.events.update_one(
-        {"_id": _id},
-        {
-            "$pull": {"pending_approval_participants": target},
-            "$addToSet": {"confirmed_participants": target},
-            "$set": {"updated_at": now()},
-        },
-    )
-    ev = await db.events.find_one({"_id": _id})
-    organizer = await db.users.find_one({"_id": ev["organizer_id"]})
+    ev = await roster.accept(_id, user_id, target)
+    organizer = await user_cache.get(ev["organizer_id"])
     
     # Notificar al usuario aceptado
     await publish_notification(
@@ -947,29 +4023,14 @@ async def accept_user(event_id: str, body: AcceptRejectBody, user_id: ObjectId =
         event_title=ev["title"],
     )
     
-    return serialize_event(ev, organizer)
+    return await event_out(ev, organizer, compact, user_id)
 
 @app.post("/events/{event_id}/reject", response_model=EventOut)
-async def reject_user(event_id: str, body: AcceptRejectBody, user_id: ObjectId = Depends(get_current_user_id)):
+async def reject_user(event_id: str, body: AcceptRejectBody, user_id: ObjectId = Depends(get_current_user_id), compact: bool = Depends(compact_view)):
     _id = ensure_oid(event_id)
     target = ensure_oid(body.user_id)
-    ev = await db.events.find_one({"_id": _id})
-    if not ev:
-        raise HTTPException(status_code=404, detail="Evento no encontrado")
-    if ev["organizer_id"] != user_id:
-        raise HTTPException(status_code=403, detail="Sólo el organizador puede rechazar")
-    update = {
-        "$pull": {
-            "pending_approval_participants": target,
-            "confirmed_participants": target,
-        },
-        "$set": {"updated_at": now()},
-    }
-    if body.blacklist:
-        update["$addToSet"] = {"blacklisted_participants": target}
-    await db.events.update_one({"_id": _id}, update)
-    ev = await db.events.find_one({"_id": _id})
-    organizer = await db.users.find_one({"_id": ev["organizer_id"]})
+    ev = await roster.reject(_id, user_id, target, body.blacklist)
+    organizer = await user_cache.get(ev["organizer_id"])
     
     # Notificar al usuario rechazado
     message = f"Tu solicitud para unirte a '{ev['title']}' fue rechazada"
@@ -984,23 +4045,28 @@ async def reject_user(event_id: str, body: AcceptRejectBody, user_id: ObjectId =
         event_title=ev["title"],
     )
     
-    return serialize_event(ev, organizer)
+    return await event_out(ev, organizer, compact, user_id)
 
 # -------------
 # Finalización + métricas simples
 # -------------
 @app.post("/events/{event_id}/complete", response_model=EventOut)
-async def complete_event(event_id: str, user_id: ObjectId = Depends(get_current_user_id)):
+async def complete_event(event_id: str, background_tasks: BackgroundTasks, user_id: ObjectId = Depends(get_current_user_id), compact: bool = Depends(compact_view)):
     _id = ensure_oid(event_id)
-    ev = await db.events.find_one({"_id": _id})
-    if not ev:
-        raise HTTPException(status_code=404, detail="Evento no encontrado")
-    if ev["organizer_id"] != user_id:
-        raise HTTPException(status_code=403, detail="Sólo el organizador puede completar")
-    if ev.get("finalizado", False):
-        raise HTTPException(status_code=400, detail="El evento ya está finalizado")
+    # Marcar evento como finalizado primero: el filtro garantiza que los contadores
+    # se incrementen una sola vez aunque lleguen dos "complete" a la vez
+    ev = await mutate_event(
+        _id,
+        {"organizer_id": user_id, "finalizado": {"$ne": True}},
+        {"$set": {"finalizado": True, "updated_at": now()}},
+        [
+            organizer_check(user_id, "Sólo el organizador puede completar"),
+            (lambda cur: cur.get("finalizado", False), 400, "El evento ya está finalizado"),
+        ],
+    )
+    lifecycle_scheduler.unschedule(str(_id))
     # actualizar contadores
-    confirmed: list[ObjectId] = ev.get("confirmed_participants", [])
+    confirmed = await roster.user_ids(ev, "confirmed")
     if confirmed:
         await db.users.update_many(
             {"_id": {"$in": confirmed}},
@@ -1010,56 +4076,34 @@ async def complete_event(event_id: str, user_id: ObjectId = Depends(get_current_
         {"_id": ev["organizer_id"]},
         {"$inc": {"cant_events_organized": 1}}
     )
-    # Marcar evento como finalizado
-    await db.events.update_one(
-        {"_id": _id}, 
-        {"$set": {"finalizado": True, "updated_at": now()}}
-    )
-    ev = await db.events.find_one({"_id": _id})
-    organizer = await db.users.find_one({"_id": ev["organizer_id"]})
+    user_cache.invalidate(ev["organizer_id"], *confirmed)
+    organizer = await user_cache.get(ev["organizer_id"])
     
     # Notificar a participantes confirmados
-    for participant_id in confirmed:
-        await publish_notification(
-            user_id=str(participant_id),
-            notification_type="event_finished",
-            title="Evento finalizado",
-            message=f"El evento '{ev['title']}' ha finalizado",
-            event_id=str(_id),
-            event_title=ev["title"],
-        )
+    await publish_notifications_bulk(
+        background_tasks,
+        user_ids=confirmed,
+        notification_type="event_finished",
+        title="Evento finalizado",
+        message=f"El evento '{ev['title']}' ha finalizado",
+        event_id=str(_id),
+        event_title=ev["title"],
+    )
     
-    return serialize_event(ev, organizer)
+    return await event_out(ev, organizer, compact, user_id)
 
 @app.post("/events/{event_id}/no_show", response_model=EventOut)
 async def mark_no_show(
     event_id: str,
     body: AcceptRejectBody,
-    user_id: ObjectId = Depends(get_current_user_id)
+    user_id: ObjectId = Depends(get_current_user_id),
+    compact: bool = Depends(compact_view),
 ):
     _id = ensure_oid(event_id)
     target = ensure_oid(body.user_id)
-    ev = await db.events.find_one({"_id": _id})
-    if not ev:
-        raise HTTPException(status_code=404, detail="Evento no encontrado")
-    if ev["organizer_id"] != user_id:
-        raise HTTPException(status_code=403, detail="Sólo el organizador puede marcar no-show")
-    # incrementar métrica y opcionalmente bloquear
-    ops = [{"updateOne": {
-        "filter": {"_id": target},
-        "update": {"$inc": {"cant_no_shows": 1}}
-    }}]
-    if body.blacklist:
-        ops.append({"updateOne": {
-            "filter": {"_id": _id},
-            "update": {"$addToSet": {"blacklisted_participants": target}}
-        }})
-    # Ejecutar operaciones
-    await db.users.bulk_write(ops[:1])  # user inc
-    if len(ops) > 1:
-        await db.events.update_one({"_id": _id}, {"$addToSet": {"blacklisted_participants": target}})
-
-    await db.events.update_one({"_id": _id}, {"$set": {"updated_at": now()}})
-    ev = await db.events.find_one({"_id": _id})
-    organizer = await db.users.find_one({"_id": ev["organizer_id"]})
-    return serialize_event(ev, organizer)
+    ev = await roster.no_show(_id, user_id, target, body.blacklist)
+    # incrementar métrica
+    await db.users.update_one({"_id": target}, {"$inc": {"cant_no_shows": 1}})
+    user_cache.invalidate(target)
+    organizer = await user_cache.get(ev["organizer_id"])
+    return await event_out(ev, organizer, compact, user_id)
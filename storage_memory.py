@@ -0,0 +1,1002 @@
+# storage_memory.py
+# Storage engine en memoria para STORAGE_ENGINE=memory (ver main.py, sección "Storage engine").
+# Implementa la parte de la API de colecciones de Motor que usa main: filtros por
+# igualdad/rango/$in/$or/$exists/$regex, updates con $set/$inc/$addToSet/$pull/$push,
+# upserts, índices únicos y parciales, $geoNear, $facet, $slice y un $text simplificado, sobre
+# un dict por _id más índices hash y ordenados por el primer campo de cada índice. Acepta y
+# devuelve RawBSONDocument (los dumps en BSON de admin_data.py).
+# Sin persistencia, change streams (watch falla como en un mongod standalone), TTL ni command
+# monitoring. Un solo proceso: cada worker tendría su propia base.
+
+from __future__ import annotations
+
+import bisect
+import functools
+import heapq
+import math
+import re
+import unicodedata
+from datetime import datetime, timezone
+from typing import Any, Callable, Optional
+
+import bson
+from bson import ObjectId
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from pymongo.results import BulkWriteResult, DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+EARTH_RADIUS_M = 6378100.0  # el mismo radio que usa MongoDB para consultas esféricas
+
+def haversine_m(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Distancia en metros sobre la esfera"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+MISSING = object()  # campo ausente (distinto de null)
+
+def bson_datetime(value: datetime) -> datetime:
+    """Como lo guarda MongoDB: UTC naive con precisión de milisegundos"""
+    if value.tzinfo is None and value.microsecond % 1000 == 0:
+        return value  # ya normalizada (todo lo guardado)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.replace(microsecond=value.microsecond // 1000 * 1000)
+
+BSON_SCALAR_RANKS = {int: 2, float: 2, str: 3, bool: 8}
+
+def bson_order_key(value: Any) -> tuple:
+    """Clave de orden (y de hash) con el orden de tipos de BSON: null < números < string <
+    objeto < array < binData < ObjectId < bool < fecha. 1 y 1.0 son iguales; 1 y True no."""
+    rank = BSON_SCALAR_RANKS.get(type(value))
+    if rank is not None:  # camino rápido: escalares comunes
+        return (rank, value)
+    if value is None or value is MISSING:
+        return (1,)
+    if isinstance(value, bool):
+        return (8, value)
+    if isinstance(value, (int, float)):
+        return (2, value)
+    if isinstance(value, str):
+        return (3, value)
+    if isinstance(value, dict):
+        return (4, tuple((k, bson_order_key(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return (5, tuple(bson_order_key(v) for v in value))
+    if isinstance(value, bytes):
+        return (6, value)
+    if isinstance(value, ObjectId):
+        return (7, value.binary)
+    if isinstance(value, datetime):
+        return (9, bson_datetime(value))
+    return (10, repr(value))
+
+def bson_equal(a: Any, b: Any) -> bool:
+    return bson_order_key(a) == bson_order_key(b)
+
+def store_value(value: Any) -> Any:
+    """Copia para guardar: nada de lo que guarda el engine se comparte con quien llama"""
+    if isinstance(value, RawBSONDocument):
+        value = bson.decode(value.raw)  # BSON crudo (insert_many de un dump): se guarda decodificado
+    if isinstance(value, dict):
+        return {k: store_value(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [store_value(v) for v in value]
+    if isinstance(value, datetime):
+        return bson_datetime(value)
+    return value
+
+def clone_value(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {k: clone_value(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [clone_value(v) for v in value]
+    return value
+
+def doc_get(doc: Any, path: str) -> Any:
+    if "." not in path and isinstance(doc, dict):
+        return doc.get(path, MISSING)
+    for part in path.split("."):
+        if isinstance(doc, dict) and part in doc:
+            doc = doc[part]
+        elif isinstance(doc, list) and part.isdigit() and int(part) < len(doc):
+            doc = doc[int(part)]
+        else:
+            return MISSING
+    return doc
+
+def doc_set(doc: dict[str, Any], path: str, value: Any):
+    *parents, last = path.split(".")
+    for part in parents:
+        doc = doc.setdefault(part, {})
+        if not isinstance(doc, dict):
+            raise OperationFailure(f"Cannot create field '{last}' in element {{{part}: ...}}", code=28)
+    doc[last] = value
+
+def doc_unset(doc: dict[str, Any], path: str):
+    *parents, last = path.split(".")
+    for part in parents:
+        doc = doc.get(part)
+        if not isinstance(doc, dict):
+            return
+    doc.pop(last, None)
+
+def is_operator_dict(value: Any) -> bool:
+    return isinstance(value, dict) and bool(value) and next(iter(value)).startswith("$")
+
+def text_tokens(text: str) -> list[str]:
+    """Palabras en minúscula y sin tildes (como el índice text v3)"""
+    folded = unicodedata.normalize("NFKD", text.lower())
+    return re.findall(r"\w+", "".join(c for c in folded if not unicodedata.combining(c)))
+
+@functools.lru_cache(maxsize=256)
+def compile_regex(pattern: str, options: str) -> re.Pattern:
+    flags = (re.IGNORECASE if "i" in options else 0) | (re.MULTILINE if "m" in options else 0)
+    return re.compile(pattern, flags)
+
+def match_equal(value: Any, target: Any) -> bool:
+    if type(value) is type(target) and not isinstance(value, (list, dict, datetime)):
+        return value == target  # mismo tipo escalar: no hace falta la clave de BSON
+    if value is MISSING:
+        return target is None
+    if bson_equal(value, target):
+        return True
+    return isinstance(value, list) and any(bson_equal(v, target) for v in value)
+
+def match_compare(value: Any, op: str, target: Any) -> bool:
+    """$gt/$gte/$lt/$lte: sólo compara valores del mismo tipo (como MongoDB)"""
+    if value is MISSING:
+        return False
+    target_key = bson_order_key(target)
+    for v in (value if isinstance(value, list) else [value]):
+        key = bson_order_key(v)
+        if key[0] != target_key[0]:
+            continue
+        if (op == "$gt" and key > target_key) or (op == "$gte" and key >= target_key) \
+                or (op == "$lt" and key < target_key) or (op == "$lte" and key <= target_key):
+            return True
+    return False
+
+def match_condition(value: Any, cond: Any) -> bool:
+    """Condición de un campo: un valor (igualdad) o un dict de operadores"""
+    if not is_operator_dict(cond):
+        return match_equal(value, cond)
+    for op, arg in cond.items():
+        if op == "$eq":
+            ok = match_equal(value, arg)
+        elif op == "$ne":
+            ok = not match_equal(value, arg)
+        elif op == "$in":
+            ok = any(match_equal(value, a) for a in arg)
+        elif op == "$nin":
+            ok = not any(match_equal(value, a) for a in arg)
+        elif op in ("$gt", "$gte", "$lt", "$lte"):
+            ok = match_compare(value, op, arg)
+        elif op == "$exists":
+            ok = (value is not MISSING) == bool(arg)
+        elif op == "$regex":
+            regex = compile_regex(arg, cond.get("$options", ""))
+            ok = any(isinstance(v, str) and regex.search(v) for v in (value if isinstance(value, list) else [value]))
+        elif op == "$options":
+            ok = True
+        elif op == "$not":
+            ok = not match_condition(value, arg)
+        elif op == "$size":
+            ok = isinstance(value, list) and len(value) == arg
+        elif op == "$all":
+            ok = isinstance(value, list) and all(match_equal(value, a) for a in arg)
+        elif op == "$elemMatch":
+            ok = isinstance(value, list) and any(
+                match_condition(v, arg) if is_operator_dict(arg) else isinstance(v, dict) and match_filter(v, arg) for v in value
+            )
+        elif op == "$geoWithin" and "$centerSphere" in arg:
+            (center_lng, center_lat), radians = arg["$centerSphere"]
+            coords = value.get("coordinates") if isinstance(value, dict) else None
+            ok = bool(coords) and haversine_m(center_lat, center_lng, coords[1], coords[0]) <= radians * EARTH_RADIUS_M
+        else:
+            raise OperationFailure(f"unknown operator: {op}", code=2)
+        if not ok:
+            return False
+    return True
+
+def match_filter(doc: dict[str, Any], flt: dict[str, Any]) -> bool:
+    """$text no se evalúa acá: lo resuelve la colección antes (ver MemoryCollection.select)"""
+    for key, cond in flt.items():
+        if key == "$and":
+            ok = all(match_filter(doc, f) for f in cond)
+        elif key == "$or":
+            ok = any(match_filter(doc, f) for f in cond)
+        elif key == "$nor":
+            ok = not any(match_filter(doc, f) for f in cond)
+        elif key == "$text":
+            ok = True
+        elif key.startswith("$"):
+            raise OperationFailure(f"unknown top level operator: {key}", code=2)
+        else:
+            ok = match_condition(doc_get(doc, key), cond)
+        if not ok:
+            return False
+    return True
+
+def apply_update(doc: dict[str, Any], update: dict[str, Any], inserting: bool) -> dict[str, Any]:
+    """Devuelve una copia de doc con los operadores de update aplicados"""
+    if not is_operator_dict(update):
+        raise OperationFailure("update only works with $ operators", code=9)
+    new = clone_value(doc)
+    for op, fields in update.items():
+        for path, arg in fields.items():
+            if op == "$set" or (op == "$setOnInsert" and inserting):
+                doc_set(new, path, store_value(arg))
+            elif op == "$setOnInsert":
+                continue
+            elif op == "$unset":
+                doc_unset(new, path)
+            elif op == "$inc":
+                current = doc_get(new, path)
+                doc_set(new, path, arg if current is MISSING else current + arg)
+            elif op in ("$min", "$max"):
+                current = doc_get(new, path)
+                if current is MISSING or (bson_order_key(arg) < bson_order_key(current)) == (op == "$min"):
+                    doc_set(new, path, store_value(arg))
+            elif op in ("$addToSet", "$push", "$pull"):
+                array = doc_get(new, path)
+                if array is MISSING:
+                    if op == "$pull":
+                        continue
+                    array = []
+                    doc_set(new, path, array)
+                elif not isinstance(array, list):
+                    raise OperationFailure(f"Cannot apply {op} to non-array field '{path}'", code=2)
+                if op == "$pull":
+                    array[:] = [v for v in array if not (match_condition(v, arg) if is_operator_dict(arg) else bson_equal(v, arg))]
+                    continue
+                values = arg["$each"] if isinstance(arg, dict) and "$each" in arg else [arg]
+                for value in values:
+                    if op == "$push" or not any(bson_equal(value, v) for v in array):
+                        array.append(store_value(value))
+            else:
+                raise OperationFailure(f"Unknown modifier: {op}", code=9)
+    return new
+
+def upsert_seed(flt: dict[str, Any]) -> dict[str, Any]:
+    """Documento base de un upsert: los campos del filtro con igualdad"""
+    seed: dict[str, Any] = {}
+    for key, cond in flt.items():
+        if key == "$and":
+            for sub in cond:
+                for k, v in upsert_seed(sub).items():
+                    seed[k] = v
+        elif key.startswith("$"):
+            continue
+        elif not is_operator_dict(cond):
+            doc_set(seed, key, store_value(cond))
+        elif "$eq" in cond:
+            doc_set(seed, key, store_value(cond["$eq"]))
+    return seed
+
+def project_doc(doc: dict[str, Any], projection: Optional[dict[str, Any]], score: Optional[float] = None) -> dict[str, Any]:
+    """Copia de doc con la proyección de find (inclusión, exclusión y $meta: textScore)"""
+    if not projection:
+        return clone_value(doc)
+    metas = [k for k, v in projection.items() if isinstance(v, dict)]
+    included = [k for k, v in projection.items() if k != "_id" and not isinstance(v, dict) and v]
+    if included:
+        out: dict[str, Any] = {}
+        if projection.get("_id", 1) and "_id" in doc:
+            out["_id"] = doc["_id"]
+        for path in included:
+            value = doc_get(doc, path)
+            if value is not MISSING:
+                doc_set(out, path, clone_value(value))
+    else:
+        excluded = {k for k, v in projection.items() if not isinstance(v, dict) and not v}
+        out = {k: clone_value(v) for k, v in doc.items() if k not in excluded}
+    for key in metas:
+        if projection[key].get("$meta") == "textScore":
+            out[key] = score or 0.0
+    return out
+
+def sort_docs(items: list[tuple[Any, dict[str, Any]]], spec: list[tuple[str, Any]], scores: Optional[dict[Any, float]], need: Optional[int] = None) -> list[tuple[Any, dict[str, Any]]]:
+    """Ordena pares (clave, doc); con `need` y una sola dirección alcanza con un heap"""
+    def key_for(field: str, direction: Any) -> Callable[[tuple[Any, dict[str, Any]]], Any]:
+        if isinstance(direction, dict):  # {"$meta": "textScore"}
+            return lambda item: (scores or {}).get(item[0], 0.0)
+        return lambda item: bson_order_key(doc_get(item[1], field))
+
+    directions = {-1 if isinstance(d, dict) else d for _, d in spec}
+    if len(directions) == 1:
+        keys = [key_for(field, direction) for field, direction in spec]
+        combined = lambda item: tuple(k(item) for k in keys)  # noqa: E731
+        descending = directions.pop() == -1
+        if need is not None and need < len(items):
+            return (heapq.nlargest if descending else heapq.nsmallest)(need, items, key=combined)
+        return sorted(items, key=combined, reverse=descending)
+    items = list(items)
+    for field, direction in reversed(spec):  # sorts estables, de la última clave a la primera
+        items.sort(key=key_for(field, direction), reverse=isinstance(direction, dict) or direction == -1)
+    return items
+
+def sort_spec(key_or_list: Any, direction: Any = None) -> list[tuple[str, Any]]:
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction if direction is not None else 1)]
+    if isinstance(key_or_list, dict):
+        return list(key_or_list.items())
+    return list(key_or_list)
+
+def eval_expression(expr: Any, doc: dict[str, Any]) -> Any:
+    """Expresiones de agregación: "$campo", $in, $ifNull, $slice, $size, $literal"""
+    if isinstance(expr, str) and expr.startswith("$"):
+        value = doc_get(doc, expr[1:])
+        return None if value is MISSING else value
+    if is_operator_dict(expr) and len(expr) == 1:
+        op, args = next(iter(expr.items()))
+        if op == "$literal":
+            return args
+        args = [eval_expression(a, doc) for a in args] if isinstance(args, list) else [eval_expression(args, doc)]
+        if op == "$in":
+            if not isinstance(args[1], list):
+                raise OperationFailure("$in requires an array as a second argument", code=40081)
+            return any(bson_equal(args[0], v) for v in args[1])
+        if op == "$ifNull":
+            return next((a for a in args[:-1] if a is not None), args[-1])
+        if op == "$size":
+            return len(args[0])
+        if op == "$slice":
+            array = args[0]
+            if array is None:
+                return None
+            if len(args) == 2:
+                n = args[1]
+                return array[:n] if n >= 0 else array[n:]
+            position, n = args[1], args[2]
+            if position < 0:
+                position = max(0, len(array) + position)
+            return array[position:position + n]
+        raise OperationFailure(f"Unrecognized expression '{op}'", code=168)
+    if isinstance(expr, dict):
+        return {k: eval_expression(v, doc) for k, v in expr.items()}
+    if isinstance(expr, list):
+        return [eval_expression(v, doc) for v in expr]
+    return expr
+
+def project_expression(doc: dict[str, Any], spec: dict[str, Any]) -> dict[str, Any]:
+    """$project: inclusión/exclusión de campos y campos calculados"""
+    if all(isinstance(v, (bool, int)) and not v for k, v in spec.items()):
+        return {k: v for k, v in doc.items() if k not in spec}
+    out: dict[str, Any] = {}
+    if spec.get("_id", 1) is not False and spec.get("_id", 1) != 0 and "_id" in doc:
+        out["_id"] = doc["_id"]
+    for field, expr in spec.items():
+        if field == "_id" and isinstance(expr, (bool, int)):
+            continue
+        if isinstance(expr, (bool, int)):
+            value = doc_get(doc, field)
+            if expr and value is not MISSING:
+                doc_set(out, field, value)
+        else:
+            doc_set(out, field, eval_expression(expr, doc))
+    return out
+
+def run_pipeline(docs: list[dict[str, Any]], stages: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """Etapas de agregación sobre documentos ya cargados (sin $geoNear, que va primero)"""
+    for stage in stages:
+        (name, spec), = stage.items()
+        if name == "$match":
+            if "$text" in spec:
+                raise OperationFailure("$match with $text is only allowed as the first pipeline stage", code=17313)
+            docs = [d for d in docs if match_filter(d, spec)]
+        elif name == "$project":
+            docs = [project_expression(d, spec) for d in docs]
+        elif name == "$sort":
+            docs = [d for _, d in sort_docs(list(enumerate(docs)), sort_spec(spec), None)]
+        elif name == "$skip":
+            docs = docs[spec:]
+        elif name == "$limit":
+            docs = docs[:spec]
+        elif name == "$facet":
+            docs = [{facet: run_pipeline(docs, sub) for facet, sub in spec.items()}]
+        elif name == "$count":
+            docs = [{spec: len(docs)}] if docs else []
+        elif name == "$geoNear":
+            raise OperationFailure("$geoNear is only valid as the first stage in a pipeline", code=40602)
+        else:
+            raise OperationFailure(f"Unrecognized pipeline stage name: '{name}'", code=40324)
+    return docs
+
+class MemoryIndex:
+    """Índice hash + lista ordenada sobre el primer campo; si es único, también la clave completa"""
+
+    __slots__ = ("name", "fields", "unique", "partial", "hash", "ordered", "keys")
+
+    def __init__(self, name: str, fields: list[str], unique: bool, partial: Optional[dict[str, Any]]):
+        self.name = name
+        self.fields = fields
+        self.unique = unique
+        self.partial = partial
+        self.hash: dict[tuple, set[tuple]] = {}          # valor del primer campo -> claves de documento
+        self.ordered: list[tuple[tuple, tuple]] = []     # (valor del primer campo, clave de documento), ordenado
+        self.keys: dict[tuple, tuple] = {}               # clave completa -> clave de documento (sólo únicos)
+
+    def covers(self, doc: dict[str, Any]) -> bool:
+        return self.partial is None or match_filter(doc, self.partial)
+
+    def first_keys(self, doc: dict[str, Any]) -> list[tuple]:
+        value = doc_get(doc, self.fields[0])
+        if isinstance(value, list) and value:  # multikey: una entrada por elemento
+            return list({bson_order_key(v) for v in value})
+        return [bson_order_key(None if value is MISSING else value)]
+
+    def unique_key(self, doc: dict[str, Any]) -> tuple:
+        return tuple(bson_order_key(doc_get(doc, f)) for f in self.fields)
+
+    def add(self, dk: tuple, doc: dict[str, Any]):
+        if not self.covers(doc):
+            return
+        for key in self.first_keys(doc):
+            self.hash.setdefault(key, set()).add(dk)
+            bisect.insort(self.ordered, (key, dk))
+        if self.unique:
+            self.keys[self.unique_key(doc)] = dk
+
+    def remove(self, dk: tuple, doc: dict[str, Any]):
+        if not self.covers(doc):
+            return
+        for key in self.first_keys(doc):
+            bucket = self.hash.get(key)
+            if bucket is not None:
+                bucket.discard(dk)
+                if not bucket:
+                    del self.hash[key]
+            i = bisect.bisect_left(self.ordered, (key, dk))
+            if i < len(self.ordered) and self.ordered[i] == (key, dk):
+                del self.ordered[i]
+        if self.unique and self.keys.get(self.unique_key(doc)) == dk:
+            del self.keys[self.unique_key(doc)]
+
+    def candidates(self, cond: Any) -> Optional[list[tuple]]:
+        """Claves de documento que pueden cumplir cond sobre el primer campo (None = no sirve)"""
+        if self.partial is not None:
+            # Sólo los parciales {campo: {$exists: true}} y con una condición que lo implique
+            if self.partial != {self.fields[0]: {"$exists": True}} or cond is None or cond == {"$exists": False}:
+                return None
+            if cond == {"$exists": True}:
+                return [dk for _, dk in self.ordered]
+        if not is_operator_dict(cond):
+            if isinstance(cond, (list, dict)):
+                return None
+            return list(self.hash.get(bson_order_key(cond), ()))
+        if "$eq" in cond and not isinstance(cond["$eq"], (list, dict)):
+            return list(self.hash.get(bson_order_key(cond["$eq"]), ()))
+        if "$in" in cond and not any(isinstance(v, (list, dict)) for v in cond["$in"]):
+            out: list[tuple] = []
+            for value in cond["$in"]:
+                out.extend(self.hash.get(bson_order_key(value), ()))
+            return out
+        low = next(((cond[op], op) for op in ("$gte", "$gt") if op in cond), None)
+        high = next(((cond[op], op) for op in ("$lte", "$lt") if op in cond), None)
+        if low is None and high is None:
+            return None
+        # El rango no cruza tipos: se acota al tipo del límite
+        rank = bson_order_key((low or high)[0])[0]
+        start = bisect.bisect_left(self.ordered, ((rank,),)) if low is None else bisect.bisect_left(self.ordered, (bson_order_key(low[0]),))
+        if low is not None and low[1] == "$gt":
+            start = bisect.bisect_right(self.ordered, (bson_order_key(low[0]), (99,)))
+        if high is None:
+            stop = bisect.bisect_left(self.ordered, ((rank + 1,),))
+        elif high[1] == "$lt":
+            stop = bisect.bisect_left(self.ordered, (bson_order_key(high[0]),))
+        else:
+            stop = bisect.bisect_right(self.ordered, (bson_order_key(high[0]), (99,)))
+        return [dk for _, dk in self.ordered[start:stop]]
+
+class MemoryCursor:
+    """find(): sort/skip/limit encadenables, to_list y async for (como el cursor de Motor)"""
+
+    def __init__(self, collection: MemoryCollection, flt: Optional[dict[str, Any]], projection: Optional[dict[str, Any]]):
+        self._collection = collection
+        self._filter = flt or {}
+        self._projection = projection
+        self._sort: Optional[list[tuple[str, Any]]] = None
+        self._skip = 0
+        self._limit = 0
+        self._codec_options: Optional[CodecOptions] = None  # document_class RawBSONDocument (ver RawBSONCollection)
+
+    def sort(self, key_or_list: Any, direction: Any = None) -> MemoryCursor:
+        self._sort = sort_spec(key_or_list, direction)
+        return self
+
+    def skip(self, n: int) -> MemoryCursor:
+        self._skip = n
+        return self
+
+    def limit(self, n: int) -> MemoryCursor:
+        self._limit = n
+        return self
+
+    def batch_size(self, n: int) -> MemoryCursor:
+        return self
+
+    async def to_list(self, length: Optional[int] = None) -> list[dict[str, Any]]:
+        docs = self._collection.find_docs(self._filter, self._projection, self._sort, self._skip, self._limit)
+        docs = docs[:length] if length else docs
+        if self._codec_options is not None:
+            docs = [RawBSONDocument(bson.encode(d), self._codec_options) for d in docs]
+        return docs
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in await self.to_list():
+            yield doc
+
+class MemoryAggregateCursor:
+    def __init__(self, run: Callable[[], list[dict[str, Any]]]):
+        self._run = run
+
+    async def to_list(self, length: Optional[int] = None) -> list[dict[str, Any]]:
+        docs = [clone_value(d) for d in self._run()]
+        return docs[:length] if length else docs
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in await self.to_list():
+            yield doc
+
+class BulkOperation:
+    """Una operación de bulk_write (InsertOne, UpdateOne, ReplaceOne, DeleteMany, ...) en limpio.
+
+    Las clases de pymongo no exponen filtro/documento; cada una se describe a sí misma con
+    _add_to_bulk(bulk) llamando add_insert/add_update/add_replace/add_delete, el mismo contrato
+    que usa el driver para armar sus batches. Esto hace de `bulk` y guarda la descripción."""
+
+    __slots__ = ("kind", "filter", "document", "upsert", "multi")
+
+    def __init__(self):
+        self.kind = ""
+        self.filter: dict[str, Any] = {}
+        self.document: dict[str, Any] = {}
+        self.upsert = False
+        self.multi = False
+
+    @classmethod
+    def of(cls, request: Any) -> BulkOperation:
+        op = cls()
+        add_to_bulk = getattr(request, "_add_to_bulk", None)
+        if add_to_bulk is None:
+            raise TypeError(f"operación de bulk_write no soportada: {type(request).__name__}")
+        add_to_bulk(op)
+        return op
+
+    def add_insert(self, document: dict[str, Any]):
+        self.kind, self.document = "insert", document
+
+    def add_update(self, selector: dict[str, Any], update: dict[str, Any], multi: bool, upsert: Optional[bool], **options):
+        self.kind, self.filter, self.document, self.multi, self.upsert = "update", selector, update, multi, bool(upsert)
+
+    def add_replace(self, selector: dict[str, Any], replacement: dict[str, Any], upsert: Optional[bool], **options):
+        self.kind, self.filter, self.document, self.upsert = "replace", selector, replacement, bool(upsert)
+
+    def add_delete(self, selector: dict[str, Any], limit: int, **options):
+        self.kind, self.filter, self.multi = "delete", selector, limit == 0
+
+class MemoryCollection:
+    """Una colección: documentos en un dict por _id (en orden de inserción) + índices"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._docs: dict[tuple, dict[str, Any]] = {}  # bson_order_key(_id) -> documento
+        self._seq: dict[tuple, int] = {}              # orden de inserción (orden natural)
+        self._next_seq = 0
+        self._indexes: dict[str, MemoryIndex] = {}
+        self._text_weights: dict[str, int] = {}
+        self._geo_field: Optional[str] = None
+
+    # --- índices ---
+    async def create_index(self, keys: Any, **options) -> str:
+        keys = sort_spec(keys)
+        name = options.get("name") or "_".join(f"{field}_{direction}" for field, direction in keys)
+        kinds = {direction for _, direction in keys}
+        if "text" in kinds:
+            weights = options.get("weights") or {}
+            self._text_weights = {field: weights.get(field, 1) for field, direction in keys if direction == "text"}
+        elif "2dsphere" in kinds:
+            self._geo_field = next(field for field, direction in keys if direction == "2dsphere")
+        elif name not in self._indexes:
+            index = MemoryIndex(name, [field for field, _ in keys], bool(options.get("unique")), options.get("partialFilterExpression"))
+            for dk, doc in self._docs.items():
+                if index.unique and index.covers(doc) and index.unique_key(doc) in index.keys:
+                    raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: {name}", 11000)
+                index.add(dk, doc)
+            self._indexes[name] = index
+        return name
+
+    async def drop(self):
+        self.__init__(self.name)
+
+    def with_options(self, codec_options: Optional[CodecOptions] = None, **kwargs) -> Any:
+        """Sólo document_class=RawBSONDocument cambia algo: el resto de las opciones no aplica"""
+        if codec_options is not None and issubclass(codec_options.document_class, RawBSONDocument):
+            return RawBSONCollection(self, codec_options)
+        return self
+
+    def watch(self, *args, **kwargs):
+        raise OperationFailure("The $changeStream stage is only supported on replica sets", code=40573)
+
+    # --- lectura ---
+    def plan(self, flt: dict[str, Any]) -> Optional[list[tuple]]:
+        """Claves candidatas usando _id o el primer campo de algún índice (None = recorrer todo)"""
+        cond = flt.get("_id", MISSING)
+        if cond is not MISSING:
+            if not is_operator_dict(cond):
+                return [bson_order_key(cond)]
+            if "$in" in cond:
+                return [bson_order_key(v) for v in cond["$in"]]
+        best: Optional[list[tuple]] = None
+        for index in self._indexes.values():
+            if index.fields[0] in flt:
+                found = index.candidates(flt[index.fields[0]])
+                if found is not None and (best is None or len(found) < len(best)):
+                    best = found
+        if best is not None:
+            return best
+        for sub in flt.get("$and", ()):
+            found = self.plan(sub)
+            if found is not None:
+                return found
+        return None
+
+    def text_scores(self, search: str, items) -> dict[tuple, float]:
+        if not self._text_weights:
+            raise OperationFailure("text index required for $text query", code=27)
+        terms = set(text_tokens(search))
+        scores = {}
+        for dk, doc in items:
+            score = 0.0
+            for field, weight in self._text_weights.items():
+                value = doc.get(field)
+                if isinstance(value, str):
+                    tokens = text_tokens(value)
+                    hits = sum(1 for t in tokens if t in terms)
+                    if hits:
+                        score += weight * hits / len(tokens) + weight
+            if score:
+                scores[dk] = score
+        return scores
+
+    def select(self, flt: Optional[dict[str, Any]]) -> tuple[list[tuple[tuple, dict[str, Any]]], Optional[dict[tuple, float]]]:
+        """(clave, documento) que cumplen flt en orden natural, y los scores si hubo $text"""
+        flt = flt or {}
+        keys = self.plan(flt)
+        if keys is None:
+            items = list(self._docs.items())
+        else:
+            unique = {dk for dk in keys if dk in self._docs}
+            items = [(dk, self._docs[dk]) for dk in sorted(unique, key=self._seq.__getitem__)]
+        scores = None
+        if "$text" in flt:
+            scores = self.text_scores(flt["$text"]["$search"], items)
+            items = [(dk, doc) for dk, doc in items if dk in scores]
+        return [(dk, doc) for dk, doc in items if match_filter(doc, flt)], scores
+
+    def find_docs(self, flt, projection, sort, skip: int = 0, limit: int = 0) -> list[dict[str, Any]]:
+        items, scores = self.select(flt)
+        if sort:
+            items = sort_docs(items, sort, scores, skip + limit if limit else None)
+        items = items[skip:skip + limit] if limit else items[skip:]
+        return [project_doc(doc, projection, scores.get(dk) if scores else None) for dk, doc in items]
+
+    def first(self, flt, sort) -> Optional[tuple[tuple, dict[str, Any]]]:
+        items, scores = self.select(flt)
+        if sort and len(items) > 1:
+            items = sort_docs(items, sort_spec(sort), scores, 1)
+        return items[0] if items else None
+
+    def find(self, filter: Optional[dict[str, Any]] = None, projection: Optional[dict[str, Any]] = None, sort: Any = None, skip: int = 0, limit: int = 0, **kwargs) -> MemoryCursor:
+        cursor = MemoryCursor(self, filter, projection).skip(skip).limit(limit)
+        return cursor.sort(sort) if sort else cursor
+
+    async def find_one(self, filter: Any = None, projection: Optional[dict[str, Any]] = None, sort: Any = None, **kwargs) -> Optional[dict[str, Any]]:
+        if filter is not None and not isinstance(filter, dict):
+            filter = {"_id": filter}
+        found = self.first(filter, sort)
+        return project_doc(found[1], projection) if found else None
+
+    async def count_documents(self, filter: dict[str, Any], skip: int = 0, limit: int = 0, **kwargs) -> int:
+        n = max(0, len(self.select(filter)[0]) - skip)
+        return min(n, limit) if limit else n
+
+    async def estimated_document_count(self, **kwargs) -> int:
+        return len(self._docs)
+
+    async def distinct(self, key: str, filter: Optional[dict[str, Any]] = None, **kwargs) -> list[Any]:
+        seen: dict[tuple, Any] = {}
+        for _, doc in self.select(filter)[0]:
+            value = doc_get(doc, key)
+            for v in (value if isinstance(value, list) else [value]):
+                if v is not MISSING:
+                    seen.setdefault(bson_order_key(v), v)
+        return [clone_value(v) for v in seen.values()]
+
+    def aggregate(self, pipeline: list[dict[str, Any]], **kwargs) -> MemoryAggregateCursor:
+        return MemoryAggregateCursor(lambda: self.run_aggregate(list(pipeline)))
+
+    def run_aggregate(self, stages: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        if stages and "$geoNear" in stages[0]:
+            # Con $skip/$limit a continuación sólo hace falta ordenar los primeros skip + limit
+            need, skip = None, 0
+            for stage in stages[1:]:
+                if "$skip" in stage and need is None:
+                    skip += stage["$skip"]
+                elif "$limit" in stage:
+                    need = skip + stage["$limit"] if need is None else min(need, skip + stage["$limit"])
+                else:
+                    break
+            docs = self.geo_near(stages.pop(0)["$geoNear"], need)
+        elif stages and "$match" in stages[0]:
+            docs = [doc for _, doc in self.select(stages.pop(0)["$match"])[0]]
+        else:
+            docs = list(self._docs.values())
+        return run_pipeline(docs, stages)
+
+    def geo_near(self, spec: dict[str, Any], need: Optional[int] = None) -> list[dict[str, Any]]:
+        if self._geo_field is None:
+            raise OperationFailure("$geoNear requires a 2dsphere index", code=291)
+        near = spec["near"]
+        lng, lat = near["coordinates"] if isinstance(near, dict) else near
+        field = spec.get("key", self._geo_field)
+        max_distance = spec.get("maxDistance")
+        min_distance = spec.get("minDistance")
+        out = []
+        for dk, doc in self.select(spec.get("query"))[0]:
+            point = doc_get(doc, field)
+            if not isinstance(point, dict) or not point.get("coordinates"):
+                continue
+            distance = haversine_m(lat, lng, point["coordinates"][1], point["coordinates"][0])
+            if (max_distance is not None and distance > max_distance) or (min_distance is not None and distance < min_distance):
+                continue
+            out.append((distance, self._seq[dk], doc))
+        key = lambda item: (item[0], item[1])  # noqa: E731
+        out = heapq.nsmallest(need, out, key=key) if need is not None and need < len(out) else sorted(out, key=key)
+        return [{**doc, spec["distanceField"]: distance} for distance, _, doc in out]
+
+    # --- escritura ---
+    def check_unique(self, doc: dict[str, Any], dk: Optional[tuple]):
+        for index in self._indexes.values():
+            if index.unique and index.covers(doc):
+                owner = index.keys.get(index.unique_key(doc))
+                if owner is not None and owner != dk:
+                    raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: {index.name}", 11000)
+
+    def insert(self, doc: dict[str, Any]) -> Any:
+        if isinstance(doc, RawBSONDocument):
+            doc = bson.decode(doc.raw)  # inmutable: como en Motor, el _id generado no vuelve al caller
+        if "_id" not in doc:
+            doc["_id"] = ObjectId()  # como Motor: completa el _id en el dict de quien llama
+        stored = store_value(doc)
+        dk = bson_order_key(stored["_id"])
+        if dk in self._docs:
+            raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: _id_", 11000)
+        self.check_unique(stored, None)
+        self._docs[dk] = stored
+        self._seq[dk] = self._next_seq
+        self._next_seq += 1
+        for index in self._indexes.values():
+            index.add(dk, stored)
+        return stored["_id"]
+
+    def replace(self, dk: tuple, old: dict[str, Any], new: dict[str, Any]):
+        self.check_unique(new, dk)
+        for index in self._indexes.values():
+            if index.first_keys(old) != index.first_keys(new) or index.covers(old) != index.covers(new) \
+                    or (index.unique and index.unique_key(old) != index.unique_key(new)):
+                index.remove(dk, old)
+                index.add(dk, new)
+        self._docs[dk] = new
+
+    def remove(self, dk: tuple):
+        doc = self._docs.pop(dk)
+        del self._seq[dk]
+        for index in self._indexes.values():
+            index.remove(dk, doc)
+
+    def update(self, flt: dict[str, Any], update: dict[str, Any], upsert: bool, multi: bool) -> dict[str, Any]:
+        """Resultado crudo como el del server: n, nModified y upserted"""
+        items = self.select(flt)[0]
+        if not multi:
+            items = items[:1]
+        if not items:
+            if not upsert:
+                return {"n": 0, "nModified": 0}
+            return {"n": 1, "nModified": 0, "upserted": self.insert(apply_update(upsert_seed(flt), update, inserting=True))}
+        modified = 0
+        for dk, old in items:
+            new = apply_update(old, update, inserting=False)
+            if new != old:
+                self.replace(dk, old, new)
+                modified += 1
+        return {"n": len(items), "nModified": modified}
+
+    def replace_matching(self, flt: dict[str, Any], replacement: dict[str, Any], upsert: bool) -> dict[str, Any]:
+        """replaceOne: documento nuevo entero, conservando el _id del reemplazado"""
+        if is_operator_dict(replacement):
+            raise OperationFailure("replacement document must not contain $ operators", code=9)
+        items = self.select(flt)[0][:1]
+        if not items:
+            if not upsert:
+                return {"n": 0, "nModified": 0}
+            return {"n": 1, "nModified": 0, "upserted": self.insert({**upsert_seed(flt), **replacement})}
+        dk, old = items[0]
+        new = {"_id": old["_id"], **store_value({k: v for k, v in replacement.items() if k != "_id"})}
+        if new == old:
+            return {"n": 1, "nModified": 0}
+        self.replace(dk, old, new)
+        return {"n": 1, "nModified": 1}
+
+    async def insert_one(self, document: dict[str, Any], **kwargs) -> InsertOneResult:
+        return InsertOneResult(self.insert(document), True)
+
+    async def insert_many(self, documents: list[dict[str, Any]], ordered: bool = True, **kwargs) -> InsertManyResult:
+        ids, errors = [], []
+        for i, doc in enumerate(documents):
+            try:
+                ids.append(self.insert(doc))
+            except DuplicateKeyError as e:
+                errors.append({"index": i, "code": 11000, "errmsg": str(e), "op": doc})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({
+                "writeErrors": errors, "writeConcernErrors": [], "nInserted": len(ids), "nUpserted": 0,
+                "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": [],
+            })
+        return InsertManyResult(ids, True)
+
+    async def update_one(self, filter: dict[str, Any], update: dict[str, Any], upsert: bool = False, **kwargs) -> UpdateResult:
+        return UpdateResult(self.update(filter, update, upsert, multi=False), True)
+
+    async def update_many(self, filter: dict[str, Any], update: dict[str, Any], upsert: bool = False, **kwargs) -> UpdateResult:
+        return UpdateResult(self.update(filter, update, upsert, multi=True), True)
+
+    async def find_one_and_update(self, filter: dict[str, Any], update: dict[str, Any], projection: Optional[dict[str, Any]] = None, sort: Any = None, upsert: bool = False, return_document: bool = ReturnDocument.BEFORE, **kwargs) -> Optional[dict[str, Any]]:
+        found = self.first(filter, sort)
+        if found is None:
+            if not upsert:
+                return None
+            new = apply_update(upsert_seed(filter), update, inserting=True)
+            _id = self.insert(new)
+            return project_doc(self._docs[bson_order_key(_id)], projection) if return_document else None
+        dk, old = found
+        new = apply_update(old, update, inserting=False)
+        if new != old:
+            self.replace(dk, old, new)
+        return project_doc(new if return_document else old, projection)
+
+    async def find_one_and_delete(self, filter: dict[str, Any], projection: Optional[dict[str, Any]] = None, sort: Any = None, **kwargs) -> Optional[dict[str, Any]]:
+        found = self.first(filter, sort)
+        if found is None:
+            return None
+        self.remove(found[0])
+        return project_doc(found[1], projection)
+
+    async def delete_one(self, filter: dict[str, Any], **kwargs) -> DeleteResult:
+        found = self.first(filter, None)
+        if found is not None:
+            self.remove(found[0])
+        return DeleteResult({"n": int(found is not None)}, True)
+
+    async def delete_many(self, filter: dict[str, Any], **kwargs) -> DeleteResult:
+        items = self.select(filter)[0]
+        for dk, _ in items:
+            self.remove(dk)
+        return DeleteResult({"n": len(items)}, True)
+
+    async def bulk_write(self, requests: list[Any], ordered: bool = True, **kwargs) -> BulkWriteResult:
+        result: dict[str, Any] = {
+            "writeErrors": [], "writeConcernErrors": [], "nInserted": 0, "nUpserted": 0,
+            "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": [],
+        }
+        for i, request in enumerate(requests):
+            op = BulkOperation.of(request)
+            try:
+                if op.kind == "insert":
+                    self.insert(op.document)
+                    result["nInserted"] += 1
+                elif op.kind in ("update", "replace"):
+                    if op.kind == "replace":
+                        raw = self.replace_matching(op.filter, op.document, op.upsert)
+                    else:
+                        raw = self.update(op.filter, op.document, op.upsert, op.multi)
+                    if "upserted" in raw:
+                        result["nUpserted"] += 1
+                        result["upserted"].append({"index": i, "_id": raw["upserted"]})
+                    else:
+                        result["nMatched"] += raw["n"]
+                        result["nModified"] += raw["nModified"]
+                else:
+                    items = self.select(op.filter)[0]
+                    for dk, _ in (items if op.multi else items[:1]):
+                        self.remove(dk)
+                        result["nRemoved"] += 1
+            except DuplicateKeyError as e:
+                result["writeErrors"].append({"index": i, "code": 11000, "errmsg": str(e)})
+                if ordered:
+                    break
+        if result["writeErrors"]:
+            raise BulkWriteError(result)
+        return BulkWriteResult(result, True)
+
+class RawBSONCollection:
+    """with_options(codec_options=...RawBSONDocument): find devuelve los documentos en BSON crudo"""
+
+    def __init__(self, collection: MemoryCollection, codec_options: CodecOptions):
+        self._collection = collection
+        self._codec_options = codec_options
+
+    def __getattr__(self, attr: str):
+        return getattr(self._collection, attr)
+
+    def find(self, *args, **kwargs) -> MemoryCursor:
+        cursor = self._collection.find(*args, **kwargs)
+        cursor._codec_options = self._codec_options
+        return cursor
+
+class MemoryDatabase:
+    def __init__(self, name: str):
+        self.name = name
+        self._collections: dict[str, MemoryCollection] = {}
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._collections[name] = MemoryCollection(name)
+        return collection
+
+    def __getattr__(self, name: str) -> MemoryCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    async def command(self, command: Any, **kwargs) -> dict[str, Any]:
+        name = command if isinstance(command, str) else next(iter(command))
+        if name != "ping":
+            raise OperationFailure(f"no such command: '{name}'", code=59)
+        return {"ok": 1.0}
+
+    async def list_collection_names(self, **kwargs) -> list[str]:
+        return [name for name, c in self._collections.items() if c._docs]
+
+    async def drop_collection(self, name: str):
+        self._collections.pop(name, None)
+
+class MemoryClient:
+    """Stand-in de AsyncIOMotorClient (STORAGE_ENGINE=memory)"""
+
+    def __init__(self, *args, **kwargs):
+        self._databases: dict[str, MemoryDatabase] = {}
+
+    def __getitem__(self, name: str) -> MemoryDatabase:
+        database = self._databases.get(name)
+        if database is None:
+            database = self._databases[name] = MemoryDatabase(name)
+        return database
+
+    def __getattr__(self, name: str) -> MemoryDatabase:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def get_database(self, name: str) -> MemoryDatabase:
+        return self[name]
+
+    async def drop_database(self, name: str):
+        self._databases.pop(name, None)
+
+    def close(self):
+        pass
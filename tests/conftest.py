@@ -0,0 +1,84 @@
+# Tests de la API sobre el storage engine en memoria (storage_memory.py): no necesitan mongod
+# ni RabbitMQ. Cada test arranca con una base vacía; el startup de la app no corre (sin loops
+# en background), así que los tests llaman a mano lo que haga falta (archivador, replay, ...).
+# Run (desde la raíz del repo):
+#   python -m pytest tests/
+
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import main  # noqa: E402
+from storage_memory import MemoryClient  # noqa: E402
+
+
+class RecordingExchange:
+    """Stand-in del exchange de RabbitMQ: guarda (routing_key, payload) de cada publish"""
+
+    def __init__(self):
+        self.published: list[tuple[str, dict]] = []
+
+    async def publish(self, message, routing_key: str):
+        self.published.append((routing_key, json.loads(message.body)))
+
+
+@pytest.fixture(autouse=True)
+def memory_db(monkeypatch):
+    database = MemoryClient()["la_segunda_test"]
+    monkeypatch.setattr(main, "db", database)
+    monkeypatch.setattr(main, "notification_exchange", None)
+    # el cache de Discover vive en el módulo: cada test arranca vacío
+    monkeypatch.setattr(main, "discover_cache", main.DiscoverResponseCache(main.DISCOVER_CACHE_SIZE, main.DISCOVER_CACHE_TTL, main.DISCOVER_CACHE_STALE))
+    main.sse_replay.clear()
+    asyncio.run(main.ensure_indexes(database))
+    return database
+
+
+@pytest.fixture
+def exchange(monkeypatch) -> RecordingExchange:
+    recorder = RecordingExchange()
+    monkeypatch.setattr(main, "notification_exchange", recorder)
+    return recorder
+
+
+@pytest.fixture
+def client() -> TestClient:
+    return TestClient(main.app)
+
+
+@pytest.fixture
+def register(client):
+    def register_user(name: str) -> dict:
+        response = client.post("/users/register", json={"name": name})
+        assert response.status_code == 200, response.text
+        user = response.json()
+        user["headers"] = {"X-User-Id": user["id"]}
+        return user
+    return register_user
+
+
+@pytest.fixture
+def create_event(client):
+    def create(organizer: dict, title: str = "Fulbito", fecha_inicio: str = "2030-01-01T10:00:00", **fields) -> dict:
+        body = {
+            "title": title,
+            "fecha_inicio": fecha_inicio,
+            "fecha_fin": "2030-01-01T12:00:00",
+            "location": {"lat": -34.6, "lng": -58.4},
+            "category": "deportes",
+            **fields,
+        }
+        response = client.post("/events", json=body, headers=organizer["headers"])
+        assert response.status_code == 200, response.text
+        return response.json()
+    return create
@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import asyncio
+import gzip
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+
+import admin_data
+from storage_memory import MemoryClient
+
+
+def seed_docs(n: int = 5) -> list[dict]:
+    return [
+        {
+            "_id": ObjectId(),
+            "title": f"evento {i}",
+            "organizer_id": ObjectId(),
+            "fecha_inicio": datetime(2030, 1, 1, 10, i, 0, 123000),
+            "location": {"type": "Point", "coordinates": [-58.4, -34.6 + i / 100]},
+            "tags": ["deportes"] if i % 2 else [],
+            "rating": i + 0.5,
+        }
+        for i in range(n)
+    ]
+
+
+@pytest.fixture
+def database():
+    db = MemoryClient()["admin_test"]
+    asyncio.run(db.events.insert_many(seed_docs()))
+    return db
+
+
+def dump(collection) -> list[dict]:
+    return asyncio.run(collection.find({}).sort("_id", 1).to_list(length=None))
+
+
+@pytest.mark.parametrize("name", ["events.ndjson", "events.ndjson.gz", "events.bson", "events.bson.gz"])
+def test_export_import_round_trip(database, tmp_path, name):
+    path = str(tmp_path / name)
+    fmt = admin_data.guess_format(path)
+
+    exported = asyncio.run(admin_data.export_collection(database.events, path, fmt, batch_size=2, query={}))
+    imported = asyncio.run(admin_data.import_collection(database.copy, path, fmt, batch_size=2, mode="insert", workers=1))
+
+    assert exported.docs == imported.docs == imported.written == 5
+    assert dump(database.copy) == dump(database.events)
+    if name.endswith(".gz"):
+        with gzip.open(path, "rb") as f:
+            assert f.read(1)
+
+
+def test_ndjson_uses_relaxed_extended_json(database, tmp_path):
+    path = str(tmp_path / "events.ndjson")
+    asyncio.run(admin_data.export_collection(database.events, path, "ndjson", batch_size=10, query={"rating": {"$gt": 3}}))
+
+    lines = (tmp_path / "events.ndjson").read_bytes().splitlines()
+    assert len(lines) == 2
+    assert b'"_id":{"$oid":' in lines[0] and b'"fecha_inicio":{"$date":"2030-01-01T10:03:00.123Z"}' in lines[0]
+
+
+def test_insert_skips_existing_ids_without_stopping_the_batch(database, tmp_path):
+    path = str(tmp_path / "events.ndjson")
+    asyncio.run(admin_data.export_collection(database.events, path, "ndjson", batch_size=10, query={}))
+    asyncio.run(database.copy.insert_many(dump(database.events)[1:3]))
+
+    progress = asyncio.run(admin_data.import_collection(database.copy, path, "ndjson", batch_size=10, mode="insert", workers=1))
+
+    assert (progress.written, progress.skipped, progress.errors) == (3, 2, 0)
+    assert dump(database.copy) == dump(database.events)
+
+
+def test_upsert_replaces_existing_documents(database, tmp_path):
+    path = str(tmp_path / "events.bson")
+    asyncio.run(admin_data.export_collection(database.events, path, "bson", batch_size=10, query={}))
+    first = dump(database.events)[0]
+    asyncio.run(database.events.update_one({"_id": first["_id"]}, {"$set": {"title": "editado"}, "$unset": {"rating": ""}}))
+
+    progress = asyncio.run(admin_data.import_collection(database.events, path, "bson", batch_size=2, mode="upsert", workers=1))
+
+    assert (progress.written, progress.skipped) == (1, 0)  # los otros 4 ya eran iguales
+    assert asyncio.run(database.events.find_one({"_id": first["_id"]})) == first
+
+
+def test_parallel_ndjson_parsing(database, tmp_path):
+    path = str(tmp_path / "events.ndjson")
+    asyncio.run(admin_data.export_collection(database.events, path, "ndjson", batch_size=10, query={}))
+
+    progress = asyncio.run(admin_data.import_collection(database.copy, path, "ndjson", batch_size=1, mode="insert", workers=2))
+
+    assert progress.written == 5 and dump(database.copy) == dump(database.events)
+
+
+def test_list_users_streams_names(capsys):
+    db = MemoryClient()["admin_test"]
+    asyncio.run(db.users.insert_many([{"name": "ana"}, {"name": "bea"}]))
+
+    assert asyncio.run(admin_data.list_users(db, batch_size=1)) == 2
+    out = capsys.readouterr().out
+    assert "  - ana (id: " in out and out.rstrip().endswith("Total usuarios: 2")
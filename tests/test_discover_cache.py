@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def cache() -> main.DiscoverResponseCache:
+    assert main.discover_cache.enabled
+    return main.discover_cache
+
+
+def tile_origins(cache: main.DiscoverResponseCache, lat: float = -34.6, lng: float = -58.4) -> list[tuple[float, float]]:
+    """Dos posiciones a ~100 m dentro del mismo tile"""
+    (center_lat, center_lng), _ = cache.tile_area(cache.tile(lat, lng))
+    origins = [(center_lat - 0.0004, center_lng - 0.0004), (center_lat + 0.0004, center_lng + 0.0004)]
+    assert len({cache.tile(*o) for o in origins}) == 1
+    return origins
+
+
+def seed(organizer: dict, create_event, origin: tuple[float, float], offsets_km: list[float], **fields) -> list[str]:
+    return [
+        create_event(organizer, title=f"e{i}", location={"lat": origin[0] + km / 111.32, "lng": origin[1]}, **fields)["id"]
+        for i, km in enumerate(offsets_km)
+    ]
+
+
+def discover(client, origin: tuple[float, float], **params) -> list[tuple[str, float]]:
+    response = client.get("/events", params={"lat": origin[0], "lng": origin[1], **params})
+    assert response.status_code == 200, response.text
+    return [(e["id"], round(e["distance_meters"], 3)) for e in response.json()]
+
+
+def uncached(client, monkeypatch, cache, origin, **params) -> list[tuple[str, float]]:
+    with monkeypatch.context() as patch:
+        patch.setattr(cache, "ttl", 0)
+        return discover(client, origin, **params)
+
+
+def test_nearby_origins_share_one_entry_with_exact_distances(client, monkeypatch, register, create_event, cache):
+    a, b = tile_origins(cache)
+    seed(register("org"), create_event, a, [0.2, -0.5, 1.5, 3, -4])
+    expected = [uncached(client, monkeypatch, cache, origin, limit=3) for origin in (a, b)]
+
+    served = [discover(client, origin, limit=3) for origin in (a, b)]
+
+    assert served == expected
+    assert expected[0] != expected[1]  # distancias propias de cada origen
+    assert (len(cache), cache.misses, cache.hits, cache.fallbacks) == (1, 1, 1, 0)
+
+
+def test_max_km_is_applied_per_request(client, monkeypatch, register, create_event, cache):
+    a, b = tile_origins(cache)
+    seed(register("org"), create_event, a, [0.3, 0.9, 2.5, 6])
+
+    for origin, max_km in ((a, 1), (b, 1), (a, 5)):
+        assert discover(client, origin, max_km=max_km) == uncached(client, monkeypatch, cache, origin, max_km=max_km)
+
+    assert len(cache) == 1 and cache.fallbacks == 0
+
+
+def test_distance_cursor_pages_from_the_cache(client, register, create_event, cache):
+    a, _ = tile_origins(cache)
+    created = seed(register("org"), create_event, a, [0.1 * i for i in range(1, 8)])
+    seen, after = [], None
+    while True:
+        params = {"lat": a[0], "lng": a[1], "limit": 3, **({"after": after} if after else {})}
+        response = client.get("/events", params=params)
+        seen += [e["id"] for e in response.json()]
+        after = response.headers.get("x-next-cursor")
+        if not after:
+            break
+
+    assert seen == created
+    # la última página (incompleta) puede seguir más allá del radio cacheado: va a MongoDB
+    assert len(cache) == 1 and cache.fallbacks == 1
+
+
+def test_pages_beyond_the_cached_radius_go_to_mongo(client, monkeypatch, register, create_event, cache):
+    a, _ = tile_origins(cache)
+    near_id, far_id = seed(register("org"), create_event, a, [0.5, cache.radius_km + 20])
+
+    served = discover(client, a, limit=5)
+
+    assert [event_id for event_id, _ in served] == [near_id, far_id]
+    assert served == uncached(client, monkeypatch, cache, a, limit=5)
+    assert cache.fallbacks == 1
+
+
+def test_dense_tiles_keep_only_the_closest_candidates(client, monkeypatch, register, create_event, cache):
+    monkeypatch.setattr(main, "DISCOVER_TILE_CANDIDATES", 3)
+    a, _ = tile_origins(cache)
+    seed(register("org"), create_event, a, [0.1, 0.2, 0.3, 0.4, 0.5])
+
+    assert discover(client, a, limit=2) == uncached(client, monkeypatch, cache, a, limit=2)
+    assert cache.fallbacks == 0
+    assert discover(client, a, limit=4) == uncached(client, monkeypatch, cache, a, limit=4)
+    assert cache.fallbacks == 1
+
+
+def test_mutations_invalidate_only_the_tiles_they_reach(client, register, create_event, cache):
+    a, _ = tile_origins(cache)
+    organizer = register("org")
+    seed(organizer, create_event, a, [0.5])
+    far = (a[0] + 5.0, a[1])  # ~550 km
+    discover(client, a)
+    discover(client, far)
+    assert len(cache) == 2
+
+    created = create_event(organizer, title="nuevo", location={"lat": a[0], "lng": a[1]})
+
+    assert len(cache) == 1 and cache.invalidations == 1
+    assert created["id"] in [event_id for event_id, _ in discover(client, a)]
+
+    discover(client, a, category="deportes")
+    create_event(organizer, title="otra categoría", category="cultural", location={"lat": a[0], "lng": a[1]})
+    # un evento "cultural" no toca el tile filtrado por deportes (ni el lejano)
+    assert sorted(str(key[2]) for key in cache._entries) == ["None", "deportes"]
+    client.patch(f"/events/{created['id']}/cancel", headers=organizer["headers"])
+    assert [event_id for event_id, _ in discover(client, a)].count(created["id"]) == 0
+
+
+def test_text_search_and_lists_without_position_skip_the_cache(client, register, create_event, cache):
+    organizer = register("org")
+    create_event(organizer, title="fulbito")
+
+    client.get("/events")
+    client.get("/events", params={"lat": -34.6, "lng": -58.4, "q": "fulbito", "search": "text"})
+
+    assert len(cache) == 0 and cache.misses == 0
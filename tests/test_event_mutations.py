@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+
+import main
+
+
+def test_mutate_event_conflict_when_event_changes_concurrently(memory_db, register, create_event):
+    organizer, applicant = register("org"), register("ana")
+    ev = create_event(organizer)
+    _id = ObjectId(ev["id"])
+    original = memory_db.events.find_one_and_update
+
+    async def racing_update(*args, **kwargs):
+        # Otra request cancela el evento justo antes y lo reactiva justo después:
+        # el filtro no matchea, pero la relectura ya no explica por qué
+        await memory_db.events.update_one({"_id": _id}, {"$set": {"activo": 2}})
+        try:
+            return await original(*args, **kwargs)
+        finally:
+            await memory_db.events.update_one({"_id": _id}, {"$set": {"activo": 1}})
+
+    memory_db.events.find_one_and_update = racing_update
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(main.roster.apply(_id, ObjectId(applicant["id"])))
+    assert exc.value.status_code == 409
+
+
+def test_mutate_event_reports_the_failed_check(client, register, create_event):
+    organizer, other = register("org"), register("ana")
+    ev = create_event(organizer)
+
+    response = client.patch(f"/events/{ev['id']}/cancel", headers=other["headers"])
+    assert response.status_code == 403
+
+    response = client.post(f"/events/{ev['id']}/apply", headers=organizer["headers"])
+    assert response.status_code == 400
+
+    response = client.patch(f"/events/{ObjectId()}/cancel", headers=organizer["headers"])
+    assert response.status_code == 404
+
+
+def test_my_events_buckets_in_one_aggregation(client, memory_db, register, create_event):
+    organizer = register("org")
+    upcoming = create_event(organizer, title="upcoming")
+    past = create_event(organizer, title="past", fecha_inicio="2020-01-01T10:00:00", fecha_fin="2020-01-01T12:00:00")
+    deleted = create_event(organizer, title="deleted")
+    client.delete(f"/events/{deleted['id']}", headers=organizer["headers"])
+    calls = []
+    original = memory_db.events.aggregate
+
+    def counting_aggregate(*args, **kwargs):
+        calls.append(args)
+        return original(*args, **kwargs)
+
+    memory_db.events.aggregate = counting_aggregate
+    body = client.get("/events/my", headers=organizer["headers"]).json()
+
+    assert len(calls) == 1
+    assert [e["id"] for e in body["activos_no_finalizados"]] == [upcoming["id"]]
+    assert [e["id"] for e in body["activos_finalizados"]] == [past["id"]]
+    assert [e["id"] for e in body["eliminados"]] == [deleted["id"]]
+    assert body["next_cursor"] is None
+
+
+def test_my_events_survives_an_empty_facet_result(client, memory_db, register):
+    organizer = register("org")
+
+    class EmptyCursor:
+        async def to_list(self, length=None):
+            return []
+
+    memory_db.events.aggregate = lambda *args, **kwargs: EmptyCursor()
+    response = client.get("/events/my", headers=organizer["headers"])
+
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["activos_no_finalizados"], body["activos_finalizados"], body["eliminados"]) == ([], [], [])
+    assert body["next_cursor"] is None
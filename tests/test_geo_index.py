@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+from bson import ObjectId
+
+import main
+
+ORIGIN = (-34.6, -58.4)
+
+
+@pytest.fixture(params=["numpy", "python"])
+def geo_index(request, monkeypatch) -> main.ActiveEventGeoIndex:
+    """Índice fresco habilitado, con y sin NumPy"""
+    if request.param == "python":
+        monkeypatch.setattr(main, "np", None)
+    elif main.np is None:
+        pytest.skip("NumPy no está instalado")
+    index = main.ActiveEventGeoIndex()
+    monkeypatch.setattr(main, "geo_index", index)
+    monkeypatch.setattr(main, "GEO_INDEX_ENABLED", True)
+    monkeypatch.setattr(main.discover_cache, "ttl", 0)  # que la comparación sea contra $geoNear
+    return index
+
+
+def seed_events(register, create_event) -> list[dict]:
+    organizer = register("org")
+    return [
+        create_event(
+            organizer,
+            title=f"e{i}",
+            category="deportes" if i % 2 else "cultural",
+            fecha_inicio=f"2030-01-0{1 + i}T10:00:00",
+            location={"lat": ORIGIN[0] + 0.01 * i, "lng": ORIGIN[1] + 0.005 * i},
+        )
+        for i in range(6)
+    ]
+
+
+def from_mongo(client, **params) -> list[tuple[str, float]]:
+    """La misma búsqueda resuelta con $geoNear (índice sin cargar)"""
+    body = client.get("/events", params={"lat": ORIGIN[0], "lng": ORIGIN[1], **params}).json()
+    return [(e["id"], round(e["distance_meters"], 3)) for e in body]
+
+
+@pytest.mark.parametrize("params", [
+    {},
+    {"category": "deportes"},
+    {"max_km": 2.5},
+    {"from_date": "2030-01-03T00:00:00", "to_date": "2030-01-05T00:00:00"},
+    {"limit": 2},
+])
+def test_nearest_matches_geo_near(client, register, create_event, geo_index, params):
+    seed_events(register, create_event)
+    expected = from_mongo(client, **params)
+    asyncio.run(geo_index.load())
+
+    served = from_mongo(client, **params)
+
+    assert served == expected and served
+    assert geo_index.queries == 1
+
+
+def test_distance_cursor_pages_through_the_index(client, register, create_event, geo_index):
+    created = seed_events(register, create_event)
+    asyncio.run(geo_index.load())
+    seen, after = [], None
+    while True:
+        params = {"lat": ORIGIN[0], "lng": ORIGIN[1], "limit": 4, **({"after": after} if after else {})}
+        response = client.get("/events", params=params)
+        seen += [e["id"] for e in response.json()]
+        after = response.headers.get("x-next-cursor")
+        if not after:
+            break
+
+    assert seen == [e["id"] for e in created]
+
+
+def test_mutations_keep_the_index_in_sync(client, register, create_event, geo_index):
+    asyncio.run(geo_index.load())
+    organizer = register("org")
+    kept, cancelled = create_event(organizer, title="kept"), create_event(organizer, title="cancelled")
+    assert len(geo_index) == 2
+
+    client.patch(f"/events/{cancelled['id']}/cancel", headers=organizer["headers"])
+
+    assert len(geo_index) == 1
+    assert [e["id"] for e in client.get("/events", params={"lat": ORIGIN[0], "lng": ORIGIN[1]}).json()] == [kept["id"]]
+
+
+def test_apply_change_handles_change_stream_events(geo_index):
+    geo_index.ready = True
+    doc = {
+        "_id": ObjectId(), "activo": 1, "title": "x", "category": "deportes",
+        "fecha_inicio": main.now(), "location": {"type": "Point", "coordinates": [ORIGIN[1], ORIGIN[0]]},
+    }
+    geo_index.apply_change({"operationType": "insert", "fullDocument": doc})
+    assert len(geo_index) == 1
+
+    geo_index.apply_change({"operationType": "update", "fullDocument": {**doc, "finalizado": True}})
+    assert len(geo_index) == 0
+
+    geo_index.apply_change({"operationType": "insert", "fullDocument": doc})
+    geo_index.apply_change({"operationType": "delete", "documentKey": {"_id": doc["_id"]}})
+    assert len(geo_index) == 0
+
+
+def test_falls_back_to_mongo_when_it_cannot_serve(client, register, create_event, geo_index):
+    seed_events(register, create_event)
+    asyncio.run(geo_index.load())
+
+    client.get("/events", params={"lat": ORIGIN[0], "lng": ORIGIN[1], "q": "e1"})
+    client.get("/events", params={"lat": ORIGIN[0], "lng": ORIGIN[1], "activo": 2})
+
+    assert geo_index.queries == 0
+    assert not main.ActiveEventGeoIndex().can_serve(1, None)  # sin cargar
@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import asyncio
+from datetime import timedelta
+
+import main
+
+
+def iso(dt) -> str:
+    return dt.replace(microsecond=0).isoformat()
+
+
+def event_with_participant(client, register, create_event, starts_in: timedelta, ends_in: timedelta):
+    organizer, participant = register("org"), register("ana")
+    t0 = main.now()
+    ev = create_event(organizer, fecha_inicio=iso(t0 + starts_in), fecha_fin=iso(t0 + ends_in))
+    client.post(f"/events/{ev['id']}/apply", headers=participant["headers"])
+    client.post(f"/events/{ev['id']}/accept", json={"user_id": participant["id"]}, headers=organizer["headers"])
+    return organizer, participant, ev
+
+
+def notification_types(client, user: dict) -> list[str]:
+    return [n["type"] for n in client.get("/notifications", headers=user["headers"]).json()]
+
+
+def test_pops_transitions_in_deadline_order_and_skips_unscheduled():
+    scheduler = main.EventLifecycleScheduler()
+    t0 = main.now()
+    scheduler.schedule("a", t0 + timedelta(seconds=10), t0 + timedelta(seconds=40))
+    scheduler.schedule("b", t0 + timedelta(seconds=20), t0 + timedelta(seconds=30))
+    scheduler.schedule("c", t0 + timedelta(seconds=5), t0 + timedelta(seconds=50))
+    scheduler.unschedule("c")
+
+    assert len(scheduler) == 4
+    assert scheduler._pop_due(t0 + timedelta(seconds=35)) == [("a", "start"), ("b", "start"), ("b", "end")]
+    assert scheduler._pop_due(t0 + timedelta(seconds=60)) == [("a", "end")]
+    assert len(scheduler) == 0 and scheduler._next_timeout() is None
+
+
+def test_rescheduling_replaces_the_previous_deadlines():
+    scheduler = main.EventLifecycleScheduler()
+    t0 = main.now()
+    scheduler.schedule("a", t0 + timedelta(seconds=10), t0 + timedelta(seconds=20))
+    scheduler.schedule("a", t0 + timedelta(seconds=100), t0 + timedelta(seconds=200))
+
+    assert scheduler._pop_due(t0 + timedelta(seconds=50)) == []
+    assert 90 < scheduler._next_timeout() <= 100
+
+
+def test_fire_start_notifies_confirmed_once(client, register, create_event):
+    organizer, participant, ev = event_with_participant(
+        client, register, create_event, starts_in=timedelta(seconds=-1), ends_in=timedelta(hours=1),
+    )
+    scheduler = main.EventLifecycleScheduler()
+
+    asyncio.run(scheduler.fire_start(ev["id"]))
+    asyncio.run(scheduler.fire_start(ev["id"]))  # otro worker con el mismo deadline
+
+    assert notification_types(client, participant).count("event_started") == 1
+    assert "event_started" not in notification_types(client, organizer)
+
+
+def test_fire_start_skips_an_event_that_already_ended(client, register, create_event):
+    _, participant, ev = event_with_participant(
+        client, register, create_event, starts_in=timedelta(hours=-2), ends_in=timedelta(hours=-1),
+    )
+
+    asyncio.run(main.EventLifecycleScheduler().fire_start(ev["id"]))
+
+    assert "event_started" not in notification_types(client, participant)
+
+
+def test_fire_end_reminds_the_organizer_once(client, register, create_event):
+    organizer, participant, ev = event_with_participant(
+        client, register, create_event, starts_in=timedelta(hours=-2), ends_in=timedelta(seconds=-1),
+    )
+    scheduler = main.EventLifecycleScheduler()
+
+    asyncio.run(scheduler.fire_end(ev["id"]))
+    asyncio.run(scheduler.fire_end(ev["id"]))
+
+    assert notification_types(client, organizer).count("event_ended") == 1
+    assert "event_ended" not in notification_types(client, participant)
+
+
+def test_no_end_reminder_for_cancelled_or_finalized_events(client, register, create_event):
+    organizer, _, cancelled = event_with_participant(
+        client, register, create_event, starts_in=timedelta(hours=-2), ends_in=timedelta(seconds=-1),
+    )
+    client.patch(f"/events/{cancelled['id']}/cancel", headers=organizer["headers"])
+
+    asyncio.run(main.EventLifecycleScheduler().fire_end(cancelled["id"]))
+
+    assert "event_ended" not in notification_types(client, organizer)
+
+
+def test_load_restores_pending_transitions_after_a_restart(client, register, create_event):
+    organizer = register("org")
+    t0 = main.now()
+    upcoming = create_event(organizer, title="upcoming", fecha_inicio=iso(t0 + timedelta(hours=1)), fecha_fin=iso(t0 + timedelta(hours=2)))
+    running = create_event(organizer, title="running", fecha_inicio=iso(t0 - timedelta(minutes=5)), fecha_fin=iso(t0 + timedelta(hours=1)))
+    create_event(organizer, title="old", fecha_inicio=iso(t0 - timedelta(days=3)), fecha_fin=iso(t0 - timedelta(days=2)))
+    asyncio.run(main.EventLifecycleScheduler().fire_start(running["id"]))
+
+    scheduler = main.EventLifecycleScheduler()
+    asyncio.run(scheduler.load())
+
+    assert set(scheduler._pending) == {
+        (upcoming["id"], "start"), (upcoming["id"], "end"), (running["id"], "end"),
+    }
+
+
+def test_run_fires_due_transitions_without_polling(client, register, create_event):
+    organizer, participant, ev = event_with_participant(
+        client, register, create_event, starts_in=timedelta(seconds=-1), ends_in=timedelta(seconds=1),
+    )
+    scheduler = main.EventLifecycleScheduler()
+
+    async def run_for(seconds: float):
+        task = asyncio.create_task(scheduler.run())
+        await asyncio.sleep(seconds)
+        task.cancel()
+
+    asyncio.run(run_for(1.5))
+
+    assert "event_started" in notification_types(client, participant)
+    assert "event_ended" in notification_types(client, organizer)
+    assert len(scheduler) == 0
@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import io
+import json
+import logging
+import queue
+import sys
+
+import pytest
+
+import main
+
+
+def record(msg: str = "hola", level: int = logging.INFO, name: str = "la_segunda.sse", **extra) -> logging.LogRecord:
+    rec = logging.LogRecord(name, level, __file__, 1, msg, None, None)
+    rec.__dict__.update(extra)
+    return rec
+
+
+@pytest.fixture
+def captured(monkeypatch):
+    """setup_logging() escribiendo en un buffer; al final deja los loggers como estaban"""
+    root = logging.getLogger("la_segunda")
+    handlers, level = root.handlers[:], root.level
+    levels = {name: logging.getLogger(f"la_segunda.{name}").level for name in ("sse", "http", "events")}
+    stream = io.StringIO()
+
+    def start(levels_spec: str = "", rate: float = 10):
+        monkeypatch.setattr(main, "LOG_LEVEL", "INFO")  # conftest lo baja a ERROR
+        monkeypatch.setattr(main, "LOG_LEVELS", levels_spec)
+        monkeypatch.setattr(main, "LOG_SAMPLE_RATE", rate)
+        return main.setup_logging(stream)
+
+    def lines(listener) -> list[dict]:
+        listener.stop()  # vacía la cola
+        return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+    yield start, lines
+    root.handlers[:] = handlers
+    root.setLevel(level)
+    for name, lvl in levels.items():
+        logging.getLogger(f"la_segunda.{name}").setLevel(lvl)
+
+
+def test_json_formatter_writes_one_object_with_extra_fields():
+    rec = record("fallo %s", level=logging.ERROR, user_id="u1")
+    rec.args = ("x",)
+    try:
+        raise RuntimeError("boom")
+    except RuntimeError:
+        rec.exc_info = sys.exc_info()
+
+    entry = json.loads(main.JsonLogFormatter().format(rec))
+
+    assert (entry["level"], entry["category"], entry["msg"], entry["user_id"]) == ("ERROR", "sse", "fallo x", "u1")
+    assert entry["ts"].endswith("+00:00") and "RuntimeError: boom" in entry["exc"]
+    assert "args" not in entry and "levelno" not in entry
+
+
+def test_sampler_limits_each_message_and_reports_suppressed(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(main.time, "monotonic", lambda: clock[0])
+    sampler = main.LogSampler(rate=2)
+
+    burst = [sampler.filter(record()) for _ in range(5)]
+    other = sampler.filter(record("otro mensaje"))
+    warning = sampler.filter(record(level=logging.WARNING))
+    clock[0] += 1
+    after = record()
+
+    assert burst == [True, True, False, False, False]
+    assert other and warning  # cada mensaje tiene su bucket; WARNING pasa siempre
+    assert sampler.filter(after) and after.suppressed == 3
+
+
+def test_sampling_disabled_with_rate_zero():
+    sampler = main.LogSampler(rate=0)
+    assert all(sampler.filter(record()) for _ in range(100))
+
+
+def test_full_queue_drops_instead_of_blocking():
+    handler = main.LogQueueHandler(queue.Queue(1))
+    handler.handle(record())
+    handler.handle(record())
+
+    assert handler.dropped == 1
+
+
+def test_levels_per_category(captured):
+    start, lines = captured
+    listener = start("sse=DEBUG, http=WARNING")
+
+    main.log_sse.debug("sse debug")
+    main.log_http.info("http info")
+    main.log_http.warning("http warning")
+    main.log_events.debug("events debug")  # nivel por defecto (INFO)
+
+    assert [(e["category"], e["msg"]) for e in lines(listener)] == [("sse", "sse debug"), ("http", "http warning")]
+
+
+def test_request_log_line_without_headers_or_body(captured, client, register):
+    start, lines = captured
+    listener = start()
+    user = register("ana")
+
+    client.get("/users/me", headers=user["headers"])
+
+    request = [e for e in lines(listener) if e["msg"] == "request" and e["path"] == "/users/me"]
+    assert len(request) == 1
+    assert request[0]["method"] == "GET" and request[0]["status"] == 200 and request[0]["duration_ms"] >= 0
+    assert "headers" not in request[0] and "body" not in request[0]
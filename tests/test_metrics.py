@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def metrics(monkeypatch) -> main.Metrics:
+    fresh = main.Metrics()
+    monkeypatch.setattr(main, "metrics", fresh)
+    monkeypatch.setattr(main, "METRICS_ENABLED", True)
+    return fresh
+
+
+def scrape(client) -> dict[str, float]:
+    response = client.get("/metrics")
+    assert response.status_code == 200 and response.headers["content-type"].startswith("text/plain")
+    samples = {}
+    for line in response.text.splitlines():
+        if line and not line.startswith("#"):
+            name, _, value = line.rpartition(" ")
+            samples[name] = float(value)
+    return samples
+
+
+def test_histogram_buckets_are_cumulative():
+    hist = main.Histogram((0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        hist.observe(value)
+    out: list[str] = []
+    hist.expose("x_seconds", 'route="/a"', out)
+
+    assert out == [
+        'x_seconds_bucket{route="/a",le="0.1"} 2',
+        'x_seconds_bucket{route="/a",le="1.0"} 3',
+        'x_seconds_bucket{route="/a",le="+Inf"} 4',
+        'x_seconds_sum{route="/a"} 3.65',
+        'x_seconds_count{route="/a"} 4',
+    ]
+
+
+def test_requests_are_labelled_by_route_template(metrics, client, register, create_event):
+    organizer = register("org")
+    ev = create_event(organizer)
+    client.get(f"/events/{ev['id']}")
+    client.get(f"/events/{main.ObjectId()}")
+    client.get("/no-existe")
+
+    samples = scrape(client)
+
+    assert samples['http_request_duration_seconds_count{method="GET",route="/events/{event_id}"}'] == 2
+    assert samples['http_responses_total{method="GET",route="/events/{event_id}",status="2xx"}'] == 1
+    assert samples['http_responses_total{method="GET",route="/events/{event_id}",status="4xx"}'] == 1
+    assert samples['http_responses_total{method="GET",route="unmatched",status="4xx"}'] == 1
+    assert not any(ev["id"] in name for name in samples)
+
+
+def test_scrape_reads_current_state(metrics, client):
+    stream = main.sse_registry.open("u1")
+    try:
+        samples = scrape(client)
+    finally:
+        main.sse_registry.close(stream)
+
+    assert samples["sse_streams_open"] == 1
+    assert samples["rabbitmq_consumer_connected"] == 0
+    assert "rabbitmq_queue_depth" in samples
+
+
+def test_disabled_metrics_404_and_record_nothing(metrics, client, monkeypatch):
+    monkeypatch.setattr(main, "METRICS_ENABLED", False)
+    client.get("/health")
+
+    assert client.get("/metrics").status_code == 404
+    assert metrics.routes == {}
+
+
+def test_mongo_command_timings_are_merged_across_threads():
+    listener = main.MongoCommandMetrics()
+
+    def commands(request_ids):
+        for request_id in request_ids:
+            listener.started(SimpleNamespace(command={"find": "events"}, command_name="find", request_id=request_id))
+            listener.succeeded(SimpleNamespace(command_name="find", request_id=request_id, duration_micros=2000))
+        listener.started(SimpleNamespace(command={"getMore": 1, "collection": "events"}, command_name="getMore", request_id=-1))
+        listener.failed(SimpleNamespace(command_name="getMore", request_id=-1, duration_micros=500))
+
+    threads = [threading.Thread(target=commands, args=(range(n * 10, n * 10 + 3),)) for n in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    merged = listener.merged()
+    assert sum(merged["ok", "find", "events"].counts) == 6
+    assert merged["ok", "find", "events"].total == pytest.approx(0.012)
+    assert sum(merged["failed", "getMore", "events"].counts) == 2
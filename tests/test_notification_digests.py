@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import asyncio
+
+from bson import ObjectId
+
+import main
+
+
+def test_replay_resends_a_digest_revised_after_last_event_id(monkeypatch, register):
+    monkeypatch.setattr(main, "NOTIFICATION_COALESCE_WINDOW", 600)
+    organizer = register("org")
+    organizer_id, event_id = ObjectId(organizer["id"]), str(ObjectId())
+
+    async def scenario():
+        await main.publish_notification(organizer["id"], "new_application", "Nueva", "ana quiere unirse", event_id, "F")
+        digest = await main.db.notifications.find_one({"user_id": organizer_id})
+        # el cliente vio la primera revisión; el digest cambia mientras está desconectado
+        await main.publish_notification(organizer["id"], "new_application", "Nueva", "beto quiere unirse", event_id, "F")
+        return digest, await main.load_sse_replay(organizer_id, digest["rev"])
+
+    digest, (payloads, _) = asyncio.run(scenario())
+    assert [(p["id"], p["count"]) for p in payloads] == [(str(digest["_id"]), 2)]
+    assert payloads[0]["rev"] != str(digest["rev"])
+
+
+def test_replay_merges_revised_digests_and_new_notifications_in_one_query(memory_db, monkeypatch, register):
+    monkeypatch.setattr(main, "NOTIFICATION_COALESCE_WINDOW", 600)
+    organizer = register("org")
+    organizer_id, event_id = ObjectId(organizer["id"]), str(ObjectId())
+    finds = []
+    original = memory_db.notifications.find
+
+    async def scenario():
+        await main.publish_notification(organizer["id"], "new_application", "Nueva", "ana quiere unirse", event_id, "F")
+        last_seen = (await main.db.notifications.find_one({"user_id": organizer_id}))["rev"]
+        await main.publish_notification(organizer["id"], "application_accepted", "ok", "m")
+        await main.publish_notification(organizer["id"], "new_application", "Nueva", "beto quiere unirse", event_id, "F")
+
+        def counting_find(*args, **kwargs):
+            finds.append(args)
+            return original(*args, **kwargs)
+
+        memory_db.notifications.find = counting_find
+        return await main.load_sse_replay(organizer_id, last_seen)
+
+    payloads, truncated = asyncio.run(scenario())
+    # en orden de su última revisión: la aceptada y después el digest actualizado
+    assert [(p["type"], p["count"]) for p in payloads] == [("application_accepted", 1), ("new_application", 2)]
+    assert len(finds) == 1 and not truncated
+
+
+def test_applications_coalesce_into_one_digest(client, monkeypatch, exchange, register):
+    monkeypatch.setattr(main, "NOTIFICATION_COALESCE_WINDOW", 600)
+    organizer = register("org")
+    event_id = str(ObjectId())
+
+    async def apply_many():
+        for i in range(12):
+            await main.publish_notification(organizer["id"], "new_application", "Nueva", f"user{i} quiere unirse", event_id, "Fulbito")
+        await main.publish_notification(organizer["id"], "application_accepted", "ok", "m", event_id, "Fulbito")
+
+    asyncio.run(apply_many())
+
+    notifications = client.get("/notifications", headers=organizer["headers"]).json()
+    assert sorted(n["count"] for n in notifications) == [1, 12]
+    assert client.get("/notifications/unread_count", headers=organizer["headers"]).json() == {"unread": 2}
+
+    digest = next(n for n in notifications if n["count"] == 12)
+    client.patch(f"/notifications/{digest['id']}/read", headers=organizer["headers"])
+    asyncio.run(main.publish_notification(organizer["id"], "new_application", "Nueva", "otro", event_id, "Fulbito"))
+    assert client.get("/notifications/unread_count", headers=organizer["headers"]).json() == {"unread": 2}
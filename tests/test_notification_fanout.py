@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+
+def confirmed_event(client, register, create_event, participants: int) -> tuple[dict, dict, list[dict]]:
+    organizer = register("org")
+    ev = create_event(organizer)
+    users = [register(f"p{i}") for i in range(participants)]
+    for user in users:
+        assert client.post(f"/events/{ev['id']}/apply", headers=user["headers"]).status_code == 200
+    for user in users[: participants // 2]:
+        response = client.post(f"/events/{ev['id']}/accept", json={"user_id": user["id"]}, headers=organizer["headers"])
+        assert response.status_code == 200
+    return organizer, ev, users
+
+
+def notification_types(client, user: dict) -> list[str]:
+    return [n["type"] for n in client.get("/notifications", headers=user["headers"]).json()]
+
+
+def test_cancel_fans_out_with_a_single_insert_many(client, memory_db, exchange, register, create_event):
+    organizer, ev, users = confirmed_event(client, register, create_event, participants=6)
+    exchange.published.clear()
+    inserts = []
+    original = memory_db.notifications.insert_many
+
+    async def counting_insert_many(docs, *args, **kwargs):
+        inserts.append(len(docs))
+        return await original(docs, *args, **kwargs)
+
+    memory_db.notifications.insert_many = counting_insert_many
+    response = client.patch(f"/events/{ev['id']}/cancel", headers=organizer["headers"])
+
+    assert response.status_code == 200
+    assert inserts == [len(users)]  # confirmados + pendientes en un solo insert_many
+    cancelled = [payload for _, payload in exchange.published if payload["type"] == "event_cancelled"]
+    assert sorted(p["user_id"] for p in cancelled) == sorted(u["id"] for u in users)
+    for user in users:
+        types = notification_types(client, user)
+        assert types.count("event_cancelled") == 1
+        # el contador de no leídas también se actualizó en lote
+        assert client.get("/notifications/unread_count", headers=user["headers"]).json() == {"unread": len(types)}
+
+
+def test_complete_notifies_only_confirmed(client, register, create_event):
+    organizer, ev, users = confirmed_event(client, register, create_event, participants=4)
+
+    response = client.post(f"/events/{ev['id']}/complete", headers=organizer["headers"])
+
+    assert response.status_code == 200
+    finished = [u for u in users if "event_finished" in notification_types(client, u)]
+    assert finished == users[:2]
@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+import asyncio
+import gzip
+from datetime import timedelta
+
+from bson import json_util
+
+import main
+
+
+def test_archiver_moves_overflow_and_old_read_notifications(client, monkeypatch, register):
+    monkeypatch.setattr(main, "NOTIFICATION_MAX_PER_USER", 3)
+    monkeypatch.setattr(main, "NOTIFICATION_READ_TTL_DAYS", 30)
+    monkeypatch.setattr(main, "NOTIFICATION_ARCHIVE", "collection")
+    ana, beto = register("ana"), register("beto")
+
+    async def seed():
+        t0 = main.now() - timedelta(days=60)
+        for i in range(5):
+            doc = main.notification_doc(ana["id"], "x", f"a{i}", "m")
+            doc["created_at"] = t0 + timedelta(days=i)
+            await main.db.notifications.insert_one(doc)
+        for i, read in enumerate([True, False]):
+            doc = main.notification_doc(beto["id"], "x", f"b{i}", "m")
+            doc["created_at"], doc["read"] = t0, read
+            await main.db.notifications.insert_one(doc)
+
+    asyncio.run(seed())
+    assert client.get("/notifications/unread_count", headers=ana["headers"]).json() == {"unread": 5}
+
+    moved = asyncio.run(main.notification_archiver.run_once())
+
+    assert moved == 3  # las 2 más viejas de ana (exceden 3) y la leída vieja de beto
+    assert [n["title"] for n in client.get("/notifications", headers=ana["headers"]).json()] == ["a4", "a3", "a2"]
+    assert [n["title"] for n in client.get("/notifications", headers=beto["headers"]).json()] == ["b1"]
+    archived = client.get("/notifications", params={"include_archived": "true"}, headers=ana["headers"]).json()
+    assert [n["title"] for n in archived] == ["a4", "a3", "a2", "a1", "a0"]
+    # el contador de ana se recuenta después de mover no leídas
+    assert client.get("/notifications/unread_count", headers=ana["headers"]).json() == {"unread": 3}
+    assert asyncio.run(main.notification_archiver.run_once()) == 0
+
+
+def test_files_mode_writes_gzip_ndjson_in_batches(client, monkeypatch, tmp_path, register):
+    monkeypatch.setattr(main, "NOTIFICATION_MAX_PER_USER", 1)
+    monkeypatch.setattr(main, "NOTIFICATION_ARCHIVE", "files")
+    monkeypatch.setattr(main, "NOTIFICATION_ARCHIVE_DIR", str(tmp_path))
+    monkeypatch.setattr(main, "NOTIFICATION_ARCHIVE_BATCH", 2)
+    ana = register("ana")
+
+    async def seed():
+        for i in range(6):
+            await main.publish_notification(ana["id"], "application_accepted", f"a{i}", "m")
+
+    asyncio.run(seed())
+
+    assert asyncio.run(main.NotificationArchiver().run_once()) == 5
+    [archive] = tmp_path.iterdir()
+    with gzip.open(archive, "rt") as f:
+        titles = sorted(json_util.loads(line)["title"] for line in f)
+    assert titles == ["a0", "a1", "a2", "a3", "a4"]
+    assert [n["title"] for n in client.get("/notifications", headers=ana["headers"]).json()] == ["a5"]
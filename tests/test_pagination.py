@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import pytest
+
+
+def page_through(client, path: str, limit: int, headers: dict | None = None, **params) -> list[dict]:
+    """Recorre todas las páginas siguiendo X-Next-Cursor"""
+    items, after = [], None
+    while True:
+        response = client.get(path, params={"limit": limit, **params, **({"after": after} if after else {})}, headers=headers)
+        assert response.status_code == 200, response.text
+        items += response.json()
+        after = response.headers.get("x-next-cursor")
+        if not after:
+            return items
+
+
+def test_events_keyset_pagination_covers_ties_without_duplicates(client, register, create_event):
+    organizer = register("org")
+    # Varios eventos con la misma fecha_inicio: el cursor desempata por _id
+    created = [
+        create_event(organizer, title=f"e{i}", fecha_inicio=f"2030-01-0{1 + i // 3}T10:00:00")["id"]
+        for i in range(8)
+    ]
+
+    seen = [e["id"] for e in page_through(client, "/events", limit=3)]
+
+    assert len(seen) == len(set(seen)) == len(created)
+    assert set(seen) == set(created)
+
+
+def test_events_geo_pagination_follows_the_distance_cursor(client, register, create_event):
+    organizer = register("org")
+    created = [
+        create_event(organizer, title=f"e{i}", location={"lat": -34.6 + i * 0.01, "lng": -58.4})["id"]
+        for i in range(5)
+    ]
+
+    seen = page_through(client, "/events", limit=2, lat=-34.6, lng=-58.4)
+
+    assert [e["id"] for e in seen] == created
+    assert [e["distance_meters"] for e in seen] == sorted(e["distance_meters"] for e in seen)
+
+
+def test_events_rejects_a_malformed_cursor(client):
+    assert client.get("/events", params={"after": "garbage"}).status_code == 400
+
+
+@pytest.mark.parametrize("path, params", [("/events", {}), ("/events/search", {"q": "fulbito"}), ("/notifications", {})])
+def test_skip_cannot_be_combined_with_a_cursor(client, register, create_event, path, params):
+    organizer = register("org")
+    for i in range(3):
+        create_event(organizer, title=f"fulbito {i}")
+    first = client.get(path, params={**params, "limit": 1}, headers=organizer["headers"])
+    after = first.headers.get("x-next-cursor") or "irrelevante"
+
+    response = client.get(path, params={**params, "limit": 1, "skip": 1, "after": after}, headers=organizer["headers"])
+
+    assert response.status_code == 400
+    assert client.get(path, params={**params, "limit": 1, "skip": 1}, headers=organizer["headers"]).status_code == 200
+
+
+def test_notifications_keyset_pagination(client, register, create_event):
+    organizer = register("org")
+    ev = create_event(organizer)
+    for i in range(5):
+        client.post(f"/events/{ev['id']}/apply", headers=register(f"p{i}")["headers"])
+
+    seen = page_through(client, "/notifications", limit=2, headers=organizer["headers"])
+
+    assert len(seen) == len({n["id"] for n in seen}) == 5
@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+import pytest
+
+import main
+
+
+@pytest.fixture(params=["embedded", "collection"], autouse=True)
+def roster(request, monkeypatch):
+    """Los tests corren con los dos ROSTER_STORAGE"""
+    backend = main.CollectionRoster() if request.param == "collection" else main.EmbeddedRoster()
+    monkeypatch.setattr(main, "roster", backend)
+    return backend
+
+
+def page_through(client, path: str, limit: int, **params) -> list[dict]:
+    """Recorre todas las páginas siguiendo X-Next-Cursor"""
+    items, after = [], None
+    while True:
+        response = client.get(path, params={"limit": limit, **params, **({"after": after} if after else {})})
+        assert response.status_code == 200, response.text
+        items += response.json()
+        after = response.headers.get("x-next-cursor")
+        if not after:
+            return items
+
+
+def test_participants_keyset_pagination(client, register, create_event):
+    organizer = register("org")
+    applicants = [register(f"p{i}") for i in range(5)]
+    ev = create_event(organizer)
+    for applicant in applicants:
+        assert client.post(f"/events/{ev['id']}/apply", headers=applicant["headers"]).status_code == 200
+
+    pending = page_through(client, f"/events/{ev['id']}/participants", limit=2, status="pending")
+
+    assert [p["name"] for p in pending] == [a["name"] for a in applicants]
+
+
+def test_lists_follow_accept_and_reject_with_blacklist(client, register, create_event):
+    organizer, ana, beto, caro = register("org"), register("ana"), register("beto"), register("caro")
+    ev = create_event(organizer)
+    for user in (ana, beto, caro):
+        client.post(f"/events/{ev['id']}/apply", headers=user["headers"])
+
+    client.post(f"/events/{ev['id']}/accept", json={"user_id": ana["id"]}, headers=organizer["headers"])
+    client.post(f"/events/{ev['id']}/reject", json={"user_id": beto["id"]}, headers=organizer["headers"])
+    response = client.post(f"/events/{ev['id']}/reject", json={"user_id": caro["id"], "blacklist": True}, headers=organizer["headers"])
+    assert response.status_code == 200
+
+    def names(status: str) -> list[str]:
+        return [p["name"] for p in page_through(client, f"/events/{ev['id']}/participants", limit=10, status=status)]
+
+    assert (names("confirmed"), names("pending"), names("blacklisted")) == (["ana"], [], ["caro"])
+    counts = client.get(f"/events/{ev['id']}", params={"view": "compact"}).json()
+    assert (counts["confirmed_count"], counts["pending_count"]) == (1, 0)
+    # el rechazado sin blacklist puede volver a postularse; el bloqueado no
+    assert client.post(f"/events/{ev['id']}/apply", headers=beto["headers"]).status_code == 200
+    assert client.post(f"/events/{ev['id']}/apply", headers=caro["headers"]).status_code == 403
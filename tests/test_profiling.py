@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+
+@pytest.fixture
+def profiled(monkeypatch, tmp_path, exchange) -> TestClient:
+    """La app con RequestProfilerMiddleware (en main sólo se instala si PROFILING al importar)"""
+    monkeypatch.setattr(main, "PROFILING", True)
+    monkeypatch.setattr(main, "PROFILE_HEADER", True)
+    monkeypatch.setattr(main, "PROFILE_DIR", str(tmp_path))
+    return TestClient(main.RequestProfilerMiddleware(main.app))
+
+
+def slow_log(tmp_path) -> list[dict]:
+    path = tmp_path / "slow_requests.ndjson"
+    if not path.exists():
+        return []
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def test_header_writes_the_request_with_its_awaits(profiled, tmp_path, register, create_event):
+    organizer, ana = register("org"), register("ana")
+    ev = create_event(organizer)
+
+    response = profiled.post(f"/events/{ev['id']}/apply", headers={**ana["headers"], "X-Profile": "1"})
+
+    assert response.status_code == 200
+    [line] = slow_log(tmp_path)
+    assert (line["method"], line["route"], line["status"], line["trigger"]) == ("POST", "/events/{event_id}/apply", 200, "header")
+    assert line["path"] == f"/events/{ev['id']}/apply"
+    assert {"kind": "rabbitmq", "name": "publish"} in [{"kind": a["kind"], "name": a["name"]} for a in line["awaits"]]
+
+
+def test_without_header_nothing_is_written(profiled, tmp_path, register):
+    profiled.get("/users/me", headers=register("ana")["headers"])
+
+    assert slow_log(tmp_path) == []
+
+
+def test_excluded_paths_are_never_profiled(profiled, tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "METRICS_ENABLED", True)
+    profiled.get("/metrics", headers={"X-Profile": "1"})
+
+    assert slow_log(tmp_path) == []
+
+
+def test_slow_threshold_keeps_only_slow_requests(profiled, tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "PROFILE_SLOW_MS", 60_000)
+    profiled.get("/health")
+    monkeypatch.setattr(main, "PROFILE_SLOW_MS", 1e-6)
+    profiled.get("/categories")
+
+    assert [(line["route"], line["trigger"]) for line in slow_log(tmp_path)] == [("/categories", "slow")]
+
+
+def test_write_dumps_folded_stacks(monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "PROFILE_DIR", str(tmp_path))
+    profile = main.RequestProfile("GET", "/events/abc", "sample")
+    profile.stacks.update({"main.py:list_events;main.py:query_events": 3, "main.py:list_events": 1})
+
+    profile.write("/events/{event_id}", 200, 0.0123)
+
+    [line] = slow_log(tmp_path)
+    assert line["samples"] == 4 and line["duration_ms"] == 12.3
+    assert os.path.basename(line["profile"]).endswith("-GET-events_event_id-12ms.folded")
+    with open(line["profile"]) as f:
+        assert f.read().splitlines() == ["main.py:list_events;main.py:query_events 3", "main.py:list_events 1"]
+
+
+def busy(seconds: float):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+def test_stack_sampler_attributes_loop_stacks_to_the_active_request(monkeypatch):
+    monkeypatch.setattr(main, "PROFILE_INTERVAL_MS", 1)
+    sampler = main.StackSampler()
+    profile = main.RequestProfile("GET", "/x", "header")
+
+    async def request():
+        sampler.active[asyncio.current_task()] = profile
+        busy(0.1)
+        sampler.active.clear()
+
+    async def scenario():
+        sampler.start(asyncio.get_running_loop())
+        try:
+            await request()
+        finally:
+            sampler.stop()
+
+    asyncio.run(scenario())
+
+    assert any(stack.rsplit(";", 2)[-2:] == ["test_profiling.py:request", "test_profiling.py:busy"] for stack in profile.stacks)
@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+import asyncio
+import json
+
+import pytest
+
+import main
+
+
+class FakeMessage:
+    """Stand-in de un IncomingMessage: registra acks y nacks"""
+
+    def __init__(self, tag: int, body=None, log: list | None = None):
+        self.delivery_tag = tag
+        self.body = body if isinstance(body, bytes) else json.dumps(body or {"user_id": "u1"}).encode()
+        self.content_type = "application/json"
+        self.routing_key = "notifications"
+        self.log = log if log is not None else []
+
+    async def ack(self, multiple: bool = False):
+        self.log.append(("ack", self.delivery_tag, multiple))
+
+    async def nack(self, requeue: bool = True):
+        self.log.append(("nack", self.delivery_tag, requeue))
+
+
+class DeadExchange:
+    def __init__(self, fail: bool = False, block: bool = False):
+        self.fail = fail
+        self.block = block
+        self.published: list = []
+
+    async def publish(self, message, routing_key: str):
+        if self.block:
+            await asyncio.Event().wait()
+        if self.fail:
+            raise ConnectionError("canal cerrado")
+        self.published.append(message)
+
+
+def received(batcher: main.AckBatcher, log: list, tags, body=None) -> dict[int, FakeMessage]:
+    messages = {tag: FakeMessage(tag, body, log) for tag in tags}
+    for message in messages.values():
+        batcher.received(message)
+    return messages
+
+
+def test_acks_up_to_the_highest_contiguous_tag():
+    log: list = []
+    batcher = main.AckBatcher(max_batch=100, interval=60)
+    messages = received(batcher, log, range(1, 6))
+
+    async def scenario():
+        for tag in (1, 2, 4):
+            await batcher.done(messages[tag])
+        await batcher.flush()
+        await batcher.done(messages[3])
+        await batcher.flush()
+        await batcher.done(messages[5])
+        await batcher.flush()
+        batcher._timer.cancel()
+
+    asyncio.run(scenario())
+
+    assert log == [("ack", 2, True), ("ack", 4, True), ("ack", 5, True)]
+    assert (batcher.frames, batcher.acked) == (3, 5)
+
+
+def test_a_settled_tag_advances_the_watermark_without_being_acked():
+    log: list = []
+    batcher = main.AckBatcher(max_batch=3, interval=60)
+    messages = received(batcher, log, range(1, 4))
+
+    async def scenario():
+        await batcher.done(messages[1])
+        batcher.settle(messages[2])
+        await batcher.done(messages[3])  # tercer tag resuelto: lote lleno
+        batcher._timer.cancel()
+
+    asyncio.run(scenario())
+
+    assert log == [("ack", 3, True)] and batcher.acked == 2
+
+
+@pytest.fixture
+def consumer(monkeypatch) -> main.NotificationConsumer:
+    monkeypatch.setattr(main, "deliver_notification", lambda data: True)
+    consumer = main.NotificationConsumer()
+    consumer.batcher = main.AckBatcher(max_batch=100, interval=60)
+    consumer.dead_exchange = DeadExchange()
+    return consumer
+
+
+def run_handlers(consumer: main.NotificationConsumer, messages, cancel_after: float | None = None):
+    """Corre handle() como consume(): un task por mensaje; stop() espera (o cancela) y ackea"""
+    async def scenario():
+        slots = asyncio.Semaphore(len(messages))
+        for message in messages:
+            await slots.acquire()
+            consumer.batcher.received(message)
+            consumer.in_flight += 1
+            task = asyncio.create_task(consumer.handle(message, consumer.batcher, slots))
+            consumer._handlers.add(task)
+            task.add_done_callback(consumer._handlers.discard)
+        await consumer.stop(timeout=cancel_after if cancel_after is not None else 1)
+        if consumer.batcher._timer is not None:
+            consumer.batcher._timer.cancel()
+
+    asyncio.run(scenario())
+
+
+def test_bad_payloads_go_to_the_dlq_and_are_acked(consumer):
+    log: list = []
+    messages = [FakeMessage(1, b"{no es json", log), FakeMessage(2, {"type": "x"}, log), FakeMessage(3, None, log)]
+
+    run_handlers(consumer, messages)
+
+    errors = [m.headers["x-error"] for m in consumer.dead_exchange.published]
+    assert errors[0].startswith("JSONDecodeError") and errors[1] == "ValueError: mensaje sin user_id"
+    assert (consumer.dead_lettered, consumer.delivered) == (2, 1)
+    assert log == [("ack", 3, True)] and consumer.in_flight == 0
+
+
+def test_dlq_failure_nacks_without_blocking_later_acks(consumer):
+    log: list = []
+    consumer.dead_exchange = DeadExchange(fail=True)
+
+    run_handlers(consumer, [FakeMessage(1, b"basura", log), FakeMessage(2, None, log)])
+
+    assert log == [("nack", 1, False), ("ack", 2, True)]
+
+
+def test_cancelled_handler_is_requeued_and_does_not_stall_the_watermark(consumer):
+    log: list = []
+    consumer.dead_exchange = DeadExchange(block=True)  # el publish a la DLQ nunca vuelve
+
+    run_handlers(consumer, [FakeMessage(1, None, log), FakeMessage(2, b"basura", log), FakeMessage(3, None, log)], cancel_after=0.05)
+
+    assert ("nack", 2, True) in log
+    assert log[-1] == ("ack", 3, True)  # el 1 y el 3 en un solo ack; el 2 ya quedó resuelto
+    assert consumer.batcher.acked == 2 and consumer.in_flight == 0
+
+
+def test_odd_created_at_does_not_dead_letter(consumer):
+    log: list = []
+    messages = [
+        FakeMessage(1, {"user_id": "u1", "created_at": "ayer"}, log),
+        FakeMessage(2, {"user_id": "u1", "created_at": main.now().isoformat()}, log),
+    ]
+
+    run_handlers(consumer, messages)
+
+    assert consumer.dead_lettered == 0 and consumer.delivered == 2
+    assert log == [("ack", 2, True)] and len(consumer._latencies) == 1
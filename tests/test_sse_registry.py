@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import asyncio
+import json
+
+import main
+
+
+def payload(n: int, event_id: str = "e1", kind: str = "new_application") -> dict:
+    return {"id": f"{n:024x}", "user_id": "u1", "type": kind, "event_id": event_id, "message": f"m{n}"}
+
+
+def drain(stream: main.SSEStream) -> list[dict]:
+    """Payloads encolados en stream (sin esperar: el buffer ya tiene todo lo publicado)"""
+    async def frames():
+        return [await stream.next_frame(timeout=0) for _ in range(len(stream._buffer))]
+    return [json.loads(frame.split("data: ", 1)[1]) for _, frame in asyncio.run(frames())]
+
+
+def test_publish_reaches_every_tab_of_the_user():
+    registry = main.SSEStreamRegistry(maxsize=10, policy="drop_oldest")
+    tabs = [registry.open("u1"), registry.open("u1")]
+    other = registry.open("u2")
+
+    assert registry.publish("u1", payload(1)) == 2
+    assert registry.publish("u3", payload(2)) == 0
+
+    assert [[p["message"] for p in drain(tab)] for tab in tabs] == [["m1"], ["m1"]]
+    assert drain(other) == []
+    assert len(registry) == 3 and registry.user_ids() == ["u1", "u2"]
+
+
+def test_drop_oldest_keeps_the_newest_frames():
+    registry = main.SSEStreamRegistry(maxsize=3, policy="drop_oldest")
+    stream = registry.open("u1")
+    for n in range(5):
+        registry.publish("u1", payload(n, event_id=f"e{n}"))
+
+    assert [p["message"] for p in drain(stream)] == ["m2", "m3", "m4"]
+    assert stream.dropped == 2 and not stream.closed
+
+
+def test_coalesce_replaces_the_pending_frame_of_the_same_event():
+    registry = main.SSEStreamRegistry(maxsize=2, policy="coalesce")
+    stream = registry.open("u1")
+    registry.publish("u1", payload(1, event_id="e1"))
+    registry.publish("u1", payload(2, event_id="e2"))
+    registry.publish("u1", payload(3, event_id="e1"))  # buffer lleno: pisa al m1
+    registry.publish("u1", payload(4, event_id="e3"))  # sin par: drop_oldest
+
+    assert [p["message"] for p in drain(stream)] == ["m2", "m4"]
+    assert (stream.coalesced, stream.dropped) == (1, 1)
+
+
+def test_disconnect_closes_only_the_slow_stream():
+    registry = main.SSEStreamRegistry(maxsize=2, policy="disconnect")
+    slow, fast = registry.open("u1"), registry.open("u1")
+    registry.publish("u1", payload(1))
+    registry.publish("u1", payload(2))
+    drain(fast)
+    registry.publish("u1", payload(3))
+
+    assert slow.closed and slow.dropped == 3
+    assert not fast.closed and [p["message"] for p in drain(fast)] == ["m3"]
+
+
+def test_close_is_idempotent_and_frees_the_user():
+    registry = main.SSEStreamRegistry(maxsize=2, policy="drop_oldest")
+    stream = registry.open("u1")
+    registry.close(stream)
+    registry.close(stream)
+
+    assert len(registry) == 0 and "u1" not in registry
+    assert registry.publish("u1", payload(1)) == 0
+
+
+def test_next_frame_times_out_for_keepalive_and_wakes_on_close():
+    stream = main.SSEStreamRegistry(maxsize=2, policy="drop_oldest").open("u1")
+
+    async def scenario():
+        keepalive = await stream.next_frame(timeout=0.01)
+        waiter = asyncio.create_task(stream.next_frame(timeout=5))
+        await asyncio.sleep(0.01)
+        stream.close()
+        return keepalive, await asyncio.wait_for(waiter, 1)
+
+    assert asyncio.run(scenario()) == (None, None)
+
+
+def test_stats_report_lag_and_buffered_frames():
+    registry = main.SSEStreamRegistry(maxsize=5, policy="drop_oldest")
+    registry.open("u1")
+    registry.open("u2")
+    registry.publish("u1", payload(1))
+
+    stats = registry.stats()
+    assert (stats["streams"], stats["users"], stats["buffered_frames"]) == (2, 2, 1)
+    assert stats["per_stream"][0]["user_id"] == "u1"
+    assert registry.stats(user_id="u2")["buffered_frames"] == 0
@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import asyncio
+
+from bson import ObjectId
+
+import main
+
+
+def payload(oid: ObjectId, **fields) -> dict:
+    return {"id": str(oid), "user_id": "u1", "type": "application_accepted", **fields}
+
+
+def test_ring_returns_what_came_after_the_last_seen_id():
+    ring = main.NotificationReplayBuffer(per_user=10, max_users=10)
+    ids = [ObjectId() for _ in range(4)]
+    for oid in ids:
+        ring.record("u1", payload(oid))
+
+    assert [p["id"] for p in ring.after("u1", ids[1])] == [str(ids[2]), str(ids[3])]
+    assert ring.after("u1", ids[3]) == []
+    assert (ring.hits, ring.misses) == (2, 0)
+
+
+def test_ring_misses_when_the_gap_is_older_than_the_buffer():
+    ring = main.NotificationReplayBuffer(per_user=2, max_users=10)
+    ids = [ObjectId() for _ in range(4)]
+    for oid in ids:
+        ring.record("u1", payload(oid))
+
+    assert ring.after("u1", ids[0]) is None  # ya salió del deque
+    assert ring.after("u2", ids[0]) is None  # usuario sin ring
+    assert ring.stats()["misses"] == 2
+
+
+def test_ring_evicts_the_least_recently_used_user():
+    ring = main.NotificationReplayBuffer(per_user=4, max_users=2)
+    ring.record("u1", payload(ObjectId()))
+    ring.record("u2", payload(ObjectId()))
+    ring.record("u1", payload(ObjectId()))  # u1 vuelve a ser el más reciente
+    ring.record("u3", payload(ObjectId()))
+
+    assert list(ring._rings) == ["u1", "u3"]
+
+
+def test_ring_replays_only_the_latest_revision_of_a_digest():
+    ring = main.NotificationReplayBuffer(per_user=10, max_users=10)
+    seen, digest = ObjectId(), ObjectId()
+    ring.record("u1", payload(seen))
+    for count in (1, 2, 3):
+        # cada revisión viaja con su propio id de evento SSE (rev)
+        ring.record("u1", payload(digest, rev=str(ObjectId()), count=count))
+
+    assert [(p["id"], p["count"]) for p in ring.after("u1", seen)] == [(str(digest), 3)]
+
+
+def test_replay_after_last_event_id_from_memory_and_from_mongo(register):
+    user = register("ana")
+    user_id = ObjectId(user["id"])
+
+    async def scenario():
+        for i in range(4):
+            await main.publish_notification(user["id"], "application_accepted", "ok", f"m{i}")
+        docs = [d async for d in main.db.notifications.find({"user_id": user_id}).sort("_id", 1)]
+        last_seen = docs[1]["_id"]
+        for doc in docs:
+            main.sse_replay.record(user["id"], main.notification_payload(doc))
+        from_ring, _ = await main.load_sse_replay(user_id, last_seen)
+        main.sse_replay.clear()
+        from_mongo, truncated = await main.load_sse_replay(user_id, last_seen)
+        return docs, from_ring, from_mongo, truncated
+
+    docs, from_ring, from_mongo, truncated = asyncio.run(scenario())
+    expected = [str(d["_id"]) for d in docs[2:]]
+    assert [p["id"] for p in from_ring] == expected
+    assert [p["id"] for p in from_mongo] == expected
+    assert not truncated
+
+
+def test_replay_from_mongo_flags_truncation(monkeypatch, register):
+    monkeypatch.setattr(main, "SSE_REPLAY_LIMIT", 2)
+    user = register("ana")
+    user_id = ObjectId(user["id"])
+
+    async def scenario():
+        for i in range(4):
+            await main.publish_notification(user["id"], "application_accepted", "ok", f"m{i}")
+        return await main.load_sse_replay(user_id, ObjectId("0" * 24))
+
+    payloads, truncated = asyncio.run(scenario())
+    assert [p["message"] for p in payloads] == ["m0", "m1"] and truncated
@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+
+import main
+
+
+class RecordingQueue:
+    """Stand-in de la queue exclusiva del worker: registra binds/unbinds por routing key"""
+
+    def __init__(self):
+        self.bound: set[str] = set()
+        self.calls: list[tuple[str, str]] = []
+
+    async def bind(self, exchange, routing_key: str):
+        self.calls.append(("bind", routing_key))
+        self.bound.add(routing_key)
+
+    async def unbind(self, exchange, routing_key: str):
+        self.calls.append(("unbind", routing_key))
+        self.bound.discard(routing_key)
+
+
+@pytest.fixture
+def per_worker(monkeypatch) -> RecordingQueue:
+    queue = RecordingQueue()
+    monkeypatch.setattr(main, "SSE_DELIVERY_MODE", "per_worker")
+    monkeypatch.setattr(main, "SSE_ROUTE_LINGER", 0.05)
+    monkeypatch.setattr(main, "worker_queue", queue)
+    monkeypatch.setattr(main, "notification_exchange", object())
+    monkeypatch.setattr(main, "user_route_refs", {})
+    monkeypatch.setattr(main, "bound_user_routes", set())
+    monkeypatch.setattr(main, "user_route_lock", None)
+    return queue
+
+
+def test_routing_key_depends_on_the_delivery_mode(monkeypatch):
+    monkeypatch.setattr(main, "SSE_DELIVERY_MODE", "shared")
+    assert main.notification_routing_key("u1") == "notifications"
+    monkeypatch.setattr(main, "SSE_DELIVERY_MODE", "per_worker")
+    assert main.notification_routing_key("u1") == "user.u1"
+
+
+def test_binds_once_per_user_and_unbinds_after_the_last_stream_lingers(per_worker):
+    async def scenario():
+        await main.acquire_user_route("u1")
+        await main.acquire_user_route("u1")  # segunda pestaña
+        main.release_user_route("u1")
+        await asyncio.sleep(0.1)
+        bound_with_one_tab = set(per_worker.bound)
+        main.release_user_route("u1")
+        bound_right_after_close = set(per_worker.bound)
+        await asyncio.sleep(0.1)
+        return bound_with_one_tab, bound_right_after_close
+
+    with_one_tab, right_after_close = asyncio.run(scenario())
+
+    assert with_one_tab == {"user.u1"}
+    assert right_after_close == {"user.u1"}  # dentro de SSE_ROUTE_LINGER
+    assert per_worker.bound == set()
+    assert per_worker.calls == [("bind", "user.u1"), ("unbind", "user.u1")]
+
+
+def test_quick_reconnect_keeps_the_binding_and_the_replay_ring(per_worker):
+    main.sse_replay.record("u1", {"id": str(main.ObjectId()), "user_id": "u1"})
+
+    async def scenario():
+        await main.acquire_user_route("u1")
+        main.release_user_route("u1")
+        await main.acquire_user_route("u1")  # reconexión antes del unbind
+        await asyncio.sleep(0.1)
+
+    asyncio.run(scenario())
+
+    assert per_worker.calls == [("bind", "user.u1")]
+    assert main.sse_replay.stats()["users"] == 1
+
+
+def test_unbind_forgets_the_replay_ring(per_worker):
+    main.sse_replay.record("u1", {"id": str(main.ObjectId()), "user_id": "u1"})
+
+    async def scenario():
+        await main.acquire_user_route("u1")
+        main.release_user_route("u1")
+        await asyncio.sleep(0.1)
+
+    asyncio.run(scenario())
+
+    # sin el binding este worker deja de ver notificaciones: el ring ya no es confiable
+    assert main.sse_replay.stats()["users"] == 0
+
+
+def test_streams_opened_before_the_broker_are_bound_on_connect(per_worker, monkeypatch):
+    monkeypatch.setattr(main, "worker_queue", None)
+    asyncio.run(main.acquire_user_route("u1"))
+    assert per_worker.calls == []
+
+    monkeypatch.setattr(main, "worker_queue", per_worker)
+    asyncio.run(main.sync_user_route("u1"))  # lo que hace consume() al conectar
+
+    assert per_worker.bound == {"user.u1"}
+
+
+def test_shared_mode_does_not_touch_bindings(per_worker, monkeypatch):
+    monkeypatch.setattr(main, "SSE_DELIVERY_MODE", "shared")
+    asyncio.run(main.acquire_user_route("u1"))
+    main.release_user_route("u1")
+
+    assert per_worker.calls == [] and main.user_route_refs == {}
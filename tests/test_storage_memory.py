@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+import asyncio
+import math
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+from storage_memory import EARTH_RADIUS_M, MemoryClient, apply_update, haversine_m, match_filter, run_pipeline
+
+DOC = {
+    "_id": 1,
+    "title": "Fulbito en Palermo",
+    "rating": 4.5,
+    "tags": ["deportes", "aire libre"],
+    "organizer": {"name": "ana", "rating": 5},
+    "fecha": datetime(2030, 1, 1, 10),
+}
+
+
+@pytest.mark.parametrize("flt, expected", [
+    ({"tags": "deportes"}, True),                      # igualdad contra un elemento del array
+    ({"organizer.name": "ana"}, True),
+    ({"missing": None}, True),                         # null matchea un campo ausente
+    ({"rating": {"$gte": 4.5, "$lt": 5}}, True),
+    ({"rating": {"$gt": "4"}}, False),                 # sólo compara dentro del mismo tipo
+    ({"fecha": {"$lt": datetime(2031, 1, 1)}}, True),
+    ({"tags": {"$in": ["cultural", "aire libre"]}}, True),
+    ({"tags": {"$nin": ["deportes"]}}, False),
+    ({"tags": {"$size": 2, "$all": ["deportes"]}}, True),
+    ({"missing": {"$exists": False}, "title": {"$exists": True}}, True),
+    ({"title": {"$regex": "^fulbito", "$options": "i"}}, True),
+    ({"rating": {"$not": {"$gt": 4}}}, False),
+    ({"$or": [{"rating": 1}, {"organizer.rating": 5}]}, True),
+    ({"$and": [{"rating": 4.5}, {"tags": "cultural"}]}, False),
+    ({"$nor": [{"rating": 1}]}, True),
+])
+def test_match_filter(flt, expected):
+    assert match_filter(DOC, flt) is expected
+
+
+def test_match_filter_rejects_unknown_operators():
+    with pytest.raises(OperationFailure):
+        match_filter(DOC, {"rating": {"$near": 1}})
+
+
+def test_apply_update_returns_a_modified_copy():
+    new = apply_update(DOC, {
+        "$set": {"organizer.name": "bea", "title": "Fulbito"},
+        "$inc": {"rating": 0.5, "visits": 1},
+        "$addToSet": {"tags": {"$each": ["deportes", "noche"]}},
+        "$pull": {"missing": 1},
+        "$unset": {"fecha": ""},
+        "$max": {"organizer.rating": 3},
+        "$setOnInsert": {"created": True},
+    }, inserting=False)
+
+    assert DOC["organizer"]["name"] == "ana" and DOC["tags"] == ["deportes", "aire libre"]
+    assert new["organizer"] == {"name": "bea", "rating": 5}
+    assert (new["rating"], new["visits"]) == (5.0, 1)
+    assert new["tags"] == ["deportes", "aire libre", "noche"]
+    assert "fecha" not in new and "created" not in new and "missing" not in new
+
+
+def test_apply_update_pull_by_condition_and_set_on_insert():
+    new = apply_update({"_id": 1, "scores": [1, 5, 9]}, {"$pull": {"scores": {"$gt": 4}}, "$setOnInsert": {"n": 0}}, inserting=True)
+
+    assert new == {"_id": 1, "scores": [1], "n": 0}
+    with pytest.raises(OperationFailure):
+        apply_update(DOC, {"title": "sin operador"}, inserting=False)
+    with pytest.raises(OperationFailure):
+        apply_update(DOC, {"$push": {"title": "x"}}, inserting=False)
+
+
+@pytest.fixture
+def collection():
+    return MemoryClient()["test"]["users"]
+
+
+def test_unique_and_partial_indexes(collection):
+    async def scenario():
+        await collection.create_index("name", unique=True)
+        await collection.create_index("email", unique=True, partialFilterExpression={"email": {"$exists": True}})
+        await collection.insert_one({"name": "ana", "email": "ana@x"})
+        await collection.insert_one({"name": "bea"})
+        await collection.insert_one({"name": "caro"})  # sin email: fuera del índice parcial
+        errors = []
+        for op in (
+            collection.insert_one({"name": "ana"}),
+            collection.update_one({"name": "bea"}, {"$set": {"email": "ana@x"}}),
+        ):
+            try:
+                await op
+            except DuplicateKeyError as e:
+                errors.append(e.code)
+        renamed = await collection.find_one_and_update({"name": "ana"}, {"$set": {"name": "ana2"}}, return_document=ReturnDocument.AFTER)
+        await collection.insert_one({"name": "ana"})  # la clave vieja quedó libre
+        return errors, renamed["name"], await collection.count_documents({})
+
+    assert asyncio.run(scenario()) == ([11000, 11000], "ana2", 4)
+
+
+def test_upsert_seeds_the_document_from_the_filter(collection):
+    async def scenario():
+        await collection.update_one({"_id": "u1", "kind": "counter"}, {"$inc": {"n": 1}, "$setOnInsert": {"created": True}}, upsert=True)
+        await collection.update_one({"_id": "u1", "kind": "counter"}, {"$inc": {"n": 1}, "$setOnInsert": {"created": False}}, upsert=True)
+        return await collection.find_one({"_id": "u1"})
+
+    assert asyncio.run(scenario()) == {"_id": "u1", "kind": "counter", "n": 2, "created": True}
+
+
+def test_geo_near_sorts_by_distance_and_applies_bounds(collection):
+    origin = (-34.60, -58.40)
+    points = {"a": (-34.60, -58.40), "b": (-34.61, -58.40), "c": (-34.65, -58.40), "d": (-34.90, -58.40)}
+
+    async def scenario():
+        await collection.create_index([("location", "2dsphere")])
+        for name, (lat, lng) in reversed(list(points.items())):
+            await collection.insert_one({"_id": ObjectId(), "name": name, "location": {"type": "Point", "coordinates": [lng, lat]}})
+        return await collection.aggregate([
+            {"$geoNear": {
+                "near": {"type": "Point", "coordinates": [origin[1], origin[0]]},
+                "distanceField": "distance_meters", "maxDistance": 10_000, "minDistance": 500,
+            }},
+            {"$limit": 5},
+        ]).to_list(length=None)
+
+    docs = asyncio.run(scenario())
+
+    assert [d["name"] for d in docs] == ["b", "c"]
+    assert docs[0]["distance_meters"] == pytest.approx(haversine_m(*origin, *points["b"]))
+    assert docs[0]["distance_meters"] == pytest.approx(math.radians(0.01) * EARTH_RADIUS_M, rel=1e-6)
+
+
+def test_geo_near_needs_a_2dsphere_index_and_the_first_stage(collection):
+    async def scenario(pipeline):
+        return await collection.aggregate(pipeline).to_list(length=None)
+
+    with pytest.raises(OperationFailure):
+        asyncio.run(scenario([{"$geoNear": {"near": [0, 0], "distanceField": "d"}}]))
+    with pytest.raises(OperationFailure):
+        asyncio.run(scenario([{"$match": {}}, {"$geoNear": {"near": [0, 0], "distanceField": "d"}}]))
+
+
+def test_facet_always_returns_one_document():
+    docs = [{"_id": n, "activo": n % 3} for n in range(7)]
+    pipeline = [{"$facet": {
+        "activos": [{"$match": {"activo": 1}}, {"$sort": {"_id": -1}}, {"$limit": 2}],
+        "total": [{"$count": "n"}],
+        "ninguno": [{"$match": {"activo": 9}}],
+    }}]
+
+    [result] = run_pipeline(docs, pipeline)
+    [empty] = run_pipeline([], pipeline)
+
+    assert [d["_id"] for d in result["activos"]] == [4, 1]
+    assert result["total"] == [{"n": 7}] and result["ninguno"] == []
+    assert empty == {"activos": [], "total": [], "ninguno": []}
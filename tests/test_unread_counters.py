@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+from bson import ObjectId
+
+import main
+
+
+def unread(client, user: dict) -> int:
+    return client.get("/notifications/unread_count", headers=user["headers"]).json()["unread"]
+
+
+async def notify(user: dict, n: int):
+    for i in range(n):
+        await main.publish_notification(user["id"], "application_accepted", "ok", f"m{i}")
+
+
+def test_counter_tracks_new_and_read_notifications(client, register):
+    ana = register("ana")
+    asyncio.run(notify(ana, 3))
+    assert unread(client, ana) == 3
+
+    first = client.get("/notifications", headers=ana["headers"]).json()[0]
+    client.patch(f"/notifications/{first['id']}/read", headers=ana["headers"])
+    assert unread(client, ana) == 2
+
+    rest = [n["id"] for n in client.get("/notifications", headers=ana["headers"]).json()[1:]]
+    assert client.patch("/notifications/read", json=rest[:1], headers=ana["headers"]).json() == {"unread": 1}
+
+    client.patch("/notifications/read-all", headers=ana["headers"])
+    assert unread(client, ana) == 0
+
+
+@pytest.mark.parametrize("legacy", [{"unread": -2}, {"unread": 7, "seeded": False}])
+def test_negative_or_unseeded_counters_are_recounted(client, memory_db, register, legacy):
+    ana = register("ana")
+    asyncio.run(notify(ana, 2))
+    asyncio.run(memory_db.notification_counters.update_one({"_id": ObjectId(ana["id"])}, {"$set": legacy}, upsert=True))
+
+    assert unread(client, ana) == 2
+    counter = asyncio.run(memory_db.notification_counters.find_one({"_id": ObjectId(ana["id"])}))
+    assert (counter["unread"], counter["seeded"]) == (2, True)
+
+
+def test_a_notification_racing_the_seed_is_not_lost(client, memory_db, register):
+    ana = register("ana")
+    user_id = ObjectId(ana["id"])
+    asyncio.run(notify(ana, 2))
+    asyncio.run(memory_db.notification_counters.delete_one({"_id": user_id}))
+    original, raced = memory_db.notifications.count_documents, []
+
+    async def racing_count(*args, **kwargs):
+        count = await original(*args, **kwargs)
+        if not raced:
+            # llega una notificación entre el conteo y el $set: cambia seq y se reintenta
+            raced.append(True)
+            await notify(ana, 1)
+        return count
+
+    memory_db.notifications.count_documents = racing_count
+
+    assert asyncio.run(main.unread_count(user_id)) == 3
+    assert asyncio.run(memory_db.notification_counters.find_one({"_id": user_id}))["unread"] == 3
+
+
+def test_sustained_contention_answers_a_fresh_count_without_caching_it(memory_db, register, monkeypatch):
+    ana = register("ana")
+    user_id = ObjectId(ana["id"])
+    asyncio.run(notify(ana, 2))
+    asyncio.run(memory_db.notification_counters.delete_one({"_id": user_id}))
+    original = memory_db.notifications.count_documents
+
+    async def always_racing_count(*args, **kwargs):
+        count = await original(*args, **kwargs)
+        await memory_db.notification_counters.update_one({"_id": user_id}, {"$inc": {"seq": 1}})
+        return count
+
+    memory_db.notifications.count_documents = always_racing_count
+    assert asyncio.run(main.unread_count(user_id)) == 2
+    counter = asyncio.run(memory_db.notification_counters.find_one({"_id": user_id}))
+    assert counter["seeded"] is False  # la próxima consulta vuelve a sembrar
+
+    memory_db.notifications.count_documents = original
+    assert asyncio.run(main.unread_count(user_id)) == 2
+    assert asyncio.run(memory_db.notification_counters.find_one({"_id": user_id}))["seeded"] is True
@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import asyncio
+import time
+
+import pytest
+from bson import ObjectId
+
+import main
+
+
+@pytest.fixture
+def cache(monkeypatch) -> main.UserProfileCache:
+    fresh = main.UserProfileCache(max_size=2, ttl=60)
+    monkeypatch.setattr(main, "user_cache", fresh)
+    return fresh
+
+
+def count_user_reads(memory_db) -> list[str]:
+    """Parchea users.find_one/find y devuelve la lista de lecturas a MongoDB"""
+    reads: list[str] = []
+    find_one, find = memory_db.users.find_one, memory_db.users.find
+
+    async def counting_find_one(*args, **kwargs):
+        reads.append("find_one")
+        return await find_one(*args, **kwargs)
+
+    def counting_find(*args, **kwargs):
+        reads.append("find")
+        return find(*args, **kwargs)
+
+    memory_db.users.find_one, memory_db.users.find = counting_find_one, counting_find
+    return reads
+
+
+def test_get_reads_mongo_once_and_projects_the_profile(cache, memory_db, register):
+    ana = register("ana")
+    reads = count_user_reads(memory_db)
+
+    first = asyncio.run(cache.get(ObjectId(ana["id"])))
+    second = asyncio.run(cache.get(ObjectId(ana["id"])))
+
+    assert reads == ["find_one"]
+    assert first["name"] == second["name"] == "ana"
+    assert set(second) <= {"_id", *main.USER_PROFILE_PROJECTION}
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_get_many_batches_the_misses_in_one_query(cache, memory_db, register):
+    ana, beto = register("ana"), register("beto")
+    ids = [ObjectId(ana["id"]), ObjectId(beto["id"]), ObjectId()]
+    asyncio.run(cache.get(ids[0]))
+    reads = count_user_reads(memory_db)
+
+    found = asyncio.run(cache.get_many(ids + [ids[0]]))
+
+    assert reads == ["find"]  # sólo beto y el inexistente, con un único $in
+    assert {p["name"] for p in found.values()} == {"ana", "beto"}
+    assert cache.stats()["hits"] == 1
+
+
+def test_lru_evicts_and_ttl_expires(cache, register, monkeypatch):
+    users = [ObjectId(register(name)["id"]) for name in ("ana", "beto", "caro")]
+    for user_id in users:
+        asyncio.run(cache.get(user_id))
+
+    assert list(cache._entries) == users[1:] and cache.evictions == 1
+
+    clock = time.monotonic() + 61
+    monkeypatch.setattr(main.time, "monotonic", lambda: clock)
+    assert cache._lookup(users[2]) is None and len(cache._entries) == 1
+
+
+def test_disabled_cache_always_reads_mongo(monkeypatch, memory_db, register):
+    cache = main.UserProfileCache(max_size=10, ttl=0)
+    ana = register("ana")
+    reads = count_user_reads(memory_db)
+
+    asyncio.run(cache.get(ObjectId(ana["id"])))
+    asyncio.run(cache.get(ObjectId(ana["id"])))
+
+    assert reads == ["find_one", "find_one"] and cache.stats()["size"] == 0
+
+
+def test_profile_edits_are_visible_right_away(cache, client, register):
+    ana = register("ana")
+    assert client.get(f"/users/{ana['id']}").json()["name"] == "ana"
+
+    client.patch("/users/me", json={"name": "ana maría"}, headers=ana["headers"])
+
+    assert client.get(f"/users/{ana['id']}").json()["name"] == "ana maría"
+
+
+def test_completing_an_event_refreshes_the_counters(cache, client, register, create_event):
+    organizer, participant = register("org"), register("ana")
+    ev = create_event(organizer)
+    client.post(f"/events/{ev['id']}/apply", headers=participant["headers"])
+    client.post(f"/events/{ev['id']}/accept", json={"user_id": participant["id"]}, headers=organizer["headers"])
+    assert client.get(f"/users/{participant['id']}").json()["cant_events_visited"] == 0
+
+    client.post(f"/events/{ev['id']}/complete", headers=organizer["headers"])
+
+    assert client.get(f"/users/{participant['id']}").json()["cant_events_visited"] == 1
+    assert client.get(f"/users/{organizer['id']}").json()["cant_events_organized"] == 1